@@ -1,43 +1,37 @@
 import os
 import time
+import hashlib
 import logging
-from logging.handlers import RotatingFileHandler  # Import RotatingFileHandler
-from dotenv import load_dotenv  # Import load_dotenv
-from amazon_paapi import AmazonApi
-# Import Country from models and SearchItemsResource from sdk.models
-from amazon_paapi.models import Country
-from amazon_paapi.sdk.models import SearchItemsResource
-
-# Load environment variables from .env file
-load_dotenv()
-
-# --- Logging Setup ---
-LOG_FILE = 'amazon_service.log'
-LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
-
-# Get the root logger
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)  # Set the root logger level
-
-# Create formatter
-formatter = logging.Formatter(LOG_FORMAT)
-
-# Console Handler (already configured by basicConfig, but let's be explicit)
-# Clear existing handlers if basicConfig was called before (e.g., during testing)
-if logger.hasHandlers():
-    logger.handlers.clear()
-
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-console_handler.setLevel(logging.INFO)  # Explicitly set console handler level
-logger.addHandler(console_handler)
-
-# File Handler (Rotating)
-# Use RotatingFileHandler to limit log file size
-file_handler = RotatingFileHandler(
-    LOG_FILE, maxBytes=10*1024*1024, backupCount=3)  # 10MB per file, keep 3 backups
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+import threading
+import dataclasses
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from .cache_backends import create_cache_backend
+from .cache import TTLCache
+from .products import (ProductPage, project_search_result, project_offer,
+                       project_features, project_categories, encode_cursor)
+from .search_index import SearchIndex, tokenize
+from .facets import FacetIndex
+from .queries import canonical_keywords, search_key
+from .singleflight import SingleFlight, AsyncSingleFlight
+from .clients import ClientRegistry
+from .ratelimit import UpstreamLimiter, INTERACTIVE, BACKGROUND
+from .breaker import NegativeCache, CircuitBreaker
+from . import metrics
+from .log_config import CACHE_HIT_LOGGER, configure_logging
+
+if TYPE_CHECKING:
+    from amazon_paapi import AmazonApi
+
+# Importing this module has no side effects and stays cheap: the PA API SDK
+# (tens of milliseconds to import) is loaded when the first client is built,
+# and settings from the environment and .env are applied by ``configure``,
+# which entry points call at startup (see app.init_app).
+
+# Logging is configured by the entry point (see log_config.configure_logging).
+# Cache hits go to their own logger, which keeps only a sample of them.
+_HIT_LOG = logging.getLogger(CACHE_HIT_LOGGER)
 
 # --- Configuration ---
 
@@ -45,24 +39,249 @@ logger.addHandler(file_handler)
 ENV_ACCESS_KEY = "AMAZON_ACCESS_KEY"
 ENV_SECRET_KEY = "AMAZON_SECRET_KEY"
 
-# Mapping region codes (used in our app) to Amazon Country enum and Associate Tag env var names
+# Mapping region codes (used in our app) to the SDK's country codes
+# (amazon_paapi.models.Country) and Associate Tag env var names
 REGION_CONFIG = {
-    "US": {"country": Country.US, "tag_env": "AMAZON_ASSOCIATE_TAG_US"},
-    "GB": {"country": Country.UK, "tag_env": "AMAZON_ASSOCIATE_TAG_GB"},
-    "AU": {"country": Country.AU, "tag_env": "AMAZON_ASSOCIATE_TAG_AU"},
-    "CA": {"country": Country.CA, "tag_env": "AMAZON_ASSOCIATE_TAG_CA"},
+    "US": {"country": "US", "tag_env": "AMAZON_ASSOCIATE_TAG_US"},
+    "GB": {"country": "UK", "tag_env": "AMAZON_ASSOCIATE_TAG_GB"},
+    "AU": {"country": "AU", "tag_env": "AMAZON_ASSOCIATE_TAG_AU"},
+    "CA": {"country": "CA", "tag_env": "AMAZON_ASSOCIATE_TAG_CA"},
     # Add NZ if supported by the library and you have a tag
-    # "NZ": {"country": Country.??? , "tag_env": "AMAZON_ASSOCIATE_TAG_NZ"}, # Check library for NZ support if needed
+    # "NZ": {"country": "??", "tag_env": "AMAZON_ASSOCIATE_TAG_NZ"}, # Check library for NZ support if needed
 }
 
 # --- Caching ---
-CACHE = {}  # Simple in-memory cache { cache_key: (timestamp, data) }
-CACHE_DURATION_SECONDS = 3600  # Cache results for 1 hour
+# Stale-while-revalidate: results younger than the soft TTL are served as-is;
+# between the soft and hard TTL they are served immediately while a background
+# refresh runs; past the hard TTL requests block on a fresh upstream call. If a
+# refresh fails, the stale result keeps being served for up to the grace period
+# beyond the hard TTL. Setting the hard TTL equal to the soft TTL disables
+# background revalidation.
+CACHE_DURATION_SECONDS = 3600  # Soft TTL: results are fresh for 1 hour
+CACHE_HARD_TTL_SECONDS = 4 * 3600  # Hard TTL: block on upstream after 4 hours
+CACHE_STALE_GRACE_SECONDS = 3600  # Serve stale for up to 1 more hour on failure
+CACHE_MAX_ENTRIES = 512  # Free-text searches can create many distinct keys
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MB budget for cached search results
+
+# Optional per-region TTL overrides in seconds, e.g. {"AU": 7200}
+REGION_CACHE_TTL_SECONDS = {}
+
+# Cache storage: "memory" (per process), or "sqlite" / "redis" to share
+# results between worker processes
+ENV_CACHE_BACKEND = "CACHE_BACKEND"
+ENV_CACHE_SQLITE_PATH = "CACHE_SQLITE_PATH"
+ENV_CACHE_REDIS_URL = "CACHE_REDIS_URL"
+DEFAULT_CACHE_SQLITE_PATH = "product_cache.sqlite3"
+
+
+def _cache_settings() -> tuple:
+    """The (backend, location) selected by the CACHE_BACKEND env vars."""
+    kind = os.getenv(ENV_CACHE_BACKEND, "memory")
+    if kind == "sqlite":
+        return kind, os.getenv(ENV_CACHE_SQLITE_PATH, DEFAULT_CACHE_SQLITE_PATH)
+    if kind == "redis":
+        return kind, os.getenv(ENV_CACHE_REDIS_URL)
+    return kind, None
+
+
+def _create_cache(kind: str = "memory", location: str | None = None):
+    """Builds a product cache backend (see ``_cache_settings``)."""
+    # Entries physically expire once past the hard TTL plus the grace period
+    options = {
+        "max_entries": CACHE_MAX_ENTRIES,
+        "max_bytes": CACHE_MAX_BYTES,
+        "default_ttl": CACHE_HARD_TTL_SECONDS + CACHE_STALE_GRACE_SECONDS,
+    }
+    if kind == "sqlite":
+        options["path"] = location
+    elif kind == "redis":
+        options["url"] = location
+    # A named logger: the logging.info() helpers would call basicConfig()
+    logging.getLogger(__name__).info("Using '%s' product cache backend.", kind)
+    return create_cache_backend(kind, **options)
+
+
+# Cache { "<region>_<keywords>_p<page>": ProductPage } (see products.project_search_result).
+# In memory until ``configure`` applies CACHE_BACKEND.
+_CACHE_SETTINGS = ("memory", None)
+CACHE = _create_cache(*_CACHE_SETTINGS)
+
+# PA API returns at most 10 items per SearchItems call and 10 pages per search
+PAGE_SIZE = 10
+MAX_ITEM_PAGES = 10
+MAX_RESULTS = PAGE_SIZE * MAX_ITEM_PAGES
+
+# Responses spanning part of a page or several pages are assembled from the
+# cached pages; the assembled page is kept so its encoded bodies are reused.
+VIEWS = TTLCache(max_entries=256, max_bytes=16 * 1024 * 1024,
+                 default_ttl=CACHE_HARD_TTL_SECONDS + CACHE_STALE_GRACE_SECONDS)
+# Number of results of each search, (region, keywords) -> count, once a short
+# page or a not-found page past the end shows it. Requests reaching beyond
+# the end are cut there instead of spending PA API calls on pages that can't
+# exist. Kept in this process (like VIEWS) for the pages' hard TTL.
+RESULT_ENDS = TTLCache(max_entries=4096, max_bytes=1024 * 1024,
+                       default_ttl=CACHE_HARD_TTL_SECONDS)
+# Fetches the pages of one request concurrently (each still rate limited)
+_PAGE_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_ITEM_PAGES,
+                                    thread_name_prefix="paapi-page")
+
+# Which cached pages list each (region, ASIN), so offers can be patched in
+# place (see patch_cached_offers). Covers pages fetched by this process;
+# pages are forgotten when found gone, refetched, or sure to have expired.
+_ASIN_PAGES = {}  # (region, asin) -> {cache_key}
+_PAGE_ASINS = {}  # cache_key -> (expires_at, [(region, asin)])
+_ASIN_PAGES_LOCK = threading.Lock()
+_ASIN_PAGES_SWEEP_SECONDS = 60
+_asin_pages_swept = 0.0
+
+
+# --- Local Full-Text Search ---
+# Products from every fetched page are indexed so free-text queries can be
+# answered without a PA API call of their own (see search_products).
+ENV_LOCAL_SEARCH = "LOCAL_SEARCH"  # Set to "0" to always search upstream
+# Answer locally when the index matches at least this many products (or the
+# whole page requested, if smaller); below that recall is too low to trust
+LOCAL_SEARCH_MIN_RESULTS = 10
+SEARCH_INDEX = SearchIndex(
+    max_age=CACHE_HARD_TTL_SECONDS + CACHE_STALE_GRACE_SECONDS)
+# Categories (browse nodes) of the same products, for listing and filtering
+FACETS = FacetIndex(max_age=CACHE_HARD_TTL_SECONDS + CACHE_STALE_GRACE_SECONDS)
+
+
+# Coalesces concurrent cache misses for the same key into one upstream call
+IN_FLIGHT = SingleFlight()
+
+
+class SearchOutcome(NamedTuple):
+    """A search result together with how old the data being served is."""
+    result: object
+    age_seconds: float
+    stale: bool
+
+
+class MultiSearchResult(NamedTuple):
+    """Outcome of one region x keywords query in a fan-out search."""
+    region: str
+    keywords: str
+    outcome: SearchOutcome | None
+    error: str | None  # None on success, else "timeout" or a failure reason
+
+
+# --- Upstream Rate Limiting ---
+# PA API allows 1 request/second per account by default (it grows with sales).
+# Calls are queued per region and credential, interactive misses ahead of
+# background refreshes, and each caller only waits a bounded time.
+# The limiter lives in each process, so the account's rate (and burst) is
+# split evenly between the PAAPI_PROCESSES processes using the credentials;
+# serve.py sets it to its worker count (set it yourself for several hosts).
+ENV_PAAPI_REQUESTS_PER_SECOND = "PAAPI_REQUESTS_PER_SECOND"
+ENV_PAAPI_BURST = "PAAPI_BURST"
+ENV_PAAPI_PROCESSES = "PAAPI_PROCESSES"
+# Defaults until ``configure`` applies the env vars (for the whole account)
+PAAPI_REQUESTS_PER_SECOND = 1.0
+PAAPI_BURST = 1.0
+PAAPI_PROCESSES = 1
+# Optional per-region overrides as (requests_per_second, burst), e.g. {"US": (2.0, 2)}
+REGION_RATE_LIMITS = {}
+INTERACTIVE_MAX_WAIT_SECONDS = 5.0  # A visitor is waiting and nothing is cached
+STALE_FALLBACK_MAX_WAIT_SECONDS = 0.5  # Stale data is available: fail fast to it
+BACKGROUND_MAX_WAIT_SECONDS = 30.0  # Refreshes and warmup can afford to queue
+# A visitor joining another caller's fetch waits as long as it would for a
+# token itself plus this long for the PA API call (the fetch may be a
+# background refresh queued for up to BACKGROUND_MAX_WAIT_SECONDS)
+UPSTREAM_CALL_SECONDS = 2.0
+
+UPSTREAM = UpstreamLimiter(PAAPI_REQUESTS_PER_SECOND, PAAPI_BURST,
+                           REGION_RATE_LIMITS)
+
+# --- Upstream Failure Handling ---
+# A failing search (API errors or an exception) is remembered per cache key
+# and not retried until its backoff expires; throttling and other exceptions
+# also count against the region's circuit breaker, which stops all calls to
+# a region that keeps failing. Meanwhile stale entries are served as the last
+# known good data (see _lookup_page).
+FAILURES = NegativeCache()
+BREAKER = CircuitBreaker()
+
+# --- Metrics (see metrics.py; served by the app's /metrics endpoint) ---
+UPSTREAM_LATENCY = metrics.Histogram(
+    "paapi_request_duration_seconds", "PA API call latency.",
+    ["region", "operation", "outcome"])
+UPSTREAM_IN_FLIGHT = metrics.Gauge(
+    "paapi_requests_in_flight", "PA API calls currently running.", ["region"])
+
+
+def configure(env_file: str | None = None) -> None:
+    """
+    Applies the settings read from the environment, after loading .env into it.
+
+    Entry points call this once at startup; until then the service runs on
+    an in-memory cache and the default PA API rate limit. Calling it again
+    only rebuilds what changed, so a warm cache survives.
+
+    Args:
+        env_file: Path of the .env file; None searches upwards from this
+            module. Variables already set in the environment take precedence.
+    """
+    global CACHE, _CACHE_SETTINGS, UPSTREAM, PAAPI_REQUESTS_PER_SECOND, PAAPI_BURST, \
+        PAAPI_PROCESSES
+    from dotenv import load_dotenv
+    load_dotenv(env_file)
+
+    settings = _cache_settings()
+    if settings != _CACHE_SETTINGS:
+        CACHE, _CACHE_SETTINGS = _create_cache(*settings), settings
+
+    rate = float(os.getenv(ENV_PAAPI_REQUESTS_PER_SECOND, 1.0))
+    burst = float(os.getenv(ENV_PAAPI_BURST, 1))
+    processes = max(1, int(os.getenv(ENV_PAAPI_PROCESSES, 1)))
+    if (rate, burst, processes) != (PAAPI_REQUESTS_PER_SECOND, PAAPI_BURST, PAAPI_PROCESSES):
+        PAAPI_REQUESTS_PER_SECOND, PAAPI_BURST, PAAPI_PROCESSES = rate, burst, processes
+        UPSTREAM = UpstreamLimiter(*_process_share(rate, burst, processes), {
+            key: _process_share(*limits, processes) for key, limits in REGION_RATE_LIMITS.items()})
+
+
+def _process_share(rate: float, burst: float, processes: int) -> tuple:
+    """One process's (rate, burst) of an account limit (a bucket holds at least one token)."""
+    return rate / processes, max(1.0, burst / processes)
+
+
+def get_cache_ttl(region: str) -> float:
+    """Returns the (soft) cache TTL in seconds for a region, honouring overrides."""
+    return REGION_CACHE_TTL_SECONDS.get(region, CACHE_DURATION_SECONDS)
+
+
+def get_hard_cache_ttl(region: str) -> float:
+    """Returns the age in seconds after which requests for a region block on upstream."""
+    return max(get_cache_ttl(region), CACHE_HARD_TTL_SECONDS)
+
+
+def get_cache_stats() -> dict:
+    """Returns hit/miss/eviction counters and occupancy of the product cache."""
+    return CACHE.stats()
+
+
+def get_rate_limit_stats() -> dict:
+    """Returns queue depth and wait times of the upstream rate limiter per region/credential."""
+    return UPSTREAM.stats()
+
+
+def get_upstream_status() -> dict:
+    """Returns circuit breaker state per region and the keys backing off after failures."""
+    return {"circuits": BREAKER.stats(), "backoff": FAILURES.stats()}
+
+
+def _rate_limit_key(region: str) -> tuple:
+    """Limiter key for a region: PA API quotas apply per credential and marketplace."""
+    access_key = os.getenv(ENV_ACCESS_KEY) or ""
+    # Only a digest of the access key is kept, as keys appear in the stats
+    credential = hashlib.sha256(access_key.encode()).hexdigest()[:8]
+    return (region, credential)
 
 # --- Client Initialization ---
 
 
-def get_amazon_client(region: str) -> AmazonApi | None:
+def get_amazon_client(region: str) -> 'AmazonApi | None':
     """
     Initializes and returns an Amazon PA API client for the specified region.
 
@@ -80,11 +299,11 @@ def get_amazon_client(region: str) -> AmazonApi | None:
 
     if not access_key or not secret_key:
         logging.error(
-            f"Missing Amazon API credentials. Set {ENV_ACCESS_KEY} and {ENV_SECRET_KEY} environment variables.")
+            "Missing Amazon API credentials. Set %s and %s environment variables.", ENV_ACCESS_KEY, ENV_SECRET_KEY)
         return None
 
     if region not in REGION_CONFIG:
-        logging.error(f"Invalid or unsupported region code: {region}")
+        logging.error("Invalid or unsupported region code: %s", region)
         return None
 
     config = REGION_CONFIG[region]
@@ -92,32 +311,65 @@ def get_amazon_client(region: str) -> AmazonApi | None:
 
     if not associate_tag:
         logging.error(
-            f"Missing Amazon Associate Tag for region {region}. Set {config['tag_env']} environment variable.")
+            "Missing Amazon Associate Tag for region %s. Set %s environment variable.", region, config['tag_env'])
         return None
 
     try:
-        # Use positional arguments for the constructor
+        # The SDK is only imported once a client is actually needed
+        from amazon_paapi import AmazonApi
+        # Use positional arguments for the constructor. Spacing between
+        # calls is handled by UPSTREAM, so the SDK's own sleep is disabled.
         amazon_client = AmazonApi(
             access_key,
             secret_key,
             associate_tag,
-            config["country"]
+            config["country"],
+            throttling=0
         )
         logging.info(
-            f"Successfully initialized Amazon API client for region {region}.")
+            "Successfully initialized Amazon API client for region %s.", region)
         return amazon_client
     except Exception as e:
         logging.error(
-            f"Error initializing Amazon API client for region {region}: {e}")
+            "Error initializing Amazon API client for region %s: %s", region, e)
         return None
 
+
+
+def _client_fingerprint(region: str) -> tuple:
+    """Snapshot of the settings a region's client is built from, for hot reload."""
+    tag_env = REGION_CONFIG.get(region, {}).get("tag_env")
+    return (os.getenv(ENV_ACCESS_KEY), os.getenv(ENV_SECRET_KEY),
+            os.getenv(tag_env) if tag_env else None)
+
+
+# Long-lived clients per region, rebuilt when credentials change. The factory
+# resolves get_amazon_client at call time so it can be patched in tests.
+CLIENTS = ClientRegistry(lambda region: get_amazon_client(region),
+                         _client_fingerprint)
+
+
+def get_client(region: str) -> 'AmazonApi | None':
+    """
+    Returns the shared Amazon PA API client for a region, creating it on first use.
+
+    Unlike ``get_amazon_client`` this reuses one client (and its HTTP connection
+    pool) per region and only reports a configuration failure once.
+    """
+    return CLIENTS.get(region)
+
+
+def warm_clients() -> dict:
+    """Builds clients for every region in REGION_CONFIG. Returns {region: succeeded}."""
+    return CLIENTS.warm(REGION_CONFIG)
+
 # --- API Interaction (with Caching) ---
 
 
 def search_bluey_products(region: str, keywords: str = "Bluey Toys", item_count: int = 10):
     """
     Searches for Bluey products in the specified region using the Amazon PA API,
-    with in-memory caching.
+    with caching (see ``CACHE``).
 
     Args:
         region: The region code (e.g., "US", "GB").
@@ -125,29 +377,712 @@ def search_bluey_products(region: str, keywords: str = "Bluey Toys", item_count:
         item_count: The maximum number of items to return.
 
     Returns:
-        The API search result object (potentially cached), or None if an error occurs.
+        The projected ProductPage (potentially cached), or None if an error occurs.
     """
-    # --- Cache Check ---
-    cache_key = f"{region}_{keywords}_{item_count}"
-    current_time = time.time()
+    outcome = lookup_bluey_products(region, keywords, item_count)
+    return outcome.result if outcome is not None else None
 
-    if cache_key in CACHE:
-        timestamp, cached_data = CACHE[cache_key]
-        if current_time - timestamp < CACHE_DURATION_SECONDS:
+
+def lookup_bluey_products(region: str, keywords: str = "Bluey Toys",
+                          item_count: int = 10, offset: int = 0) -> SearchOutcome | None:
+    """
+    Like ``search_bluey_products`` but also reports the age of the data served.
+
+    Results are fetched and cached per PA API page of ``PAGE_SIZE`` items, so
+    requests for overlapping ranges share pages: a smaller request is served
+    from the pages of a larger one, and a larger one only fetches the pages
+    not yet cached (and none past the known end of the results, see
+    ``RESULT_ENDS``). The pages a request spans are looked up concurrently,
+    each with stale-while-revalidate (see the TTL settings above), and
+    merged with duplicate ASINs removed. Keywords are
+    canonicalised first (see ``queries``), so "Bluey Toys" and "bluey  toys"
+    share pages and a single upstream search.
+
+    Args:
+        region: The region code (e.g., "US", "GB").
+        keywords: The search keywords.
+        item_count: The maximum number of items to return (at most
+            ``MAX_RESULTS`` minus ``offset``).
+        offset: Position of the first result, e.g. from a pagination cursor.
+
+    Returns:
+        A SearchOutcome whose page carries a ``next_cursor`` when more results
+        may follow, or None if an error occurs and no stale data is available.
+    """
+    keywords = canonical_keywords(keywords)
+    item_count = min(item_count, MAX_RESULTS - offset)
+    if item_count < 1:
+        return SearchOutcome(ProductPage((), ()), 0.0, False)
+
+    pages, total = _known_pages(region, keywords, offset, item_count)
+    if not pages:
+        # A cursor past the end of the results
+        return SearchOutcome(ProductPage((), ()), 0.0, False)
+    if len(pages) == 1:
+        outcomes = [_lookup_page(region, keywords, pages[0])]
+    else:
+        outcomes = list(_PAGE_EXECUTOR.map(
+            lambda page: _lookup_page(region, keywords, page), pages))
+    return _assemble(region, keywords, offset, item_count, pages, outcomes, total)
+
+
+def search_products(region: str, keywords: str = "Bluey Toys",
+                    item_count: int = 10, offset: int = 0,
+                    category: str | None = None) -> SearchOutcome | None:
+    """
+    Answers a free-text product search, from the local index when it can.
+
+    Searches run upstream before (their first page is cached) keep their
+    exact PA API results. Other queries are answered from ``SEARCH_INDEX``
+    when it matches enough products (see ``LOCAL_SEARCH_MIN_RESULTS``) and
+    fall back to ``lookup_bluey_products`` otherwise, which in turn indexes
+    what it fetches.
+
+    Filtering by ``category`` (a browse node ID from ``FACETS``) is always
+    answered locally: a PA API search per filter is what the facet index
+    avoids. With empty ``keywords`` the whole category is listed.
+
+    Args and return value are as for ``lookup_bluey_products``.
+    """
+    canonical = canonical_keywords(keywords)
+    if category is not None:
+        return _search_locally(region, canonical, item_count, offset, category)
+    if (local_search_enabled()
+            and _page_cache_key(region, canonical, 1) not in CACHE):
+        outcome = _search_locally(region, canonical, item_count, offset)
+        if outcome is not None:
+            return outcome
+    return lookup_bluey_products(region=region, keywords=keywords,
+                                 item_count=item_count, offset=offset)
+
+
+def local_search_enabled() -> bool:
+    return os.getenv(ENV_LOCAL_SEARCH, "1") != "0"
+
+
+def get_categories(region: str) -> list:
+    """Returns the categories of products fetched for ``region``, with product counts."""
+    return FACETS.categories(region)
+
+
+def _search_locally(region: str, keywords: str, item_count: int, offset: int,
+                    category: str | None = None) -> SearchOutcome | None:
+    """
+    Serves a search from the index, or returns None if recall is too low.
+
+    Searches within a category are always served, possibly empty.
+    """
+    item_count = min(item_count, MAX_RESULTS - offset)
+    if item_count < 1:
+        return SearchOutcome(ProductPage((), ()), 0.0, False) if category is not None else None
+    end = offset + item_count
+    # Pages of one query (same item_count) all pass or fail this test, so a
+    # cursor from a locally served page stays local
+    required = min(LOCAL_SEARCH_MIN_RESULTS, item_count) if category is None else 0
+    # Normalised so "Bluey Campervans" and "bluey campervan" share results
+    view_key = ("index", region, tuple(tokenize(keywords)), category, offset, item_count,
+                SEARCH_INDEX.generation(region),
+                FACETS.generation(region) if category is not None else None)
+    view = VIEWS.get(view_key)
+    if view is None:
+        within = None
+        if category is not None:
+            within = FACETS.members(region, category) or frozenset()
+        hits = SEARCH_INDEX.search(region, keywords, limit=end, within=within)
+        if hits.total < required:
             logging.info(
-                f"Returning cached result for '{keywords}' in region {region}.")
-            return cached_data
-        else:
-            logging.info(f"Cache expired for '{keywords}' in region {region}.")
-            del CACHE[cache_key]  # Remove expired entry
+                "Local index matched %s products for '%s' in region %s; searching upstream.", hits.total, keywords, region)
+            return None
+        next_offset = end if end < min(hits.total, MAX_RESULTS) else None
+        view = ProductPage(
+            tuple(hits.records[offset:]), (),
+            next_cursor=encode_cursor(next_offset) if next_offset is not None else None,
+            fetched_at=hits.indexed_at[0] or time.time())
+        VIEWS.set(view_key, view)
+    age = max(0.0, time.time() - view.fetched_at)
+    return SearchOutcome(view, age, age >= get_cache_ttl(region))
+
+
+def refresh_bluey_products(region: str, keywords: str = "Bluey Toys", item_count: int = 10):
+    """
+    Fetches fresh results from the PA API into the cache, ignoring any cached entry.
+
+    Used by the warmup scheduler to keep hot keys fresh (see ``refresh_pages``).
+
+    Returns:
+        The last page fetched (possibly carrying API errors), or None on failure.
+    """
+    pages = refresh_pages(region, keywords, item_count)
+    return pages[-1] if pages else None
+
+
+def refresh_pages(region: str, keywords: str = "Bluey Toys", item_count: int = 10) -> list:
+    """
+    Force-fetches each page covering ``item_count`` results, in order.
+
+    Stops after the end of the results (a short page, or a page not found
+    after a full one) or the first failure, and coalesces with any in-flight
+    fetch of the same page. Calls queue as background work for the rate
+    limiter.
+
+    Returns:
+        The pages fetched; only the last one can be a failure (None or a
+        page carrying API errors). A page past the end is left out.
+    """
+    keywords = canonical_keywords(keywords)
+    pages = []
+    for page in _pages_for(0, min(item_count, MAX_RESULTS)):
+        cache_key = _page_cache_key(region, keywords, page)
+        result = IN_FLIGHT.do(cache_key, _fetch_and_cache,
+                              region, keywords, page, cache_key, force=True,
+                              priority=BACKGROUND, max_wait=BACKGROUND_MAX_WAIT_SECONDS)
+        if result is None and page > 1 and _known_end(region, keywords, page):
+            break  # Not found: the previous (full) page ended the results
+        pages.append(result)
+        if _is_failed_result(result) or len(result.products) < PAGE_SIZE:
+            break
+    return pages
+
+
+def get_item_offers(region: str, asins) -> dict | None:
+    """
+    Re-fetches the price and availability of known products via PA API GetItems.
+
+    Makes a single GetItems call, so pass at most 10 ASINs. The call queues
+    as background work for the rate limiter.
+
+    Returns:
+        {asin: (price, availability)} for the ASINs Amazon returned (items
+        no longer available come back with both None), or None on failure.
+    """
+    asins = list(asins)
+    amazon = get_client(region)
+    if not amazon:
+        return None
+    if not BREAKER.allow(region):
+        logging.warning("Circuit open for region %s; skipping GetItems call.", region)
+        return None
+    limiter_key = _rate_limit_key(region)
+    if not UPSTREAM.acquire(limiter_key, BACKGROUND, timeout=BACKGROUND_MAX_WAIT_SECONDS):
+        BREAKER.release(region)
+        logging.warning(
+            "Rate limit: no PA API capacity for GetItems in region %s; skipping call.", region)
+        return None
+    try:
+        with _upstream_call(region, "get_items"):
+            items = amazon.get_items(asins, include_unavailable=True)
+    except _sdk_errors().ItemsNotFound:
+        BREAKER.record_success(region)
+        return {}
+    except Exception as e:
+        if isinstance(e, _sdk_errors().TooManyRequests):
+            UPSTREAM.penalize(limiter_key)
+        BREAKER.record_failure(region, _describe_error(e))
+        logging.error(
+            "Error getting items from Amazon PA API in region %s: %s", region, e, exc_info=True)
+        return None
+    BREAKER.record_success(region)
+    return {item.asin: project_offer(item) for item in items if getattr(item, 'asin', None)}
+
+
+def tracked_asins(region: str, asins) -> list:
+    """
+    The given ASINs that ``patch_cached_offers`` can update in this process.
+
+    Those are on pages this process fetched (see ``_ASIN_PAGES``) or in its
+    search index. With a shared CACHE_BACKEND, pages fetched by other
+    workers are not tracked here, so their offers are theirs to refresh.
+    """
+    with _ASIN_PAGES_LOCK:
+        on_pages = {asin for asin in asins if _ASIN_PAGES.get((region, asin))}
+    return [asin for asin in asins
+            if asin in on_pages or SEARCH_INDEX.get(region, asin) is not None]
+
+
+def patch_cached_offers(region: str, offers: dict) -> int:
+    """
+    Updates price and availability in cached pages that list the given products.
+
+    Pages keep their cache age (so the search itself is still refreshed on
+    schedule) but get a new ``fetched_at``, which changes their ETag and
+    Last-Modified and retires assembled views built from the old page.
+    Indexed products (see ``SEARCH_INDEX``) are updated as well.
+
+    Args:
+        region: The region code.
+        offers: {asin: (price, availability)}, e.g. from ``get_item_offers``.
+
+    Returns:
+        The number of cached pages changed.
+    """
+    with _ASIN_PAGES_LOCK:
+        cache_keys = set().union(*(_ASIN_PAGES.get((region, asin), ())
+                                   for asin in offers))
+    patched = 0
+    for cache_key in cache_keys:
+        entry = CACHE.peek(cache_key)  # Not a visitor's lookup, so not counted
+        if entry is None:
+            # Evicted or expired: stop tracking it
+            with _ASIN_PAGES_LOCK:
+                _untrack_page(cache_key)
+            continue
+        page = entry.value
+        records = tuple(
+            dataclasses.replace(record, price=offers[record.asin][0],
+                                availability=offers[record.asin][1])
+            if record.asin in offers else record
+            for record in page.products)
+        if records == page.products:
+            continue
+        updated = ProductPage(records, page.api_errors, page.next_cursor)
+        # Unless a fetch stored a newer page meanwhile (its offers are current)
+        if CACHE.replace(cache_key, updated.encode(), stored_at=entry.stored_at):
+            patched += 1
+
+    # Locally answered searches should show the new offers too
+    indexed = {}
+    for asin, (price, availability) in offers.items():
+        record = SEARCH_INDEX.get(region, asin)
+        if record is not None:
+            indexed[asin] = dataclasses.replace(record, price=price, availability=availability)
+    SEARCH_INDEX.update_records(region, indexed)
+    return patched
+
+
+def _track_page(region: str, cache_key: str, products, expires_at: float) -> None:
+    """Records which ASINs a newly cached page lists (see ``_ASIN_PAGES``)."""
+    global _asin_pages_swept
+    now = time.time()
+    with _ASIN_PAGES_LOCK:
+        _untrack_page(cache_key)
+        asins = [(region, record.asin) for record in products if record.asin]
+        _PAGE_ASINS[cache_key] = (expires_at, asins)
+        for asin in asins:
+            _ASIN_PAGES.setdefault(asin, set()).add(cache_key)
+        if now - _asin_pages_swept >= _ASIN_PAGES_SWEEP_SECONDS:
+            _asin_pages_swept = now
+            for expired in [key for key, (expiry, _) in _PAGE_ASINS.items() if expiry <= now]:
+                _untrack_page(expired)
+
+
+def _untrack_page(cache_key: str) -> None:
+    """Forgets a page's ASINs; the caller holds ``_ASIN_PAGES_LOCK``."""
+    _, asins = _PAGE_ASINS.pop(cache_key, (None, ()))
+    for asin in asins:
+        pages = _ASIN_PAGES.get(asin)
+        if pages is not None:
+            pages.discard(cache_key)
+            if not pages:
+                del _ASIN_PAGES[asin]
+
+
+def _page_cache_key(region: str, keywords: str, page: int) -> str:
+    return search_key(region, keywords, page)
+
+
+def _pages_for(offset: int, item_count: int) -> range:
+    """The (1-based) PA API item pages covering results [offset, offset + item_count)."""
+    return range(offset // PAGE_SIZE + 1, (offset + item_count - 1) // PAGE_SIZE + 2)
+
+
+def _known_pages(region: str, keywords: str, offset: int, item_count: int) -> tuple:
+    """
+    The pages covering a request, cut at the end of the results if it is known.
+
+    Returns:
+        (pages, total): ``total`` is the number of results, or None if not
+        known. ``pages`` is empty if the request starts past the end.
+    """
+    pages = _pages_for(offset, item_count)
+    total = RESULT_ENDS.get((region, keywords))
+    if total is None:
+        return pages, None
+    last = max(1, -(-total // PAGE_SIZE))
+    if offset >= total:
+        return range(pages.start, pages.start), total
+    return range(pages.start, min(pages.stop, last + 1)), total
+
+
+def _record_result_end(region: str, keywords: str, page: int, count: int | None) -> None:
+    """Notes where a search's results end after fetching ``page`` (``count`` None: not found)."""
+    key = (region, keywords)
+    start = (page - 1) * PAGE_SIZE
+    if count is None:
+        if page > 1:
+            RESULT_ENDS.set(key, start, ttl=get_hard_cache_ttl(region))
+    elif count < PAGE_SIZE:
+        RESULT_ENDS.set(key, start + count, ttl=get_hard_cache_ttl(region))
+    elif RESULT_ENDS.get(key, start + count) < start + count:
+        RESULT_ENDS.delete(key)  # The results have grown past the recorded end
+
+
+def _known_end(region: str, keywords: str, page: int) -> bool:
+    """True if ``page`` is known to be past the end of the results (e.g. it was not found)."""
+    total = RESULT_ENDS.get((region, keywords))
+    return total is not None and total <= (page - 1) * PAGE_SIZE
+
+
+def _lookup_page(region: str, keywords: str, page: int,
+                 cached_only: bool = False) -> SearchOutcome | None:
+    """
+    Returns one page of results, serving from the cache with stale-while-revalidate.
+
+    With ``cached_only`` the lookup never waits: it returns None instead of
+    calling upstream when the page isn't cached (or is past the hard TTL).
+    """
+    # --- Cache Check ---
+    cache_key = _page_cache_key(region, keywords, page)
+
+    # Past the hard TTL the entry is only a fallback: the lookup counts as a miss
+    entry = CACHE.get_entry(cache_key, max_age=get_hard_cache_ttl(region))
+    if entry is not None:
+        age = time.time() - entry.stored_at
+        if age < get_cache_ttl(region):
+            _HIT_LOG.info(
+                "Returning cached result for '%s' (page %s) in region %s.", keywords, page, region)
+            return SearchOutcome(entry.value, age, False)
+        if age < get_hard_cache_ttl(region):
+            _HIT_LOG.info(
+                "Returning stale result (%.0fs old) for '%s' (page %s) in region %s; refreshing in background.", age, keywords, page, region)
+            _schedule_refresh(region, keywords, page, cache_key)
+            return SearchOutcome(entry.value, age, True)
+    if cached_only:
+        return None
 
     # --- API Call (if not cached or expired) ---
+    # Concurrent misses for the same key wait on a single upstream call and
+    # share its outcome, so an expiring popular key doesn't stampede the PA API.
+    # If that call is a background refresh still queued for a token, move it
+    # to the front since a visitor now depends on it.
+    if IN_FLIGHT.in_flight(cache_key):
+        UPSTREAM.promote(cache_key)
+    # With stale data to fall back on, don't keep the visitor queued for long
+    max_wait = (STALE_FALLBACK_MAX_WAIT_SECONDS if entry is not None
+                else INTERACTIVE_MAX_WAIT_SECONDS)
+    try:
+        search_result = IN_FLIGHT.do_within(max_wait + UPSTREAM_CALL_SECONDS, cache_key,
+                                            _fetch_and_cache, region, keywords, page, cache_key,
+                                            max_wait=max_wait)
+    except TimeoutError:
+        logging.warning(
+            "Gave up waiting for the PA API call in flight for '%s' (page %s) in region %s.", keywords, page, region)
+        search_result = None
+
+    if _is_failed_result(search_result) and entry is not None:
+        age = time.time() - entry.stored_at
+        logging.warning(
+            "Refresh failed for '%s' (page %s) in region %s; serving stale result (%.0fs old).", keywords, page, region, age)
+        return SearchOutcome(entry.value, age, True)
+    if search_result is None:
+        return None
+    return SearchOutcome(search_result, 0.0, False)
+
+
+def _assemble(region: str, keywords: str, offset: int, item_count: int,
+              pages: range, outcomes: list, total: int | None = None) -> SearchOutcome | None:
+    """
+    Merges per-page outcomes into the requested slice of results.
+
+    Stops at the first short page (the end of the results) or failed page;
+    in the latter case the cursor resumes at the failed page so the client
+    can retry it, unless the page was not found because the results end
+    before it. A failure of the first page is returned unchanged. ``total``
+    is the number of results when known, so a full last page can end them.
+    """
+    first = outcomes[0]
+    if first is None and pages[0] > 1 and _known_end(region, keywords, pages[0]):
+        # A cursor past the end of the results (the fetch just found out)
+        return SearchOutcome(ProductPage((), ()), 0.0, False)
+    if first is None or first.result.api_errors:
+        return first
+
+    end = offset + item_count
+    next_offset = end if end < MAX_RESULTS else None
+    usable = []
+    for page, outcome in zip(pages, outcomes):
+        start = (page - 1) * PAGE_SIZE
+        if outcome is None and _known_end(region, keywords, page):
+            next_offset = None
+            break
+        if outcome is None or outcome.result.api_errors:
+            logging.warning(
+                "Page %s for '%s' in region %s failed; returning earlier pages only.", page, keywords, region)
+            next_offset = start
+            break
+        usable.append((start, outcome))
+        available = len(outcome.result.products)
+        if available < PAGE_SIZE or (total is not None and start + available >= total):
+            next_offset = end if end < start + available else None
+            break
+
+    # Reuse the assembled page (and its encoded bodies) until a source page changes
+    view_key = (region, keywords, offset, item_count, next_offset,
+                tuple(outcome.result.fetched_at for _, outcome in usable))
+    view = VIEWS.get(view_key)
+    if view is None:
+        seen = set()
+        products = []
+        for start, outcome in usable:
+            for position, record in enumerate(outcome.result.products, start):
+                if not offset <= position < end:
+                    continue
+                if record.asin is not None:
+                    if record.asin in seen:
+                        continue
+                    seen.add(record.asin)
+                products.append(record)
+        view = ProductPage(
+            tuple(products), (),
+            next_cursor=encode_cursor(next_offset) if next_offset is not None else None,
+            fetched_at=min(outcome.result.fetched_at for _, outcome in usable))
+        VIEWS.set(view_key, view)
+    return SearchOutcome(view,
+                         max(outcome.age_seconds for _, outcome in usable),
+                         any(outcome.stale for _, outcome in usable))
+
+
+# --- Async Fan-out ---
+# The SDK is synchronous, so each query runs on a worker thread. A dedicated
+# pool (rather than the event loop's default one) means a query that times
+# out keeps running without holding up the caller's loop shutdown. asyncio is
+# imported where used: the threaded WSGI app never needs it.
+MULTI_SEARCH_MAX_CONCURRENCY = 4
+MULTI_SEARCH_TIMEOUT_SECONDS = 10.0
+# async_search_products searches local indexes up to this size on the event
+# loop (well under a millisecond); larger ones cost more than a thread hop
+ASYNC_INLINE_INDEX_MAX_PRODUCTS = 1000
+_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=16,
+                                      thread_name_prefix="paapi-search")
+
+
+async def async_search_many(queries, item_count: int = 10,
+                            max_concurrency: int = MULTI_SEARCH_MAX_CONCURRENCY,
+                            timeout: float = MULTI_SEARCH_TIMEOUT_SECONDS) -> list:
+    """
+    Runs several searches concurrently, e.g. one keyword across every region.
+
+    Each query goes through ``lookup_bluey_products``, so it is served from
+    the cache, coalesced with identical in-flight fetches and rate limited
+    like any other request. A query that fails or exceeds ``timeout`` is
+    reported in its result without affecting the others.
+
+    Args:
+        queries: Iterable of (region, keywords) pairs.
+        item_count: The maximum number of items per query.
+        max_concurrency: Maximum queries running at once.
+        timeout: Seconds allowed per query.
+
+    Returns:
+        A MultiSearchResult per query, in the order given.
+    """
+    import asyncio
+    semaphore = asyncio.Semaphore(max_concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def run(region, keywords):
+        async with semaphore:
+            try:
+                outcome = await asyncio.wait_for(
+                    loop.run_in_executor(_SEARCH_EXECUTOR, lookup_bluey_products,
+                                         region, keywords, item_count),
+                    timeout)
+            except asyncio.TimeoutError:
+                logging.warning(
+                    "Search for '%s' in region %s timed out after %.1fs.", keywords, region, timeout)
+                return MultiSearchResult(region, keywords, None, "timeout")
+            except Exception as e:
+                logging.error(
+                    "Search for '%s' in region %s failed: %s", keywords, region, e, exc_info=True)
+                return MultiSearchResult(region, keywords, None, str(e))
+        if outcome is None:
+            return MultiSearchResult(region, keywords, None, "failed")
+        return MultiSearchResult(region, keywords, outcome, None)
+
+    return await asyncio.gather(*(run(region, keywords)
+                                  for region, keywords in queries))
+
+
+def search_many(queries, item_count: int = 10, **kwargs) -> list:
+    """Synchronous wrapper around ``async_search_many`` for non-async callers."""
+    import asyncio
+    return asyncio.run(async_search_many(queries, item_count, **kwargs))
+
+
+# Searches that need the PA API, awaited by any number of identical requests
+ASYNC_IN_FLIGHT = AsyncSingleFlight()
+
+
+async def async_search_products(region: str, keywords: str = "Bluey Toys",
+                                item_count: int = 10, offset: int = 0,
+                                category: str | None = None,
+                                encoding: str | None = None) -> SearchOutcome | None:
+    """
+    ``search_products`` for async servers (see ``asgi``): upstream waits hold no thread.
+
+    Requests whose pages are all cached in process memory (fresh or stale)
+    are answered on the calling event loop, provided the response body is
+    already encoded; that path never waits on upstream. Everything slower
+    runs on a worker thread: searches of large local indexes, first-time
+    compression of a page, any use of a shared cache backend and upstream
+    searches. Concurrent identical requests needing upstream await
+    one search (``ASYNC_IN_FLIGHT``) instead of each occupying a thread.
+
+    Args:
+        encoding: The Content-Encoding the response will use (None for
+            plain JSON); its body is built before returning, so rendering
+            the response on the loop only writes bytes.
+
+    Other args and the return value are as for ``search_products``.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    # CPU-bound work goes to the loop's default executor, so it never queues
+    # behind upstream searches waiting on _SEARCH_EXECUTOR threads
+    canonical = canonical_keywords(keywords)
+    if category is not None:
+        outcome = await _search_index(loop, region, canonical, item_count, offset, category)
+        return await _prepare_off_loop(loop, outcome, encoding)
+    item_count = min(item_count, MAX_RESULTS - offset)
+    if item_count < 1:
+        return SearchOutcome(ProductPage((), ()), 0.0, False)
+    pages, total = _known_pages(region, canonical, offset, item_count)
+    if not pages:
+        return SearchOutcome(ProductPage((), ()), 0.0, False)
+    if not isinstance(CACHE, TTLCache):
+        # Even probing a shared backend is I/O, so all of it runs on a worker thread
+        outcome = await _search_upstream(loop, search_products, region, canonical,
+                                         item_count, offset, encoding)
+        return await _prepare_off_loop(loop, outcome, encoding)
+    outcome = None
+    if _cached_until_hard_ttl(region, canonical, pages):
+        # Every page is a hit: no upstream call, and no point fanning out to threads
+        outcomes = [_lookup_page(region, canonical, page, cached_only=True) for page in pages]
+        if None not in outcomes:  # Else a page was evicted since the check
+            outcome = _assemble(region, canonical, offset, item_count, pages, outcomes, total)
+    elif local_search_enabled() and _page_cache_key(region, canonical, 1) not in CACHE:
+        outcome = await _search_index(loop, region, canonical, item_count, offset)
+    if outcome is None:
+        outcome = await _search_upstream(loop, lookup_bluey_products, region, canonical,
+                                         item_count, offset, encoding)
+    return await _prepare_off_loop(loop, outcome, encoding)
+
+
+async def _search_index(loop, region: str, keywords: str, item_count: int, offset: int,
+                        category: str | None = None) -> SearchOutcome | None:
+    """``_search_locally``, on a worker thread once the region's index is large."""
+    if SEARCH_INDEX.size(region) <= ASYNC_INLINE_INDEX_MAX_PRODUCTS:
+        return _search_locally(region, keywords, item_count, offset, category)
+    return await loop.run_in_executor(
+        None, _search_locally, region, keywords, item_count, offset, category)
+
+
+async def _prepare_off_loop(loop, outcome: SearchOutcome | None,
+                            encoding: str | None) -> SearchOutcome | None:
+    """Builds the outcome's response body on a worker thread unless it already exists."""
+    if outcome is None or outcome.result.prepared(outcome.stale, encoding):
+        return outcome
+    # E.g. a new view: compressing it (brotli especially) would stall the loop
+    return await loop.run_in_executor(None, _prepared, encoding, lambda: outcome)
+
+
+async def _search_upstream(loop, search, region: str, keywords: str, item_count: int,
+                           offset: int, encoding: str | None) -> SearchOutcome | None:
+    """
+    Runs ``search`` (which may call the PA API) on a worker thread, shared by identical requests.
+
+    The thread also builds the body for the first caller's ``encoding``.
+    """
+    return await ASYNC_IN_FLIGHT.do(
+        (region, keywords, offset, item_count), loop.run_in_executor,
+        _SEARCH_EXECUTOR, _prepared, encoding, search,
+        region, keywords, item_count, offset)
+
+
+def _prepared(encoding: str | None, search, *args) -> SearchOutcome | None:
+    """Runs ``search(*args)`` and builds the response body of the page it returns."""
+    outcome = search(*args)
+    if outcome is not None:
+        outcome.result.prepare(outcome.stale, encoding)
+    return outcome
+
+
+def _cached_until_hard_ttl(region: str, keywords: str, pages: range) -> bool:
+    """True if every page is cached and younger than the hard TTL (serving it never waits)."""
+    hard_ttl = get_hard_cache_ttl(region)
+    now = time.time()
+    for page in pages:
+        # Not counted: the lookup that follows is
+        entry = CACHE.peek(_page_cache_key(region, keywords, page))
+        if entry is None or now - entry.stored_at >= hard_ttl:
+            return False
+    return True
+
+
+def _is_failed_result(search_result) -> bool:
+    """True if a fetch produced nothing usable (an exception or API errors)."""
+    return search_result is None or bool(search_result.api_errors)
+
+
+def _schedule_refresh(region: str, keywords: str, page: int, cache_key: str) -> None:
+    """Starts a background refresh for ``cache_key`` unless one is already running."""
+    if IN_FLIGHT.in_flight(cache_key):
+        return
+    _start_background(IN_FLIGHT.do, cache_key, _fetch_and_cache,
+                      region, keywords, page, cache_key, False,
+                      BACKGROUND, BACKGROUND_MAX_WAIT_SECONDS)
+
+
+def _start_background(fn, *args) -> None:
+    """Runs ``fn(*args)`` on a daemon thread."""
+    threading.Thread(target=fn, args=args, daemon=True).start()
+
+
+def _fetch_and_cache(region: str, keywords: str, page: int, cache_key: str,
+                     force: bool = False, priority: int = INTERACTIVE,
+                     max_wait: float = INTERACTIVE_MAX_WAIT_SECONDS):
+    """
+    Calls the Amazon PA API for one page of results and caches a successful result.
+
+    Runs at most once at a time per cache key (see ``IN_FLIGHT``); all waiting
+    callers receive its return value, including the None/error results. The
+    call first queues for a rate limit token at ``priority`` and gives up
+    (returning None) if none is granted within ``max_wait`` seconds.
+
+    Failed results are remembered (see ``FAILURES``): until the key's backoff
+    expires, even forced fetches return the failure without calling the PA
+    API. No call is made either while the region's circuit is open.
+    """
+    # Another flight may have refreshed the cache between our miss and now
+    # (not counted: the caller's lookup already was)
+    if not force:
+        entry = CACHE.peek(cache_key)
+        if entry is not None and time.time() - entry.stored_at < get_cache_ttl(region):
+            return entry.value
+
+    failure = FAILURES.get(cache_key)
+    if failure is not None:
+        logging.info(
+            "Skipping PA API call for '%s' (page %s) in region %s: backing off after failures.", keywords, page, region)
+        return failure[0]
+
     logging.info(
-        f"Cache miss or expired. Calling Amazon PA API for '{keywords}' in region {region}.")
-    amazon = get_amazon_client(region)
+        "Cache miss or expired. Calling Amazon PA API for '%s' (page %s) in region %s.", keywords, page, region)
+    amazon = get_client(region)
     if not amazon:
         return None  # Error handled within get_amazon_client
 
+    if not BREAKER.allow(region):
+        logging.warning(
+            "Circuit open for region %s; skipping PA API call for '%s' (page %s).", region, keywords, page)
+        return None
+
+    limiter_key = _rate_limit_key(region)
+    if not UPSTREAM.acquire(limiter_key, priority, timeout=max_wait, tag=cache_key):
+        BREAKER.release(region)
+        logging.warning(
+            "Rate limit: no PA API capacity within %.1fs for '%s' in region %s; skipping call.", max_wait, keywords, region)
+        return None
+
     try:
         # Define which details we want in the response (keep for reference)
         # search_resources = [
@@ -159,43 +1094,150 @@ def search_bluey_products(region: str, keywords: str = "Bluey Toys", item_count:
         # ]
 
         # Perform the search (REMOVED explicit resources argument)
-        search_result = amazon.search_items(
-            keywords=keywords,
-            item_count=item_count
-        )
+        # Always request full pages so any item_count can share them
+        with _upstream_call(region, "search_items"):
+            search_result = amazon.search_items(
+                keywords=keywords,
+                item_count=PAGE_SIZE,
+                item_page=page
+            )
+
+        # Keep only the fields we serve, as plain data that any cache backend can store
+        projected = project_search_result(search_result)
+        # The region answered, whatever it said about this search
+        BREAKER.record_success(region)
 
-        # TODO: Add more robust processing of the search_result
         # Check for errors within the search_result object itself
-        if hasattr(search_result, 'errors') and search_result.errors:
+        if projected.api_errors:
             logging.warning(
-                f"API returned errors for '{keywords}' in region {region}: {search_result.errors}")
-            # Decide if you still want to cache partial results or errors
-            # For now, we won't cache results with errors
-            return search_result  # Or return None, depending on desired behavior
+                "API returned errors for '%s' in region %s: %s", keywords, region, search_result.errors)
+            # Not cached as a result, but replayed until the key's backoff expires
+            delay = FAILURES.record_failure(cache_key, projected,
+                                            "; ".join(map(str, projected.api_errors)))
+            logging.info("Retrying '%s' (page %s) in region %s in %.0fs.", keywords, page, region, delay)
+            return projected
 
         logging.info(
-            f"Successfully searched Amazon PA API for '{keywords}' in region {region}.")
+            "Successfully searched Amazon PA API for '%s' in region %s.", keywords, region)
+        FAILURES.record_success(cache_key)
+        _record_result_end(region, keywords, page, len(projected.products))
 
         # --- Cache Update ---
-        # Get the current time *again* for the cache timestamp
-        cache_timestamp = time.time()
-        CACHE[cache_key] = (cache_timestamp, search_result)
+        # Encode the response bodies now so cache hits only write bytes
+        ttl = get_hard_cache_ttl(region) + CACHE_STALE_GRACE_SECONDS
+        CACHE.set(cache_key, projected.encode(), ttl=ttl)
+        _track_page(region, cache_key, projected.products, time.time() + ttl)
+        items = [item for item in getattr(search_result, 'items', None) or ()
+                 if getattr(item, 'asin', None)]
+        SEARCH_INDEX.add(region, projected.products,
+                         features={item.asin: project_features(item) for item in items})
+        FACETS.add(region, {item.asin: project_categories(item) for item in items})
         logging.info(
-            f"Stored result in cache for '{keywords}' in region {region}.")
+            "Stored result in cache for '%s' in region %s.", keywords, region)
 
-        return search_result
+        return projected
 
+    except _sdk_errors().ItemsNotFound as e:
+        # A problem with this search only, not with the region
+        BREAKER.record_success(region)
+        _record_result_end(region, keywords, page, None)
+        delay = FAILURES.record_failure(cache_key, None, _describe_error(e))
+        logging.warning(
+            "No items found for '%s' (page %s) in region %s; retrying in %.0fs.", keywords, page, region, delay)
+        return None
     except Exception as e:
+        if isinstance(e, _sdk_errors().TooManyRequests):
+            # Our quota estimate was too generous; back off before the next call
+            UPSTREAM.penalize(limiter_key)
+        BREAKER.record_failure(region, _describe_error(e))
+        FAILURES.record_failure(cache_key, None, _describe_error(e))
         # Add exc_info for traceback
         logging.error(
-            f"Error searching Amazon PA API in region {region}: {e}", exc_info=True)
+            "Error searching Amazon PA API in region %s: %s", region, e, exc_info=True)
         return None
 
 
+def _sdk_errors():
+    """
+    The SDK's exception module, imported on first use.
+
+    Only needed once a call has raised; by then a client (and so the SDK)
+    has normally been loaded. ``except`` clauses evaluate their expression
+    only when matching an exception, so they can call this.
+    """
+    from amazon_paapi import errors
+    return errors
+
+
+class _upstream_call:
+    """Times a PA API call into ``UPSTREAM_LATENCY`` and counts it as in flight."""
+
+    __slots__ = ('region', 'operation', '_start')
+
+    def __init__(self, region: str, operation: str):
+        self.region = region
+        self.operation = operation
+
+    def __enter__(self):
+        UPSTREAM_IN_FLIGHT.labels(self.region).inc()
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        UPSTREAM_IN_FLIGHT.labels(self.region).dec()
+        if exc_type is None or issubclass(exc_type, _sdk_errors().ItemsNotFound):
+            outcome = "ok"
+        elif issubclass(exc_type, _sdk_errors().TooManyRequests):
+            outcome = "throttled"
+        else:
+            outcome = "error"
+        UPSTREAM_LATENCY.labels(self.region, self.operation, outcome).observe(elapsed)
+
+
+def _collect_metrics() -> list:
+    """Scrape-time metrics read from the cache, rate limiter, breaker and in-flight calls."""
+    cache = CACHE.stats()
+    families = [
+        metrics.Family(f"product_cache_{name}", "counter", f"Product cache {name}.",
+                       [("_total", {}, cache.get(name, 0))])
+        for name in ("hits", "misses", "evictions", "expirations")]
+    families += [
+        metrics.Family(f"product_cache_{name}", "gauge", f"Product cache {name}.",
+                       [("", {}, cache[name])])
+        for name in ("entries", "bytes") if name in cache]
+    families.append(metrics.Family(
+        "paapi_fetches_in_flight", "gauge",
+        "Distinct page fetches in flight (concurrent misses share one).",
+        [("", {}, len(IN_FLIGHT))]))
+    queued = []
+    for lane, stats in UPSTREAM.stats().items():
+        for priority, counts in stats["priorities"].items():
+            queued.append(("", {"lane": lane, "priority": priority}, counts["queued"]))
+    families.append(metrics.Family(
+        "paapi_rate_limit_queued", "gauge", "Calls waiting for a rate limit token.", queued))
+    families.append(metrics.Family(
+        "paapi_circuit_open", "gauge", "1 while a region's circuit breaker is open.",
+        [("", {"region": region}, int(circuit["state"] != "closed"))
+         for region, circuit in BREAKER.stats().items()]))
+    families.append(metrics.Family(
+        "paapi_keys_backing_off", "gauge", "Search keys backing off after failures.",
+        [("", {}, FAILURES.stats()["backing_off"])]))
+    return families
+
+
+metrics.REGISTRY.add_collector(_collect_metrics)
+
+
+def _describe_error(e: Exception) -> str:
+    """Short description of an upstream exception for status reporting."""
+    return f"{type(e).__name__}: {e}"[:200]
+
+
 # Example usage (for testing purposes)
 if __name__ == '__main__':
+    configure()
     # Set level to DEBUG for more verbose output when running directly
-    logging.getLogger().setLevel(logging.DEBUG)
+    configure_logging(level=logging.DEBUG, cache_hit_sample_rate=1.0)
     logging.info("Testing Amazon Service...")
     # Make sure to set environment variables before running this directly
     # Example: export AMAZON_ACCESS_KEY='YOUR_KEY'
@@ -209,9 +1251,9 @@ if __name__ == '__main__':
         if results:
             # In a real scenario, you'd parse results.items, results.errors etc.
             # Use debug for raw object
-            logging.debug(f"Search results obtained (raw object): {results}")
+            logging.debug("Search results obtained (raw object): %s", results)
         else:
             logging.error("Search failed.")
     else:
         logging.error(
-            f"Failed to initialize client for {test_region}. Check environment variables and configuration.")
+            "Failed to initialize client for %s. Check environment variables and configuration.", test_region)
@@ -1,76 +1,373 @@
-from flask import Flask, jsonify, request
+import time
+import logging
+from typing import NamedTuple
+from datetime import datetime, timezone
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 # Import the amazon service module (changed to relative for testing)
 from . import amazon_service
+from . import compression
+from . import warmup
+from . import catalogue
+from . import bundles
+from . import prices
+from . import metrics
+from .log_config import QUERY_LOGGER, configure_logging
+from .products import decode_cursor
 
 app = Flask(__name__)
 # Enable CORS for /api/* routes from localhost:3000
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
 
+REQUEST_LATENCY = metrics.Histogram(
+    "http_request_duration_seconds", "Time to handle a request, by endpoint and status.",
+    ["endpoint", "status"])
+REQUESTS_IN_FLIGHT = metrics.Gauge(
+    "http_requests_in_flight", "Requests currently being handled.")
+
+# WSGI environ keys set by the ASGI server (see asgi.py): when the request
+# was received, and the /api/products outcome it already awaited
+ENVIRON_REQUEST_STARTED = "backend.request_started"
+ENVIRON_PRODUCTS_OUTCOME = "backend.products_outcome"
+
+# Every /api/products query, as sent; sampled like cache hits (see log_config)
+_QUERY_LOG = logging.getLogger(QUERY_LOGGER)
+
+
+@app.before_request
+def _start_timer():
+    REQUESTS_IN_FLIGHT.inc()
+    g.request_started = request.environ.get(ENVIRON_REQUEST_STARTED) or time.perf_counter()
+
+
+@app.after_request
+def _record_latency(response):
+    REQUEST_LATENCY.labels(request.endpoint or "unmatched", response.status_code).observe(
+        time.perf_counter() - g.request_started)
+    return response
+
+
+@app.teardown_request
+def _end_request(exc):
+    # Runs even when a view raised, unlike after_request, but also for
+    # contexts that never dispatched a request
+    if g.pop('request_started', None) is not None:
+        REQUESTS_IN_FLIGHT.dec()
+
 
 @app.route('/')
 def hello_world():
     return 'Hello, World!'
 
 
+def _cache_control(region: str) -> str:
+    """
+    Builds the Cache-Control header for product responses in a region.
+
+    Mirrors the backend cache: responses are fresh for the soft TTL, may be
+    served stale while revalidating until the hard TTL, and on upstream errors
+    for the grace period after that. The Age header tells caches how much of
+    the freshness lifetime has already been used.
+    """
+    soft_ttl = int(amazon_service.get_cache_ttl(region))
+    hard_ttl = int(amazon_service.get_hard_cache_ttl(region))
+    return (f"public, max-age={soft_ttl}, "
+            f"stale-while-revalidate={hard_ttl - soft_ttl}, "
+            f"stale-if-error={int(amazon_service.CACHE_STALE_GRACE_SECONDS)}")
+
+
+class ProductsQuery(NamedTuple):
+    """The validated query parameters of an /api/products request."""
+    region: str
+    keywords: str
+    item_count: int
+    offset: int
+    category: str | None
+
+
+def parse_products_query(args) -> tuple:
+    """
+    Validates /api/products query parameters.
+
+    Returns:
+        (ProductsQuery, None), or (None, error message) for a 400 response.
+    """
+    region = args.get('region')
+    # Optional browse node ID from /api/categories
+    category = args.get('category') or None
+    keywords = args.get(
+        # Optional keyword param; a category alone lists the whole category
+        'keywords', default="" if category else "Bluey Toys")
+    try:
+        # Optional item_count param
+        item_count = int(args.get('item_count', default=10))
+    except ValueError:
+        return None, "Invalid item_count parameter. Must be an integer."
+
+    if item_count < 1:
+        return None, "Invalid item_count parameter. Must be positive."
+
+    # Optional cursor from a previous response's next_cursor
+    offset = 0
+    cursor = args.get('cursor')
+    if cursor:
+        try:
+            offset = decode_cursor(cursor)
+        except ValueError:
+            return None, "Invalid cursor parameter."
+        if offset >= amazon_service.MAX_RESULTS:
+            return None, "Invalid cursor parameter."
+
+    if not region:
+        return None, "Missing required query parameter: region"
+
+    region = region.upper()  # Ensure region is uppercase
+    return ProductsQuery(region, keywords, item_count, offset, category), None
+
+
+def searches_upstream(query: ProductsQuery) -> bool:
+    """True if the query is answered by ``amazon_service.search_products`` (and may call the PA API)."""
+    return (query.category is None and not catalogue.serve_from_catalogue()
+            and not bundles.serve_from_bundles())
+
+
 @app.route('/api/products')
 def get_products():
     """API endpoint to search for products on Amazon."""
+    query, error = parse_products_query(request.args)
+    if error is not None:
+        return jsonify({"error": error}), 400
+    region, keywords, item_count, offset, category = query
+    # Raw queries as sent, for replays (see benchmarks/replay_query_log.py);
+    # dropped unless LOG_QUERY_SAMPLE_RATE is set
+    _QUERY_LOG.info(
+        "Product query: region=%s item_count=%s offset=%s keywords=%r", region, item_count, offset, keywords)
+
+    if category is not None:
+        if catalogue.serve_from_catalogue():
+            return jsonify({"error": "Category filtering is not available in catalogue mode."}), 400
+        if bundles.serve_from_bundles():
+            return jsonify({"error": "Category filtering is not available in bundles mode."}), 400
+        if amazon_service.FACETS.members(region, category) is None:
+            return jsonify({"error": "Unknown category for this region."}), 404
+        # Answered in memory from the facet and search indexes
+        outcome = amazon_service.search_products(
+            region=region,
+            keywords=keywords,
+            item_count=item_count,
+            offset=offset,
+            category=category
+        )
+    elif catalogue.serve_from_catalogue():
+        # Answer from the locally stored snapshot; never calls the PA API
+        outcome = catalogue.get_catalogue().lookup(
+            region, keywords, item_count, offset)
+        if outcome is None:
+            return jsonify({"error": "No stored products for this search."}), 404
+    elif bundles.serve_from_bundles():
+        # Answer from the prebuilt bundles: a slice of a mapped file
+        outcome = bundles.get_bundles().lookup(region, keywords, item_count, offset)
+        if outcome is None:
+            return jsonify({"error": "No bundled products for this search."}), 404
+    elif ENVIRON_PRODUCTS_OUTCOME in request.environ:
+        # Served by asgi.py, which awaited the search without holding a thread
+        outcome = request.environ[ENVIRON_PRODUCTS_OUTCOME]
+    else:
+        # Call the service function: answers from the local search index
+        # when it can, else upstream (may serve stale data while refreshing)
+        outcome = amazon_service.search_products(
+            region=region,
+            keywords=keywords,
+            item_count=item_count,
+            offset=offset
+        )
+
+    if outcome is None:
+        # Error occurred during client init or API call (logged in amazon_service)
+        return jsonify({"error": "Failed to fetch products from Amazon."}), 500
+    # The service returns a ProductPage whose response bodies are already
+    # encoded, so a cache hit is a plain byte write
+    page = outcome.result
+    if not bundles.serve_from_bundles():
+        # Views decide which products get their prices refreshed most often
+        # (bundles are rebuilt whole, and reading their records isn't free)
+        prices.PRICES.record_views(region, page.products)
+    encoding = compression.negotiate(request.accept_encodings)
+
+    response = app.response_class(
+        page.body(stale=outcome.stale, encoding=encoding),
+        mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Age of the data served; stale results are being refreshed in background
+    response.headers['Age'] = str(int(outcome.age_seconds))
+
+    if page.api_errors:
+        # Only negative-cached briefly here (see amazon_service.FAILURES), so
+        # browsers and CDNs must not keep the error: no validators either
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    # Validators and freshness so browsers and CDNs can revalidate with a 304
+    etag = page.etag(outcome.stale)
+    response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    response.last_modified = datetime.fromtimestamp(
+        page.fetched_at, tz=timezone.utc)
+    response.headers['Cache-Control'] = _cache_control(region)
+    return response.make_conditional(request)
+
+
+MAX_MULTI_QUERIES = 20  # Upper bound on region x keyword pairs per request
+
+
+def _multi_result_to_dict(result) -> dict:
+    """Serialises one MultiSearchResult for the /api/products/multi response."""
+    data = {"region": result.region, "keywords": result.keywords}
+    if result.outcome is None:
+        data.update({"status": "timeout" if result.error == "timeout" else "error",
+                     "error": result.error})
+        return data
+    page = result.outcome.result
+    data.update({
+        "status": "ok",
+        "products": [p.to_dict() for p in page.products],
+        "api_errors": list(page.api_errors),
+        "fetched_at": page.fetched_at,
+        "age_seconds": int(result.outcome.age_seconds),
+        "stale": result.outcome.stale,
+    })
+    return data
+
+
+@app.route('/api/categories')
+def get_categories():
+    """
+    API endpoint listing the categories of products seen in a region.
+
+    Each category carries its browse node ``id`` (usable as
+    ``/api/products?category=``), ``name``, ``parent_id`` and product
+    ``count``, most populated first.
+    """
     region = request.args.get('region')
-    keywords = request.args.get(
-        'keywords', default="Bluey Toys")  # Optional keyword param
+    if not region:
+        return jsonify({"error": "Missing required query parameter: region"}), 400
+    region = region.upper()
+    return jsonify({"region": region,
+                    "categories": amazon_service.get_categories(region)})
+
+
+@app.route('/api/products/multi')
+def get_products_multi():
+    """
+    API endpoint searching several regions and/or keywords concurrently.
+
+    Query parameters: ``regions`` (comma separated, defaults to every
+    region), ``keywords`` (repeatable, defaults to "Bluey Toys") and
+    ``item_count``. Queries that fail or time out are reported per result;
+    the response is only an error if every query failed.
+    """
+    regions_param = request.args.get('regions')
+    regions = ([r.strip().upper() for r in regions_param.split(',') if r.strip()]
+               if regions_param else list(amazon_service.REGION_CONFIG))
+    keywords_list = request.args.getlist('keywords') or ["Bluey Toys"]
     try:
-        # Optional item_count param
         item_count = int(request.args.get('item_count', default=10))
     except ValueError:
         return jsonify({"error": "Invalid item_count parameter. Must be an integer."}), 400
 
-    if not region:
-        return jsonify({"error": "Missing required query parameter: region"}), 400
+    unknown = [r for r in regions if r not in amazon_service.REGION_CONFIG]
+    if unknown:
+        return jsonify({"error": f"Unsupported region(s): {', '.join(unknown)}"}), 400
+    queries = [(region, keywords) for keywords in keywords_list for region in regions]
+    if not queries or len(queries) > MAX_MULTI_QUERIES:
+        return jsonify({"error": f"Request between 1 and {MAX_MULTI_QUERIES} region x keyword combinations."}), 400
 
-    # Call the service function
-    search_result = amazon_service.search_bluey_products(
-        region=region.upper(),  # Ensure region is uppercase
-        keywords=keywords,
-        item_count=item_count
-    )
+    results = [_multi_result_to_dict(r)
+               for r in amazon_service.search_many(queries, item_count)]
+    succeeded = sum(1 for r in results if r["status"] == "ok")
+    if not succeeded:
+        return jsonify({"error": "Failed to fetch products from Amazon.",
+                        "results": results}), 500
+    return jsonify({"results": results, "partial": succeeded < len(results)})
+
+
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    """API endpoint exposing product cache hit/miss/eviction counters."""
+    return jsonify(amazon_service.get_cache_stats())
+
+
+@app.route('/api/ratelimit/stats')
+def get_rate_limit_stats():
+    """API endpoint exposing PA API rate limiter queue depth and wait times."""
+    return jsonify(amazon_service.get_rate_limit_stats())
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus scrape endpoint: latency histograms, cache and upstream metrics."""
+    return Response(metrics.REGISTRY.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/api/upstream/status')
+def get_upstream_status():
+    """API endpoint exposing circuit breaker state and keys backing off after PA API failures."""
+    return jsonify(amazon_service.get_upstream_status())
+
+
+@app.route('/api/warmup/status')
+def get_warmup_status():
+    """API endpoint reporting duration and failures of recent cache warmup runs."""
+    return jsonify({"runs": warmup.WARMER.history()})
+
+
+@app.route('/api/prices/status')
+def get_prices_status():
+    """API endpoint reporting recent price/availability refresh runs."""
+    return jsonify({"runs": prices.PRICES.history()})
+
+
+def init_app(env_file: str | None = None, start_background: bool = True) -> Flask:
+    """
+    Prepares this process to serve requests; call once before the first one.
+
+    Importing the app configures nothing, so tests and tools import it
+    cheaply. This loads .env, sets up logging, applies the service settings
+    (``amazon_service.configure``) and, unless ``start_background`` is False
+    (e.g. on serverless platforms that freeze the process between
+    requests), starts the background services.
+
+    Args:
+        env_file: Path of the .env file; None to search for one.
+        start_background: Build the API clients and start the cache warmer
+            and price refresher.
+
+    Returns:
+        The Flask app.
+    """
+    from dotenv import load_dotenv
+    load_dotenv(env_file)  # Before logging, so LOG_* settings in .env apply
+    configure_logging()
+    amazon_service.configure(env_file)
+    if start_background:
+        start_services()
+    return app
 
-    if search_result is None:
-        # Error occurred during client init or API call (logged in amazon_service)
-        return jsonify({"error": "Failed to fetch products from Amazon."}), 500
 
-    # Basic processing: Check for API errors and extract items if available
-    products = []
-    api_errors = []
-
-    if hasattr(search_result, 'errors') and search_result.errors:
-        # Convert errors to strings
-        api_errors = [str(e) for e in search_result.errors]
-        # Decide if we should still return items even if there are errors
-        # For now, we'll return both items and errors if they exist
-
-    if hasattr(search_result, 'items') and search_result.items:
-        for item in search_result.items:
-            # Extract desired fields (handle potential missing data)
-            product_info = {
-                'asin': getattr(item, 'asin', None),
-                'title': getattr(item.item_info.title, 'display_value', None) if hasattr(item, 'item_info') and hasattr(item.item_info, 'title') else None,
-                'url': getattr(item, 'detail_page_url', None),
-                'image': getattr(item.images.primary.large, 'url', None) if hasattr(item, 'images') and hasattr(item.images, 'primary') and hasattr(item.images.primary, 'large') else None,
-                'price': getattr(item.offers.listings[0].price, 'display_amount', None) if hasattr(item, 'offers') and hasattr(item.offers, 'listings') and item.offers.listings else None,
-                # Add more fields as needed (e.g., features)
-            }
-            products.append(product_info)
-
-    response_data = {
-        "products": products,
-        "api_errors": api_errors  # Include any errors reported by the Amazon API
-    }
-
-    return jsonify(response_data)
+def start_services() -> None:
+    """Starts the background work a serving process needs; called once per process."""
+    # Build the per-region API clients up front rather than on the first request
+    amazon_service.warm_clients()
+    # Prefetch hot searches now and on an interval so visitors rarely miss
+    warmup.WARMER.start()
+    # Keep prices of shown products current between search refreshes
+    prices.PRICES.start()
 
 
 if __name__ == '__main__':
+    # Development server; see serve.py for production
+    init_app()
     # Make sure debug=False in production!
     # Use host='0.0.0.0' to make it accessible on the network
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,179 @@
+"""
+ASGI entry point: /api/products awaits the PA API instead of blocking a thread.
+
+Under the WSGI server every request holds a thread for its whole PA API
+round trip, so during a spike (say, popular keys expiring together) the
+thread pool fills with requests waiting on upstream and cache hits queue
+behind them. Here /api/products first awaits
+``amazon_service.async_search_products``, which answers from memory on the
+event loop and coalesces requests needing the same upstream search onto one
+worker thread, and then renders the response through the Flask view, so the
+status codes, headers, conditional requests and CORS are unchanged.
+
+Every other route is the Flask app run on a worker thread.
+
+Serve with any ASGI server, e.g. via serve.py or directly:
+    python -m backend.serve --mode asgi
+    uvicorn backend.asgi:application
+"""
+import sys
+import time
+import asyncio
+import logging
+from io import BytesIO
+from werkzeug.wrappers import Request
+from . import amazon_service
+from . import compression
+from .app import (app as flask_app, init_app, parse_products_query, searches_upstream,
+                  ENVIRON_PRODUCTS_OUTCOME, ENVIRON_REQUEST_STARTED, REQUESTS_IN_FLIGHT)
+
+PRODUCTS_PATH = "/api/products"
+
+
+class AsgiApp:
+    """
+    Serves the Flask app over ASGI with a non-blocking /api/products.
+
+    Args:
+        wsgi_app: The Flask (WSGI) application rendering responses.
+        on_startup: Called (synchronously) when the server starts, e.g.
+            ``app.init_app``; run once per worker process.
+        on_shutdown: Called when the server stops.
+    """
+
+    def __init__(self, wsgi_app=flask_app, on_startup=None, on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _http(self, scope, receive, send):
+        started = time.perf_counter()
+        body = await _read_body(receive)
+        environ = _wsgi_environ(scope, body)
+        environ[ENVIRON_REQUEST_STARTED] = started
+        if scope["method"] in ("GET", "HEAD") and scope["path"] == PRODUCTS_PATH:
+            query, error = parse_products_query(Request(environ).args)
+            if error is None and searches_upstream(query):
+                REQUESTS_IN_FLIGHT.inc()  # The Flask hooks count the rest of the request
+                encoding = compression.negotiate(Request(environ).accept_encodings)
+                try:
+                    environ[ENVIRON_PRODUCTS_OUTCOME] = await amazon_service.async_search_products(
+                        query.region, query.keywords, query.item_count, query.offset,
+                        encoding=encoding)
+                except Exception:
+                    logging.error("Product search failed for %r", query, exc_info=True)
+                    environ[ENVIRON_PRODUCTS_OUTCOME] = None
+                finally:
+                    REQUESTS_IN_FLIGHT.dec()
+                # The bodies are encoded off the loop, so rendering only writes bytes
+                status, headers, chunks = _call_wsgi(self.wsgi_app, environ)
+                await _send_response(send, status, headers, chunks)
+                return
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(
+            None, _call_wsgi, self.wsgi_app, environ)
+        await _send_response(send, status, headers, chunks)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    if self.on_startup is not None:
+                        self.on_startup()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.on_shutdown is not None:
+                    self.on_shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def _wsgi_environ(scope, body: bytes) -> dict:
+    """Builds the PEP 3333 environ for an ASGI HTTP scope."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if name == "CONTENT_LENGTH":
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(wsgi_app, environ) -> tuple:
+    """Runs a WSGI app to completion. Returns (status code, headers, body chunks)."""
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [int(status.split(" ", 1)[0]), headers]
+
+    iterable = wsgi_app(environ, start_response)
+    try:
+        chunks = [chunk for chunk in iterable if chunk]
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+    status, headers = response
+    return status, headers, chunks
+
+
+async def _send_response(send, status: int, headers, chunks) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": b"".join(chunks)})
+
+
+# Settings, logging and background services are set up per worker at startup
+application = AsgiApp(on_startup=init_app)
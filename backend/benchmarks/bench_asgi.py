@@ -0,0 +1,157 @@
+"""
+Benchmark: /api/products requests/sec, WSGI threads vs ASGI, with a slow PA API.
+
+Both modes serve the same app in process, against the stub PA API (see
+paapi_stub.py) with ``--latency`` seconds per call and no rate limit:
+
+* wsgi: each request runs on one of ``--threads`` server threads (like a
+  gunicorn gthread worker) and holds it until answered
+* asgi: requests are coroutines on one event loop (asgi.py); only upstream
+  searches take a worker thread, one per distinct search
+
+``--clients`` concurrent clients send requests back to back. Workloads:
+
+* long_tail: popular searches are cached; ``--miss-rate`` of requests are
+  one-off searches that go upstream
+* ttl_churn: TTLs are cut to ``--ttl`` seconds, so the popular searches keep
+  expiring past the hard TTL and requests for them block on upstream (the
+  worst case of a spike while popular keys expire)
+
+Run from the repository root:
+    python -m backend.benchmarks.bench_asgi --clients 200 --requests 3000
+"""
+import time
+import random
+import asyncio
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from urllib.parse import urlencode, urlsplit
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+from .. import amazon_service
+from ..app import app
+from ..asgi import application
+from ..ratelimit import UpstreamLimiter
+from .load_test import POPULAR, percentile, reset_service
+from .paapi_stub import StubPaapi
+
+REGIONS = ["US", "GB", "AU", "CA"]
+
+
+def make_urls(count: int, miss_rate: float, seed: int) -> list:
+    rng = random.Random(seed)
+    urls = []
+    for n in range(count):
+        keywords = f"bluey gift idea {n}" if rng.random() < miss_rate else rng.choice(POPULAR)
+        urls.append("/api/products?" + urlencode({"region": rng.choice(REGIONS),
+                                                  "keywords": keywords}))
+    return urls
+
+
+def wsgi_get(url: str) -> int:
+    environ = EnvironBuilder(url, headers={"Accept-Encoding": "gzip"}).get_environ()
+    body, status, _ = run_wsgi_app(app, environ, buffered=True)
+    return int(status.split(" ", 1)[0])
+
+
+async def asgi_get(url: str) -> int:
+    parts = urlsplit(url)
+    scope = {"type": "http", "method": "GET", "path": parts.path, "root_path": "",
+             "query_string": parts.query.encode(), "http_version": "1.1", "scheme": "http",
+             "server": ("localhost", 80), "client": ("127.0.0.1", 0),
+             "headers": [(b"accept-encoding", b"gzip")]}
+    statuses = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await application(scope, receive, send)
+    return statuses[0]
+
+
+async def drive(urls: list, clients: int, get) -> tuple:
+    """Runs ``clients`` closed-loop clients over ``urls``. Returns (latencies, statuses, seconds)."""
+    pending = iter(urls)
+    latencies, statuses = [], []
+
+    async def client():
+        for url in pending:
+            start = time.perf_counter()
+            statuses.append(await get(url))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def run(mode: str, workload: str, args) -> dict:
+    reset_service()
+    stub = StubPaapi(latency=args.latency, jitter=0.2)
+    ttl = args.ttl if workload == "ttl_churn" else amazon_service.CACHE_DURATION_SECONDS
+    with stub.installed(), \
+            patch.object(amazon_service, 'UPSTREAM', UpstreamLimiter(1e6, 1e6)), \
+            patch.object(amazon_service, 'CACHE_DURATION_SECONDS', ttl), \
+            patch.object(amazon_service, 'CACHE_HARD_TTL_SECONDS', ttl):
+        # Popular searches start out cached in every region
+        stub.latency = 0.0
+        for region in REGIONS:
+            for keywords in POPULAR:
+                amazon_service.search_products(region, keywords)
+        stub.latency = args.latency
+        stub.reset_counters()
+
+        urls = make_urls(args.requests, args.miss_rate if workload == "long_tail" else 0.0,
+                         args.seed)
+        if mode == "wsgi":
+            threads = ThreadPoolExecutor(max_workers=args.threads)
+
+            async def get(url):
+                return await asyncio.get_running_loop().run_in_executor(threads, wsgi_get, url)
+        else:
+            get = asgi_get
+        latencies, statuses, seconds = asyncio.run(drive(urls, args.clients, get))
+        if mode == "wsgi":
+            threads.shutdown()
+    latencies.sort()
+    return {
+        "rps": len(latencies) / seconds,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "errors": sum(1 for status in statuses if status != 200),
+        "upstream": stub.total_calls(),
+        "max_upstream": stub.max_in_flight,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workloads', nargs='+', choices=["long_tail", "ttl_churn"],
+                        default=["long_tail", "ttl_churn"])
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16, help="WSGI server threads.")
+    parser.add_argument('--latency', type=float, default=1.0, help="Seconds per PA API call.")
+    parser.add_argument('--miss-rate', type=float, default=0.05,
+                        help="long_tail: share of one-off searches.")
+    parser.add_argument('--ttl', type=float, default=0.5, help="ttl_churn: cache TTL (s).")
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'workload':<12} {'mode':<6} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'errors':>7} {'upstream':>9} {'max conc':>9}")
+    for workload in args.workloads:
+        for mode in ("wsgi", "asgi"):
+            r = run(mode, workload, args)
+            print(f"{workload:<12} {mode:<6} {r['rps']:>8.1f} {r['p50']:>9.1f} {r['p99']:>9.1f} "
+                  f"{r['errors']:>7} {r['upstream']:>9} {r['max_upstream']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark: bytes on the wire and CPU per /api/products request.
+
+Compares the original handler (walk SDK objects and jsonify on every request,
+uncompressed) with serving a cached ProductPage's pre-encoded bodies, and with
+the naive alternative of compressing on every request. Full-request rows go
+through the Flask test client (routing, CORS, conditional checks included);
+"handler work only" rows isolate the cost of producing the body. Note the
+test client itself accounts for most of the full-request CPU time.
+
+Run from the repository root:
+    python -m backend.benchmarks.bench_compression --requests 2000
+"""
+import argparse
+import gzip
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+from flask import Flask, jsonify, request
+from flask_cors import CORS
+from .. import amazon_service, compression
+from ..app import app
+from ..products import project_search_result
+
+
+def make_search_result(item_count: int):
+    """Builds a PA API-like search result with realistically long fields."""
+    items = []
+    for i in range(item_count):
+        asin = f"B0{i:08d}"
+        items.append(SimpleNamespace(
+            asin=asin,
+            item_info=SimpleNamespace(title=SimpleNamespace(
+                display_value=f"Bluey and Bingo Deluxe Family Campervan Playset with {i + 2} Figures and Accessories")),
+            detail_page_url=f"https://www.amazon.com/dp/{asin}?tag=blueytoys-20&linkCode=ogi&th=1&psc=1&language=en_US",
+            images=SimpleNamespace(primary=SimpleNamespace(large=SimpleNamespace(
+                url=f"https://m.media-amazon.com/images/I/71{asin}ExampleImageHash._AC_SL1500_.jpg"))),
+            offers=SimpleNamespace(listings=[SimpleNamespace(
+                price=SimpleNamespace(display_amount=f"${19 + i}.99"))]),
+        ))
+    return SimpleNamespace(items=items, errors=None)
+
+
+def legacy_products_response(search_result):
+    """The original get_products body: per-request object traversal + jsonify."""
+    products = []
+    for item in search_result.items:
+        products.append({
+            'asin': getattr(item, 'asin', None),
+            'title': getattr(item.item_info.title, 'display_value', None) if hasattr(item, 'item_info') and hasattr(item.item_info, 'title') else None,
+            'url': getattr(item, 'detail_page_url', None),
+            'image': getattr(item.images.primary.large, 'url', None) if hasattr(item, 'images') and hasattr(item.images, 'primary') and hasattr(item.images.primary, 'large') else None,
+            'price': getattr(item.offers.listings[0].price, 'display_amount', None) if hasattr(item, 'offers') and hasattr(item.offers, 'listings') and item.offers.listings else None,
+        })
+    return jsonify({"products": products, "api_errors": []})
+
+
+def make_legacy_app(search_result) -> Flask:
+    """A Flask app serving the original handler, optionally gzipping per request."""
+    legacy_app = Flask(__name__)
+    CORS(legacy_app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
+
+    @legacy_app.route('/api/products')
+    def get_products():
+        response = legacy_products_response(search_result)
+        if request.args.get('gzip'):
+            response.set_data(gzip.compress(response.get_data()))
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    return legacy_app
+
+
+def measure(label, fn, requests):
+    """Runs ``fn`` ``requests`` times; returns (label, wire bytes, CPU µs/request)."""
+    size = len(fn())  # Warm up (and fill any memoized bodies)
+    start = time.process_time()
+    for _ in range(requests):
+        fn()
+    cpu_us = (time.process_time() - start) / requests * 1e6
+    return label, size, cpu_us
+
+
+def run(requests: int, item_count: int) -> list:
+    search_result = make_search_result(item_count)
+    page = project_search_result(search_result).encode()
+    outcome = amazon_service.SearchOutcome(page, 0.0, False)
+    client = app.test_client()
+    legacy_client = make_legacy_app(search_result).test_client()
+    rows = []
+
+    rows.append(measure("before: traverse + jsonify (identity)",
+                        lambda: legacy_client.get('/api/products').data, requests))
+    rows.append(measure("naive: traverse + jsonify + gzip per request",
+                        lambda: legacy_client.get('/api/products?gzip=1').data, requests))
+    with app.test_request_context():
+        rows.append(measure("before: handler work only",
+                            lambda: legacy_products_response(search_result).get_data(), requests))
+
+    # A plain function rather than a Mock so the stub adds no measurable overhead;
+    # the view calls search_products (stubbing lookup_bluey_products would also
+    # time a local index search on every request)
+    with patch.object(amazon_service, 'search_products', lambda **kwargs: outcome):
+        for encoding in (None,) + compression.available_encodings():
+            headers = {'Accept-Encoding': encoding} if encoding else {}
+            rows.append(measure(f"after: cached page ({encoding or 'identity'})",
+                                lambda: client.get('/api/products?region=US', headers=headers).data,
+                                requests))
+        for encoding in (None,) + compression.available_encodings():
+            rows.append(measure(f"after: handler work only ({encoding or 'identity'})",
+                                lambda: page.body(encoding=encoding), requests))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.items} products per response, {args.requests} requests per scenario")
+    print(f"{'scenario':<46} {'wire bytes':>10} {'CPU us/req':>11}")
+    for label, size, cpu_us in run(args.requests, args.items):
+        print(f"{label:<46} {size:>10} {cpu_us:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark: time a request thread spends logging, before and after the queue.
+
+Logs the lines a cache hit produces and compares the caller's cost with:
+
+* before: a synchronous RotatingFileHandler and f-string messages (the
+  formatting and the file write happen on the request thread)
+* queued: ``log_config.configure_logging`` (the request thread only
+  enqueues the record)
+* queued + sampled: the same, with cache hit lines logged through
+  ``CACHE_HIT_LOGGER`` at the default sample rate
+
+Run from the repository root:
+    python -m backend.benchmarks.bench_logging --lines 50000
+"""
+import argparse
+import contextlib
+import logging
+import os
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+from .. import log_config
+
+REGION, KEYWORDS, PAGE = "US", "bluey toys", 1
+
+
+def legacy_setup(path: str) -> None:
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.setLevel(logging.INFO)
+    handler = RotatingFileHandler(path, maxBytes=log_config.LOG_MAX_BYTES,
+                                  backupCount=log_config.LOG_BACKUP_COUNT)
+    handler.setFormatter(logging.Formatter(log_config.LOG_FORMAT))
+    root.addHandler(handler)
+
+
+def legacy_hit():
+    logging.info(
+        f"Product query: region={REGION} item_count=10 offset=0 keywords={KEYWORDS!r}")
+    logging.info(
+        f"Returning cached result for '{KEYWORDS}' (page {PAGE}) in region {REGION}.")
+
+
+def queued_hit(hit_log):
+    def run():
+        logging.info(
+            "Product query: region=%s item_count=%s offset=%s keywords=%r", REGION, 10, 0, KEYWORDS)
+        hit_log.info(
+            "Returning cached result for '%s' (page %s) in region %s.", KEYWORDS, PAGE, REGION)
+    return run
+
+
+def per_call_us(fn, lines: int) -> float:
+    start = time.perf_counter()
+    for _ in range(lines):
+        fn()
+    return (time.perf_counter() - start) / lines * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=50_000, help="Cache hits logged per scenario.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        rows = []
+        legacy_setup(os.path.join(directory, "legacy.log"))
+        rows.append(("before: sync file + f-strings", per_call_us(legacy_hit, args.lines)))
+        for handler in logging.getLogger().handlers:
+            handler.close()
+
+        hit_log = logging.getLogger(log_config.CACHE_HIT_LOGGER)
+        for label, rate in [("queued", 1.0),
+                            ("queued + sampled hits", log_config.CACHE_HIT_SAMPLE_RATE)]:
+            # The console handler writes to stderr: send it nowhere, like the legacy run
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+                log_config.configure_logging(os.path.join(directory, f"{rate}.log"), "INFO",
+                                             cache_hit_sample_rate=rate)
+                rows.append((label, per_call_us(queued_hit(hit_log), args.lines)))
+                start = time.perf_counter()
+                log_config.shutdown_logging()
+            rows.append((f"  (writer drained backlog in {time.perf_counter() - start:.2f}s)", None))
+
+    print(f"{'scenario':<44} {'caller us/hit':>14}")
+    for label, us in rows:
+        print(f"{label:<44} {us:>14.2f}" if us is not None else label)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: cost of metrics instrumentation relative to request time.
+
+Times each recording primitive (counter, gauge, histogram observe) on one
+thread and with several threads recording concurrently, then the work the
+app's request hooks add to every /api/products request (in-flight gauge,
+two clock reads, a labelled histogram observation) against a full request
+for a cached page through the Flask test client. The instrumentation should
+stay well under 1% of the request.
+
+Run from the repository root:
+    python -m backend.benchmarks.bench_metrics --iterations 200000
+"""
+import argparse
+import threading
+import time
+from unittest.mock import patch
+from .. import amazon_service
+from ..app import app
+from ..metrics import Counter, Gauge, Histogram, Registry
+from .bench_compression import make_search_result
+from ..products import project_search_result
+
+
+def per_call_ns(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def concurrent_ns(fn, iterations: int, threads: int) -> float:
+    """Wall time per call with ``threads`` threads each making ``iterations`` calls."""
+    barrier = threading.Barrier(threads + 1)
+
+    def work():
+        barrier.wait()
+        for _ in range(iterations):
+            fn()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (iterations * threads) * 1e9
+
+
+def request_hooks(in_flight, latency):
+    """What the app's before/after/teardown hooks record per request."""
+    def run():
+        in_flight.inc()
+        started = time.perf_counter()
+        latency.labels("get_products", 200).observe(time.perf_counter() - started)
+        in_flight.dec()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200_000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    registry = Registry()
+    counter = Counter("bench_calls", "Calls.", registry=registry)
+    gauge = Gauge("bench_in_flight", "In flight.", registry=registry)
+    histogram = Histogram("bench_latency_seconds", "Latency.", ["endpoint", "status"],
+                          registry=registry)
+    primitives = {
+        "counter inc": counter.inc,
+        "gauge inc + dec": lambda: (gauge.inc(), gauge.dec()),
+        "histogram observe": lambda: histogram.labels("get_products", 200).observe(0.003),
+        "request hooks": request_hooks(gauge, histogram),
+    }
+    print(f"{'operation':<20} {'ns/call':>10} {f'ns/call x{args.threads}':>14}")
+    for label, fn in primitives.items():
+        single = per_call_ns(fn, args.iterations)
+        shared = concurrent_ns(fn, args.iterations // args.threads, args.threads)
+        print(f"{label:<20} {single:>10.0f} {shared:>14.0f}")
+
+    # A cached page served end to end, hooks included
+    page = project_search_result(make_search_result(10)).encode()
+    outcome = amazon_service.SearchOutcome(page, 0.0, False)
+    client = app.test_client()
+    with patch.object(amazon_service, 'search_products', lambda **kwargs: outcome):
+        request_ns = per_call_ns(lambda: client.get('/api/products?region=US'), args.requests)
+    hooks_ns = per_call_ns(primitives["request hooks"], args.iterations)
+    print(f"cached /api/products request: {request_ns / 1000:.0f} us; "
+          f"instrumentation {hooks_ns / request_ns:.3%} of it")
+
+
+if __name__ == '__main__':
+    main()
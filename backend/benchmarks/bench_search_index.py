@@ -0,0 +1,101 @@
+"""
+Benchmark: local full-text search latency at catalogue scale.
+
+Indexes synthetic Bluey-style product titles and features (100k products by
+default) into a SearchIndex and times queries of each kind the site sees:
+single terms, multi-term queries, as-you-type prefixes and
+typos. Compare with a PA API round trip (hundreds of milliseconds plus rate
+limiting) that each of these queries used to cost.
+
+Run from the repository root:
+    python -m backend.benchmarks.bench_search_index --products 100000
+"""
+import argparse
+import random
+import statistics
+import time
+from ..products import ProductRecord
+from ..search_index import SearchIndex
+
+CHARACTERS = ["Bluey", "Bingo", "Bandit", "Chilli", "Muffin", "Socks", "Stripe",
+              "Trixie", "Nana", "Rusty", "Indy", "Chloe", "Mackenzie", "Calypso"]
+PRODUCTS = ["Plush", "Figure", "Playset", "Campervan", "House", "Puzzle", "Book",
+            "Backpack", "Pyjamas", "T-Shirt", "Lunchbox", "Water Bottle", "Blanket",
+            "Costume", "Board Game", "Sticker Pack", "Colouring Set", "Car", "Boat"]
+ADJECTIVES = ["Deluxe", "Mini", "Jumbo", "Talking", "Glow-in-the-Dark", "Wooden",
+              "Interactive", "Classic", "Family", "Beach", "Camping", "Christmas"]
+FEATURES = ["Suitable for ages 3 and up", "Machine washable", "Batteries included",
+            "Officially licensed", "Includes {n} accessories", "Soft and cuddly",
+            "Perfect for imaginative play", "Makes {n} different sounds"]
+
+QUERIES = {
+    "one term": ["calypso", "lunchbox", "stripe", "bluey", "plush"],
+    "two terms": ["bluey campervan", "bingo plush", "deluxe playset"],
+    "three terms": ["bluey deluxe campervan", "chilli wooden puzzle"],
+    "prefix": ["camp", "bluey camper", "glow"],
+    "typo": ["campervna", "backpak", "bluey plsh"],
+    "no match": ["dinosaur", "bluey spaceship"],
+}
+
+
+def make_products(count: int, seed: int = 7):
+    """Builds ``count`` records and their feature lists, deterministically."""
+    rng = random.Random(seed)
+    records = []
+    features = {}
+    for i in range(count):
+        asin = f"B{i:09d}"
+        title = " ".join([
+            rng.choice(CHARACTERS),
+            *rng.sample(ADJECTIVES, rng.randint(0, 2)),
+            rng.choice(PRODUCTS),
+            f"with {rng.choice(CHARACTERS)}" if rng.random() < 0.3 else "",
+            f"{rng.randint(2, 40)} Pieces" if rng.random() < 0.2 else "",
+        ])
+        records.append(ProductRecord(asin, " ".join(title.split()), None, None, f"${rng.randint(5, 80)}.99"))
+        features[asin] = [f.format(n=rng.randint(2, 12)) for f in rng.sample(FEATURES, 3)]
+    return records, features
+
+
+def build(records, features, batch: int = 10) -> tuple:
+    """Indexes the products a search page at a time. Returns (index, seconds)."""
+    index = SearchIndex()
+    start = time.perf_counter()
+    for i in range(0, len(records), batch):
+        index.add("US", records[i:i + batch], features)
+    return index, time.perf_counter() - start
+
+
+def time_queries(index, queries, repeat: int, limit: int) -> tuple:
+    """Returns (mean µs, p95 µs, max matches) over ``repeat`` runs of each query."""
+    samples = []
+    matches = 0
+    for query in queries:
+        matches = max(matches, index.search("US", query, limit).total)  # Warm vocabulary
+        for _ in range(repeat):
+            start = time.perf_counter()
+            index.search("US", query, limit)
+            samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.fmean(samples), samples[int(len(samples) * 0.95) - 1], matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    records, features = make_products(args.products)
+    index, seconds = build(records, features)
+    stats = index.stats()["US"]
+    print(f"Indexed {stats['products']} products ({stats['terms']} terms) in {seconds:.2f}s")
+    print(f"{'query kind':<14} {'matches':>8} {'mean us':>10} {'p95 us':>10}")
+    for kind, queries in QUERIES.items():
+        mean_us, p95_us, matches = time_queries(index, queries, args.repeat, args.limit)
+        print(f"{kind:<14} {matches:>8} {mean_us:>10.0f} {p95_us:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""
+Load test: drive the Flask app with concurrent clients against a stub PA API.
+
+Each scenario resets the service's caches, installs a ``StubPaapi``
+(injected latency, errors, throttling; see paapi_stub.py), optionally
+prewarms the cache, then has ``--concurrency`` clients issue ``--requests``
+/api/products requests back to back. Reported per scenario: throughput,
+latency percentiles, status codes, PA API calls made, and the product
+cache hit rate.
+
+Scenarios:
+  cold_start              popular searches against an empty cache
+  ttl_expiry_storm        popular searches whose cache entries have all
+                          passed the hard TTL at once (requests block on
+                          upstream; concurrent misses must coalesce)
+  stale_while_revalidate  the same past the soft TTL only (served stale,
+                          refreshed in the background)
+  free_text_long_tail     mostly one-off free-text searches
+  flaky_upstream          cold start with 20% upstream errors and
+                          throttling (backoff and circuit breaking)
+
+Results can be written as JSON and compared with an earlier run; the
+comparison exits non-zero when throughput or p95 latency regressed beyond
+the tolerance.
+
+Run from the repository root:
+    python -m backend.benchmarks.load_test --requests 2000 --concurrency 32 --output after.json
+    python -m backend.benchmarks.load_test --compare before.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from unittest.mock import patch
+from urllib.parse import urlencode
+from werkzeug.serving import make_server
+from .. import amazon_service
+from ..app import app
+from ..ratelimit import UpstreamLimiter
+from .bench_search_index import ADJECTIVES, CHARACTERS, PRODUCTS
+from .paapi_stub import StubPaapi
+
+REGIONS = ["US", "US", "US", "GB", "GB", "AU", "CA"]  # Served regions, weighted by traffic
+POPULAR = ["Bluey Toys", "Bluey Plush", "Bluey House", "Bluey Campervan", "Bluey Figures",
+           "Bluey Books", "Bingo Plush", "Bluey Costume", "Bluey Puzzle", "Bluey Pyjamas"]
+
+
+class Scenario(NamedTuple):
+    description: str
+    long_tail: float  # Share of requests that are one-off free-text searches
+    prewarm_age: float | None  # Seconds old the popular entries are when the run starts
+    stub: dict  # StubPaapi overrides
+
+
+SCENARIOS = {
+    "cold_start": Scenario("popular searches, empty cache", 0.0, None, {}),
+    "ttl_expiry_storm": Scenario(
+        "popular entries all past the hard TTL", 0.0,
+        amazon_service.CACHE_HARD_TTL_SECONDS + 60, {}),
+    "stale_while_revalidate": Scenario(
+        "popular entries past the soft TTL", 0.0,
+        amazon_service.CACHE_DURATION_SECONDS + 60, {}),
+    "free_text_long_tail": Scenario("80% one-off free-text searches", 0.8, None, {}),
+    "flaky_upstream": Scenario(
+        "cold start, 20% upstream errors and throttling", 0.0, None,
+        {"error_rate": 0.2, "max_rps": 5}),
+}
+
+
+def make_requests(scenario: Scenario, count: int, seed: int) -> list:
+    """The /api/products URLs of a run: Zipf-skewed popular searches plus long-tail ones."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(POPULAR))]
+    urls = []
+    for n in range(count):
+        if rng.random() < scenario.long_tail:
+            keywords = " ".join([rng.choice(CHARACTERS), rng.choice(ADJECTIVES),
+                                 rng.choice(PRODUCTS), str(n)])
+        else:
+            keywords = rng.choices(POPULAR, weights)[0]
+        params = {"region": rng.choice(REGIONS), "keywords": keywords,
+                  "item_count": rng.choices([10, 20], [85, 15])[0]}
+        urls.append("/api/products?" + urlencode(params))
+    return urls
+
+
+def popular_requests() -> list:
+    """Every distinct popular request, for prewarming."""
+    return sorted({"/api/products?" + urlencode({"region": region, "keywords": keywords,
+                                                 "item_count": count})
+                   for region in set(REGIONS) for keywords in POPULAR for count in (10, 20)})
+
+
+def reset_service() -> None:
+    """Empties every cache, index and failure record the service keeps."""
+    amazon_service.CACHE.clear()
+    amazon_service.VIEWS.clear()
+    amazon_service.RESULT_ENDS.clear()
+    amazon_service.SEARCH_INDEX.clear()
+    amazon_service.FACETS.clear()
+    amazon_service.FAILURES.clear()
+    amazon_service.BREAKER.reset()
+    amazon_service.UPSTREAM.reset()
+    amazon_service._ASIN_PAGES.clear()
+
+
+class InProcessClient:
+    """Requests through the Flask test client (no sockets)."""
+
+    def __init__(self):
+        self._client = app.test_client()
+
+    def get(self, url: str) -> int:
+        response = self._client.get(url, headers={"Accept-Encoding": "gzip"})
+        response.get_data()
+        return response.status_code
+
+
+class HttpClient:
+    """Requests over HTTP to a local server (reconnects whenever the server closes)."""
+
+    def __init__(self, port: int):
+        self._connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+    def get(self, url: str) -> int:
+        self._connection.request("GET", url, headers={"Accept-Encoding": "gzip"})
+        response = self._connection.getresponse()
+        response.read()
+        return response.status
+
+
+def drive(urls: list, concurrency: int, new_client) -> tuple:
+    """Issues ``urls`` from ``concurrency`` closed-loop clients. Returns (samples, seconds)."""
+    pending = iter(urls)
+    lock = threading.Lock()
+    samples = []
+
+    def worker():
+        client = new_client()
+        mine = []
+        while True:
+            with lock:
+                url = next(pending, None)
+            if url is None:
+                break
+            start = time.perf_counter()
+            try:
+                status = client.get(url)
+            except Exception:
+                status = 0  # Connection-level failure
+            mine.append((time.perf_counter() - start, status))
+        with lock:
+            samples.extend(mine)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return samples, time.perf_counter() - start
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(fraction * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def cache_delta(before: dict, after: dict) -> dict:
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+    return {"hits": hits, "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0}
+
+
+def run_scenario(name: str, args, new_client) -> dict:
+    scenario = SCENARIOS[name]
+    stub = StubPaapi(**{"latency": args.latency, **scenario.stub})
+    reset_service()
+    limiter = UpstreamLimiter(args.paapi_rps, args.paapi_burst, amazon_service.REGION_RATE_LIMITS)
+    with stub.installed(), patch.object(amazon_service, 'UPSTREAM', limiter):
+        if scenario.prewarm_age is not None:
+            # Fill the cache as if it had happened prewarm_age seconds ago
+            real_time = time.time
+            with patch('time.time', lambda: real_time() - scenario.prewarm_age), \
+                    patch.object(amazon_service, 'UPSTREAM', UpstreamLimiter(1000.0, 1000)):
+                warm = InProcessClient()
+                for url in popular_requests():
+                    warm.get(url)
+            stub.reset_counters()
+
+        urls = make_requests(scenario, args.requests, args.seed)
+        cache_before = amazon_service.CACHE.stats()
+        samples, seconds = drive(urls, args.concurrency, new_client)
+        cache_after = amazon_service.CACHE.stats()
+        # Let background refreshes started by the run finish before the next scenario
+        deadline = time.monotonic() + 30
+        while stub.in_flight and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    statuses = Counter(str(status) for _, status in samples)
+    upstream = Counter()
+    for (operation, outcome), count in stub.calls.items():
+        upstream[f"{operation}:{outcome}"] += count
+    return {
+        "description": scenario.description,
+        "requests": len(samples),
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(samples) / seconds, 1) if seconds else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p95": round(percentile(latencies, 0.95), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+        },
+        "statuses": dict(sorted(statuses.items())),
+        "upstream": {"calls": sum(upstream.values()), "max_in_flight": stub.max_in_flight,
+                     "by_outcome": dict(sorted(upstream.items()))},
+        "cache": cache_delta(cache_before, cache_after),
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list:
+    """Prints per-scenario changes. Returns the regressions found."""
+    regressions = []
+    print(f"\n{'scenario':<24} {'rps':>16} {'p95 ms':>18} {'upstream calls':>16}")
+    for name, now in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        rps_change = _change(before["throughput_rps"], now["throughput_rps"])
+        p95_change = _change(before["latency_ms"]["p95"], now["latency_ms"]["p95"])
+        print(f"{name:<24} {now['throughput_rps']:>8} ({rps_change:+.0%}) "
+              f"{now['latency_ms']['p95']:>9} ({p95_change:+.0%}) "
+              f"{before['upstream']['calls']:>7} -> {now['upstream']['calls']}")
+        if rps_change < -tolerance:
+            regressions.append(f"{name}: throughput {rps_change:+.0%}")
+        if p95_change > tolerance:
+            regressions.append(f"{name}: p95 latency {p95_change:+.0%}")
+    return regressions
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before if before else 0.0
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    amazon_service.configure()  # PA API rate limit defaults come from the environment
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per scenario.")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.15, help="Mean stub PA API latency (s).")
+    parser.add_argument('--paapi-rps', type=float, default=amazon_service.PAAPI_REQUESTS_PER_SECOND,
+                        help="Rate limit the service applies per region.")
+    parser.add_argument('--paapi-burst', type=float, default=amazon_service.PAAPI_BURST)
+    parser.add_argument('--http', action='store_true',
+                        help="Serve the app on a local socket instead of using the test client.")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help="Write results to this JSON file.")
+    parser.add_argument('--compare', help="Compare with results from an earlier --output.")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="Relative change in rps or p95 reported as a regression.")
+    parser.add_argument('--verbose', action='store_true', help="Show the service's logs.")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    server = None
+    new_client = InProcessClient
+    if args.http:
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        new_client = lambda: HttpClient(server.server_port)  # noqa: E731
+
+    results = {
+        "meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "revision": _git_revision(),
+                 "python": platform.python_version(),
+                 "transport": "http" if args.http else "in-process",
+                 "options": {k: v for k, v in vars(args).items()
+                             if k not in ("output", "compare", "verbose")}},
+        "scenarios": {},
+    }
+    print(f"{'scenario':<24} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'upstream':>9} {'hit rate':>9}  statuses")
+    try:
+        for name in args.scenarios:
+            result = run_scenario(name, args, new_client)
+            results["scenarios"][name] = result
+            latency = result["latency_ms"]
+            print(f"{name:<24} {result['throughput_rps']:>8} {latency['p50']:>8} "
+                  f"{latency['p95']:>8} {latency['p99']:>8} {result['upstream']['calls']:>9} "
+                  f"{result['cache']['hit_rate']:>9.1%}  {result['statuses']}")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+A local stand-in for the PA API client, for load tests and benchmarks.
+
+``StubPaapi`` answers ``search_items`` and ``get_items`` with realistically
+shaped items (titles, prices, images, features, browse nodes) after an
+injected latency, and can fail a share of calls or throttle callers that
+exceed a request rate, raising the same exceptions as the real SDK. Every
+call is counted so a run can report how much upstream traffic it caused.
+
+    stub = StubPaapi(latency=0.2, error_rate=0.05, max_rps=10)
+    with stub.installed():
+        ...  # amazon_service now talks to the stub in every region
+"""
+import contextlib
+import random
+import threading
+import time
+from collections import Counter, deque
+from types import SimpleNamespace
+from unittest.mock import patch
+from amazon_paapi.errors import ItemsNotFound, TooManyRequests
+from .. import amazon_service
+from .bench_search_index import ADJECTIVES, CHARACTERS, FEATURES, PRODUCTS
+
+CATEGORIES = [("166164011", "Toys & Games"), ("166220011", "Stuffed Animals & Plush"),
+              ("166092011", "Play Figures"), ("283155", "Books"), ("7141123011", "Clothing")]
+
+
+class StubError(Exception):
+    """An injected upstream failure (network error, 5xx)."""
+
+
+class StubPaapi:
+    """Thread-safe fake of ``amazon_paapi.AmazonApi`` with latency, errors and throttling."""
+
+    def __init__(self, latency: float = 0.15, jitter: float = 0.5, error_rate: float = 0.0,
+                 max_rps: float | None = None, results_per_search: int = 40, seed: int = 1):
+        """
+        Args:
+            latency: Mean seconds per call.
+            jitter: Latency varies uniformly by this fraction either way.
+            error_rate: Share of calls failing with ``StubError``.
+            max_rps: Calls per second (per region, over a sliding second)
+                beyond which ``TooManyRequests`` is raised; None to never throttle.
+            results_per_search: Items each keyword search has in total.
+            seed: Seeds latency, errors and generated products.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.results_per_search = results_per_search
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = {}  # region -> deque of call times in the last second
+        self.calls = Counter()  # (operation, outcome) -> count
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def client(self, region: str) -> 'StubClient':
+        return StubClient(self, region)
+
+    @contextlib.contextmanager
+    def installed(self):
+        """Makes amazon_service build stub clients for every region."""
+        amazon_service.CLIENTS.reload()
+        with patch.object(amazon_service, 'get_amazon_client', self.client):
+            yield self
+        amazon_service.CLIENTS.reload()
+
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self._recent.clear()
+            self.max_in_flight = self.in_flight
+
+    def _call(self, region: str, operation: str, respond):
+        with self._lock:
+            delay = self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter))
+            failed = self._rng.random() < self.error_rate
+            now = time.monotonic()
+            recent = self._recent.setdefault(region, deque())
+            while recent and recent[0] <= now - 1.0:
+                recent.popleft()
+            throttled = self.max_rps is not None and len(recent) >= self.max_rps
+            recent.append(now)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        outcome = "ok"
+        try:
+            time.sleep(max(0.0, delay))
+            if throttled:
+                outcome = "throttled"
+                raise TooManyRequests("Requests limit reached")
+            if failed:
+                outcome = "error"
+                raise StubError("Injected upstream failure")
+            try:
+                return respond()
+            except ItemsNotFound:
+                outcome = "not_found"
+                raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.calls[(operation, outcome)] += 1
+
+    def _item(self, region: str, keywords: str, position: int):
+        """The product at ``position`` in a search; the same inputs give the same item."""
+        rng = random.Random(f"{self.seed}:{region}:{keywords}:{position}")
+        asin = f"B0{rng.randrange(10 ** 8):08d}"
+        title = " ".join([rng.choice(CHARACTERS), rng.choice(ADJECTIVES),
+                          rng.choice(PRODUCTS), f"({keywords.title()})"])
+        node_id, node_name = rng.choice(CATEGORIES)
+        return SimpleNamespace(
+            asin=asin,
+            detail_page_url=f"https://www.amazon.com/dp/{asin}?tag=blueytoys-20&linkCode=ogi&th=1&psc=1",
+            item_info=SimpleNamespace(
+                title=SimpleNamespace(display_value=title),
+                features=SimpleNamespace(display_values=[
+                    f.format(n=rng.randint(2, 12)) for f in rng.sample(FEATURES, 3)])),
+            images=SimpleNamespace(primary=SimpleNamespace(large=SimpleNamespace(
+                url=f"https://m.media-amazon.com/images/I/71{asin}._AC_SL1500_.jpg"))),
+            offers=self._offers(rng),
+            browse_node_info=SimpleNamespace(browse_nodes=[SimpleNamespace(
+                id=node_id, display_name=node_name, ancestor=None)]),
+        )
+
+    @staticmethod
+    def _offers(rng):
+        return SimpleNamespace(listings=[SimpleNamespace(
+            price=SimpleNamespace(display_amount=f"${rng.randint(5, 80)}.99"),
+            availability=SimpleNamespace(message="In Stock"))])
+
+
+class StubClient:
+    """The per-region client handed to amazon_service."""
+
+    def __init__(self, stub: StubPaapi, region: str):
+        self.stub = stub
+        self.region = region
+
+    def search_items(self, keywords: str, item_count: int = 10, item_page: int = 1, **kwargs):
+        def respond():
+            start = (item_page - 1) * item_count
+            positions = range(start, min(start + item_count, self.stub.results_per_search))
+            if not positions:
+                raise ItemsNotFound("No items have been found")
+            return SimpleNamespace(
+                items=[self.stub._item(self.region, keywords, i) for i in positions],
+                errors=None)
+        return self.stub._call(self.region, "search_items", respond)
+
+    def get_items(self, asins, include_unavailable: bool = False, **kwargs):
+        def respond():
+            return [SimpleNamespace(asin=asin, offers=StubPaapi._offers(random.Random(asin)))
+                    for asin in asins]
+        return self.stub._call(self.region, "get_items", respond)
@@ -0,0 +1,176 @@
+"""
+Replay: product cache hit rate of raw vs canonical query keys.
+
+Feeds a query log through an LRU + TTL model of the product cache under
+three keying schemes and reports hit rate and upstream calls for each:
+
+* raw: the original ``f"{region}_{keywords}_{item_count}"`` key
+* canonical: ``queries.search_key`` per PA API page, with any item_count
+  sliced from the cached pages
+* canonical+stemming: the same with QUERY_STEMMING=1
+
+Queries are read from ``Product query:`` lines of amazon_service.log (the
+app logs every /api/products request with LOG_QUERY_SAMPLE_RATE=1; text or
+LOG_JSON=1 lines) or from a TSV of
+``region<TAB>keywords<TAB>item_count[<TAB>offset]``. Without a log a
+synthetic one is generated: popular searches typed with the case, spacing,
+punctuation and page-size variations seen from real visitors.
+
+Run from the repository root:
+    python -m backend.benchmarks.replay_query_log amazon_service.log
+    python -m backend.benchmarks.replay_query_log --synthetic 20000
+"""
+import argparse
+import ast
+import json
+import os
+import random
+import re
+from collections import OrderedDict
+from datetime import datetime
+from unittest.mock import patch
+from .. import amazon_service
+from ..queries import ENV_QUERY_STEMMING, search_key
+
+_QUERY_RE = re.compile(
+    r"Product query: region=(?P<region>\S+) "
+    r"item_count=(?P<item_count>\d+) offset=(?P<offset>\d+) keywords=(?P<keywords>.*)$")
+_LOG_LINE_RE = re.compile(r"^(?P<time>\S+ \S+) - INFO - " + _QUERY_RE.pattern)
+_LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+
+
+def _parse_json_line(line: str):
+    """Returns (timestamp, query match) for a JSON log line of a query, else None."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    match = _QUERY_RE.match(record.get("message", "")) if isinstance(record, dict) else None
+    if match is None:
+        return None
+    return datetime.fromisoformat(record["time"]).timestamp(), match
+
+SYNTHETIC_SEARCHES = ["Bluey Toys", "Bluey Plush", "Bluey House", "Bluey Campervan",
+                      "Bluey Figures", "Bluey Books", "Bingo Plush", "Bluey Costume",
+                      "Bluey T-Shirt", "Bluey Lunchbox", "Bluey Puzzle", "Bluey Pyjamas"]
+SYNTHETIC_REGIONS = ["US", "US", "US", "GB", "GB", "AU", "CA"]  # Served regions, weighted by traffic
+
+
+def read_log(path: str) -> list:
+    """Returns [(timestamp, region, keywords, item_count, offset)] from a log or TSV."""
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            line = line.rstrip("\n")
+            match = _LOG_LINE_RE.match(line)
+            parsed = _parse_json_line(line) if line.startswith("{") else None
+            if match or parsed:
+                timestamp, match = parsed or (
+                    datetime.strptime(match["time"], _LOG_TIME_FORMAT).timestamp(), match)
+                queries.append((
+                    timestamp, match["region"], ast.literal_eval(match["keywords"]),
+                    int(match["item_count"]), int(match["offset"])))
+            elif line.count("\t") in (2, 3):
+                region, keywords, item_count, *offset = line.split("\t")
+                # No timestamps: assume one request per second
+                queries.append((float(n), region.upper(), keywords, int(item_count),
+                                int(offset[0]) if offset else 0))
+    return queries
+
+
+def _variant(rng: random.Random, keywords: str) -> str:
+    """How a visitor might type ``keywords``."""
+    words = keywords.split()
+    style = rng.random()
+    if style < 0.35:
+        words = [w.lower() for w in words]
+    elif style < 0.40:
+        words = [w.upper() for w in words]
+    if rng.random() < 0.15 and not words[-1].endswith('s'):
+        words[-1] += 's'
+    text = ("  " if rng.random() < 0.1 else " ").join(words)
+    if rng.random() < 0.1:
+        text += rng.choice([" ", "!", "?", "."])
+    return text
+
+
+def synthetic_log(count: int, seed: int = 11) -> list:
+    """A Zipf-skewed query log over popular searches, one request per second."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(SYNTHETIC_SEARCHES))]
+    queries = []
+    for n in range(count):
+        keywords = rng.choices(SYNTHETIC_SEARCHES, weights)[0]
+        item_count = rng.choices([10, 12, 20, 9, 5], [60, 10, 15, 10, 5])[0]
+        offset = item_count * rng.choices([0, 1, 2], [80, 15, 5])[0]
+        queries.append((float(n), rng.choice(SYNTHETIC_REGIONS),
+                        _variant(rng, keywords), item_count, offset))
+    return queries
+
+
+class CacheModel:
+    """LRU of ``capacity`` entries, each fresh for ``ttl`` seconds."""
+
+    def __init__(self, capacity: int, ttl: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def hit(self, key, now: float) -> bool:
+        """Looks up ``key``; on a miss, stores it (the upstream call's result)."""
+        stored_at = self._entries.get(key)
+        if stored_at is not None and now - stored_at < self.ttl:
+            self._entries.move_to_end(key)
+            return True
+        self._entries[key] = now
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+        return False
+
+
+def replay(queries, key_fn, capacity: int, ttl: float) -> tuple:
+    """Returns (hit rate, upstream calls); a request hits if all its keys are cached."""
+    cache = CacheModel(capacity, ttl)
+    hits = calls = 0
+    for now, region, keywords, item_count, offset in queries:
+        misses = sum(not cache.hit(key, now) for key in key_fn(region, keywords, item_count, offset))
+        calls += misses
+        hits += not misses
+    return hits / len(queries), calls
+
+
+def raw_keys(region, keywords, item_count, offset):
+    return [f"{region}_{keywords}_{item_count}_{offset}"]
+
+
+def canonical_keys(region, keywords, item_count, offset):
+    return [search_key(region, keywords, page)
+            for page in amazon_service._pages_for(offset, item_count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('log', nargs='?', help="amazon_service.log or a TSV of queries.")
+    parser.add_argument('--synthetic', type=int, default=20000,
+                        help="Synthetic queries to generate when no log is given.")
+    parser.add_argument('--capacity', type=int, default=amazon_service.CACHE_MAX_ENTRIES)
+    parser.add_argument('--ttl', type=float, default=amazon_service.CACHE_DURATION_SECONDS)
+    args = parser.parse_args()
+
+    queries = read_log(args.log) if args.log else synthetic_log(args.synthetic)
+    if not queries:
+        parser.error(f"no queries found in {args.log}")
+    distinct = len({(r, k, c, o) for _, r, k, c, o in queries})
+    print(f"{len(queries)} queries ({distinct} distinct), "
+          f"cache of {args.capacity} entries, TTL {args.ttl:.0f}s")
+    print(f"{'keying':<20} {'hit rate':>9} {'upstream calls':>15}")
+    for label, key_fn, env in [("raw", raw_keys, "0"), ("canonical", canonical_keys, "0"),
+                               ("canonical+stemming", canonical_keys, "1")]:
+        with patch.dict(os.environ, {ENV_QUERY_STEMMING: env}):
+            hit_rate, calls = replay(queries, key_fn, args.capacity, args.ttl)
+        print(f"{label:<20} {hit_rate:>9.1%} {calls:>15}")
+
+
+if __name__ == '__main__':
+    main()
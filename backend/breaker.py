@@ -0,0 +1,239 @@
+"""
+Failure handling for upstream calls: negative caching and circuit breaking.
+
+A failing search used to reach the PA API on every request. Now:
+
+* ``NegativeCache`` remembers the failed result of a key (a page carrying
+  API errors, or None after an exception) and replays it until the key's
+  retry time. Each consecutive failure doubles the wait, with jitter so
+  many keys failing together don't retry together.
+* ``CircuitBreaker`` counts consecutive failures per region (throttling,
+  network or credential errors). After ``failure_threshold`` of them the
+  region's circuit opens and no calls are made until its cooldown (itself
+  backing off exponentially) passes. One probe call is then let through; its
+  outcome closes the circuit or opens it again.
+
+Callers fall back to the last known good (stale) cache entry meanwhile.
+"""
+import time
+import random
+import threading
+
+# --- Negative caching ---
+NEGATIVE_TTL_SECONDS = 30  # Wait after the first failure of a key
+MAX_BACKOFF_SECONDS = 15 * 60
+NEGATIVE_CACHE_MAX_ENTRIES = 1024
+
+# --- Circuit breaking ---
+BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failures that open a region's circuit
+BREAKER_COOLDOWN_SECONDS = 30  # First open period; doubles each time a probe fails
+BREAKER_MAX_COOLDOWN_SECONDS = 10 * 60
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def backoff_delay(failures: int, base: float, cap: float, rng=random) -> float:
+    """
+    Exponential backoff with jitter after ``failures`` consecutive failures.
+
+    Returns a delay between half and all of ``min(cap, base * 2 ** (failures - 1))``:
+    jittered, but never much shorter than the backoff itself.
+    """
+    delay = min(cap, base * 2 ** (max(failures, 1) - 1))
+    return delay * rng.uniform(0.5, 1.0)
+
+
+class _Failure:
+    """Backoff state of one failing key."""
+
+    __slots__ = ('failures', 'retry_at', 'result', 'error')
+
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = 0.0
+        self.result = None
+        self.error = None
+
+
+class NegativeCache:
+    """Thread-safe record of failing keys and the result to replay until retry."""
+
+    def __init__(self, base: float = NEGATIVE_TTL_SECONDS, cap: float = MAX_BACKOFF_SECONDS,
+                 max_entries: int = NEGATIVE_CACHE_MAX_ENTRIES,
+                 clock=time.monotonic, rng=None):
+        """
+        Args:
+            base: Seconds a key is held back after its first failure.
+            cap: Maximum backoff in seconds.
+            max_entries: Failing keys tracked; the oldest are forgotten first.
+            clock: Monotonic clock returning seconds.
+            rng: ``random.Random``-like source of jitter.
+        """
+        self.base = base
+        self.cap = cap
+        self.max_entries = max_entries
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._failures = {}  # key -> _Failure, oldest first
+
+    def get(self, key) -> tuple | None:
+        """Returns ``(result,)`` while ``key`` is backing off, else None."""
+        with self._lock:
+            failure = self._failures.get(key)
+            if failure is None or self._clock() >= failure.retry_at:
+                return None
+            return (failure.result,)
+
+    def record_failure(self, key, result=None, error: str | None = None) -> float:
+        """
+        Records a failed call for ``key``.
+
+        Args:
+            key: The failing key.
+            result: What the call returned (replayed until the retry time).
+            error: Short description for status reporting.
+
+        Returns:
+            Seconds until the key may be retried.
+        """
+        with self._lock:
+            failure = self._failures.pop(key, None) or _Failure()
+            failure.failures += 1
+            delay = backoff_delay(failure.failures, self.base, self.cap, self._rng)
+            failure.retry_at = self._clock() + delay
+            failure.result = result
+            failure.error = error
+            self._failures[key] = failure  # Re-inserted as the newest
+            while len(self._failures) > self.max_entries:
+                del self._failures[next(iter(self._failures))]
+            return delay
+
+    def record_success(self, key) -> None:
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._failures.clear()
+
+    def stats(self) -> dict:
+        """Returns the failing keys with their failure count and time to retry."""
+        now = self._clock()
+        with self._lock:
+            keys = {str(key): {"failures": failure.failures,
+                               "retry_in_seconds": round(max(0.0, failure.retry_at - now), 1),
+                               "error": failure.error}
+                    for key, failure in self._failures.items()}
+        return {"keys": len(keys), "backing_off": sum(1 for k in keys.values() if k["retry_in_seconds"]),
+                "entries": keys}
+
+
+class _Circuit:
+    """Breaker state of one region."""
+
+    __slots__ = ('state', 'failures', 'opens', 'opened_at', 'retry_at',
+                 'probing', 'last_error')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0  # Consecutive failures
+        self.opens = 0  # Consecutive times opened, for the cooldown backoff
+        self.opened_at = None
+        self.retry_at = 0.0
+        self.probing = False
+        self.last_error = None
+
+
+class CircuitBreaker:
+    """Thread-safe per-region circuit breaker."""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 cooldown: float = BREAKER_COOLDOWN_SECONDS,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN_SECONDS,
+                 clock=time.monotonic, rng=None):
+        """
+        Args:
+            failure_threshold: Consecutive failures that open a circuit.
+            cooldown: Seconds the circuit first stays open.
+            max_cooldown: Maximum open period in seconds.
+            clock: Monotonic clock returning seconds.
+            rng: ``random.Random``-like source of jitter.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._circuits = {}
+
+    def allow(self, region: str) -> bool:
+        """
+        Whether a call to ``region`` may be made now.
+
+        Once an open circuit's cooldown has passed, exactly one caller is
+        allowed through as a probe; it must report back with
+        ``record_success``, ``record_failure`` or ``release``.
+        """
+        with self._lock:
+            circuit = self._circuits.get(region)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            if circuit.probing or self._clock() < circuit.retry_at:
+                return False
+            circuit.state = HALF_OPEN
+            circuit.probing = True
+            return True
+
+    def record_success(self, region: str) -> None:
+        with self._lock:
+            circuit = self._circuits.get(region)
+            if circuit is not None:
+                circuit.__init__()  # Closed, counters cleared
+
+    def record_failure(self, region: str, error: str | None = None) -> None:
+        """Counts a failed call; opens the circuit at the threshold or on a failed probe."""
+        with self._lock:
+            circuit = self._circuits.setdefault(region, _Circuit())
+            circuit.failures += 1
+            circuit.last_error = error
+            if circuit.state == HALF_OPEN or circuit.failures >= self.failure_threshold:
+                circuit.opens += 1
+                circuit.state = OPEN
+                circuit.probing = False
+                circuit.opened_at = time.time()
+                circuit.retry_at = self._clock() + backoff_delay(
+                    circuit.opens, self.cooldown, self.max_cooldown, self._rng)
+
+    def release(self, region: str) -> None:
+        """Gives up an allowed call without making it (e.g. no rate limit token)."""
+        with self._lock:
+            circuit = self._circuits.get(region)
+            if circuit is not None and circuit.probing:
+                # Let the next caller probe instead
+                circuit.probing = False
+
+    def state(self, region: str) -> str:
+        with self._lock:
+            circuit = self._circuits.get(region)
+            return circuit.state if circuit is not None else CLOSED
+
+    def reset(self) -> None:
+        with self._lock:
+            self._circuits.clear()
+
+    def stats(self) -> dict:
+        """Returns state, consecutive failures and time to the next probe per region."""
+        now = self._clock()
+        with self._lock:
+            return {region: {
+                "state": circuit.state,
+                "consecutive_failures": circuit.failures,
+                "opened_at": circuit.opened_at,
+                "retry_in_seconds": (round(max(0.0, circuit.retry_at - now), 1)
+                                     if circuit.state != CLOSED else 0.0),
+                "last_error": circuit.last_error,
+            } for region, circuit in self._circuits.items()}
@@ -0,0 +1,413 @@
+"""
+Static product bundles: prebuilt /api/products responses per region, served from disk.
+
+A build (run daily, like the catalogue refresh) fetches every region x
+keyword search and writes one bundle file per region holding the search
+results and, for each page of ``PAGE_SIZE`` results, the finished response
+bodies: JSON plus its gzip/brotli compressions, in fresh and stale
+variants. Bundle files are named by a hash of their content and listed in
+``manifest.json``, which is replaced atomically last, so a server never
+sees a half-written build and a rebuild with unchanged data writes nothing
+new.
+
+With ``PRODUCT_SOURCE=bundles`` the ``/api/products`` endpoint is answered
+from the memory-mapped bundles: a request for a prebuilt page is a slice of
+the mapped file, with no encoding and no PA API dependency. Other page
+shapes are cut from the bundled results (still without calling upstream).
+
+    python -m backend.bundles --out bundles --regions US,GB
+"""
+import os
+import json
+import mmap
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from . import amazon_service
+from . import catalogue
+from . import compression
+from .products import ProductPage, ProductRecord, encode_cursor
+from .queries import canonical_keywords
+from .warmup import hot_keywords, warmup_plan
+
+# --- Configuration ---
+ENV_BUNDLES_DIR = "BUNDLES_DIR"
+DEFAULT_BUNDLES_DIR = "bundles"
+MANIFEST_NAME = "manifest.json"
+BUNDLE_FORMAT = 1  # Bumped when the manifest or file layout changes
+PAGE_SIZE = amazon_service.PAGE_SIZE  # Prebuilt page size: the default item_count
+DEFAULT_BUILD_ITEM_COUNT = amazon_service.MAX_RESULTS
+# Data older than this is served flagged stale (the build runs daily)
+BUNDLE_STALE_AFTER_SECONDS = 2 * 24 * 3600
+RELOAD_CHECK_SECONDS = 5.0  # How often a server looks for a newer manifest
+_PAGE_MEMO_SIZE = 256  # Pages cut from bundled results, kept per store
+
+_IDENTITY = "identity"  # Key of the uncompressed body in the manifest
+_VARIANTS = (("fresh", False), ("stale", True))
+
+
+# --- Build ---
+
+
+class _BundleWriter:
+    """Accumulates one region's blobs and their (offset, length) in the file."""
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+
+    def add(self, data: bytes) -> list:
+        self._chunks.append(data)
+        self._size += len(data)
+        return [self._size - len(data), len(data)]
+
+    def data(self) -> bytes:
+        return b"".join(self._chunks)
+
+
+def _encode_records(records) -> bytes:
+    return json.dumps([r.to_dict() for r in records], separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+
+
+def _decode_records(data) -> tuple:
+    return tuple(ProductRecord(**r) for r in json.loads(bytes(data)))
+
+
+def _page_of(records: tuple, fetched_at: float, offset: int, limit: int) -> ProductPage:
+    """Results ``[offset, offset + limit)`` as served for a cursor at ``offset``."""
+    more = offset + limit < len(records)
+    return ProductPage(records[offset:offset + limit], (),
+                       next_cursor=encode_cursor(offset + limit) if more else None,
+                       fetched_at=fetched_at)
+
+
+def _write_search(writer: _BundleWriter, records: tuple, fetched_at: float) -> dict:
+    """Adds a search's results and prebuilt pages to a bundle. Returns its manifest entry."""
+    pages = []
+    for offset in range(0, max(len(records), 1), PAGE_SIZE):
+        page = _page_of(records, fetched_at, offset, PAGE_SIZE)
+        bodies, etags = {}, {}
+        for name, stale in _VARIANTS:
+            bodies[name] = {_IDENTITY: writer.add(page.body(stale))}
+            for encoding in compression.available_encodings():
+                bodies[name][encoding] = writer.add(page.body(stale, encoding))
+            etags[name] = page.etag(stale)
+        pages.append({"bodies": bodies, "etags": etags, "next_cursor": page.next_cursor})
+    return {"fetched_at": fetched_at, "total": len(records),
+            "records": writer.add(_encode_records(records)), "pages": pages}
+
+
+def build_bundles(directory: str, regions=None, keywords=None,
+                  item_count: int = DEFAULT_BUILD_ITEM_COUNT) -> dict:
+    """
+    Fetches every region x keyword search and writes a new bundle build.
+
+    A search whose fetch fails keeps the results of the previous build, if
+    it had them, rather than disappearing. Files of builds older than the
+    previous one are removed (a server may still have the previous build
+    mapped).
+
+    Args:
+        directory: Where bundle files and the manifest are written (created if missing).
+        regions: Region codes; defaults to every region in REGION_CONFIG.
+        keywords: Searches per region; defaults to the warmup keywords.
+        item_count: Results to bundle per search.
+
+    Returns:
+        The manifest written. Searches with nothing to serve are listed
+        under "failed".
+    """
+    os.makedirs(directory, exist_ok=True)
+    regions = tuple(regions or amazon_service.REGION_CONFIG)
+    keywords = tuple(keywords or hot_keywords())
+    previous = BundleStore(directory) if os.path.exists(
+        os.path.join(directory, MANIFEST_NAME)) else None
+
+    results = {region: {} for region in regions}
+    failed = []
+    for region, kw in warmup_plan(regions, keywords):
+        canonical = canonical_keywords(kw)
+        pages = amazon_service.refresh_pages(region, kw, item_count)
+        if pages and pages[-1] is not None and not pages[-1].api_errors:
+            records = [record for page in pages for record in page.products][:item_count]
+            results[region][canonical] = (tuple(records), min(p.fetched_at for p in pages))
+            continue
+        kept = previous.results(region, canonical) if previous is not None else None
+        if kept is None:
+            failed.append([region, canonical])
+        else:
+            results[region][canonical] = kept
+        logging.warning(
+            "Bundle build failed to fetch '%s' in region %s; %s.", kw, region,
+            "keeping previous results" if kept is not None else "leaving it out")
+
+    bundles = {}
+    for region, searches in results.items():
+        if not searches:
+            continue
+        writer = _BundleWriter()
+        entries = {kw: _write_search(writer, records, fetched_at)
+                   for kw, (records, fetched_at) in sorted(searches.items())}
+        data = writer.data()
+        digest = hashlib.sha256(data).hexdigest()
+        name = f"products-{region}-{digest[:16]}.bundle"
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            _write_atomically(path, data)
+        bundles[region] = {"file": name, "sha256": digest, "size": len(data),
+                           "searches": entries}
+
+    manifest = {"format": BUNDLE_FORMAT, "built_at": time.time(),
+                "encodings": list(compression.available_encodings()),
+                "page_size": PAGE_SIZE, "bundles": bundles, "failed": failed}
+    _write_atomically(os.path.join(directory, MANIFEST_NAME),
+                      json.dumps(manifest, separators=(',', ':')).encode('utf-8'))
+    _prune(directory, manifest, previous)
+    logging.info("Wrote bundles for %s regions to %s (%s searches failed).",
+                 len(bundles), directory, len(failed))
+    return manifest
+
+
+def _write_atomically(path: str, data: bytes) -> None:
+    temporary = f"{path}.tmp-{os.getpid()}"
+    with open(temporary, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def _prune(directory: str, manifest: dict, previous) -> None:
+    """Removes bundle files referenced by neither this build nor the previous one."""
+    keep = {bundle["file"] for bundle in manifest["bundles"].values()}
+    if previous is not None:
+        keep |= previous.files()
+    for name in os.listdir(directory):
+        if name.startswith("products-") and name.endswith(".bundle") and name not in keep:
+            os.remove(os.path.join(directory, name))
+
+
+# --- Serving ---
+
+
+class BundlePage:
+    """
+    A prebuilt page: its response bodies are slices of a mapped bundle.
+
+    Offers the parts of ``ProductPage`` the /api/products view uses.
+    """
+
+    __slots__ = ('_data', '_bodies', '_etags', '_search', 'fetched_at', 'next_cursor')
+    api_errors = ()  # Searches that returned errors aren't bundled
+
+    def __init__(self, data, entry: dict, search, fetched_at: float):
+        self._data = data
+        self._bodies = entry["bodies"]
+        self._etags = entry["etags"]
+        self._search = search
+        self.fetched_at = fetched_at
+        self.next_cursor = entry["next_cursor"]
+
+    def body(self, stale: bool = False, encoding: str | None = None) -> bytes:
+        bodies = self._bodies["stale" if stale else "fresh"]
+        span = bodies.get(encoding or _IDENTITY)
+        if span is None:
+            # Built without this encoding's library; compress on the fly
+            return compression.compress(self.body(stale), encoding)
+        offset, length = span
+        return self._data[offset:offset + length]
+
+    def etag(self, stale: bool = False) -> str:
+        return self._etags["stale" if stale else "fresh"]
+
+    @property
+    def products(self) -> tuple:
+        """The page's records (decoded from the bundle on demand)."""
+        return self._search()
+
+
+class _Build:
+    """One loaded manifest and its mapped bundle files."""
+
+    def __init__(self, directory: str, manifest: dict):
+        self.manifest = manifest
+        self.maps = {}
+        for region, bundle in manifest["bundles"].items():
+            with open(os.path.join(directory, bundle["file"]), "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(data) != bundle["size"]:
+                raise ValueError(f"Bundle {bundle['file']} is {len(data)} bytes, "
+                                 f"expected {bundle['size']}")
+            self.maps[region] = data
+
+
+class BundleStore:
+    """
+    Serves /api/products from the bundle build in a directory.
+
+    Bundles are memory-mapped, so their pages are shared by every worker
+    process through the OS page cache. A newer manifest (from a rebuild) is
+    picked up within ``RELOAD_CHECK_SECONDS``.
+    """
+
+    def __init__(self, directory: str, clock=time.time):
+        """
+        Args:
+            directory: Where ``build_bundles`` wrote the build.
+            clock: Time source for ages and reload checks.
+        """
+        self.directory = directory
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._build = None
+        self._manifest_mtime = None
+        self._next_check = 0.0
+        # Memos keyed by the bundle's content hash, so a rebuild never serves old pages
+        self._records = {}  # (sha256, keywords) -> tuple of records
+        self._pages = {}  # (sha256, keywords, offset, limit) -> ProductPage
+        self._reload(force=True)
+
+    def lookup(self, region: str, keywords: str, item_count: int = 10,
+               offset: int = 0) -> amazon_service.SearchOutcome | None:
+        """
+        Like ``amazon_service.lookup_bluey_products`` but only reads the bundles.
+
+        Returns:
+            A SearchOutcome, or None if the build has no such search.
+        """
+        if self._clock() >= self._next_check:
+            self._reload()
+        build = self._build
+        if build is None:
+            return None
+        bundle = build.manifest["bundles"].get(region)
+        keywords = canonical_keywords(keywords)
+        search = bundle["searches"].get(keywords) if bundle is not None else None
+        if search is None:
+            return None
+
+        fetched_at = search["fetched_at"]
+        age = max(0.0, self._clock() - fetched_at)
+        stale = age > BUNDLE_STALE_AFTER_SECONDS
+        if item_count == PAGE_SIZE and offset % PAGE_SIZE == 0 \
+                and offset // PAGE_SIZE < len(search["pages"]):
+            page = BundlePage(
+                build.maps[region], search["pages"][offset // PAGE_SIZE],
+                lambda: self._page(build, region, keywords, search, offset, item_count).products,
+                fetched_at)
+        else:
+            page = self._page(build, region, keywords, search, offset, item_count)
+        return amazon_service.SearchOutcome(page, age, stale)
+
+    def results(self, region: str, keywords: str) -> tuple | None:
+        """Returns (records, fetched_at) of a bundled search, or None."""
+        build = self._build
+        bundle = build.manifest["bundles"].get(region) if build is not None else None
+        search = bundle["searches"].get(keywords) if bundle is not None else None
+        if search is None:
+            return None
+        return self._search_records(build, region, keywords, search), search["fetched_at"]
+
+    def files(self) -> set:
+        """Names of the bundle files in the loaded build."""
+        build = self._build
+        return {b["file"] for b in build.manifest["bundles"].values()} if build else set()
+
+    # --- Internal helpers ---
+
+    def _page(self, build, region, keywords, search, offset, limit) -> ProductPage:
+        """Cuts a page that isn't prebuilt from the search's bundled results."""
+        memo_key = (build.manifest["bundles"][region]["sha256"], keywords, offset, limit)
+        page = self._pages.get(memo_key)
+        if page is None:
+            records = self._search_records(build, region, keywords, search)
+            page = _page_of(records, search["fetched_at"], offset, limit)
+            if len(self._pages) >= _PAGE_MEMO_SIZE:
+                self._pages.clear()
+            self._pages[memo_key] = page
+        return page
+
+    def _search_records(self, build, region, keywords, search) -> tuple:
+        memo_key = (build.manifest["bundles"][region]["sha256"], keywords)
+        records = self._records.get(memo_key)
+        if records is None:
+            offset, length = search["records"]
+            records = _decode_records(build.maps[region][offset:offset + length])
+            if len(self._records) >= _PAGE_MEMO_SIZE:
+                self._records.clear()
+            self._records[memo_key] = records
+        return records
+
+    def _reload(self, force: bool = False) -> None:
+        """Loads the manifest if it changed since the last check."""
+        with self._lock:
+            if not force and self._clock() < self._next_check:
+                return
+            self._next_check = self._clock() + RELOAD_CHECK_SECONDS
+            path = os.path.join(self.directory, MANIFEST_NAME)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                if self._build is None:
+                    logging.warning("No product bundles in %s; run python -m backend.bundles.",
+                                    self.directory)
+                return
+            if mtime == self._manifest_mtime:
+                return
+            try:
+                with open(path, "rb") as f:
+                    manifest = json.load(f)
+                if manifest.get("format") != BUNDLE_FORMAT:
+                    raise ValueError(f"unsupported bundle format {manifest.get('format')}")
+                build = _Build(self.directory, manifest)
+            except (OSError, ValueError) as e:
+                # Keep serving the build already loaded
+                logging.error("Could not load product bundles from %s: %s", self.directory, e)
+                return
+            self._build, self._manifest_mtime = build, mtime
+            logging.info("Loaded product bundles built at %s for regions %s.",
+                         manifest["built_at"], ", ".join(sorted(manifest["bundles"])))
+
+
+_BUNDLES = None
+_BUNDLES_LOCK = threading.Lock()
+
+
+def get_bundles() -> BundleStore:
+    """Returns the shared bundle store at BUNDLES_DIR, loading it on first use."""
+    global _BUNDLES
+    with _BUNDLES_LOCK:
+        if _BUNDLES is None:
+            _BUNDLES = BundleStore(os.getenv(ENV_BUNDLES_DIR, DEFAULT_BUNDLES_DIR))
+        return _BUNDLES
+
+
+def serve_from_bundles() -> bool:
+    """True if /api/products should be answered from the bundles (PRODUCT_SOURCE=bundles)."""
+    return os.getenv(catalogue.ENV_PRODUCT_SOURCE, "live").lower() == "bundles"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Build static /api/products bundles per region from the PA API.")
+    parser.add_argument('--out', help="Output directory (default: BUNDLES_DIR).")
+    parser.add_argument('--regions', help="Comma separated region codes to build.")
+    parser.add_argument('--keywords', help="Comma separated keywords to build.")
+    parser.add_argument('--item-count', type=int, default=DEFAULT_BUILD_ITEM_COUNT,
+                        help="Results to bundle per search.")
+    args = parser.parse_args(argv)
+    amazon_service.configure()
+
+    manifest = build_bundles(
+        args.out or os.getenv(ENV_BUNDLES_DIR, DEFAULT_BUNDLES_DIR),
+        regions=args.regions.split(',') if args.regions else None,
+        keywords=[k.strip() for k in args.keywords.split(',')] if args.keywords else None,
+        item_count=args.item_count)
+    return 1 if manifest["failed"] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,335 @@
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+# --- Defaults ---
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # 64MB budget for cached values
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_SWEEP_INTERVAL_SECONDS = 60
+
+
+def estimate_size(value, _seen=None) -> int:
+    """
+    Roughly estimates the memory footprint of a value in bytes.
+
+    Walks containers and object attributes (``__dict__`` / ``__slots__``) so
+    that nested SDK response objects are accounted for, not just their shell.
+
+    Args:
+        value: The object to measure.
+
+    Returns:
+        The estimated size in bytes.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, bytearray, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen)
+                    for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, _seen) for v in value)
+    else:
+        if hasattr(value, '__dict__'):
+            size += estimate_size(vars(value), _seen)
+        for slot in getattr(type(value), '__slots__', ()):
+            if hasattr(value, slot):
+                size += estimate_size(getattr(value, slot), _seen)
+    return size
+
+
+class CacheEntry:
+    """A single cached value with its bookkeeping metadata."""
+
+    __slots__ = ('value', 'stored_at', 'expires_at', 'size')
+
+    def __init__(self, value, stored_at: float, expires_at: float, size: int):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.size = size
+
+
+class CacheBackend:
+    """
+    Interface for product cache storage.
+
+    ``TTLCache`` keeps entries in process memory; the implementations in
+    ``cache_backends`` share entries between worker processes.
+    """
+
+    def get(self, key, default=None):
+        """Returns the cached value for ``key``, or ``default`` if missing or expired."""
+        entry = self.get_entry(key)
+        return default if entry is None else entry.value
+
+    def get_entry(self, key, max_age: float | None = None) -> CacheEntry | None:
+        """
+        Returns the unexpired ``CacheEntry`` for ``key``, or None.
+
+        An entry stored more than ``max_age`` seconds ago is still returned
+        (e.g. as a fallback) but counted as a miss, since the caller won't
+        serve it as it is.
+        """
+        raise NotImplementedError
+
+    def peek(self, key) -> CacheEntry | None:
+        """Like ``get_entry``, but not counted as a hit or miss (for internal re-checks)."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        """Stores ``value`` under ``key`` for ``ttl`` seconds."""
+        raise NotImplementedError
+
+    def replace(self, key, value, stored_at: float | None = None) -> bool:
+        """
+        Swaps the value of an unexpired entry, keeping its stored and expiry times.
+
+        Used to patch part of a cached value without making it look fresher
+        than it is. Returns False (storing nothing) if ``key`` is not cached,
+        or if ``stored_at`` is given and the entry was stored at another time
+        (e.g. a newer value arrived since the one being patched was read).
+        """
+        raise NotImplementedError
+
+    def delete(self, key) -> bool:
+        """Removes ``key``. Returns True if it was present."""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """Removes all entries and resets the counters."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the cache counters and current occupancy."""
+        raise NotImplementedError
+
+    def __contains__(self, key) -> bool:
+        raise NotImplementedError
+
+
+class TTLCache(CacheBackend):
+    """
+    Thread-safe in-memory cache with LRU eviction and per-entry TTLs.
+
+    The cache is bounded both by entry count and by an (estimated) byte budget;
+    when either limit is exceeded the least recently used entries are evicted.
+    Expired entries are removed lazily on access, by a periodic sweep piggybacked
+    on writes, and optionally by a background sweeper thread.
+    """
+
+    def __init__(self,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 default_ttl: float = DEFAULT_TTL_SECONDS,
+                 sweep_interval: float = DEFAULT_SWEEP_INTERVAL_SECONDS,
+                 size_of=estimate_size):
+        """
+        Args:
+            max_entries: Maximum number of entries kept in the cache.
+            max_bytes: Maximum total estimated size of cached values.
+            default_ttl: TTL in seconds used when ``set`` is called without one.
+            sweep_interval: Minimum seconds between lazy sweeps on write.
+            size_of: Callable returning the size in bytes of a value.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.sweep_interval = sweep_interval
+        self._size_of = size_of
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self._last_sweep = time.time()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+        self._sweeper_thread = None
+        self._sweeper_stop = threading.Event()
+
+    # --- Core operations ---
+
+    def get_entry(self, key, max_age: float | None = None) -> CacheEntry | None:
+        """
+        Returns the full ``CacheEntry`` (value and timestamps) for ``key``, or None.
+
+        A hit marks the entry as most recently used. Entries older than
+        ``max_age`` are returned but counted as misses (see ``CacheBackend``).
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if now >= entry.expires_at:
+                self._remove(key)
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if max_age is not None and now - entry.stored_at >= max_age:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return entry
+
+    def peek(self, key) -> CacheEntry | None:
+        """Returns the unexpired entry for ``key`` without affecting LRU order or stats."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry if entry is not None and time.time() < entry.expires_at else None
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        """
+        Stores ``value`` under ``key`` for ``ttl`` seconds (defaults to ``default_ttl``).
+
+        Values larger than the whole byte budget are not cached at all.
+        """
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        size = self._size_of(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                logging.warning(
+                    "Not caching '%s': %s bytes exceeds cache budget of %s bytes.", key, size, self.max_bytes)
+                return
+
+            self._entries[key] = CacheEntry(value, now, now + ttl, size)
+            self._bytes += size
+
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+            self._evict_to_limits()
+
+    def replace(self, key, value, stored_at: float | None = None) -> bool:
+        size = self._size_of(value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() >= entry.expires_at:
+                return False
+            if stored_at is not None and entry.stored_at != stored_at:
+                return False
+            self._bytes += size - entry.size
+            entry.value = value
+            entry.size = size
+            self._evict_to_limits()
+            return True
+
+    def delete(self, key) -> bool:
+        """Removes ``key`` from the cache. Returns True if it was present."""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def clear(self) -> None:
+        """Removes all entries and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+            self._expirations = 0
+
+    def __contains__(self, key) -> bool:
+        """True if ``key`` holds an unexpired value. Does not affect LRU order or stats."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.time() < entry.expires_at
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    # --- Expiry sweeping ---
+
+    def sweep(self) -> int:
+        """Removes every expired entry. Returns the number of entries removed."""
+        with self._lock:
+            return self._sweep(time.time())
+
+    def start_sweeper(self, interval: float | None = None) -> None:
+        """Starts a daemon thread that sweeps expired entries every ``interval`` seconds."""
+        interval = self.sweep_interval if interval is None else interval
+        with self._lock:
+            if self._sweeper_thread is not None and self._sweeper_thread.is_alive():
+                return
+            self._sweeper_stop.clear()
+            self._sweeper_thread = threading.Thread(
+                target=self._run_sweeper, args=(interval,),
+                name="cache-sweeper", daemon=True)
+            self._sweeper_thread.start()
+
+    def stop_sweeper(self) -> None:
+        """Stops the background sweeper thread, if running."""
+        thread = self._sweeper_thread
+        if thread is None:
+            return
+        self._sweeper_stop.set()
+        thread.join()
+        self._sweeper_thread = None
+
+    def _run_sweeper(self, interval: float) -> None:
+        while not self._sweeper_stop.wait(interval):
+            removed = self.sweep()
+            if removed:
+                logging.debug("Cache sweeper removed %s expired entries.", removed)
+
+    # --- Stats ---
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the cache counters and current occupancy."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+    # --- Internal helpers (caller must hold the lock) ---
+
+    def _remove(self, key) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _sweep(self, now: float) -> int:
+        expired = [key for key, entry in self._entries.items()
+                   if now >= entry.expires_at]
+        for key in expired:
+            self._remove(key)
+        self._expirations += len(expired)
+        self._last_sweep = now
+        return len(expired)
+
+    def _evict_to_limits(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._bytes > self.max_bytes):
+            key, _ = next(iter(self._entries.items()))
+            self._remove(key)
+            self._evictions += 1
@@ -0,0 +1,336 @@
+import json
+import time
+import zlib
+import struct
+import sqlite3
+import threading
+from .cache import CacheBackend, CacheEntry, TTLCache, DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS
+from .products import ProductPage
+
+# Payloads above this size are zlib-compressed before being stored
+COMPRESS_THRESHOLD_BYTES = 512
+
+_RAW = b'j'  # Payload is plain JSON
+_ZLIB = b'z'  # Payload is zlib-compressed JSON
+_PAGE = b'p'  # Payload is a ProductPage's JSON
+_PAGE_ZLIB = b'P'  # Payload is a ProductPage's zlib-compressed JSON
+
+
+# --- Serialization ---
+
+
+def serialize(value) -> bytes:
+    """
+    Encodes a ProductPage or JSON-compatible value into compact bytes for shared storage.
+
+    Pages are stored as their response JSON, so a page read back from storage
+    already has its body encoded. SDK objects are deliberately not supported
+    so nothing is ever pickled.
+    """
+    if isinstance(value, ProductPage):
+        raw_marker, zlib_marker = _PAGE, _PAGE_ZLIB
+        payload = value.to_json()
+    else:
+        raw_marker, zlib_marker = _RAW, _ZLIB
+        payload = json.dumps(value, separators=(',', ':'),
+                             ensure_ascii=False).encode('utf-8')
+    if len(payload) > COMPRESS_THRESHOLD_BYTES:
+        return zlib_marker + zlib.compress(payload)
+    return raw_marker + payload
+
+
+def deserialize(data: bytes):
+    """Decodes bytes produced by ``serialize``."""
+    marker, payload = data[:1], data[1:]
+    if marker in (_ZLIB, _PAGE_ZLIB):
+        payload = zlib.decompress(payload)
+    elif marker not in (_RAW, _PAGE):
+        raise ValueError(f"Unknown cache payload marker: {marker!r}")
+    if marker in (_PAGE, _PAGE_ZLIB):
+        return ProductPage.from_json(payload)
+    return json.loads(payload)
+
+
+def _counted(now: float, stored_at: float, max_age: float | None) -> str:
+    """The counter a found entry goes to (see ``CacheBackend.get_entry``)."""
+    return "misses" if max_age is not None and now - stored_at >= max_age else "hits"
+
+
+class _Counters:
+    """Per-process hit/miss counters for backends whose storage is shared."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def add(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+# --- SQLite (WAL) backend ---
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Cache stored in a local SQLite database in WAL mode.
+
+    Every worker process opening the same file shares entries, so a result
+    fetched by one gunicorn worker is a hit for the others. WAL lets readers
+    proceed while a writer commits. When ``max_entries`` is exceeded the
+    oldest-stored entries are evicted (reads don't write, to keep them cheap).
+    """
+
+    def __init__(self, path: str,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 default_ttl: float = DEFAULT_TTL_SECONDS):
+        """
+        Args:
+            path: Database file path (shared by all workers).
+            max_entries: Maximum number of entries kept.
+            default_ttl: TTL in seconds used when ``set`` is called without one.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._counters = _Counters()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " expires_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)")
+
+    def get_entry(self, key, max_age: float | None = None) -> CacheEntry | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at, expires_at FROM cache WHERE key = ?",
+                (key,)).fetchone()
+            if row is not None and now >= row[2]:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._counters.add("expirations")
+                row = None
+        if row is None:
+            self._counters.add("misses")
+            return None
+        value, stored_at, expires_at = row
+        self._counters.add(_counted(now, stored_at, max_age))
+        return CacheEntry(deserialize(value), stored_at, expires_at, len(value))
+
+    def peek(self, key) -> CacheEntry | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at, expires_at FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())).fetchone()
+        if row is None:
+            return None
+        value, stored_at, expires_at = row
+        return CacheEntry(deserialize(value), stored_at, expires_at, len(value))
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        data = serialize(value)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, stored_at, expires_at)"
+                    " VALUES (?, ?, ?, ?)", (key, data, now, now + ttl))
+                expired = self._conn.execute(
+                    "DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+                evicted = self._conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache"
+                    " ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._counters.add("expirations", expired)
+        self._counters.add("evictions", evicted)
+
+    def replace(self, key, value, stored_at: float | None = None) -> bool:
+        data = serialize(value)
+        with self._lock:
+            # One statement, so a newer value stored meanwhile is never overwritten
+            return self._conn.execute(
+                "UPDATE cache SET value = ? WHERE key = ? AND expires_at > ?"
+                " AND (? IS NULL OR stored_at = ?)",
+                (data, key, time.time(), stored_at, stored_at)).rowcount > 0
+
+    def delete(self, key) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM cache WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+        self._counters.reset()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache").fetchone()
+        stats = self._counters.as_dict()
+        stats.update({"entries": entries, "bytes": size,
+                      "max_entries": self.max_entries, "backend": "sqlite"})
+        return stats
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())).fetchone()
+        return row is not None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# --- Redis-compatible backend ---
+
+
+_REDIS_HEADER = struct.Struct('>dd')  # stored_at, expires_at
+
+
+class RedisBackend(CacheBackend):
+    """
+    Cache stored in Redis (or anything speaking the same client API).
+
+    Only ``get``, ``set(name, value, px=..., xx=...)``, ``delete`` and ``scan_iter``
+    are used, so any redis-py compatible client (or a local fake) works.
+    Expiry is delegated to Redis; eviction follows the server's maxmemory policy.
+    """
+
+    def __init__(self, client, prefix: str = "bluey:cache:",
+                 default_ttl: float = DEFAULT_TTL_SECONDS):
+        """
+        Args:
+            client: A redis-py compatible client.
+            prefix: Namespace for keys written by this cache.
+            default_ttl: TTL in seconds used when ``set`` is called without one.
+        """
+        self.client = client
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self._counters = _Counters()
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        """Creates a backend from a Redis URL. Requires the optional ``redis`` package."""
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(
+                "The redis cache backend requires the 'redis' package (pip install redis).") from e
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get_entry(self, key, max_age: float | None = None) -> CacheEntry | None:
+        entry = self.peek(key)
+        self._counters.add("misses" if entry is None else
+                           _counted(time.time(), entry.stored_at, max_age))
+        return entry
+
+    def peek(self, key) -> CacheEntry | None:
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return None
+        stored_at, expires_at = _REDIS_HEADER.unpack_from(data)
+        value = deserialize(data[_REDIS_HEADER.size:])
+        return CacheEntry(value, stored_at, expires_at, len(data))
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        data = _REDIS_HEADER.pack(now, now + ttl) + serialize(value)
+        self.client.set(self.prefix + key, data, px=max(1, int(ttl * 1000)))
+
+    def replace(self, key, value, stored_at: float | None = None) -> bool:
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return False
+        current_stored_at, expires_at = _REDIS_HEADER.unpack_from(data)
+        # Not atomic with the write below (the client API has no transactions),
+        # but narrows the window for overwriting a newer value to one round trip
+        if stored_at is not None and current_stored_at != stored_at:
+            return False
+        remaining_ms = int((expires_at - time.time()) * 1000)
+        if remaining_ms <= 0:
+            return False
+        # xx: only overwrite if the key still exists (it may have just expired)
+        return bool(self.client.set(
+            self.prefix + key, data[:_REDIS_HEADER.size] + serialize(value),
+            px=remaining_ms, xx=True))
+
+    def delete(self, key) -> bool:
+        return bool(self.client.delete(self.prefix + key))
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+        self._counters.reset()
+
+    def stats(self) -> dict:
+        stats = self._counters.as_dict()
+        stats.update({
+            "entries": sum(1 for _ in self.client.scan_iter(match=self.prefix + '*')),
+            "backend": "redis",
+        })
+        return stats
+
+    def __contains__(self, key) -> bool:
+        return self.client.get(self.prefix + key) is not None
+
+
+def create_cache_backend(kind: str, **options) -> CacheBackend:
+    """
+    Builds a cache backend by name.
+
+    Args:
+        kind: "memory", "sqlite" or "redis".
+        options: Backend specific settings: ``path`` for sqlite, ``url`` for
+            redis, plus ``max_entries`` / ``max_bytes`` / ``default_ttl``.
+
+    Returns:
+        The configured CacheBackend.
+
+    Raises:
+        ValueError: If ``kind`` is not a known backend.
+    """
+    kind = kind.lower()
+    if kind == "memory":
+        return TTLCache(**options)
+    if kind == "sqlite":
+        options.pop("max_bytes", None)
+        return SQLiteBackend(**options)
+    if kind == "redis":
+        options.pop("max_entries", None)
+        options.pop("max_bytes", None)
+        return RedisBackend.from_url(**options)
+    raise ValueError(f"Unknown cache backend: {kind}")
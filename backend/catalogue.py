@@ -0,0 +1,388 @@
+"""
+Local product catalogue: the last known search results per region, in SQLite.
+
+A refresh job (run daily from cron or a scheduled Lambda) fetches each
+region x keyword search and stores the normalized products keyed by ASIN,
+writing only rows that changed since the previous snapshot. With
+``PRODUCT_SOURCE=catalogue`` the ``/api/products`` endpoint is answered from
+this store alone, so requests never wait on the PA API.
+
+    python -m backend.catalogue --regions US,GB --keywords "Bluey Toys"
+"""
+import os
+import time
+import logging
+import argparse
+import sqlite3
+import threading
+from typing import NamedTuple
+from . import amazon_service
+from .products import ProductPage, ProductRecord, encode_cursor
+from .queries import canonical_keywords
+from .warmup import hot_keywords, warmup_plan
+
+# --- Configuration ---
+ENV_PRODUCT_SOURCE = "PRODUCT_SOURCE"  # "live" (default), "catalogue" or "bundles"
+ENV_CATALOGUE_PATH = "CATALOGUE_PATH"
+DEFAULT_CATALOGUE_PATH = "catalogue.sqlite3"
+DEFAULT_REFRESH_ITEM_COUNT = amazon_service.MAX_RESULTS
+# Data older than this is flagged stale (the refresh runs daily)
+CATALOGUE_STALE_AFTER_SECONDS = 2 * 24 * 3600
+_PAGE_MEMO_SIZE = 256  # Assembled pages kept per catalogue
+
+_PRODUCT_FIELDS = ('title', 'url', 'image', 'price', 'availability')
+
+
+class RefreshDiff(NamedTuple):
+    """What a snapshot changed in the catalogue."""
+    inserted: int  # New products
+    updated: int  # Products whose fields changed
+    unchanged: int  # Products left untouched
+    removed: int  # Products no longer listed for the search
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.inserted or self.updated or self.removed)
+
+
+class Catalogue:
+    """
+    SQLite store of products per region and the ordered results per search.
+
+    ``products`` holds one row per (region, ASIN); ``listings`` the ordered
+    ASINs each (region, keywords) search returned; ``snapshots`` when each
+    search was last refreshed. Reads are indexed lookups by primary key.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Database file path (shared by all workers).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._pages = {}  # memo: (region, keywords, offset, limit, refreshed_at) -> ProductPage
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS products ("
+            " region TEXT NOT NULL,"
+            " asin TEXT NOT NULL,"
+            " title TEXT, url TEXT, image TEXT, price TEXT, availability TEXT,"
+            " fetched_at REAL NOT NULL,"  # When these field values were fetched
+            " PRIMARY KEY (region, asin));"
+            "CREATE TABLE IF NOT EXISTS listings ("
+            " region TEXT NOT NULL,"
+            " keywords TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " asin TEXT NOT NULL,"
+            " PRIMARY KEY (region, keywords, position));"
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            " region TEXT NOT NULL,"
+            " keywords TEXT NOT NULL,"
+            " refreshed_at REAL NOT NULL,"
+            " PRIMARY KEY (region, keywords));")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(products)")}
+        if 'availability' not in columns:
+            # Catalogues created before availability was stored
+            self._conn.execute("ALTER TABLE products ADD COLUMN availability TEXT")
+        self._canonicalise_searches()
+        # Changes when another connection (e.g. the refresh job) commits
+        self._data_version = None
+
+    # --- Writes ---
+
+    def apply_snapshot(self, region: str, keywords: str, records,
+                       fetched_at: float | None = None) -> RefreshDiff:
+        """
+        Makes the stored results for a search match ``records``.
+
+        Only products whose fields differ from the stored row are written, and
+        the listing is only rewritten if its order changed. Records without
+        an ASIN can't be keyed and are skipped; repeated ASINs keep their
+        first position.
+
+        Args:
+            region: The region code.
+            keywords: The search keywords (stored in canonical form).
+            records: The ProductRecords the search returned, in order.
+            fetched_at: When the records were fetched (defaults to now).
+
+        Returns:
+            A RefreshDiff counting inserted, updated, unchanged and removed products.
+        """
+        keywords = canonical_keywords(keywords)
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        ordered = []
+        seen = set()
+        for record in records:
+            if record.asin and record.asin not in seen:
+                seen.add(record.asin)
+                ordered.append(record)
+        asins = [record.asin for record in ordered]
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                stored = self._stored_products(region, asins)
+                inserts, updates = [], []
+                for record in ordered:
+                    values = tuple(getattr(record, f) for f in _PRODUCT_FIELDS)
+                    previous = stored.get(record.asin)
+                    if previous is None:
+                        inserts.append((region, record.asin) + values + (fetched_at,))
+                    elif previous != values:
+                        updates.append(values + (fetched_at, region, record.asin))
+                if inserts:
+                    self._conn.executemany(
+                        "INSERT INTO products (region, asin, title, url, image, price,"
+                        " availability, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", inserts)
+                if updates:
+                    self._conn.executemany(
+                        "UPDATE products SET title = ?, url = ?, image = ?, price = ?,"
+                        " availability = ?, fetched_at = ? WHERE region = ? AND asin = ?", updates)
+
+                listed = [row[0] for row in self._conn.execute(
+                    "SELECT asin FROM listings WHERE region = ? AND keywords = ?"
+                    " ORDER BY position", (region, keywords))]
+                if listed != asins:
+                    self._conn.execute(
+                        "DELETE FROM listings WHERE region = ? AND keywords = ?",
+                        (region, keywords))
+                    self._conn.executemany(
+                        "INSERT INTO listings (region, keywords, position, asin)"
+                        " VALUES (?, ?, ?, ?)",
+                        [(region, keywords, i, asin) for i, asin in enumerate(asins)])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO snapshots (region, keywords, refreshed_at)"
+                    " VALUES (?, ?, ?)", (region, keywords, fetched_at))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._pages.clear()
+
+        return RefreshDiff(inserted=len(inserts), updated=len(updates),
+                           unchanged=len(ordered) - len(inserts) - len(updates),
+                           removed=len(set(listed) - seen))
+
+    def patch_offers(self, region: str, offers: dict,
+                     fetched_at: float | None = None) -> int:
+        """
+        Updates just the price and availability of stored products.
+
+        Args:
+            region: The region code.
+            offers: {asin: (price, availability)}, e.g. from a GetItems refresh.
+            fetched_at: When the offers were fetched (defaults to now).
+
+        Returns:
+            The number of product rows whose offer actually changed.
+        """
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self._lock:
+            changed = self._conn.executemany(
+                "UPDATE products SET price = ?, availability = ?, fetched_at = ?"
+                " WHERE region = ? AND asin = ?"
+                " AND (price IS NOT ? OR availability IS NOT ?)",
+                [(price, availability, fetched_at, region, asin, price, availability)
+                 for asin, (price, availability) in offers.items()]).rowcount
+            if changed:
+                self._pages.clear()
+        return changed
+
+    # --- Reads ---
+
+    def page(self, region: str, keywords: str, offset: int = 0,
+             limit: int = 10) -> ProductPage | None:
+        """
+        Returns stored results ``[offset, offset + limit)`` for a search.
+
+        Returns:
+            A ProductPage (``fetched_at`` is the snapshot time, ``next_cursor``
+            set if more results are stored), or None if the search has never
+            been refreshed. Equivalent keywords find the same search.
+        """
+        keywords = canonical_keywords(keywords)
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                # Another process changed the catalogue; memoized pages may be out of date
+                self._pages.clear()
+                self._data_version = data_version
+            row = self._conn.execute(
+                "SELECT refreshed_at FROM snapshots WHERE region = ? AND keywords = ?",
+                (region, keywords)).fetchone()
+            if row is None:
+                return None
+            memo_key = (region, keywords, offset, limit, row[0])
+            page = self._pages.get(memo_key)
+            if page is not None:
+                return page
+
+            # One row past the limit tells us whether another page exists
+            rows = self._conn.execute(
+                "SELECT p.asin, p.title, p.url, p.image, p.price, p.availability"
+                " FROM listings l JOIN products p ON p.region = l.region AND p.asin = l.asin"
+                " WHERE l.region = ? AND l.keywords = ?"
+                " ORDER BY l.position LIMIT ? OFFSET ?",
+                (region, keywords, limit + 1, offset)).fetchall()
+            more = len(rows) > limit
+            page = ProductPage(
+                tuple(ProductRecord(*r) for r in rows[:limit]), (),
+                next_cursor=encode_cursor(offset + limit) if more else None,
+                fetched_at=row[0])
+            if len(self._pages) >= _PAGE_MEMO_SIZE:
+                self._pages.clear()
+            self._pages[memo_key] = page
+            return page
+
+    def lookup(self, region: str, keywords: str, item_count: int = 10,
+               offset: int = 0) -> amazon_service.SearchOutcome | None:
+        """Like ``amazon_service.lookup_bluey_products`` but never calls upstream."""
+        page = self.page(region, keywords, offset, item_count)
+        if page is None:
+            return None
+        age = max(0.0, time.time() - page.fetched_at)
+        return amazon_service.SearchOutcome(page, age, age > CATALOGUE_STALE_AFTER_SECONDS)
+
+    def searches(self) -> list:
+        """Returns [(region, keywords, refreshed_at)] for every stored search."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT region, keywords, refreshed_at FROM snapshots"
+                " ORDER BY region, keywords").fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # --- Internal helpers (caller must hold the lock) ---
+
+    def _canonicalise_searches(self) -> None:
+        """Renames searches stored before keywords were canonicalised."""
+        renames = [(region, keywords, canonical_keywords(keywords))
+                   for region, keywords in self._conn.execute(
+                       "SELECT region, keywords FROM snapshots")
+                   if canonical_keywords(keywords) != keywords]
+        if not renames:
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for region, keywords, canonical in renames:
+                newer = self._conn.execute(
+                    "SELECT 1 FROM snapshots s JOIN snapshots o"
+                    " ON o.region = s.region AND o.keywords = ?"
+                    " WHERE s.region = ? AND s.keywords = ? AND o.refreshed_at >= s.refreshed_at",
+                    (canonical, region, keywords)).fetchone()
+                if newer is None:
+                    # Keep this snapshot under the canonical keywords
+                    for table in ("listings", "snapshots"):
+                        self._conn.execute(
+                            f"DELETE FROM {table} WHERE region = ? AND keywords = ?",
+                            (region, canonical))
+                        self._conn.execute(
+                            f"UPDATE {table} SET keywords = ? WHERE region = ? AND keywords = ?",
+                            (canonical, region, keywords))
+                else:
+                    for table in ("listings", "snapshots"):
+                        self._conn.execute(
+                            f"DELETE FROM {table} WHERE region = ? AND keywords = ?",
+                            (region, keywords))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _stored_products(self, region: str, asins: list) -> dict:
+        stored = {}
+        # Stay well below SQLite's bound-parameter limit
+        for i in range(0, len(asins), 500):
+            chunk = asins[i:i + 500]
+            rows = self._conn.execute(
+                f"SELECT asin, {', '.join(_PRODUCT_FIELDS)} FROM products"
+                f" WHERE region = ? AND asin IN ({', '.join('?' * len(chunk))})",
+                [region, *chunk])
+            stored.update((r[0], tuple(r[1:])) for r in rows)
+        return stored
+
+
+_CATALOGUE = None
+_CATALOGUE_LOCK = threading.Lock()
+
+
+def get_catalogue() -> Catalogue:
+    """Returns the shared catalogue at CATALOGUE_PATH, opening it on first use."""
+    global _CATALOGUE
+    with _CATALOGUE_LOCK:
+        if _CATALOGUE is None:
+            _CATALOGUE = Catalogue(os.getenv(ENV_CATALOGUE_PATH, DEFAULT_CATALOGUE_PATH))
+        return _CATALOGUE
+
+
+def serve_from_catalogue() -> bool:
+    """True if /api/products should be answered from the catalogue (PRODUCT_SOURCE=catalogue)."""
+    return os.getenv(ENV_PRODUCT_SOURCE, "live").lower() == "catalogue"
+
+# --- Refresh job ---
+
+
+def refresh_search(catalogue: Catalogue, region: str, keywords: str,
+                   item_count: int = DEFAULT_REFRESH_ITEM_COUNT) -> RefreshDiff | None:
+    """
+    Fetches one search from the PA API and applies it to the catalogue.
+
+    A failed fetch (of any page) leaves the stored snapshot untouched rather
+    than truncating it. Returns the diff, or None if the fetch failed.
+    """
+    pages = amazon_service.refresh_pages(region, keywords, item_count)
+    if not pages or pages[-1] is None or pages[-1].api_errors:
+        logging.warning(
+            "Catalogue refresh failed for '%s' in region %s; keeping previous snapshot.", keywords, region)
+        return None
+    records = [record for page in pages for record in page.products][:item_count]
+    diff = catalogue.apply_snapshot(region, keywords, records,
+                                    min(page.fetched_at for page in pages))
+    logging.info(
+        "Catalogue refresh for '%s' in region %s: %s new, %s updated, %s unchanged, %s removed.",
+        keywords, region, diff.inserted, diff.updated, diff.unchanged, diff.removed)
+    return diff
+
+
+def refresh_catalogue(catalogue: Catalogue, regions=None, keywords=None,
+                      item_count: int = DEFAULT_REFRESH_ITEM_COUNT) -> dict:
+    """
+    Refreshes every region x keyword search. Returns {(region, keywords): RefreshDiff | None}.
+
+    Defaults to every region in REGION_CONFIG and the warmup keywords.
+    """
+    regions = tuple(regions or amazon_service.REGION_CONFIG)
+    keywords = tuple(keywords or hot_keywords())
+    return {(region, kw): refresh_search(catalogue, region, kw, item_count)
+            for region, kw in warmup_plan(regions, keywords)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Refresh the local product catalogue from the PA API.")
+    parser.add_argument('--regions', help="Comma separated region codes to refresh.")
+    parser.add_argument('--keywords', help="Comma separated keywords to refresh.")
+    parser.add_argument('--item-count', type=int, default=DEFAULT_REFRESH_ITEM_COUNT,
+                        help="Results to store per search.")
+    parser.add_argument('--path', help="Catalogue database (default: CATALOGUE_PATH).")
+    args = parser.parse_args(argv)
+    amazon_service.configure()
+
+    catalogue = Catalogue(args.path) if args.path else get_catalogue()
+    results = refresh_catalogue(
+        catalogue,
+        regions=args.regions.split(',') if args.regions else None,
+        keywords=[k.strip() for k in args.keywords.split(',')] if args.keywords else None,
+        item_count=args.item_count)
+    return 1 if any(diff is None for diff in results.values()) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
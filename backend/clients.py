@@ -0,0 +1,101 @@
+import time
+import logging
+import threading
+
+# Failed constructions are remembered (and not logged again) for this long
+DEFAULT_FAILURE_RETRY_SECONDS = 300
+
+
+class _RegistryEntry:
+    """A constructed client (or a remembered failure) for one region."""
+
+    __slots__ = ('client', 'fingerprint', 'created_at')
+
+    def __init__(self, client, fingerprint, created_at: float):
+        self.client = client
+        self.fingerprint = fingerprint
+        self.created_at = created_at
+
+
+class ClientRegistry:
+    """
+    Thread-safe registry of long-lived API clients keyed by region.
+
+    Clients are built lazily on first use (or eagerly via ``warm``) and then
+    reused, so their HTTP connection pools survive across requests. Each entry
+    remembers a fingerprint of the configuration it was built from; when the
+    fingerprint changes (e.g. rotated credentials) the client is rebuilt.
+    Construction failures are cached too, so a misconfigured region is
+    reported once rather than on every request.
+    """
+
+    def __init__(self, factory, fingerprint,
+                 failure_retry_seconds: float = DEFAULT_FAILURE_RETRY_SECONDS):
+        """
+        Args:
+            factory: Callable ``factory(region)`` returning a client, or None on failure.
+            fingerprint: Callable ``fingerprint(region)`` returning a hashable
+                snapshot of the configuration a client depends on.
+            failure_retry_seconds: How long a failed construction is remembered
+                before it is attempted again with unchanged configuration.
+        """
+        self._factory = factory
+        self._fingerprint = fingerprint
+        self.failure_retry_seconds = failure_retry_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._region_locks = {}
+
+    def get(self, region: str):
+        """
+        Returns the client for ``region``, building it if needed.
+
+        Returns:
+            The client, or None if it could not be constructed.
+        """
+        fingerprint = self._fingerprint(region)
+        entry = self._entries.get(region)
+        if self._is_current(entry, fingerprint):
+            return entry.client
+
+        # Serialize construction per region so concurrent misses build once
+        with self._region_lock(region):
+            entry = self._entries.get(region)
+            if self._is_current(entry, fingerprint):
+                return entry.client
+            if entry is not None and entry.fingerprint != fingerprint:
+                logging.info(
+                    "Configuration changed for region %s; rebuilding API client.", region)
+
+            client = self._factory(region)
+            self._entries[region] = _RegistryEntry(
+                client, fingerprint, time.time())
+            return client
+
+    def warm(self, regions) -> dict:
+        """Eagerly builds clients for ``regions``. Returns {region: succeeded}."""
+        return {region: self.get(region) is not None for region in regions}
+
+    def reload(self, region: str | None = None) -> None:
+        """Drops the cached client for ``region`` (or all regions) so it is rebuilt."""
+        with self._lock:
+            if region is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(region, None)
+
+    def status(self) -> dict:
+        """Returns {region: "ready" | "failed"} for every region seen so far."""
+        return {region: "ready" if entry.client is not None else "failed"
+                for region, entry in list(self._entries.items())}
+
+    def _is_current(self, entry, fingerprint) -> bool:
+        if entry is None or entry.fingerprint != fingerprint:
+            return False
+        if entry.client is None:
+            return time.time() - entry.created_at < self.failure_retry_seconds
+        return True
+
+    def _region_lock(self, region: str) -> threading.Lock:
+        with self._lock:
+            return self._region_locks.setdefault(region, threading.Lock())
@@ -0,0 +1,52 @@
+import gzip
+
+try:
+    import brotli  # Optional: enables "br" Content-Encoding
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+# Bodies are compressed once per cache entry, so we can afford a high level
+BROTLI_QUALITY = 11
+
+
+def available_encodings() -> tuple:
+    """Content-Encodings we can produce, in order of server preference."""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    Compresses ``data`` with the given Content-Encoding.
+
+    Args:
+        data: The identity (uncompressed) body.
+        encoding: "br" or "gzip".
+
+    Returns:
+        The compressed bytes.
+
+    Raises:
+        ValueError: If the encoding is unknown or its library is not installed.
+    """
+    if encoding == 'gzip':
+        # mtime=0 keeps the output deterministic for identical content
+        return gzip.compress(data, GZIP_LEVEL, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def negotiate(accept_encodings) -> str | None:
+    """
+    Picks the Content-Encoding to use for a request.
+
+    Args:
+        accept_encodings: The request's parsed Accept-Encoding header
+            (werkzeug ``request.accept_encodings``), which honours q-values.
+
+    Returns:
+        "br" or "gzip", or None to send the identity body.
+    """
+    best = accept_encodings.best_match(available_encodings() + ('identity',))
+    return None if best in (None, 'identity') else best
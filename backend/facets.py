@@ -0,0 +1,166 @@
+"""
+Precomputed category facets over the products we have already fetched.
+
+Browse nodes (Amazon categories) are captured from every fetched search page
+and aggregated per region into category -> ASIN sets, so listing categories
+with product counts and filtering by category are in-memory lookups rather
+than a PA API search per filter. Updates are incremental: re-fetching a
+product only touches the categories it joined or left.
+"""
+import time
+import threading
+
+DEFAULT_MAX_AGE_SECONDS = 5 * 3600  # Products not re-fetched for this long are dropped
+PRUNE_INTERVAL_SECONDS = 300
+
+
+class _Category:
+    """One browse node and the ASINs listed in it (caller holds the lock)."""
+
+    __slots__ = ('name', 'parent_id', 'asins', 'version', '_snapshot')
+
+    def __init__(self, name: str | None, parent_id: str | None):
+        self.name = name
+        self.parent_id = parent_id
+        self.asins = set()
+        self.version = 0
+        self._snapshot = (-1, frozenset())
+
+    def snapshot(self) -> frozenset:
+        """An immutable copy of ``asins``, rebuilt only after the category changed."""
+        version, asins = self._snapshot
+        if version != self.version:
+            asins = frozenset(self.asins)
+            self._snapshot = (self.version, asins)
+        return asins
+
+
+class _RegionFacets:
+    """Categories of one region (caller holds the lock)."""
+
+    def __init__(self):
+        self.categories = {}  # node_id -> _Category
+        self.memberships = {}  # asin -> frozenset of node_ids
+        self.indexed_at = {}  # asin -> time last (re-)indexed
+        self.generation = 0
+        self._listing = (-1, [])
+
+    def put(self, asin: str, nodes, now: float) -> None:
+        node_ids = frozenset(node_id for node_id, _, _ in nodes)
+        for node_id, name, parent_id in nodes:
+            category = self.categories.get(node_id)
+            if category is None:
+                self.categories[node_id] = _Category(name, parent_id)
+                self.generation += 1
+            elif (name, parent_id) != (category.name, category.parent_id):
+                category.name, category.parent_id = name, parent_id
+                self.generation += 1
+        self.indexed_at[asin] = now
+        old = self.memberships.get(asin, frozenset())
+        if old == node_ids:
+            return
+        for node_id in old - node_ids:
+            self._leave(asin, node_id)
+        for node_id in node_ids - old:
+            category = self.categories[node_id]
+            category.asins.add(asin)
+            category.version += 1
+        if node_ids:
+            self.memberships[asin] = node_ids
+        else:
+            self.memberships.pop(asin, None)
+        self.generation += 1
+
+    def remove(self, asin: str) -> None:
+        self.indexed_at.pop(asin, None)
+        for node_id in self.memberships.pop(asin, ()):
+            self._leave(asin, node_id)
+        self.generation += 1
+
+    def listing(self) -> list:
+        """Categories with their product counts, largest first; memoized per generation."""
+        generation, categories = self._listing
+        if generation != self.generation:
+            categories = sorted(
+                ({"id": node_id, "name": category.name, "parent_id": category.parent_id,
+                  "count": len(category.asins)}
+                 for node_id, category in self.categories.items()),
+                key=lambda c: (-c["count"], c["name"] or "", c["id"]))
+            self._listing = (self.generation, categories)
+        return categories
+
+    def _leave(self, asin: str, node_id: str) -> None:
+        category = self.categories[node_id]
+        category.asins.discard(asin)
+        category.version += 1
+        if not category.asins:
+            del self.categories[node_id]
+
+
+class FacetIndex:
+    """Thread-safe category -> ASIN index, partitioned by region."""
+
+    def __init__(self, max_age: float = DEFAULT_MAX_AGE_SECONDS, clock=time.time):
+        """
+        Args:
+            max_age: Seconds after its last indexing that a product is dropped.
+            clock: Wall clock returning seconds.
+        """
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._regions = {}
+        self._last_prune = clock()
+
+    def add(self, region: str, categories: dict) -> None:
+        """
+        Records the categories of products fetched for ``region``.
+
+        Args:
+            region: The region code.
+            categories: {asin: ((node_id, name, parent_id), ...)}, e.g. from
+                ``products.project_categories``. A product's previous
+                categories are replaced.
+        """
+        now = self._clock()
+        with self._lock:
+            facets = self._regions.setdefault(region, _RegionFacets())
+            for asin, nodes in categories.items():
+                facets.put(asin, nodes, now)
+            if now - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+                self._prune(now)
+
+    def categories(self, region: str) -> list:
+        """
+        Returns the categories of ``region``'s products, most populated first.
+
+        Returns:
+            [{"id", "name", "parent_id", "count"}, ...]; shared, do not modify.
+        """
+        with self._lock:
+            facets = self._regions.get(region)
+            return facets.listing() if facets is not None else []
+
+    def members(self, region: str, node_id: str) -> frozenset | None:
+        """Returns the ASINs listed in a category, or None if it is unknown."""
+        with self._lock:
+            facets = self._regions.get(region)
+            category = facets.categories.get(node_id) if facets is not None else None
+            return category.snapshot() if category is not None else None
+
+    def generation(self, region: str) -> int:
+        """A counter that changes whenever ``region``'s facets change."""
+        with self._lock:
+            facets = self._regions.get(region)
+            return facets.generation if facets is not None else 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._regions.clear()
+
+    def _prune(self, now: float) -> None:
+        self._last_prune = now
+        cutoff = now - self.max_age
+        for facets in self._regions.values():
+            for asin in [asin for asin, at in facets.indexed_at.items() if at < cutoff]:
+                facets.remove(asin)
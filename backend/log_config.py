@@ -0,0 +1,168 @@
+"""
+Logging setup: records are queued on the request path and written by a thread.
+
+``configure_logging`` installs a single handler on the root logger that only
+puts records on an in-memory queue; a ``QueueListener`` thread formats them
+and does the console and (rotating) file writes. Messages use %-style
+arguments, so they are formatted on that thread too, and only if kept.
+
+Cache hits are logged through ``CACHE_HIT_LOGGER``, which keeps a sample of
+its records (see ENV_LOG_CACHE_HIT_SAMPLE_RATE); hit counts are in /metrics.
+Every /api/products query goes to ``QUERY_LOGGER``, which drops them unless
+ENV_LOG_QUERY_SAMPLE_RATE is set (e.g. to 1 to record a log for replays).
+
+Nothing is configured on import: entry points call ``configure_logging``.
+"""
+import os
+import json
+import atexit
+import logging
+import itertools
+import threading
+from queue import SimpleQueue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+ENV_LOG_FILE = "LOG_FILE"
+ENV_LOG_LEVEL = "LOG_LEVEL"
+ENV_LOG_JSON = "LOG_JSON"  # "1" writes one JSON object per line
+ENV_LOG_CACHE_HIT_SAMPLE_RATE = "LOG_CACHE_HIT_SAMPLE_RATE"
+ENV_LOG_QUERY_SAMPLE_RATE = "LOG_QUERY_SAMPLE_RATE"
+
+LOG_FILE = 'amazon_service.log'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 10MB per file, keep 3 backups
+LOG_BACKUP_COUNT = 3
+CACHE_HIT_SAMPLE_RATE = 0.01  # Fraction of cache hit records kept
+QUERY_SAMPLE_RATE = 0.0  # Fraction of query records kept (opt-in)
+
+CACHE_HIT_LOGGER = "backend.cache_hits"
+QUERY_LOGGER = "backend.queries"
+
+_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+_sample_filters = {}  # logger name -> SampleFilter
+
+
+class SampleFilter(logging.Filter):
+    """Keeps every Nth record, where N = 1 / rate (a rate of 0 drops them all)."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self._every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._seen = itertools.count()
+
+    def filter(self, record) -> bool:
+        return self._every != 0 and next(self._seen) % self._every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects."""
+
+    def format(self, record) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are, leaving all formatting to the listener.
+
+    The stock ``prepare`` formats the message (and traceback) in the calling
+    thread so records can cross process boundaries; ours never leave the
+    process, so that work can happen on the writer thread instead.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(log_file: str | None = None, level: str | int | None = None,
+                      json_output: bool | None = None,
+                      cache_hit_sample_rate: float | None = None,
+                      query_sample_rate: float | None = None) -> QueueListener:
+    """
+    Routes the root logger through a queue to console and rotating file handlers.
+
+    Replaces any handlers already on the root logger (and any previous
+    configuration by this function). Arguments default to the LOG_*
+    environment variables, then to the module defaults.
+
+    Args:
+        log_file: Path of the rotating log file; "" disables file output.
+        level: Root log level, e.g. "INFO".
+        json_output: Write JSON lines instead of ``LOG_FORMAT`` text.
+        cache_hit_sample_rate: Fraction of ``CACHE_HIT_LOGGER`` records kept.
+        query_sample_rate: Fraction of ``QUERY_LOGGER`` records kept.
+
+    Returns:
+        The started listener (stopped automatically at exit).
+    """
+    global _listener, _queue_handler
+    if log_file is None:
+        log_file = os.getenv(ENV_LOG_FILE, LOG_FILE)
+    if level is None:
+        level = os.getenv(ENV_LOG_LEVEL, "INFO").upper()
+    if json_output is None:
+        json_output = os.getenv(ENV_LOG_JSON, "0") == "1"
+    if cache_hit_sample_rate is None:
+        cache_hit_sample_rate = float(os.getenv(ENV_LOG_CACHE_HIT_SAMPLE_RATE,
+                                                CACHE_HIT_SAMPLE_RATE))
+    if query_sample_rate is None:
+        query_sample_rate = float(os.getenv(ENV_LOG_QUERY_SAMPLE_RATE, QUERY_SAMPLE_RATE))
+
+    formatter = JsonFormatter() if json_output else logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    with _lock:
+        shutdown_logging()
+        queue = SimpleQueue()
+        root = logging.getLogger()
+        root.setLevel(level)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        _queue_handler = _DeferredQueueHandler(queue)
+        root.addHandler(_queue_handler)
+
+        for name, rate in ((CACHE_HIT_LOGGER, cache_hit_sample_rate),
+                           (QUERY_LOGGER, query_sample_rate)):
+            _sample_filters[name] = SampleFilter(rate)
+            logging.getLogger(name).addFilter(_sample_filters[name])
+
+        _listener = QueueListener(queue, *handlers)
+        _listener.start()
+        return _listener
+
+
+def shutdown_logging() -> None:
+    """Writes out queued records and stops the listener thread, if running."""
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    while _sample_filters:
+        name, sample_filter = _sample_filters.popitem()
+        logging.getLogger(name).removeFilter(sample_filter)
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
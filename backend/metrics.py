@@ -0,0 +1,323 @@
+"""
+Counters, gauges and histograms exposed in the Prometheus text format.
+
+Recording sits on the request path, so it avoids locks: each thread adds to
+its own cells and the cells are only summed when ``/metrics`` is scraped.
+When a thread exits its cells are folded into a shared total, so thread
+churn (e.g. a thread per request) doesn't grow memory. Values that already
+exist elsewhere (cache counters, limiter queues) are read at scrape time by
+collectors rather than recorded twice.
+
+Usage:
+    LATENCY = metrics.Histogram("paapi_request_duration_seconds",
+                                "PA API call latency.", ["region"])
+    with LATENCY.labels("US").time():
+        ...
+"""
+import time
+import bisect
+import threading
+import weakref
+from typing import NamedTuple
+
+# Seconds, from a memoized cache hit (~100us) to a slow PA API call
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Family(NamedTuple):
+    """A metric and its samples as produced by a collector."""
+    name: str
+    kind: str  # "counter", "gauge" or "histogram"
+    help: str
+    samples: list  # [(suffix, {label: value}, number)]
+
+
+class _Shard:
+    """One thread's cells; folded into the owner's total when the thread exits."""
+
+    __slots__ = ('owner', 'values', '__weakref__')
+
+    def __init__(self, owner, size: int):
+        self.owner = owner
+        self.values = [0] * size
+
+    def __del__(self):
+        self.owner._retire(self)
+
+
+class _Cells:
+    """Per-thread numeric cells of one labelled series, summed on read."""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live = weakref.WeakSet()
+        self._retired = [0] * size
+
+    def mine(self) -> list:
+        """The calling thread's cells, to update in place without locking."""
+        try:
+            return self._local.shard.values
+        except AttributeError:
+            shard = _Shard(self, self._size)
+            with self._lock:
+                self._live.add(shard)
+            self._local.shard = shard
+            return shard.values
+
+    def snapshot(self) -> list:
+        with self._lock:
+            total = list(self._retired)
+            for shard in list(self._live):
+                for i, value in enumerate(shard.values):
+                    total[i] += value
+        return total
+
+    def _retire(self, shard: _Shard) -> None:
+        with self._lock:
+            self._live.discard(shard)
+            for i, value in enumerate(shard.values):
+                self._retired[i] += value
+
+
+class _Metric:
+    """A named metric with zero or more labels; one child per label combination."""
+
+    kind = None
+
+    def __init__(self, name: str, help: str, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        # Unlabelled metrics record straight into their only child
+        self._only = None if self.labelnames else self.labels()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values):
+        """Returns the child for these label values (in ``labelnames`` order)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} takes labels {self.labelnames}, got {values!r}")
+            with self._lock:
+                child = self._children.setdefault(
+                    tuple(str(v) for v in values), self._child())
+                self._children[values] = child
+        return child
+
+    def collect(self) -> Family:
+        samples = []
+        seen = set()
+        for values, child in list(self._children.items()):
+            if id(child) in seen:
+                continue  # Also registered under its unconverted label values
+            seen.add(id(child))
+            labels = dict(zip(self.labelnames, map(str, values)))
+            samples.extend(child.samples(labels))
+        return Family(self.name, self.kind, self.help, samples)
+
+    def _child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        if self._only is None:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use labels()")
+        return self._only
+
+
+class _CounterChild:
+    __slots__ = ('_cells',)
+
+    def __init__(self):
+        self._cells = _Cells(1)
+
+    def inc(self, amount: float = 1) -> None:
+        self._cells.mine()[0] += amount
+
+    def value(self) -> float:
+        return self._cells.snapshot()[0]
+
+    def samples(self, labels: dict) -> list:
+        return [("_total", labels, self.value())]
+
+
+class Counter(_Metric):
+    """A monotonically increasing count. Exposed with a ``_total`` suffix."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def _child(self):
+        return _CounterChild()
+
+
+class _GaugeChild:
+    __slots__ = ('_cells',)
+
+    def __init__(self):
+        self._cells = _Cells(1)
+
+    def inc(self, amount: float = 1) -> None:
+        self._cells.mine()[0] += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self._cells.mine()[0] -= amount
+
+    def value(self) -> float:
+        return self._cells.snapshot()[0]
+
+    def samples(self, labels: dict) -> list:
+        return [("", labels, self.value())]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. requests in flight."""
+
+    kind = "gauge"
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default().dec(amount)
+
+    def _child(self):
+        return _GaugeChild()
+
+
+class _Timer:
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _HistogramChild:
+    __slots__ = ('_bounds', '_cells')
+
+    def __init__(self, bounds: tuple):
+        self._bounds = bounds
+        # A cell per bucket, one for +Inf, then the sum of observations
+        self._cells = _Cells(len(bounds) + 2)
+
+    def observe(self, value: float) -> None:
+        cells = self._cells.mine()
+        cells[bisect.bisect_left(self._bounds, value)] += 1
+        cells[-1] += value
+
+    def time(self) -> _Timer:
+        """Context manager observing the seconds spent in its block."""
+        return _Timer(self)
+
+    def samples(self, labels: dict) -> list:
+        values = self._cells.snapshot()
+        samples = []
+        count = 0
+        for bound, n in zip(self._bounds + (float("inf"),), values):
+            count += n
+            samples.append(("_bucket", {**labels, "le": _format_number(bound)}, count))
+        samples.append(("_sum", labels, values[-1]))
+        samples.append(("_count", labels, count))
+        return samples
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (typically seconds) over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def time(self) -> _Timer:
+        return self._default().time()
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+
+class Registry:
+    """The metrics and collectors served by one ``/metrics`` endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def add_collector(self, collector) -> None:
+        """Adds a callable returning Families, called on every scrape."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def get(self, name: str) -> _Metric | None:
+        return self._metrics.get(name)
+
+    def collect(self) -> list:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            families.extend(collector())
+        return families
+
+    def exposition(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        for family in self.collect():
+            lines.append(f"# HELP {family.name} {_escape_help(family.help)}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for suffix, labels, value in family.samples:
+                if labels:
+                    rendered = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+                    lines.append(f"{family.name}{suffix}{{{rendered}}} {_format_number(value)}")
+                else:
+                    lines.append(f"{family.name}{suffix} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", r"\\").replace("\n", r"\n")
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# Default registry, served by the app's /metrics endpoint
+REGISTRY = Registry()
@@ -0,0 +1,183 @@
+"""
+Keeps prices and availability of displayed products current between searches.
+
+Re-running a keyword search is the only other way to see a price change, so
+this refresher re-queries the ASINs we have shown via PA API ``GetItems`` in
+batches of 10 and patches just the offer fields of the cached pages (and of
+the catalogue when it is serving). Products viewed most are refreshed more
+often than the long tail.
+"""
+import time
+import logging
+import threading
+from collections import Counter, deque
+from . import amazon_service
+from . import catalogue
+
+# --- Configuration ---
+BATCH_SIZE = 10  # GetItems accepts up to 10 ASINs per call
+HOT_ASINS_PER_REGION = 50  # Most viewed products refreshed on the hot schedule
+HOT_REFRESH_SECONDS = 10 * 60
+# The long tail only needs to beat the search refresh (soft TTL)
+COLD_REFRESH_SECONDS = amazon_service.CACHE_DURATION_SECONDS
+VIEW_DECAY_SECONDS = 3600  # View counts halve every hour so "hot" tracks recent traffic
+MIN_TRACKED_VIEWS = 0.1  # Below this (one view ~4 hours ago) an ASIN is forgotten
+TICK_SECONDS = 60  # How often the scheduler looks for due ASINs
+HISTORY_SIZE = 20
+
+
+class PriceRefresher:
+    """Tracks shown ASINs and their views, and refreshes the ones that are due."""
+
+    def __init__(self, batch_size: int = BATCH_SIZE,
+                 hot_count: int = HOT_ASINS_PER_REGION,
+                 hot_interval: float = HOT_REFRESH_SECONDS,
+                 cold_interval: float = COLD_REFRESH_SECONDS,
+                 clock=time.monotonic):
+        """
+        Args:
+            batch_size: ASINs per GetItems call (at most 10).
+            hot_count: Number of most viewed ASINs per region treated as hot.
+            hot_interval: Seconds between refreshes of a hot ASIN.
+            cold_interval: Seconds between refreshes of any other ASIN.
+            clock: Monotonic clock returning seconds.
+        """
+        self.batch_size = batch_size
+        self.hot_count = hot_count
+        self.hot_interval = hot_interval
+        self.cold_interval = cold_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._views = Counter()  # (region, asin) -> decayed view count
+        self._refreshed = {}  # (region, asin) -> clock time of last refresh
+        self._last_decay = clock()
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Tracking ---
+
+    def record_views(self, region: str, products) -> None:
+        """Counts one view of each product on a served page."""
+        now = self._clock()
+        with self._lock:
+            for record in products:
+                if record.asin:
+                    key = (region, record.asin)
+                    self._views[key] += 1
+                    # Just fetched with the page; first refresh is due one interval later
+                    self._refreshed.setdefault(key, now)
+
+    def due(self) -> dict:
+        """Returns {region: [asin, ...]} due for a refresh, hottest first."""
+        now = self._clock()
+        by_region = {}
+        with self._lock:
+            for (region, asin) in self._refreshed:
+                by_region.setdefault(region, []).append(asin)
+            due = {}
+            for region, asins in by_region.items():
+                asins.sort(key=lambda asin: -self._views[(region, asin)])
+                ready = [asin for rank, asin in enumerate(asins)
+                         if now - self._refreshed[(region, asin)] >=
+                         (self.hot_interval if rank < self.hot_count else self.cold_interval)]
+                if ready:
+                    due[region] = ready
+        return due
+
+    # --- Refreshing ---
+
+    def run_once(self) -> dict:
+        """Refreshes every due ASIN in GetItems batches. Returns a summary of the run."""
+        started = time.time()
+        self._decay_views()
+        summary = {"started_at": started, "batches": 0, "asins": 0, "skipped_asins": 0,
+                   "patched_pages": 0, "patched_rows": 0, "failed_batches": 0}
+        patch_catalogue = catalogue.serve_from_catalogue()
+
+        for region, asins in self.due().items():
+            if not patch_catalogue:
+                # Don't spend GetItems quota on offers with nothing here to patch
+                # (e.g. pages another worker fetched into a shared cache)
+                tracked = amazon_service.tracked_asins(region, asins)
+                self._mark_refreshed(region, set(asins).difference(tracked))
+                summary["skipped_asins"] += len(asins) - len(tracked)
+                asins = tracked
+            for i in range(0, len(asins), self.batch_size):
+                if self._stop.is_set():
+                    break
+                batch = asins[i:i + self.batch_size]
+                offers = amazon_service.get_item_offers(region, batch)
+                # Even a failed batch waits a full interval, so a broken
+                # region isn't retried every tick
+                self._mark_refreshed(region, batch)
+                summary["batches"] += 1
+                if offers is None:
+                    summary["failed_batches"] += 1
+                    continue
+                summary["asins"] += len(offers)
+                summary["patched_pages"] += amazon_service.patch_cached_offers(region, offers)
+                if patch_catalogue:
+                    summary["patched_rows"] += catalogue.get_catalogue().patch_offers(region, offers)
+
+        summary["duration_seconds"] = round(time.time() - started, 3)
+        self._history.append(summary)
+        if summary["batches"]:
+            logging.info(
+                "Price refresh: %s products in %s batches (%s failed), %s cached pages "
+                "and %s catalogue rows updated.",
+                summary['asins'], summary['batches'], summary['failed_batches'],
+                summary['patched_pages'], summary['patched_rows'])
+        return summary
+
+    def start(self, interval: float = TICK_SECONDS) -> None:
+        """Checks for due ASINs on a daemon thread every ``interval`` seconds until stopped."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,),
+                                        name="price-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def history(self) -> list:
+        """Returns recent run summaries, newest last."""
+        return list(self._history)
+
+    def _loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error("Price refresh run crashed: %s", e, exc_info=True)
+
+    def _mark_refreshed(self, region: str, asins) -> None:
+        now = self._clock()
+        with self._lock:
+            for asin in asins:
+                self._refreshed[(region, asin)] = now
+
+    def _decay_views(self) -> None:
+        now = self._clock()
+        with self._lock:
+            elapsed = now - self._last_decay
+            if elapsed < VIEW_DECAY_SECONDS:
+                return
+            self._last_decay = now
+            # By however long it has been, so a late run doesn't under-decay
+            factor = 0.5 ** (elapsed / VIEW_DECAY_SECONDS)
+            for key in list(self._views):
+                self._views[key] *= factor
+                if self._views[key] < MIN_TRACKED_VIEWS:
+                    # Not shown for hours: stop refreshing it
+                    del self._views[key]
+                    self._refreshed.pop(key, None)
+
+
+# Refresher used by the Flask app
+PRICES = PriceRefresher()
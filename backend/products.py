@@ -0,0 +1,241 @@
+import json
+import base64
+import hashlib
+import time
+from dataclasses import dataclass, field
+from . import compression
+from . import metrics
+
+# Compact JSON: no whitespace, UTF-8 passed through rather than \u-escaped
+_JSON_SEPARATORS = (',', ':')
+
+# Only real encodes are timed; memoized bodies cost a dict lookup
+SERIALIZATION_TIME = metrics.Histogram(
+    "response_serialization_seconds", "Time to encode a response body.", ["encoding"])
+
+
+@dataclass(slots=True, frozen=True)
+class ProductRecord:
+    """The fields of a PA API item that the site displays."""
+    asin: str | None
+    title: str | None
+    url: str | None
+    image: str | None
+    price: str | None
+    availability: str | None = None
+
+    def to_dict(self) -> dict:
+        return {'asin': self.asin, 'title': self.title, 'url': self.url,
+                'image': self.image, 'price': self.price,
+                'availability': self.availability}
+
+
+@dataclass(slots=True)
+class ProductPage:
+    """
+    A projected search result: product records plus any API errors.
+
+    Built once when results are fetched. The encoded response bodies (JSON and
+    its gzip/brotli compressions, for both the fresh and the stale variant)
+    are memoized on the page,
+    so serving a cache hit is a byte write rather than object traversal and
+    JSON encoding.
+    """
+    products: tuple[ProductRecord, ...]
+    api_errors: tuple[str, ...]
+    next_cursor: str | None = None  # Cursor for the following results, if any
+    fetched_at: float = field(default_factory=time.time, compare=False)
+    _bodies: dict = field(default_factory=dict, compare=False, repr=False)
+    _etags: dict = field(default_factory=dict, compare=False, repr=False)
+
+    def body(self, stale: bool = False, encoding: str | None = None) -> bytes:
+        """
+        Returns the ``/api/products`` response body for this page.
+
+        Args:
+            stale: Whether the page is being served past its soft TTL.
+            encoding: None for plain JSON, or a Content-Encoding supported
+                by ``compression`` ("gzip", "br").
+
+        Returns:
+            The (possibly compressed) JSON bytes, computed once per variant.
+        """
+        key = (stale, encoding)
+        data = self._bodies.get(key)
+        if data is None:
+            if encoding is None:
+                with SERIALIZATION_TIME.labels("json").time():
+                    data = self._encode_json(stale)
+            else:
+                plain = self.body(stale)
+                with SERIALIZATION_TIME.labels(encoding).time():
+                    data = compression.compress(plain, encoding)
+            self._bodies[key] = data
+        return data
+
+    def etag(self, stale: bool = False) -> str:
+        """Returns a strong validator for the JSON body of the given variant."""
+        tag = self._etags.get(stale)
+        if tag is None:
+            tag = hashlib.blake2b(self.body(stale), digest_size=12).hexdigest()
+            self._etags[stale] = tag
+        return tag
+
+    def prepare(self, stale: bool = False, encoding: str | None = None) -> 'ProductPage':
+        """Builds one body variant and its ETag ahead of serving. Returns the page for chaining."""
+        self.body(stale, encoding)
+        self.etag(stale)
+        return self
+
+    def prepared(self, stale: bool = False, encoding: str | None = None) -> bool:
+        """True if serving the variant is a plain byte write (see ``prepare``)."""
+        return (stale, encoding) in self._bodies and stale in self._etags
+
+    def encode(self) -> 'ProductPage':
+        """Eagerly builds the fresh response bodies and ETag. Returns the page for chaining."""
+        self.body()
+        for encoding in compression.available_encodings():
+            self.body(encoding=encoding)
+        self.etag()
+        return self
+
+    def to_json(self) -> bytes:
+        """Compact JSON used both as the response body and as the storage format."""
+        return self.body()
+
+    @classmethod
+    def from_json(cls, data: bytes) -> 'ProductPage':
+        """Rebuilds a page from ``to_json`` output (e.g. read from a shared cache)."""
+        raw = json.loads(data)
+        page = cls(
+            products=tuple(ProductRecord(**p) for p in raw["products"]),
+            api_errors=tuple(raw["api_errors"]),
+            next_cursor=raw.get("next_cursor"),
+            fetched_at=raw["fetched_at"],
+        )
+        # The stored bytes are exactly the fresh body; reuse them as-is
+        page._bodies[(False, None)] = bytes(data)
+        return page
+
+    def _encode_json(self, stale: bool) -> bytes:
+        return json.dumps({
+            "products": [p.to_dict() for p in self.products],
+            "api_errors": list(self.api_errors),
+            "next_cursor": self.next_cursor,
+            "fetched_at": self.fetched_at,
+            "stale": stale,
+        }, separators=_JSON_SEPARATORS, ensure_ascii=False).encode('utf-8')
+
+
+def encode_cursor(offset: int) -> str:
+    """Builds the opaque pagination cursor for a result offset."""
+    return base64.urlsafe_b64encode(f"o:{offset}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Returns the result offset encoded in a cursor from ``encode_cursor``.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        prefix, offset = raw.split(':', 1)
+        if prefix != 'o' or not offset.isdigit():
+            raise ValueError
+        return int(offset)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}") from None
+
+
+def _project_item(item) -> ProductRecord:
+    """Extracts the fields we display from a PA API item (handles missing data)."""
+    price, availability = project_offer(item)
+    return ProductRecord(
+        asin=getattr(item, 'asin', None),
+        title=getattr(item.item_info.title, 'display_value', None) if hasattr(item, 'item_info') and hasattr(item.item_info, 'title') else None,
+        url=getattr(item, 'detail_page_url', None),
+        image=getattr(item.images.primary.large, 'url', None) if hasattr(item, 'images') and hasattr(item.images, 'primary') and hasattr(item.images.primary, 'large') else None,
+        price=price,
+        availability=availability,
+        # Add more fields as needed (e.g., features)
+    )
+
+
+def project_offer(item) -> tuple:
+    """
+    Extracts the volatile offer fields of a PA API item.
+
+    Returns:
+        (price, availability): the first listing's display price and
+        availability message, each None if missing.
+    """
+    listings = getattr(getattr(item, 'offers', None), 'listings', None)
+    if not listings:
+        return None, None
+    listing = listings[0]
+    price = getattr(getattr(listing, 'price', None), 'display_amount', None)
+    availability = getattr(getattr(listing, 'availability', None), 'message', None)
+    return price, availability
+
+
+def project_features(item) -> tuple:
+    """
+    Extracts a PA API item's feature bullet points.
+
+    Not served to the site, but made searchable by the local search index.
+    """
+    features = getattr(getattr(getattr(item, 'item_info', None), 'features', None),
+                       'display_values', None)
+    return tuple(features) if features else ()
+
+
+def project_categories(item) -> tuple:
+    """
+    Extracts the browse nodes (Amazon categories) a PA API item is listed in.
+
+    Each node is followed by its ancestors, so a product also counts towards
+    the broader categories above it.
+
+    Returns:
+        ((node_id, name, parent_id), ...) without duplicates; parent_id is
+        None for the top of each chain.
+    """
+    nodes = getattr(getattr(item, 'browse_node_info', None), 'browse_nodes', None) or ()
+    categories = {}
+    for node in nodes:
+        while node is not None and getattr(node, 'id', None):
+            parent = getattr(node, 'ancestor', None)
+            parent_id = getattr(parent, 'id', None) or None
+            name = getattr(node, 'display_name', None) or getattr(node, 'context_free_name', None)
+            categories.setdefault(str(node.id), (str(node.id), name,
+                                                 str(parent_id) if parent_id else None))
+            node = parent
+    return tuple(categories.values())
+
+
+def project_search_result(search_result) -> ProductPage:
+    """
+    Projects a PA API search result into a compact ProductPage.
+
+    Only the fields the site displays are kept, so the result is small enough
+    to cache compactly and can be stored outside the process.
+
+    Args:
+        search_result: The SDK search result object.
+
+    Returns:
+        A ProductPage with the product records and any API error strings.
+    """
+    products = ()
+    api_errors = ()
+
+    if hasattr(search_result, 'errors') and search_result.errors:
+        # Convert errors to strings
+        api_errors = tuple(str(e) for e in search_result.errors)
+
+    if hasattr(search_result, 'items') and search_result.items:
+        products = tuple(_project_item(item) for item in search_result.items)
+
+    return ProductPage(products=products, api_errors=api_errors)
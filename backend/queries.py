@@ -0,0 +1,66 @@
+"""
+Canonical forms of search queries, so equivalent queries share cache entries.
+
+"Bluey Toys", "bluey toys " and "Bluey  toys!" are the same PA API search.
+``canonical_keywords`` folds case, Unicode compatibility forms, punctuation
+and whitespace; the canonical form is what is sent upstream. Cache keys are
+built from it by ``search_key``, which can additionally fold plurals
+("toys" -> "toy") when QUERY_STEMMING=1. That trades exact upstream results
+for more sharing, so it is off by default.
+
+Item counts need no bucketing here: results are fetched and cached per PA
+API page and any count is sliced from those pages (see
+``amazon_service.lookup_bluey_products``).
+"""
+import os
+import re
+import unicodedata
+from urllib.parse import quote
+
+ENV_QUERY_STEMMING = "QUERY_STEMMING"  # "1" folds plurals in cache keys
+KEY_VERSION = "v2"  # Bump when the canonical form changes so old entries aren't reused
+
+# Word characters plus in-word apostrophes and hyphens ("bluey's", "t-shirt")
+_WORD_RE = re.compile(r"[^\W_]+(?:['’-][^\W_]+)*")
+
+
+def fold_plural(term: str) -> str:
+    """Strips a simple plural "s" ("toys" -> "toy", but "glass" stays)."""
+    if len(term) > 3 and term.endswith('s') and not term.endswith('ss'):
+        return term[:-1]
+    return term
+
+
+def canonical_keywords(keywords: str) -> str:
+    """
+    Returns the canonical form of search keywords.
+
+    Applies NFKC normalisation and case folding, drops punctuation other than
+    in-word apostrophes and hyphens (curly apostrophes become straight), and
+    joins the words with single spaces. Idempotent.
+    """
+    text = unicodedata.normalize("NFKC", keywords or "").casefold()
+    return " ".join(word.replace('’', "'") for word in _WORD_RE.findall(text))
+
+
+def stemming_enabled() -> bool:
+    return os.getenv(ENV_QUERY_STEMMING, "0") == "1"
+
+
+def search_key(region: str, keywords: str, page: int) -> str:
+    """
+    Builds the cache key of one page of a keyword search.
+
+    Each part is percent-encoded before joining with ":", so no keywords
+    can produce another search's key (whatever characters they contain).
+
+    Args:
+        region: The region code.
+        keywords: Search keywords, canonicalised here if they aren't already.
+        page: The 1-based PA API item page.
+    """
+    keywords = canonical_keywords(keywords)
+    if stemming_enabled():
+        keywords = " ".join(fold_plural(word) for word in keywords.split(" "))
+    return ":".join(["search", KEY_VERSION] +
+                    [quote(part, safe="") for part in (region, keywords, str(page))])
@@ -0,0 +1,256 @@
+import heapq
+import itertools
+import threading
+import time
+
+# --- Priorities (lower runs first) ---
+INTERACTIVE = 0  # A visitor is waiting on the result
+BACKGROUND = 1  # Stale-while-revalidate refreshes and warmup
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class TokenBucket:
+    """
+    Classic token bucket: ``rate`` tokens per second, holding at most ``capacity``.
+
+    Not thread-safe on its own; ``UpstreamLimiter`` serialises access.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        """
+        Args:
+            rate: Tokens added per second (the sustained requests/second).
+            capacity: Maximum tokens held (the burst size).
+            clock: Monotonic clock returning seconds.
+        """
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate must be positive and capacity at least 1")
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def try_acquire(self) -> bool:
+        """Takes one token if available. Returns True on success."""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def time_until_available(self) -> float:
+        """Seconds until a token can be taken (0 if one is available now)."""
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def drain(self) -> None:
+        """Empties the bucket, e.g. after the upstream reported throttling."""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class _Ticket:
+    """A caller queued for a token."""
+
+    __slots__ = ('priority', 'seq', 'tag', 'enqueued_at')
+
+    def __init__(self, priority: int, seq: int, tag, enqueued_at: float):
+        self.priority = priority
+        self.seq = seq
+        self.tag = tag
+        self.enqueued_at = enqueued_at
+
+    def __lt__(self, other) -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Lane:
+    """One token bucket plus the queue of callers waiting on it."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.queue = []  # heap of _Ticket
+        self.granted = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.rejected = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.wait_total = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        self.wait_max = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        self.max_depth = 0
+
+
+class UpstreamLimiter:
+    """
+    Token-bucket rate limiting with a priority queue per upstream key.
+
+    Each key (e.g. a region + credential pair) gets its own bucket. Callers
+    queue for tokens in priority order, FIFO within a priority, so an
+    interactive cache miss always goes ahead of queued background refreshes.
+    Waits are bounded: a caller that cannot get a token within its timeout
+    gives up, letting the service fall back to stale data instead of piling
+    up requests that would be throttled anyway.
+    """
+
+    def __init__(self, rate: float = 1.0, capacity: float = 1.0,
+                 overrides: dict | None = None, clock=time.monotonic):
+        """
+        Args:
+            rate: Default tokens per second for each key.
+            capacity: Default burst size for each key.
+            overrides: Optional {key_prefix: (rate, capacity)} applied to keys
+                whose first element (e.g. the region) matches.
+            clock: Monotonic clock returning seconds.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.overrides = overrides if overrides is not None else {}
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._lanes = {}
+        self._seq = itertools.count()
+
+    def acquire(self, key, priority: int = INTERACTIVE,
+                timeout: float | None = None, tag=None) -> bool:
+        """
+        Blocks until a token for ``key`` is granted or ``timeout`` elapses.
+
+        Args:
+            key: The upstream being called; each key has its own bucket.
+            priority: ``INTERACTIVE`` or ``BACKGROUND``.
+            timeout: Maximum seconds to wait, or None to wait indefinitely.
+            tag: Optional label (e.g. a cache key) so ``promote`` can find the ticket.
+
+        Returns:
+            True if a token was taken, False if the wait timed out.
+        """
+        with self._cond:
+            lane = self._lane(key)
+            now = self._clock()
+            deadline = None if timeout is None else now + timeout
+            ticket = _Ticket(priority, next(self._seq), tag, now)
+            heapq.heappush(lane.queue, ticket)
+            lane.max_depth = max(lane.max_depth, len(lane.queue))
+
+            while True:
+                if lane.queue[0] is ticket and lane.bucket.try_acquire():
+                    heapq.heappop(lane.queue)
+                    self._record_grant(lane, ticket)
+                    # The next caller in line may be able to go too (burst)
+                    self._cond.notify_all()
+                    return True
+
+                now = self._clock()
+                if deadline is not None and now >= deadline:
+                    lane.queue.remove(ticket)
+                    heapq.heapify(lane.queue)
+                    lane.rejected[ticket.priority] += 1
+                    self._cond.notify_all()
+                    return False
+
+                wait = lane.bucket.time_until_available() if lane.queue[0] is ticket else None
+                if deadline is not None:
+                    remaining = deadline - now
+                    wait = remaining if wait is None else min(wait, remaining)
+                # Guard against a zero wait spinning before the clock moves
+                self._cond.wait(None if wait is None else max(wait, 0.001))
+
+    def promote(self, tag, priority: int = INTERACTIVE) -> int:
+        """
+        Raises queued tickets carrying ``tag`` to ``priority``.
+
+        Used when an interactive request joins a background fetch that is
+        still waiting for a token. Returns the number of tickets promoted.
+        """
+        promoted = 0
+        with self._cond:
+            for lane in self._lanes.values():
+                changed = False
+                for ticket in lane.queue:
+                    if ticket.tag == tag and ticket.priority > priority:
+                        ticket.priority = priority
+                        changed = True
+                        promoted += 1
+                if changed:
+                    heapq.heapify(lane.queue)
+            if promoted:
+                self._cond.notify_all()
+        return promoted
+
+    def penalize(self, key) -> None:
+        """Empties ``key``'s bucket after the upstream reported throttling."""
+        with self._cond:
+            self._lane(key).bucket.drain()
+
+    def queue_depth(self, key) -> int:
+        """Number of callers currently waiting for a token for ``key``."""
+        with self._cond:
+            lane = self._lanes.get(key)
+            return len(lane.queue) if lane is not None else 0
+
+    def reset(self) -> None:
+        """Forgets every bucket and its metrics."""
+        with self._cond:
+            self._lanes.clear()
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """Returns queue depth, grant/reject counts and wait times per key."""
+        with self._cond:
+            return {self._label(key): self._lane_stats(lane)
+                    for key, lane in self._lanes.items()}
+
+    # --- Internal helpers (caller must hold the lock) ---
+
+    def _lane(self, key) -> _Lane:
+        lane = self._lanes.get(key)
+        if lane is None:
+            prefix = key[0] if isinstance(key, tuple) else key
+            rate, capacity = self.overrides.get(prefix, (self.rate, self.capacity))
+            lane = _Lane(TokenBucket(rate, capacity, self._clock))
+            self._lanes[key] = lane
+        return lane
+
+    def _record_grant(self, lane: _Lane, ticket: _Ticket) -> None:
+        waited = self._clock() - ticket.enqueued_at
+        lane.granted[ticket.priority] += 1
+        lane.wait_total[ticket.priority] += waited
+        lane.wait_max[ticket.priority] = max(lane.wait_max[ticket.priority], waited)
+
+    @staticmethod
+    def _label(key) -> str:
+        return "/".join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+
+    @staticmethod
+    def _lane_stats(lane: _Lane) -> dict:
+        depth = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+        for ticket in lane.queue:
+            depth[PRIORITY_NAMES[ticket.priority]] += 1
+        by_priority = {}
+        for priority, name in PRIORITY_NAMES.items():
+            granted = lane.granted[priority]
+            by_priority[name] = {
+                "queued": depth[name],
+                "granted": granted,
+                "rejected": lane.rejected[priority],
+                "avg_wait_seconds": lane.wait_total[priority] / granted if granted else 0.0,
+                "max_wait_seconds": lane.wait_max[priority],
+            }
+        return {
+            "rate": lane.bucket.rate,
+            "capacity": lane.bucket.capacity,
+            "tokens": lane.bucket.tokens,
+            "queue_depth": len(lane.queue),
+            "max_queue_depth": lane.max_depth,
+            "priorities": by_priority,
+        }
@@ -0,0 +1,396 @@
+"""
+In-process full-text index over the products we have already fetched.
+
+Every distinct free-text query ("Bluey campervan") used to be its own PA API
+search and cache key. The products behind them overlap heavily, so this
+module keeps an inverted index of the titles and features of every product
+fetched per region and answers queries from it, ranked with BM25. Query
+terms also match as prefixes ("camper" finds "campervan") and, failing
+that, within one edit ("campervon"). ``amazon_service.search_products``
+decides when the index has enough matches to answer instead of upstream.
+"""
+import math
+import re
+import time
+import heapq
+import bisect
+import threading
+from operator import itemgetter
+from typing import NamedTuple
+from .queries import fold_plural
+
+# --- Configuration ---
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 2  # A title term counts as this many feature terms
+PREFIX_WEIGHT = 0.7  # Score multiplier for a prefix match ("camper" -> "campervan")
+FUZZY_WEIGHT = 0.5  # Score multiplier for a match within one edit
+MIN_PREFIX_LENGTH = 3
+MIN_FUZZY_LENGTH = 4
+MAX_EXPANSIONS = 32  # Vocabulary terms a single query term may expand to
+DEFAULT_MAX_AGE_SECONDS = 5 * 3600  # Products not re-fetched for this long are dropped
+PRUNE_INTERVAL_SECONDS = 300
+
+# Too common to narrow a search; dropped from documents and queries
+STOPWORDS = frozenset({"a", "an", "and", "by", "for", "from", "in", "of",
+                       "on", "or", "the", "to", "with"})
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str | None) -> list:
+    """
+    Splits text into normalised index terms.
+
+    Lowercases, drops stopwords and folds simple plurals ("toys" -> "toy")
+    so documents and queries meet on the same terms.
+    """
+    if not text:
+        return []
+    terms = []
+    for token in _TOKEN_RE.findall(text.casefold()):
+        if token in STOPWORDS:
+            continue
+        terms.append(fold_plural(token))
+    return terms
+
+
+def _deletes(term: str) -> set:
+    """Every string one deletion away from ``term``."""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Whether ``b`` is one insertion, deletion or substitution away from ``a``."""
+    if abs(len(a) - len(b)) > 1 or a == b:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return a[i + 1:] == b[i + 1:] if len(a) == len(b) else a[i:] == b[i + 1:]
+    return True
+
+
+class SearchHits(NamedTuple):
+    """Result of ``SearchIndex.search``."""
+    total: int  # Number of matching products
+    records: list  # The best ``limit`` matches, best first
+    indexed_at: tuple  # (oldest, newest) indexing time of ``records``; (0, 0) if none
+
+
+class _Doc:
+    """One indexed product."""
+
+    __slots__ = ('record', 'terms', 'length', 'indexed_at')
+
+    def __init__(self, record, terms: dict, indexed_at: float):
+        self.record = record
+        self.terms = terms  # term -> weighted frequency
+        self.length = sum(terms.values())
+        self.indexed_at = indexed_at
+
+
+class _RegionIndex:
+    """Postings and vocabulary for one region (caller holds the lock)."""
+
+    def __init__(self):
+        self.docs = {}  # asin -> _Doc
+        self.lengths = {}  # asin -> document length, kept flat for scoring
+        self.postings = {}  # term -> {asin: weighted frequency}
+        self.total_length = 0
+        self.generation = 0  # Bumped on every change; keys memoized results
+        self._vocab = []  # Sorted terms, rebuilt lazily for prefix lookups
+        self._vocab_dirty = False
+        self._deletes = {}  # one-deletion variant -> {term}, for fuzzy lookups
+
+    def put(self, asin: str, doc: _Doc) -> None:
+        old = self.docs.get(asin)
+        if old is not None:
+            if old.terms == doc.terms:
+                # Same text (e.g. a refreshed price): swap the record only
+                self.docs[asin] = doc
+                self.generation += 1
+                return
+            self.remove(asin)
+        self.docs[asin] = doc
+        self.lengths[asin] = doc.length
+        self.total_length += doc.length
+        for term, frequency in doc.terms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                self._vocab_dirty = True
+                if len(term) >= MIN_FUZZY_LENGTH - 1:
+                    for variant in _deletes(term) | {term}:
+                        self._deletes.setdefault(variant, set()).add(term)
+            posting[asin] = frequency
+        self.generation += 1
+
+    def remove(self, asin: str) -> None:
+        doc = self.docs.pop(asin)
+        del self.lengths[asin]
+        self.total_length -= doc.length
+        for term in doc.terms:
+            posting = self.postings[term]
+            del posting[asin]
+            if not posting:
+                del self.postings[term]
+                self._vocab_dirty = True
+                if len(term) >= MIN_FUZZY_LENGTH - 1:
+                    for variant in _deletes(term) | {term}:
+                        terms = self._deletes[variant]
+                        terms.discard(term)
+                        if not terms:
+                            del self._deletes[variant]
+        self.generation += 1
+
+    def expand(self, term: str) -> list:
+        """Returns [(vocabulary term, weight)] a query term matches."""
+        matches = []
+        if term in self.postings:
+            matches.append((term, 1.0))
+        if len(term) >= MIN_PREFIX_LENGTH:
+            if self._vocab_dirty:
+                self._vocab = sorted(self.postings)
+                self._vocab_dirty = False
+            start = bisect.bisect_right(self._vocab, term)
+            for candidate in self._vocab[start:start + MAX_EXPANSIONS]:
+                if not candidate.startswith(term):
+                    break
+                matches.append((candidate, PREFIX_WEIGHT))
+        if not matches and len(term) >= MIN_FUZZY_LENGTH:
+            # Deletion neighbourhoods meet for any single insert, delete or substitution
+            candidates = set(self._deletes.get(term, ()))
+            for variant in _deletes(term):
+                candidates.update(self._deletes.get(variant, ()))
+                if variant in self.postings:
+                    candidates.add(variant)
+            # Sharing a deletion can also mean two edits; keep true neighbours only
+            matches.extend((candidate, FUZZY_WEIGHT)
+                           for candidate in sorted(candidates)
+                           if _within_one_edit(term, candidate))
+            del matches[MAX_EXPANSIONS:]
+        return matches
+
+
+class SearchIndex:
+    """
+    Thread-safe BM25 index of ProductRecords, partitioned by region.
+
+    Products are (re-)indexed whenever a search page is fetched and expire
+    when they have not been seen for ``max_age`` seconds, so the index
+    follows what the PA API currently returns.
+    """
+
+    def __init__(self, max_age: float = DEFAULT_MAX_AGE_SECONDS,
+                 k1: float = BM25_K1, b: float = BM25_B, clock=time.time):
+        """
+        Args:
+            max_age: Seconds after its last indexing that a product is dropped.
+            k1: BM25 term frequency saturation.
+            b: BM25 document length normalisation.
+            clock: Wall clock returning seconds.
+        """
+        self.max_age = max_age
+        self.k1 = k1
+        self.b = b
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._regions = {}
+        self._last_prune = clock()
+
+    def add(self, region: str, records, features: dict | None = None) -> None:
+        """
+        Indexes (or re-indexes) products fetched for ``region``.
+
+        Args:
+            region: The region code.
+            records: ProductRecords; those without an ASIN are skipped.
+            features: Optional {asin: [feature text, ...]} also made searchable.
+        """
+        now = self._clock()
+        features = features or {}
+        with self._lock:
+            index = self._regions.setdefault(region, _RegionIndex())
+            for record in records:
+                if not record.asin:
+                    continue
+                terms = {}
+                for term in tokenize(record.title):
+                    terms[term] = terms.get(term, 0) + TITLE_WEIGHT
+                for text in features.get(record.asin) or ():
+                    for term in tokenize(text):
+                        terms[term] = terms.get(term, 0) + 1
+                if terms:
+                    index.put(record.asin, _Doc(record, terms, now))
+            if now - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+                self._prune(now)
+
+    def update_records(self, region: str, records: dict) -> int:
+        """
+        Swaps in updated records (e.g. refreshed prices) for indexed products.
+
+        Args:
+            region: The region code.
+            records: {asin: ProductRecord} with unchanged titles.
+
+        Returns:
+            The number of indexed products updated.
+        """
+        updated = 0
+        with self._lock:
+            index = self._regions.get(region)
+            if index is None:
+                return 0
+            for asin, record in records.items():
+                doc = index.docs.get(asin)
+                if doc is not None and doc.record != record:
+                    doc.record = record
+                    updated += 1
+            if updated:
+                index.generation += 1
+        return updated
+
+    def get(self, region: str, asin: str):
+        """Returns the indexed ProductRecord for ``asin``, or None."""
+        with self._lock:
+            doc = self._regions.get(region, _RegionIndex()).docs.get(asin)
+            return doc.record if doc is not None else None
+
+    def search(self, region: str, query: str, limit: int = 10,
+               within: frozenset | None = None) -> SearchHits:
+        """
+        Ranks the products matching every term of ``query`` with BM25.
+
+        Each query term matches exact terms and, at reduced weight, terms it
+        is a prefix of; a term with neither falls back to terms within one
+        edit. Products past ``max_age`` are pruned (every
+        ``PRUNE_INTERVAL_SECONDS``) rather than filtered per query.
+
+        Args:
+            region: The region code.
+            query: Free-text query. May be empty when ``within`` is given, to
+                list those products by title.
+            limit: Maximum number of records returned.
+            within: Optional ASINs (e.g. a category's) to restrict matches to.
+
+        Returns:
+            SearchHits with the total match count and the top ``limit`` records.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            now = self._clock()
+            if now - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+                self._prune(now)
+            index = self._regions.get(region)
+            if index is None or not index.docs or not (terms or within):
+                return SearchHits(0, [], (0.0, 0.0))
+            if not terms:
+                docs = [index.docs[asin] for asin in within if asin in index.docs]
+                best = heapq.nsmallest(limit, docs, key=lambda doc: (
+                    doc.record.title or "", doc.record.asin))
+                return self._hits(len(docs), best)
+            expanded = [index.expand(term) for term in terms]
+            if not all(expanded):
+                return SearchHits(0, [], (0.0, 0.0))
+
+            # Intersect starting from the rarest term so common terms only filter
+            postings = [[(index.postings[t], weight) for t, weight in matches]
+                        for matches in expanded]
+            postings.sort(key=lambda lists: sum(len(p) for p, _ in lists))
+            matching = [lists[0][0].keys() if len(lists) == 1
+                        else set().union(*(posting.keys() for posting, _ in lists))
+                        for lists in postings]
+            if within is not None:
+                matching.append(within)
+            if len(matching) == 1:
+                # Single-posting queries score straight off the posting dict
+                candidates = postings[0][0][0] if len(postings[0]) == 1 else matching[0]
+            else:
+                candidates = matching[0] & matching[1]
+                for keys in matching[2:]:
+                    candidates &= keys
+            if not candidates:
+                return SearchHits(0, [], (0.0, 0.0))
+
+            scores = self._score(index, candidates, postings)
+            best = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+            return self._hits(len(scores), [index.docs[asin] for asin, _ in best])
+
+    def generation(self, region: str) -> int:
+        """A counter that changes whenever ``region``'s index changes."""
+        with self._lock:
+            index = self._regions.get(region)
+            return index.generation if index is not None else 0
+
+    def size(self, region: str | None = None) -> int:
+        """Number of indexed products in ``region``, or in all regions."""
+        with self._lock:
+            if region is not None:
+                index = self._regions.get(region)
+                return len(index.docs) if index is not None else 0
+            return sum(len(index.docs) for index in self._regions.values())
+
+    def stats(self) -> dict:
+        """Returns product and vocabulary counts per region."""
+        with self._lock:
+            return {region: {"products": len(index.docs), "terms": len(index.postings)}
+                    for region, index in self._regions.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._regions.clear()
+
+    # --- Internal helpers (caller must hold the lock) ---
+
+    @staticmethod
+    def _hits(total: int, docs: list) -> SearchHits:
+        indexed = [doc.indexed_at for doc in docs]
+        return SearchHits(total, [doc.record for doc in docs],
+                          (min(indexed), max(indexed)) if indexed else (0.0, 0.0))
+
+    def _score(self, index: _RegionIndex, candidates, postings) -> dict:
+        """Returns {asin: BM25 score} for every candidate."""
+        n = len(index.docs)
+        k1 = self.k1
+        # BM25's length normalisation is k1 * (1 - b + b * length / avg_length)
+        scale = k1 * self.b * n / index.total_length
+        base = k1 * (1 - self.b)
+        lengths = index.lengths
+        scores = None
+
+        for lists in postings:
+            term_scores = None
+            for posting, weight in lists:
+                df = len(posting)
+                factor = weight * math.log(1 + (n - df + 0.5) / (df + 0.5)) * (k1 + 1)
+                if posting is candidates:
+                    pairs = posting.items()
+                elif df <= len(candidates):
+                    pairs = [(asin, frequency) for asin, frequency in posting.items()
+                             if asin in candidates]
+                else:
+                    pairs = [(asin, posting[asin]) for asin in candidates if asin in posting]
+                expansion = {asin: factor * frequency / (frequency + base + scale * lengths[asin])
+                             for asin, frequency in pairs}
+                if term_scores is None:
+                    term_scores = expansion
+                else:
+                    # A query term scores through its best matching expansion
+                    for asin, term_score in expansion.items():
+                        if term_score > term_scores.get(asin, 0.0):
+                            term_scores[asin] = term_score
+            if scores is None:
+                scores = term_scores
+            else:
+                for asin, term_score in term_scores.items():
+                    scores[asin] += term_score
+        return scores
+
+    def _prune(self, now: float) -> None:
+        self._last_prune = now
+        cutoff = now - self.max_age
+        for index in self._regions.values():
+            for asin in [asin for asin, doc in index.docs.items() if doc.indexed_at < cutoff]:
+                index.remove(asin)
@@ -0,0 +1,119 @@
+"""
+Production entry point: serves the API with worker processes.
+
+Two modes:
+  asgi  uvicorn workers running asgi.py; /api/products waits on the PA API
+        without holding a thread, so concurrency is bounded by
+        SERVER_MAX_CONCURRENCY rather than by thread count (default)
+  wsgi  gunicorn workers, each with SERVER_THREADS threads running the
+        Flask app; each request holds a thread until it is answered
+
+Both servers are optional dependencies: pip install uvicorn (asgi) or
+gunicorn (wsgi). Each worker is a separate process with its own in-memory
+cache and background warmup, so with several workers consider a shared
+CACHE_BACKEND (see cache_backends.py).
+
+Each worker also rate limits its own PA API calls, including its warmup and
+price refreshes. To keep the total within the account's
+PAAPI_REQUESTS_PER_SECOND, every worker gets an equal share: PAAPI_PROCESSES
+is set to the worker count unless it is already set (e.g. to the total
+across several hosts sharing the credentials).
+
+Settings come from the environment and can be overridden on the command line:
+    python -m backend.serve --mode asgi --workers 4 --port 5001
+"""
+import os
+import argparse
+
+ENV_SERVER_MODE = "SERVER_MODE"
+ENV_HOST = "HOST"
+ENV_PORT = "PORT"
+ENV_WORKERS = "WEB_CONCURRENCY"  # The name most platforms set
+ENV_THREADS = "SERVER_THREADS"
+ENV_MAX_CONCURRENCY = "SERVER_MAX_CONCURRENCY"
+
+DEFAULT_MODE = "asgi"
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 5001
+DEFAULT_WORKERS = 2
+DEFAULT_THREADS = 16  # WSGI only: concurrent requests per worker
+DEFAULT_MAX_CONCURRENCY = 1000  # ASGI only: open requests per worker before 503s
+GRACEFUL_TIMEOUT_SECONDS = 30
+
+
+def _start_worker() -> None:
+    """Per worker process: settings, logging, API clients and background refreshers."""
+    from .app import init_app
+    init_app()
+
+
+def create_asgi_app():
+    """Application factory for uvicorn; called in each worker process."""
+    from .asgi import application
+    return application
+
+
+def serve_asgi(host: str, port: int, workers: int, max_concurrency: int) -> None:
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise RuntimeError(
+            "ASGI mode requires the 'uvicorn' package (pip install uvicorn).") from e
+    uvicorn.run(f"{__name__}:create_asgi_app", factory=True, host=host, port=port,
+                workers=workers, limit_concurrency=max_concurrency, lifespan="on",
+                timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS,
+                log_config=None)  # Keep our logging setup
+
+
+def serve_wsgi(host: str, port: int, workers: int, threads: int) -> None:
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError as e:
+        raise RuntimeError(
+            "WSGI mode requires the 'gunicorn' package (pip install gunicorn).") from e
+
+    class _Gunicorn(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": "gthread",
+                "threads": threads,
+                "graceful_timeout": GRACEFUL_TIMEOUT_SECONDS,
+                "post_worker_init": lambda worker: _start_worker(),
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from .app import app
+            return app
+
+    _Gunicorn().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=["asgi", "wsgi"],
+                        default=os.getenv(ENV_SERVER_MODE, DEFAULT_MODE))
+    parser.add_argument('--host', default=os.getenv(ENV_HOST, DEFAULT_HOST))
+    parser.add_argument('--port', type=int, default=int(os.getenv(ENV_PORT, DEFAULT_PORT)))
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv(ENV_WORKERS, DEFAULT_WORKERS)))
+    parser.add_argument('--threads', type=int, default=int(os.getenv(ENV_THREADS, DEFAULT_THREADS)),
+                        help="WSGI: threads per worker.")
+    parser.add_argument('--max-concurrency', type=int,
+                        default=int(os.getenv(ENV_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY)),
+                        help="ASGI: concurrent requests per worker before answering 503.")
+    args = parser.parse_args()
+
+    # Inherited by the workers (see amazon_service.configure)
+    from .amazon_service import ENV_PAAPI_PROCESSES
+    os.environ.setdefault(ENV_PAAPI_PROCESSES, str(args.workers))
+    if args.mode == "asgi":
+        serve_asgi(args.host, args.port, args.workers, args.max_concurrency)
+    else:
+        serve_wsgi(args.host, args.port, args.workers, args.threads)
+
+
+if __name__ == '__main__':
+    main()
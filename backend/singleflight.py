@@ -0,0 +1,144 @@
+import threading
+
+
+class _Call:
+    """An in-flight call whose outcome is shared by every caller of the same key."""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into a single execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    still running block until it finishes and receive the same return value,
+    or have the same exception re-raised. Once the call completes the key is
+    forgotten, so later callers start a fresh execution.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Runs ``fn(*args, **kwargs)`` unless a call for ``key`` is already in flight.
+
+        Args:
+            key: Identifies calls that may share a result.
+            fn: The function to execute.
+
+        Returns:
+            The result of the (possibly shared) call.
+
+        Raises:
+            Whatever exception the shared call raised.
+        """
+        return self.do_within(None, key, fn, *args, **kwargs)
+
+    def do_within(self, timeout, key, fn, *args, **kwargs):
+        """
+        ``do``, but a caller joining an in-flight call waits at most ``timeout`` seconds.
+
+        The caller that runs ``fn`` is not limited. A timeout of None waits
+        as long as the call takes.
+
+        Raises:
+            TimeoutError: The joined call was still running after ``timeout``
+                seconds (it keeps running for the other callers).
+            Whatever exception the shared call raised.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    call.waiters -= 1
+                raise TimeoutError(f"Call for {key!r} still running after {timeout}s")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self, key) -> bool:
+        """True if a call for ``key`` is currently executing."""
+        with self._lock:
+            return key in self._calls
+
+    def __len__(self) -> int:
+        """Number of calls currently executing."""
+        with self._lock:
+            return len(self._calls)
+
+    def waiters(self, key) -> int:
+        """Number of callers currently waiting on the in-flight call for ``key``."""
+        with self._lock:
+            call = self._calls.get(key)
+            return call.waiters if call is not None else 0
+
+
+class AsyncSingleFlight:
+    """
+    ``SingleFlight`` for coroutines: concurrent awaits for the same key share one task.
+
+    Callers waiting on a shared call are suspended coroutines rather than
+    blocked threads. Calls are tracked per event loop, so one instance can
+    serve several loops (e.g. one per worker thread or test).
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, fn, *args):
+        """
+        Awaits ``fn(*args)`` unless a call for ``key`` is already in flight.
+
+        Args:
+            key: Identifies calls that may share a result.
+            fn: Returns an awaitable, e.g. a coroutine function or
+                ``loop.run_in_executor``.
+
+        Returns:
+            The result of the (possibly shared) call. Cancelling one caller
+            does not cancel the call for the others.
+
+        Raises:
+            Whatever exception the shared call raised.
+        """
+        import asyncio  # Only async servers need it; see amazon_service
+        flight_key = (asyncio.get_running_loop(), key)
+        task = self._tasks.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._tasks[flight_key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(flight_key, None))
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        """Number of calls currently executing."""
+        return len(self._tasks)
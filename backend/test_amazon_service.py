@@ -1,22 +1,42 @@
 import pytest
 import os
 import time
+import threading
 import logging  # Import logging for caplog
 from unittest.mock import patch  # Use unittest.mock for patching os.getenv
 from types import SimpleNamespace  # To create mock objects easily
 # Import Country from the models sub-package
 from amazon_paapi import AmazonApi
 from amazon_paapi.models import Country
+from amazon_paapi.errors import ItemsNotFound
 # Import the module we are testing (changed to relative import)
 from . import amazon_service
+from .products import ProductPage, ProductRecord, project_search_result, encode_cursor, decode_cursor
+from .ratelimit import UpstreamLimiter
 
 # --- Fixtures (Optional, but good practice) ---
 
 
+def _make_page(asin):
+    """Build a projected page holding a single product, as stored in the cache."""
+    return ProductPage((ProductRecord(asin, None, None, None, None),), ())
+
+
 @pytest.fixture(autouse=True)
 def clear_cache():
-    """Ensure the cache is clear before each test."""
+    """Ensure the cache, client registry, rate limiter, failure state and search index are clear before each test."""
     amazon_service.CACHE.clear()
+    amazon_service.CLIENTS.reload()
+    amazon_service.UPSTREAM.reset()
+    amazon_service.VIEWS.clear()
+    amazon_service.RESULT_ENDS.clear()
+    amazon_service._ASIN_PAGES.clear()
+    amazon_service._PAGE_ASINS.clear()
+    amazon_service._asin_pages_swept = 0.0
+    amazon_service.SEARCH_INDEX.clear()
+    amazon_service.FACETS.clear()
+    amazon_service.FAILURES.clear()
+    amazon_service.BREAKER.reset()
 
 # --- Tests for get_amazon_client ---
 
@@ -98,8 +118,8 @@ def test_get_amazon_client_invalid_region(caplog):
     amazon_service.ENV_SECRET_KEY: "test_secret_key",
     amazon_service.REGION_CONFIG["US"]["tag_env"]: "test_us_tag-20"
 })
-# Patch the name within the module under test
-@patch('backend.amazon_service.AmazonApi')
+# The SDK is imported when a client is built, so patch it at the source
+@patch('amazon_paapi.AmazonApi')
 def test_get_amazon_client_init_exception(mock_amazon_api, caplog):
     """Test handling of exceptions during AmazonApi instantiation."""
     mock_amazon_api.side_effect = Exception("Initialization failed")
@@ -108,6 +128,73 @@ def test_get_amazon_client_init_exception(mock_amazon_api, caplog):
         assert client is None
         assert "Error initializing Amazon API client for region US: Initialization failed" in caplog.text
 
+# --- Tests for configure ---
+
+
+@pytest.fixture
+def restore_settings(monkeypatch):
+    """configure() replaces module-level settings; put the originals back afterwards."""
+    for name in ("CACHE", "_CACHE_SETTINGS", "UPSTREAM",
+                 "PAAPI_REQUESTS_PER_SECOND", "PAAPI_BURST", "PAAPI_PROCESSES"):
+        monkeypatch.setattr(amazon_service, name, getattr(amazon_service, name))
+    for name in (amazon_service.ENV_PAAPI_REQUESTS_PER_SECOND, amazon_service.ENV_PAAPI_BURST,
+                 amazon_service.ENV_PAAPI_PROCESSES,
+                 amazon_service.ENV_CACHE_BACKEND, amazon_service.ENV_CACHE_SQLITE_PATH):
+        # Recorded either way, so variables loaded from a .env file are removed too
+        monkeypatch.setenv(name, "")
+        monkeypatch.delenv(name)
+
+
+def test_configure_applies_env_file(tmp_path, restore_settings, monkeypatch):
+    env_file = tmp_path / ".env"
+    env_file.write_text(f"{amazon_service.ENV_PAAPI_REQUESTS_PER_SECOND}=3\n"
+                        f"{amazon_service.ENV_PAAPI_BURST}=5\n"
+                        f"{amazon_service.ENV_CACHE_BACKEND}=sqlite\n"
+                        f"{amazon_service.ENV_CACHE_SQLITE_PATH}={tmp_path / 'cache.db'}\n")
+    monkeypatch.setenv(amazon_service.ENV_PAAPI_BURST, "2")  # The environment wins
+
+    amazon_service.configure(str(env_file))
+
+    assert amazon_service.PAAPI_REQUESTS_PER_SECOND == 3.0
+    assert amazon_service.PAAPI_BURST == 2.0
+    assert (amazon_service.UPSTREAM.rate, amazon_service.UPSTREAM.capacity) == (3.0, 2.0)
+    assert amazon_service.CACHE.stats()["backend"] == "sqlite"
+
+
+def test_configure_splits_rate_limit_between_processes(tmp_path, restore_settings, monkeypatch):
+    """Test each process gets its share of the account's PA API quota."""
+    monkeypatch.setenv(amazon_service.ENV_PAAPI_REQUESTS_PER_SECOND, "2")
+    monkeypatch.setenv(amazon_service.ENV_PAAPI_BURST, "3")
+    monkeypatch.setenv(amazon_service.ENV_PAAPI_PROCESSES, "4")
+    monkeypatch.setattr(amazon_service, 'REGION_RATE_LIMITS', {"US": (8.0, 8)})
+
+    amazon_service.configure(str(tmp_path / "missing.env"))
+
+    assert (amazon_service.UPSTREAM.rate, amazon_service.UPSTREAM.capacity) == (0.5, 1.0)
+    assert amazon_service.UPSTREAM.overrides == {"US": (2.0, 2.0)}
+    assert amazon_service.PAAPI_REQUESTS_PER_SECOND == 2.0  # Still the account's
+
+
+def test_configure_keeps_unchanged_settings(tmp_path, restore_settings):
+    cache, upstream = amazon_service.CACHE, amazon_service.UPSTREAM
+    amazon_service.CACHE.set("key", _make_page("B1"))
+
+    amazon_service.configure(str(tmp_path / "missing.env"))
+
+    assert amazon_service.CACHE is cache and amazon_service.UPSTREAM is upstream
+    assert amazon_service.CACHE.get("key") is not None
+
+
+def test_client_built_from_sdk_on_first_use(mocker):
+    """Test the SDK class is looked up when a client is built, not at import."""
+    api = mocker.patch('amazon_paapi.AmazonApi')
+    with patch.dict(os.environ, {
+        amazon_service.ENV_ACCESS_KEY: "key", amazon_service.ENV_SECRET_KEY: "secret",
+        amazon_service.REGION_CONFIG["GB"]["tag_env"]: "tag-21",
+    }):
+        assert amazon_service.get_amazon_client("GB") is api.return_value
+    api.assert_called_once_with("key", "secret", "tag-21", Country.UK, throttling=0)
+
 # --- Tests for search_bluey_products ---
 
 
@@ -129,15 +216,17 @@ def test_search_bluey_products_success(mock_get_client, mocker):
         "US", keywords="test", item_count=5)
 
     mock_get_client.assert_called_once_with("US")
+    # Full pages are always requested so other item counts can share them
     mock_api_client.search_items.assert_called_once_with(
         keywords="test",
-        item_count=5
+        item_count=10,
+        item_page=1
     )
-    assert result == mock_search_result
+    assert result == project_search_result(mock_search_result)
     # Check cache
-    cache_key = "US_test_5"
+    cache_key = amazon_service._page_cache_key("US", "test", 1)
     assert cache_key in amazon_service.CACHE
-    assert amazon_service.CACHE[cache_key][1] == mock_search_result
+    assert amazon_service.CACHE.get(cache_key) == project_search_result(mock_search_result)
 
 
 @patch.dict(os.environ, {
@@ -158,10 +247,10 @@ def test_search_bluey_products_api_error(mock_get_client, mocker, caplog):
 
         mock_get_client.assert_called_once_with("US")
         mock_api_client.search_items.assert_called_once()
-        assert result == mock_search_result  # Returns result even with errors
+        assert result == project_search_result(mock_search_result)  # Returns result even with errors
         assert "API returned errors" in caplog.text
         # Ensure result with errors is NOT cached
-        cache_key = "US_Bluey Toys_10"
+        cache_key = amazon_service._page_cache_key("US", "Bluey Toys", 1)
         assert cache_key not in amazon_service.CACHE
 
 
@@ -186,7 +275,7 @@ def test_search_bluey_products_search_exception(mock_get_client, mocker, caplog)
         assert "Error searching Amazon PA API" in caplog.text
         assert "Search failed" in caplog.text
         # Ensure nothing is cached on exception
-        cache_key = "US_Bluey Toys_10"
+        cache_key = amazon_service._page_cache_key("US", "Bluey Toys", 1)
         assert cache_key not in amazon_service.CACHE
 
 
@@ -205,7 +294,7 @@ def test_search_bluey_products_client_init_fails(mock_get_client):
     mock_get_client.assert_called_once_with("US")
     assert result is None
     # Ensure nothing is cached
-    cache_key = "US_Bluey Toys_10"
+    cache_key = amazon_service._page_cache_key("US", "Bluey Toys", 1)
     assert cache_key not in amazon_service.CACHE
 
 
@@ -214,16 +303,16 @@ def test_search_bluey_products_client_init_fails(mock_get_client):
 @patch('backend.amazon_service.get_amazon_client')
 def test_search_bluey_products_cache_hit(mock_get_client, mock_time, mocker, caplog):
     """Test that a valid cached result is returned."""
-    cache_key = "CA_Bluey Figures_8"
-    cached_data = SimpleNamespace(items=["cached_item"], errors=None)
+    cache_key = amazon_service._page_cache_key("CA", "Bluey Figures", 1)
+    cached_data = _make_page("CACHED")
     # Use fixed numeric timestamps for mocking
     current_mock_time = 1700000000.0
     cached_time = current_mock_time - 100  # Cached 100s ago
 
-    mock_time.return_value = current_mock_time
-
     # Pre-populate cache
-    amazon_service.CACHE[cache_key] = (cached_time, cached_data)
+    mock_time.return_value = cached_time
+    amazon_service.CACHE.set(cache_key, cached_data)
+    mock_time.return_value = current_mock_time
 
     with caplog.at_level(logging.INFO):
         result = amazon_service.search_bluey_products(
@@ -243,31 +332,17 @@ def test_search_bluey_products_cache_hit(mock_get_client, mock_time, mocker, cap
 @patch('backend.amazon_service.get_amazon_client')
 def test_search_bluey_products_cache_expired(mock_get_client, mock_time, mocker, caplog):
     """Test that an expired cached result triggers a new API call."""
-    cache_key = "GB_Bluey House_1"
-    cached_data = SimpleNamespace(items=["old_item"], errors=None)
+    cache_key = amazon_service._page_cache_key("GB", "Bluey House", 1)
+    cached_data = _make_page("OLD")
     # Use fixed numeric timestamps for mocking
     current_mock_time = 1700000000.0
-    expired_time = current_mock_time - \
-        amazon_service.CACHE_DURATION_SECONDS - 10  # Expired
-    log_time_expired = current_mock_time + 0.1  # Time for "Cache expired" log
-    log_time_calling = current_mock_time + 0.2  # Time for "Calling API" log
-    # Time for "Successfully searched" log
-    log_time_success = current_mock_time + 0.3
-    new_cache_time = current_mock_time + 0.4   # Time when new result is cached
-    log_time_stored = current_mock_time + 0.5  # Time for "Stored result" log
-
-    # Mock time: cache check, log expired, log calling, log success, cache update, log stored
-    mock_time.side_effect = [
-        current_mock_time,
-        log_time_expired,
-        log_time_calling,
-        log_time_success,
-        new_cache_time,
-        log_time_stored
-    ]
+    expired_time = current_mock_time - amazon_service.CACHE_HARD_TTL_SECONDS - \
+        amazon_service.CACHE_STALE_GRACE_SECONDS - 10  # Expired past grace
 
-    # Pre-populate cache with expired data
-    amazon_service.CACHE[cache_key] = (expired_time, cached_data)
+    # Pre-populate cache with data that has since expired
+    mock_time.return_value = expired_time
+    amazon_service.CACHE.set(cache_key, cached_data)
+    mock_time.return_value = current_mock_time
 
     # Mock the API call that will happen after cache expiry
     mock_api_client = mocker.Mock(spec=AmazonApi)
@@ -279,16 +354,1154 @@ def test_search_bluey_products_cache_expired(mock_get_client, mock_time, mocker,
         result = amazon_service.search_bluey_products(
             "GB", keywords="Bluey House", item_count=1)
 
-        assert result == new_search_result  # Should get the new result
+        assert result == project_search_result(new_search_result)  # Should get the new result
         mock_get_client.assert_called_once_with("GB")
         mock_api_client.search_items.assert_called_once()
         # Check log messages
-        assert "Cache expired" in caplog.text
         assert "Calling Amazon PA API" in caplog.text
         assert "Successfully searched Amazon PA API" in caplog.text
         assert "Stored result in cache" in caplog.text
         # Check cache was updated
         assert cache_key in amazon_service.CACHE
-        assert amazon_service.CACHE[cache_key][1] == new_search_result
+        entry = amazon_service.CACHE.get_entry(cache_key)
+        assert entry.value == project_search_result(new_search_result)
         # Check timestamp updated
-        assert amazon_service.CACHE[cache_key][0] == new_cache_time
+        assert entry.stored_at == current_mock_time
+        assert amazon_service.CACHE.stats()["expirations"] == 1
+
+
+@patch.dict(amazon_service.REGION_CACHE_TTL_SECONDS, {"AU": 60})
+@patch('backend.amazon_service.time.time')
+@patch('backend.amazon_service.get_amazon_client')
+def test_search_bluey_products_region_ttl_override(mock_get_client, mock_time, mocker):
+    """Test that per-region TTL overrides decide when results go stale."""
+    mock_time.return_value = 1700000000.0
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.return_value = SimpleNamespace(
+        items=["item"], errors=None)
+    mock_get_client.return_value = mock_api_client
+    mocker.patch('backend.amazon_service._start_background')
+
+    amazon_service.search_bluey_products("AU")
+    amazon_service.search_bluey_products("US")
+
+    mock_time.return_value = 1700000000.0 + 61
+    assert amazon_service.lookup_bluey_products("AU").stale is True
+    # A region without an override uses the default duration
+    assert amazon_service.lookup_bluey_products("US").stale is False
+
+# --- Tests for stale-while-revalidate ---
+
+
+def _seed_cache(mock_time, cache_key, data, age):
+    """Store data in the cache as if it had been fetched ``age`` seconds ago."""
+    now = mock_time.return_value
+    mock_time.return_value = now - age
+    amazon_service.CACHE.set(cache_key, data)
+    mock_time.return_value = now
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+@patch('backend.amazon_service.get_amazon_client')
+def test_lookup_serves_stale_and_refreshes_in_background(mock_get_client, mock_time, mocker):
+    """Test that a result past the soft TTL is served while a refresh runs."""
+    stale_data = _make_page("OLD")
+    fresh_data = SimpleNamespace(items=["new_item"], errors=None)
+    age = amazon_service.CACHE_DURATION_SECONDS + 100
+    _seed_cache(mock_time, amazon_service._page_cache_key("US", "Bluey Toys", 1), stale_data, age)
+
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.return_value = fresh_data
+    mock_get_client.return_value = mock_api_client
+    background = []
+    mocker.patch('backend.amazon_service._start_background',
+                 side_effect=lambda fn, *args: background.append((fn, args)))
+
+    outcome = amazon_service.lookup_bluey_products("US")
+
+    assert outcome.result == stale_data
+    assert outcome.stale is True
+    assert outcome.age_seconds == age
+    mock_api_client.search_items.assert_not_called()  # Request didn't block
+
+    # Run the scheduled refresh and check the cache now holds fresh data
+    assert len(background) == 1
+    fn, args = background[0]
+    fn(*args)
+    mock_api_client.search_items.assert_called_once()
+    outcome = amazon_service.lookup_bluey_products("US")
+    assert outcome.result == project_search_result(fresh_data)
+    assert outcome.stale is False
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+@patch('backend.amazon_service.get_amazon_client')
+def test_lookup_keeps_stale_when_background_refresh_fails(mock_get_client, mock_time, mocker):
+    """Test that a failed background refresh leaves the stale entry in place."""
+    stale_data = _make_page("OLD")
+    _seed_cache(mock_time, amazon_service._page_cache_key("US", "Bluey Toys", 1), stale_data,
+                amazon_service.CACHE_DURATION_SECONDS + 100)
+
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = Exception("Throttled")
+    mock_get_client.return_value = mock_api_client
+    mocker.patch('backend.amazon_service._start_background',
+                 side_effect=lambda fn, *args: fn(*args))
+
+    first = amazon_service.lookup_bluey_products("US")
+    second = amazon_service.lookup_bluey_products("US")
+
+    assert first.result == stale_data
+    assert second.result == stale_data
+    assert second.stale is True
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+@patch('backend.amazon_service.get_amazon_client')
+def test_lookup_blocks_after_hard_ttl(mock_get_client, mock_time, mocker):
+    """Test that past the hard TTL the request waits for fresh data."""
+    stale_data = _make_page("OLD")
+    fresh_data = SimpleNamespace(items=["new_item"], errors=None)
+    _seed_cache(mock_time, amazon_service._page_cache_key("US", "Bluey Toys", 1), stale_data,
+                amazon_service.CACHE_HARD_TTL_SECONDS + 10)
+
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.return_value = fresh_data
+    mock_get_client.return_value = mock_api_client
+    start_background = mocker.patch(
+        'backend.amazon_service._start_background')
+
+    outcome = amazon_service.lookup_bluey_products("US")
+
+    assert outcome.result == project_search_result(fresh_data)
+    assert outcome.stale is False
+    start_background.assert_not_called()
+
+
+@pytest.mark.parametrize("failure", [
+    {"side_effect": Exception("Throttled")},
+    {"return_value": SimpleNamespace(items=None, errors=["TooManyRequests"])},
+])
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+@patch('backend.amazon_service.get_amazon_client')
+def test_lookup_serves_stale_within_grace_on_failure(mock_get_client, mock_time, mocker, failure, caplog):
+    """Test that a failed blocking refresh falls back to stale data within grace."""
+    stale_data = _make_page("OLD")
+    age = amazon_service.CACHE_HARD_TTL_SECONDS + 10
+    _seed_cache(mock_time, amazon_service._page_cache_key("US", "Bluey Toys", 1), stale_data, age)
+
+    mock_api_client = mocker.Mock(spec=AmazonApi, **{
+        f"search_items.{k}": v for k, v in failure.items()})
+    mock_get_client.return_value = mock_api_client
+
+    with caplog.at_level(logging.WARNING):
+        outcome = amazon_service.lookup_bluey_products("US")
+
+    assert outcome.result == stale_data
+    assert outcome.stale is True
+    assert outcome.age_seconds == age
+    assert "serving stale result" in caplog.text
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+@patch('backend.amazon_service.get_amazon_client')
+def test_lookup_gives_up_after_grace_period(mock_get_client, mock_time, mocker):
+    """Test that stale data is no longer served once the grace period has passed."""
+    stale_data = _make_page("OLD")
+    _seed_cache(mock_time, amazon_service._page_cache_key("US", "Bluey Toys", 1), stale_data,
+                amazon_service.CACHE_HARD_TTL_SECONDS +
+                amazon_service.CACHE_STALE_GRACE_SECONDS + 10)
+
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = Exception("Throttled")
+    mock_get_client.return_value = mock_api_client
+
+    assert amazon_service.lookup_bluey_products("US") is None
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_search_bluey_products_coalesces_concurrent_misses(mock_get_client, mocker):
+    """Test that N parallel misses for one key make a single upstream call."""
+    n_requests = 10
+    cache_key = amazon_service._page_cache_key("US", "Bluey Toys", 1)
+    release = threading.Event()
+    search_result = SimpleNamespace(items=["item"], errors=None)
+
+    def slow_search(**kwargs):
+        release.wait(5)
+        return search_result
+
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = slow_search
+    mock_get_client.return_value = mock_api_client
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            amazon_service.search_bluey_products("US")))
+        for _ in range(n_requests)
+    ]
+    for thread in threads:
+        thread.start()
+    # Hold the upstream call until every other request is waiting on it
+    for _ in range(1000):
+        if amazon_service.IN_FLIGHT.waiters(cache_key) == n_requests - 1:
+            break
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    mock_api_client.search_items.assert_called_once()
+    mock_get_client.assert_called_once_with("US")
+    assert results == [project_search_result(search_result)] * n_requests
+    assert amazon_service.CACHE.get(cache_key) == project_search_result(
+        search_result)
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_search_bluey_products_coalesces_concurrent_failures(mock_get_client, mocker):
+    """Test that waiting requests share the error outcome of the single call."""
+    n_requests = 5
+    cache_key = amazon_service._page_cache_key("GB", "Bluey Toys", 1)
+    release = threading.Event()
+
+    def failing_search(**kwargs):
+        release.wait(5)
+        raise Exception("Throttled")
+
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = failing_search
+    mock_get_client.return_value = mock_api_client
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            amazon_service.search_bluey_products("GB")))
+        for _ in range(n_requests)
+    ]
+    for thread in threads:
+        thread.start()
+    for _ in range(1000):
+        if amazon_service.IN_FLIGHT.waiters(cache_key) == n_requests - 1:
+            break
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    mock_api_client.search_items.assert_called_once()
+    assert results == [None] * n_requests
+    assert cache_key not in amazon_service.CACHE
+
+
+# --- Tests for the client registry ---
+
+
+@patch.dict(os.environ, {
+    amazon_service.ENV_ACCESS_KEY: "test_access_key",
+    amazon_service.ENV_SECRET_KEY: "test_secret_key",
+    amazon_service.REGION_CONFIG["US"]["tag_env"]: "test_us_tag-20"
+})
+@patch('backend.amazon_service.get_amazon_client')
+def test_get_client_reuses_client(mock_get_client, mocker):
+    """Test that one client per region is built and then reused."""
+    mock_get_client.side_effect = lambda region: mocker.Mock(spec=AmazonApi)
+
+    first = amazon_service.get_client("US")
+    second = amazon_service.get_client("US")
+
+    assert first is second
+    mock_get_client.assert_called_once_with("US")
+
+
+@patch.dict(os.environ, {
+    amazon_service.ENV_ACCESS_KEY: "test_access_key",
+    amazon_service.ENV_SECRET_KEY: "test_secret_key",
+    amazon_service.REGION_CONFIG["US"]["tag_env"]: "test_us_tag-20"
+})
+def test_get_client_rebuilds_on_credential_change():
+    """Test that rotated credentials hot-reload the client."""
+    first = amazon_service.get_client("US")
+    os.environ[amazon_service.ENV_ACCESS_KEY] = "rotated_access_key"
+    second = amazon_service.get_client("US")
+
+    assert isinstance(second, AmazonApi)
+    assert first is not second
+    assert amazon_service.get_client("US") is second
+
+
+@patch.dict(os.environ, {
+    amazon_service.ENV_ACCESS_KEY: "test_access_key",
+    amazon_service.ENV_SECRET_KEY: "test_secret_key"
+})
+def test_get_client_reports_failure_once(caplog):
+    """Test that a misconfigured region is only logged once."""
+    tag_env_var = amazon_service.REGION_CONFIG["GB"]["tag_env"]
+    os.environ.pop(tag_env_var, None)
+
+    with caplog.at_level(logging.ERROR):
+        for _ in range(5):
+            assert amazon_service.get_client("GB") is None
+
+    assert caplog.text.count("Missing Amazon Associate Tag for region GB") == 1
+    assert amazon_service.CLIENTS.status() == {"GB": "failed"}
+
+    # Fixing the configuration is picked up without a restart
+    os.environ[tag_env_var] = "test_gb_tag-21"
+    assert amazon_service.get_client("GB") is not None
+    assert amazon_service.CLIENTS.status() == {"GB": "ready"}
+
+
+@patch('backend.amazon_service.time.time')
+@patch('backend.amazon_service.get_amazon_client', return_value=None)
+def test_get_client_retries_failure_after_interval(mock_get_client, mock_time):
+    """Test that a remembered failure is retried once the retry interval passes."""
+    mock_time.return_value = 1700000000.0
+    amazon_service.get_client("US")
+    amazon_service.get_client("US")
+    assert mock_get_client.call_count == 1
+
+    mock_time.return_value += amazon_service.CLIENTS.failure_retry_seconds
+    amazon_service.get_client("US")
+    assert mock_get_client.call_count == 2
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_warm_clients_builds_every_region(mock_get_client, mocker):
+    """Test that warming builds a client for each configured region."""
+    mock_get_client.side_effect = lambda region: None if region == "CA" else mocker.Mock(
+        spec=AmazonApi)
+
+    result = amazon_service.warm_clients()
+
+    assert result == {"US": True, "GB": True, "AU": True, "CA": False}
+    assert mock_get_client.call_count == len(amazon_service.REGION_CONFIG)
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+@patch('backend.amazon_service.get_amazon_client')
+def test_refresh_bluey_products_ignores_fresh_cache(mock_get_client, mock_time, mocker):
+    """Test that a forced refresh calls upstream even when the entry is fresh."""
+    _seed_cache(mock_time, amazon_service._page_cache_key("US", "Bluey Toys", 1), _make_page("OLD"), 10)
+    fresh_data = SimpleNamespace(items=["new_item"], errors=None)
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.return_value = fresh_data
+    mock_get_client.return_value = mock_api_client
+
+    result = amazon_service.refresh_bluey_products("US")
+
+    mock_api_client.search_items.assert_called_once()
+    assert result == project_search_result(fresh_data)
+    assert amazon_service.search_bluey_products("US") == result
+
+# --- Tests for upstream rate limiting ---
+
+
+@patch.dict(os.environ, {amazon_service.ENV_ACCESS_KEY: "test_access_key"})
+@patch('backend.amazon_service.get_amazon_client')
+def test_search_bluey_products_rate_limited(mock_get_client, mocker, caplog):
+    """Test a miss that can't get a token in time fails without calling upstream."""
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_get_client.return_value = mock_api_client
+    mocker.patch.object(amazon_service, 'INTERACTIVE_MAX_WAIT_SECONDS', 0.01)
+    amazon_service.UPSTREAM.penalize(amazon_service._rate_limit_key("US"))
+
+    with caplog.at_level(logging.WARNING):
+        assert amazon_service.search_bluey_products("US") is None
+
+    mock_api_client.search_items.assert_not_called()
+    assert "Rate limit" in caplog.text
+    stats = amazon_service.get_rate_limit_stats()
+    (region_stats,) = stats.values()
+    assert region_stats["priorities"]["interactive"]["rejected"] == 1
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+@patch('backend.amazon_service.get_amazon_client')
+def test_lookup_fails_fast_to_stale_when_rate_limited(mock_get_client, mock_time, mocker):
+    """Test an expired entry within grace is served when no token is free soon."""
+    cached_data = _make_page("OLD")
+    _seed_cache(mock_time, amazon_service._page_cache_key("US", "Bluey Toys", 1),
+                cached_data, amazon_service.CACHE_HARD_TTL_SECONDS + 60)
+    mock_get_client.return_value = mocker.Mock(spec=AmazonApi)
+    acquire = mocker.patch.object(
+        amazon_service.UPSTREAM, 'acquire', return_value=False)
+
+    outcome = amazon_service.lookup_bluey_products("US")
+
+    assert outcome.result == cached_data
+    assert outcome.stale is True
+    _, priority = acquire.call_args.args
+    assert priority == amazon_service.INTERACTIVE
+    assert acquire.call_args.kwargs["timeout"] == amazon_service.STALE_FALLBACK_MAX_WAIT_SECONDS
+    stats = amazon_service.CACHE.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 1)  # Past the hard TTL: not a hit
+
+
+@pytest.mark.parametrize("cached", [True, False])
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+def test_lookup_joining_stuck_fetch_gives_up(mock_time, mocker, cached):
+    """Test a visitor joining a fetch still queued falls back after a bounded wait."""
+    cache_key = amazon_service._page_cache_key("US", "Bluey Toys", 1)
+    cached_data = _make_page("OLD")
+    if cached:
+        _seed_cache(mock_time, cache_key, cached_data, amazon_service.CACHE_HARD_TTL_SECONDS + 60)
+    mocker.patch.object(amazon_service, 'STALE_FALLBACK_MAX_WAIT_SECONDS', 0.01)
+    mocker.patch.object(amazon_service, 'INTERACTIVE_MAX_WAIT_SECONDS', 0.01)
+    mocker.patch.object(amazon_service, 'UPSTREAM_CALL_SECONDS', 0.01)
+    release = threading.Event()
+    refresh = threading.Thread(target=amazon_service.IN_FLIGHT.do, args=(cache_key, release.wait))
+    refresh.start()
+    while not amazon_service.IN_FLIGHT.in_flight(cache_key):
+        time.sleep(0.001)
+
+    try:
+        outcome = amazon_service.lookup_bluey_products("US")
+    finally:
+        release.set()
+        refresh.join()
+
+    if cached:
+        assert outcome.result == cached_data
+        assert outcome.stale is True
+    else:
+        assert outcome is None
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_refresh_bluey_products_queues_as_background(mock_get_client, mocker):
+    """Test warmup refreshes queue behind interactive requests."""
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.return_value = SimpleNamespace(items=[], errors=None)
+    mock_get_client.return_value = mock_api_client
+    acquire = mocker.patch.object(
+        amazon_service.UPSTREAM, 'acquire', return_value=True)
+
+    amazon_service.refresh_bluey_products("US")
+
+    _, priority = acquire.call_args.args
+    assert priority == amazon_service.BACKGROUND
+    assert acquire.call_args.kwargs["timeout"] == amazon_service.BACKGROUND_MAX_WAIT_SECONDS
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_too_many_requests_penalizes_limiter(mock_get_client, mocker):
+    """Test upstream throttling empties the region's token bucket."""
+    from amazon_paapi.errors import TooManyRequests
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = TooManyRequests("Slow down")
+    mock_get_client.return_value = mock_api_client
+    penalize = mocker.patch.object(amazon_service.UPSTREAM, 'penalize')
+
+    assert amazon_service.search_bluey_products("US") is None
+    penalize.assert_called_once_with(amazon_service._rate_limit_key("US"))
+
+@pytest.mark.parametrize("error, outcome", [
+    (None, "ok"),
+    (ItemsNotFound("none"), "ok"),
+    (Exception("boom"), "error"),
+])
+@patch('backend.amazon_service.get_amazon_client')
+def test_upstream_calls_are_timed(mock_get_client, mocker, error, outcome):
+    """Test PA API calls are observed in the latency histogram by outcome."""
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = error
+    mock_api_client.search_items.return_value = SimpleNamespace(items=[], errors=None)
+    mock_get_client.return_value = mock_api_client
+    latency = amazon_service.UPSTREAM_LATENCY.labels("US", "search_items", outcome)
+    before = sum(latency._cells.snapshot()[:-1])  # Bucket cells; the last is the sum
+
+    amazon_service.search_bluey_products("US")
+
+    assert sum(latency._cells.snapshot()[:-1]) == before + 1
+    assert amazon_service.UPSTREAM_IN_FLIGHT.labels("US").value() == 0
+
+# --- Tests for negative caching and circuit breaking ---
+
+
+@pytest.mark.parametrize("failure", [
+    {"side_effect": Exception("Boom")},
+    {"side_effect": ItemsNotFound("No items have been found")},
+    {"return_value": SimpleNamespace(items=None, errors=["InvalidParameterValue"])},
+])
+@patch('backend.amazon_service.get_amazon_client')
+def test_failed_search_is_not_retried_while_backing_off(mock_get_client, mocker, failure):
+    """Test a failing key is answered from the negative cache until its backoff expires."""
+    mock_api_client = mocker.Mock(spec=AmazonApi, **{
+        f"search_items.{k}": v for k, v in failure.items()})
+    mock_get_client.return_value = mock_api_client
+
+    first = amazon_service.search_bluey_products("US")
+    second = amazon_service.search_bluey_products("US")
+    amazon_service.refresh_bluey_products("US")  # Forced refreshes back off too
+
+    assert second == first
+    mock_api_client.search_items.assert_called_once()
+    cache_key = amazon_service._page_cache_key("US", "Bluey Toys", 1)
+    assert amazon_service.get_upstream_status()["backoff"]["entries"][cache_key]["failures"] == 1
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_failed_search_is_retried_after_backoff(mock_get_client, mocker, fast_upstream):
+    """Test a key is retried once its backoff expires and forgotten on success."""
+    clock = mocker.patch.object(amazon_service.FAILURES, '_clock', return_value=1000.0)
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = [
+        Exception("Boom"), SimpleNamespace(items=["item"], errors=None)]
+    mock_get_client.return_value = mock_api_client
+
+    assert amazon_service.search_bluey_products("US") is None
+    clock.return_value += amazon_service.FAILURES.cap
+
+    assert amazon_service.search_bluey_products("US") is not None
+    assert mock_api_client.search_items.call_count == 2
+    assert amazon_service.get_upstream_status()["backoff"]["keys"] == 0
+
+
+def test_search_errors_do_not_open_circuit(mocker, fast_upstream):
+    """Test searches Amazon answered (even with no items) count as a healthy region."""
+    _stub_clients(mocker, total=0)
+    for n in range(amazon_service.BREAKER.failure_threshold + 1):
+        amazon_service.search_bluey_products("US", keywords=f"unknown {n}")
+
+    assert amazon_service.BREAKER.state("US") == "closed"
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+@patch('backend.amazon_service.get_amazon_client')
+def test_open_circuit_serves_last_known_good(mock_get_client, mock_time, mocker, fast_upstream):
+    """Test repeated upstream failures open the region's circuit and stop calls to it."""
+    from amazon_paapi.errors import TooManyRequests
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = TooManyRequests("Slow down")
+    mock_get_client.return_value = mock_api_client
+    threshold = amazon_service.BREAKER.failure_threshold
+    for n in range(threshold):
+        assert amazon_service.search_bluey_products("US", keywords=f"query {n}") is None
+    assert amazon_service.BREAKER.state("US") == "open"
+
+    # A key past its hard TTL falls back to its stale entry without an upstream call
+    stale_data = _make_page("OLD")
+    _seed_cache(mock_time, amazon_service._page_cache_key("US", "Bluey Toys", 1), stale_data,
+                amazon_service.CACHE_HARD_TTL_SECONDS + 10)
+    outcome = amazon_service.lookup_bluey_products("US")
+
+    assert outcome.result == stale_data
+    assert outcome.stale is True
+    assert amazon_service.search_bluey_products("US", keywords="never cached") is None
+    assert mock_api_client.search_items.call_count == threshold
+    circuit = amazon_service.get_upstream_status()["circuits"]["US"]
+    assert circuit["state"] == "open"
+    assert circuit["last_error"].startswith("TooManyRequests")
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_open_circuit_skips_get_items(mock_get_client, mocker, fast_upstream):
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.get_items.side_effect = Exception("boom")
+    mock_get_client.return_value = mock_api_client
+    threshold = amazon_service.BREAKER.failure_threshold
+    for _ in range(threshold + 2):
+        assert amazon_service.get_item_offers("US", ["A"]) is None
+
+    assert mock_api_client.get_items.call_count == threshold
+
+
+def test_rate_limited_probe_is_released(mocker):
+    """Test a half-open probe that gets no rate limit token lets the next caller probe."""
+    mocker.patch.object(amazon_service.BREAKER, 'allow', return_value=True)
+    release = mocker.patch.object(amazon_service.BREAKER, 'release')
+    mocker.patch.object(amazon_service.UPSTREAM, 'acquire', return_value=False)
+    _stub_clients(mocker)
+
+    assert amazon_service.search_bluey_products("US") is None
+    release.assert_called_once_with("US")
+
+# --- Tests for the async fan-out ---
+
+
+class StubAmazonApi:
+    """
+    Local stand-in for the PA API client.
+
+    Serves a catalogue of ``total`` items per search, paged like
+    ``SearchItems``; items are named "<region>-<keywords>-<position>". An
+    optional ``on_search(region)`` hook runs first (to block, fail or record
+    concurrency), and every (keywords, item_page) call is recorded.
+    """
+
+    def __init__(self, region, on_search=None, total=1):
+        self.region = region
+        self.on_search = on_search
+        self.total = total
+        self.calls = []
+
+    def search_items(self, keywords, item_count, item_page=1):
+        self.calls.append((keywords, item_page))
+        if self.on_search is not None:
+            self.on_search(self.region)
+        start = (item_page - 1) * item_count
+        positions = range(start, min(start + item_count, self.total))
+        if not positions:
+            raise ItemsNotFound("No items have been found")
+        items = [SimpleNamespace(asin=f"{self.region}-{keywords}-{i}") for i in positions]
+        return SimpleNamespace(items=items, errors=None)
+
+
+def _stub_clients(mocker, on_search=None, missing=(), total=1):
+    """Patch client creation to return a StubAmazonApi per region; returns {region: stub}."""
+    stubs = {}
+
+    def create(region):
+        if region in missing:
+            return None
+        stubs[region] = StubAmazonApi(region, on_search, total)
+        return stubs[region]
+
+    mocker.patch('backend.amazon_service.get_amazon_client', side_effect=create)
+    return stubs
+
+
+def test_async_search_many_fans_out_concurrently(mocker):
+    """Test every region is queried at the same time and results keep query order."""
+    regions = list(amazon_service.REGION_CONFIG)
+    barrier = threading.Barrier(len(regions), timeout=5)
+    _stub_clients(mocker, on_search=lambda region: barrier.wait())
+    queries = [(region, "Bluey Toys") for region in regions]
+
+    results = amazon_service.search_many(queries, max_concurrency=len(regions))
+
+    assert [(r.region, r.keywords) for r in results] == queries
+    assert all(r.error is None for r in results)
+    assert [r.outcome.result.products[0].asin for r in results] == \
+        [f"{region}-bluey toys-0" for region in regions]
+
+
+def test_async_search_many_bounds_concurrency(mocker):
+    """Test no more than max_concurrency queries run at once."""
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def track(region):
+        with lock:
+            running.append(region)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(region)
+
+    _stub_clients(mocker, on_search=track)
+    queries = [(region, "Bluey Toys") for region in amazon_service.REGION_CONFIG]
+
+    results = amazon_service.search_many(queries, max_concurrency=2)
+
+    assert all(r.error is None for r in results)
+    assert max(peak) <= 2
+
+
+def test_async_search_many_returns_partial_results(mocker):
+    """Test a slow region times out and a misconfigured one fails, without losing the rest."""
+    release = threading.Event()
+
+    def slow_gb(region):
+        if region == "GB":
+            release.wait(5)
+
+    _stub_clients(mocker, on_search=slow_gb, missing=("CA",))
+    queries = [("US", "Bluey Toys"), ("GB", "Bluey Toys"), ("CA", "Bluey Toys")]
+    try:
+        results = amazon_service.search_many(queries, timeout=0.2)
+    finally:
+        release.set()
+
+    us, gb, ca = results
+    assert us.error is None and us.outcome.stale is False
+    assert gb.outcome is None and gb.error == "timeout"
+    assert ca.outcome is None and ca.error == "failed"
+
+# --- Tests for paginated deep fetch ---
+
+
+@pytest.fixture
+def fast_upstream(mocker):
+    """Allow bursts of upstream calls so page fetches aren't spaced a second apart."""
+    return mocker.patch.object(amazon_service, 'UPSTREAM',
+                               UpstreamLimiter(rate=100.0, capacity=10))
+
+
+def _asins(outcome):
+    return [p.asin for p in outcome.result.products]
+
+
+def test_lookup_fetches_pages_beyond_ten_items(mocker, fast_upstream):
+    """Test item_count above one PA API page is served from several cached pages."""
+    stubs = _stub_clients(mocker, total=35)
+
+    outcome = amazon_service.lookup_bluey_products("US", item_count=25)
+
+    assert _asins(outcome) == [f"US-bluey toys-{i}" for i in range(25)]
+    assert sorted(stubs["US"].calls) == [("bluey toys", page) for page in (1, 2, 3)]
+    assert outcome.result.next_cursor == encode_cursor(25)
+    for page in (1, 2, 3):
+        assert amazon_service._page_cache_key("US", "Bluey Toys", page) in amazon_service.CACHE
+
+
+def test_lookup_fetches_pages_concurrently(mocker, fast_upstream):
+    """Test the pages of one request are requested at the same time."""
+    barrier = threading.Barrier(3, timeout=5)
+    _stub_clients(mocker, on_search=lambda region: barrier.wait(), total=30)
+
+    outcome = amazon_service.lookup_bluey_products("US", item_count=30)
+
+    assert len(outcome.result.products) == 30
+
+
+def test_overlapping_requests_share_pages(mocker, fast_upstream):
+    """Test smaller and follow-on requests reuse pages instead of refetching."""
+    stubs = _stub_clients(mocker, total=35)
+    first = amazon_service.lookup_bluey_products("US", item_count=25)
+
+    small = amazon_service.lookup_bluey_products("US", item_count=5)
+    rest = amazon_service.lookup_bluey_products(
+        "US", item_count=10, offset=decode_cursor(first.result.next_cursor))
+
+    assert _asins(small) == [f"US-bluey toys-{i}" for i in range(5)]
+    assert small.result.next_cursor == encode_cursor(5)
+    assert _asins(rest) == [f"US-bluey toys-{i}" for i in range(25, 35)]
+    assert rest.result.next_cursor is None  # End of the results
+    # Only page 4 was new
+    assert len(stubs["US"].calls) == 4
+
+
+def test_lookup_reuses_assembled_page(mocker, fast_upstream):
+    """Test repeated requests get the same assembled page, with its encoded bodies."""
+    _stub_clients(mocker, total=35)
+
+    first = amazon_service.lookup_bluey_products("US", item_count=15)
+    second = amazon_service.lookup_bluey_products("US", item_count=15)
+
+    assert second.result is first.result
+
+
+def test_lookups_count_one_hit_or_miss_each(mocker, fast_upstream):
+    """Test a miss then a hit record exactly one miss and one hit (the fetch's re-check isn't counted)."""
+    _stub_clients(mocker, total=5)
+
+    amazon_service.lookup_bluey_products("US")
+    amazon_service.lookup_bluey_products("US")
+
+    stats = amazon_service.CACHE.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_lookup_stops_at_end_of_results(mocker, fast_upstream):
+    """Test pages past a short page are ignored, including their not-found errors."""
+    _stub_clients(mocker, total=15)
+
+    outcome = amazon_service.lookup_bluey_products("US", item_count=30)
+
+    assert len(outcome.result.products) == 15
+    assert outcome.result.api_errors == ()
+    assert outcome.result.next_cursor is None
+
+
+def test_growing_requests_fetch_only_new_pages(mocker, fast_upstream):
+    """Test each larger request fetches just the pages past what is cached."""
+    stubs = _stub_clients(mocker, total=100)
+
+    def calls():
+        return [page for _, page in stubs["US"].calls] if stubs else []
+
+    for item_count, fetched in [(5, [1]), (10, []), (25, [2, 3]), (3, []), (40, [4])]:
+        before = len(calls())
+        outcome = amazon_service.lookup_bluey_products("US", item_count=item_count)
+
+        assert _asins(outcome) == [f"US-bluey toys-{i}" for i in range(item_count)]
+        assert sorted(calls()[before:]) == fetched
+
+
+@pytest.mark.parametrize("total", [15, 20])
+def test_lookup_skips_pages_past_known_end(mocker, fast_upstream, total):
+    """Test pages past a short or not-found page aren't requested again."""
+    stubs = _stub_clients(mocker, total=total)
+    first = amazon_service.lookup_bluey_products("US", item_count=30)
+    assert len(first.result.products) == total
+    assert first.result.next_cursor is None
+
+    outcome = amazon_service.lookup_bluey_products("US", item_count=50)
+
+    assert len(stubs["US"].calls) == 3
+    assert len(outcome.result.products) == total
+    assert outcome.result.next_cursor is None
+    assert amazon_service.lookup_bluey_products("US", item_count=10, offset=10) \
+        .result.next_cursor is None
+
+
+@pytest.mark.parametrize("warm", [False, True])
+def test_cursor_past_end_returns_empty_page(mocker, fast_upstream, warm):
+    """Test a cursor at the end of exactly 20 results is an empty page, not an error."""
+    stubs = _stub_clients(mocker, total=20)
+    if warm:
+        amazon_service.lookup_bluey_products("US", item_count=30)
+    calls = len(stubs["US"].calls) if warm else 0
+
+    for _ in range(2):  # Also once the not-found page is backing off
+        outcome = amazon_service.lookup_bluey_products("US", item_count=10, offset=20)
+
+        assert outcome.result.products == ()
+        assert outcome.result.next_cursor is None
+    assert len(stubs["US"].calls) - calls == (0 if warm else 1)
+
+
+def test_lookup_refetches_only_evicted_page(mocker, fast_upstream):
+    stubs = _stub_clients(mocker, total=35)
+    amazon_service.lookup_bluey_products("US", item_count=30)
+    amazon_service.CACHE.delete(amazon_service._page_cache_key("US", "bluey toys", 2))
+
+    outcome = amazon_service.lookup_bluey_products("US", item_count=30)
+
+    assert _asins(outcome) == [f"US-bluey toys-{i}" for i in range(30)]
+    assert [page for _, page in stubs["US"].calls[3:]] == [2]
+
+
+def test_known_end_moves_when_results_grow(mocker, fast_upstream):
+    stubs = _stub_clients(mocker, total=15)
+    amazon_service.lookup_bluey_products("US", item_count=20)
+    stubs["US"].total = 25
+
+    amazon_service.refresh_bluey_products("US", item_count=20)  # Page 2 is full now
+    outcome = amazon_service.lookup_bluey_products("US", item_count=30)
+
+    assert len(outcome.result.products) == 25
+    assert amazon_service.RESULT_ENDS.get(("US", "bluey toys")) == 25
+
+
+def test_lookup_caps_item_count(mocker, fast_upstream):
+    """Test requests are limited to the 10 pages PA API can return."""
+    stubs = _stub_clients(mocker, total=500)
+
+    outcome = amazon_service.lookup_bluey_products("US", item_count=500)
+
+    assert len(outcome.result.products) == amazon_service.MAX_RESULTS
+    assert len(stubs["US"].calls) == amazon_service.MAX_ITEM_PAGES
+    assert outcome.result.next_cursor is None
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_lookup_dedupes_asins_across_pages(mock_get_client, mocker, fast_upstream):
+    """Test an item repeated on the next page is only returned once."""
+    pages = {
+        1: [f"A{i}" for i in range(10)],
+        2: ["A9"] + [f"B{i}" for i in range(9)],
+    }
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = lambda keywords, item_count, item_page: \
+        SimpleNamespace(items=[SimpleNamespace(asin=a) for a in pages[item_page]], errors=None)
+    mock_get_client.return_value = mock_api_client
+
+    outcome = amazon_service.lookup_bluey_products("US", item_count=20)
+
+    assert _asins(outcome) == pages[1] + pages[2][1:]
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_lookup_returns_earlier_pages_when_later_page_fails(mock_get_client, mocker, fast_upstream):
+    """Test a failed page truncates the response and the cursor resumes there."""
+    def search(keywords, item_count, item_page):
+        if item_page == 2:
+            raise Exception("Throttled")
+        return SimpleNamespace(items=[SimpleNamespace(asin=f"A{item_page}-{i}")
+                                      for i in range(10)], errors=None)
+
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = search
+    mock_get_client.return_value = mock_api_client
+
+    outcome = amazon_service.lookup_bluey_products("US", item_count=30, offset=5)
+
+    assert _asins(outcome) == [f"A1-{i}" for i in range(5, 10)]
+    assert outcome.result.next_cursor == encode_cursor(10)
+
+
+def test_refresh_bluey_products_refreshes_every_page(mocker, fast_upstream):
+    """Test warmup refreshes all pages needed for the item count, stopping at the end."""
+    stubs = _stub_clients(mocker, total=25)
+
+    result = amazon_service.refresh_bluey_products("US", item_count=40)
+
+    assert [page for _, page in stubs["US"].calls] == [1, 2, 3]
+    assert len(result.products) == 5
+
+def test_refresh_pages_ends_at_full_last_page(mocker, fast_upstream):
+    """Test a not-found page after a full one ends the results rather than failing them."""
+    stubs = _stub_clients(mocker, total=20)
+
+    pages = amazon_service.refresh_pages("US", item_count=40)
+
+    assert [page for _, page in stubs["US"].calls] == [1, 2, 3]
+    assert [len(page.products) for page in pages] == [10, 10]
+
+# --- Tests for price refreshes ---
+
+
+def _offer_item(asin, price, availability="In Stock"):
+    return SimpleNamespace(asin=asin, offers=SimpleNamespace(listings=[SimpleNamespace(
+        price=SimpleNamespace(display_amount=price),
+        availability=SimpleNamespace(message=availability))]))
+
+
+@patch('backend.amazon_service.get_amazon_client')
+def test_get_item_offers(mock_get_client, mocker):
+    """Test GetItems results are reduced to price and availability per ASIN."""
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.get_items.return_value = [
+        _offer_item("A", "$5.00"), SimpleNamespace(asin="B", offers=None)]
+    mock_get_client.return_value = mock_api_client
+    acquire = mocker.spy(amazon_service.UPSTREAM, 'acquire')
+
+    offers = amazon_service.get_item_offers("US", ["A", "B"])
+
+    assert offers == {"A": ("$5.00", "In Stock"), "B": (None, None)}
+    mock_api_client.get_items.assert_called_once_with(["A", "B"], include_unavailable=True)
+    assert acquire.call_args.args[1] == amazon_service.BACKGROUND
+
+
+@pytest.mark.parametrize("error, expected", [
+    (ItemsNotFound("none"), {}),
+    (Exception("boom"), None),
+])
+@patch('backend.amazon_service.get_amazon_client')
+def test_get_item_offers_errors(mock_get_client, mocker, error, expected):
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.get_items.side_effect = error
+    mock_get_client.return_value = mock_api_client
+
+    assert amazon_service.get_item_offers("US", ["A"]) == expected
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+@patch('backend.amazon_service.get_amazon_client')
+def test_patch_cached_offers(mock_get_client, mock_time, mocker):
+    """Test offers are patched into cached pages without refreshing the search's age."""
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.return_value = SimpleNamespace(
+        items=[_offer_item("A", "$5.00"), _offer_item("B", "$6.00")], errors=None)
+    mock_get_client.return_value = mock_api_client
+    before = amazon_service.lookup_bluey_products("US")
+    entry = amazon_service.CACHE.get_entry(amazon_service._page_cache_key("US", "Bluey Toys", 1))
+
+    mock_time.return_value += 600
+    patched = amazon_service.patch_cached_offers(
+        "US", {"A": ("$4.00", "Only 2 left"), "B": ("$6.00", "In Stock")})
+    after = amazon_service.lookup_bluey_products("US")
+
+    assert patched == 1
+    assert [(p.price, p.availability) for p in after.result.products] == [
+        ("$4.00", "Only 2 left"), ("$6.00", "In Stock")]
+    assert after.age_seconds == 600  # Still due for its search refresh on schedule
+    assert after.result.fetched_at != before.result.fetched_at
+    assert after.result.etag() != before.result.etag()
+    assert amazon_service.CACHE.get_entry(amazon_service._page_cache_key("US", "Bluey Toys", 1)).stored_at == entry.stored_at
+    # Nothing else to patch
+    assert amazon_service.patch_cached_offers("US", {"A": ("$4.00", "Only 2 left")}) == 0
+    assert amazon_service.patch_cached_offers("GB", {"A": ("$1.00", None)}) == 0
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+def test_patch_cached_offers_keeps_newer_page(mock_time, mocker):
+    """Test a page refetched while its offers were patched isn't overwritten by the old one."""
+    cache_key = amazon_service._page_cache_key("US", "Bluey Toys", 1)
+    old, new = _make_page("A"), _make_page("A")
+    amazon_service.CACHE.set(cache_key, old)
+    amazon_service._track_page("US", cache_key, old.products, mock_time.return_value + 60)
+    real_peek = amazon_service.CACHE.peek
+
+    def peek_then_refetch(key):
+        entry = real_peek(key)
+        mock_time.return_value += 1
+        amazon_service.CACHE.set(key, new)
+        return entry
+
+    mocker.patch.object(amazon_service.CACHE, 'peek', side_effect=peek_then_refetch)
+
+    assert amazon_service.patch_cached_offers("US", {"A": ("$1.00", None)}) == 0
+    assert amazon_service.CACHE.get(cache_key) is new
+
+
+@patch('backend.amazon_service.time.time', return_value=1700000000.0)
+def test_asin_tracking_forgets_gone_pages(mock_time):
+    """Test pages are untracked when refetched, found evicted, or expired."""
+    def track(cache_key, *asins):
+        amazon_service._track_page(
+            "US", cache_key, [ProductRecord(a, None, None, None, None) for a in asins],
+            mock_time.return_value + 60)
+
+    track("p1", "A", "B")
+    track("p1", "B", "C")  # Refetched: A isn't on it any more
+    assert amazon_service._ASIN_PAGES == {("US", "B"): {"p1"}, ("US", "C"): {"p1"}}
+
+    amazon_service.patch_cached_offers("US", {"B": ("$1.00", None)})  # p1 isn't cached
+    assert amazon_service._ASIN_PAGES == {} and amazon_service._PAGE_ASINS == {}
+
+    track("p2", "D")
+    mock_time.return_value += 60 + amazon_service._ASIN_PAGES_SWEEP_SECONDS
+    track("p3", "E")  # Sweeps p2, which has expired
+    assert set(amazon_service._PAGE_ASINS) == {"p3"}
+    assert amazon_service._ASIN_PAGES == {("US", "E"): {"p3"}}
+
+
+def test_tracked_asins(indexed_client):
+    """Test only ASINs on pages or in the index of this process are tracked."""
+    amazon_service._track_page("US", "key", [ProductRecord("X1", None, None, None, None)],
+                               time.time() + 60)
+
+    assert amazon_service.tracked_asins("US", ["X1", "B000", "X2"]) == ["X1", "B000"]
+    assert amazon_service.tracked_asins("GB", ["X1", "B000"]) == []
+
+# --- Tests for local full-text search ---
+
+
+def _titled_result(titles, start=0, features=None):
+    features = features or {}
+    items = [SimpleNamespace(
+        asin=f"B{i:03}",
+        item_info=SimpleNamespace(title=SimpleNamespace(display_value=title),
+                                  features=SimpleNamespace(display_values=features.get(i))),
+    ) for i, title in enumerate(titles, start)]
+    return SimpleNamespace(items=items, errors=None)
+
+
+@pytest.fixture
+def indexed_client(mocker, fast_upstream):
+    """A client whose 'Bluey Toys' search returns 12 titled products."""
+    titles = [f"Bluey Campervan Set {i}" for i in range(8)] + [
+        "Bluey Plush", "Bingo Plush", "Bluey House", "Bluey Figures"]
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.side_effect = lambda keywords, item_count, item_page: (
+        _titled_result(titles[(item_page - 1) * 10:item_page * 10], (item_page - 1) * 10,
+                       {10: ["Includes a campervan"]}))
+    mocker.patch('backend.amazon_service.get_amazon_client', return_value=mock_api_client)
+    amazon_service.lookup_bluey_products("US", item_count=20)
+    mock_api_client.search_items.reset_mock()
+    return mock_api_client
+
+
+def test_fetched_products_are_indexed(indexed_client):
+    assert amazon_service.SEARCH_INDEX.size("US") == 12
+
+
+def test_search_products_served_from_index(indexed_client):
+    """Test a new free-text query with enough local matches doesn't call the PA API."""
+    outcome = amazon_service.search_products("US", "bluey campervans", item_count=5)
+
+    indexed_client.search_items.assert_not_called()
+    assert len(outcome.result.products) == 5
+    assert outcome.stale is False
+    assert decode_cursor(outcome.result.next_cursor) == 5
+
+    rest = amazon_service.search_products("US", "Bluey Campervan", item_count=5,
+                                          offset=5)
+    assert len(rest.result.products) == 4  # 8 sets plus the house with a campervan
+    assert rest.result.next_cursor is None
+    # Normalised queries share memoized pages
+    assert amazon_service.search_products("US", "BLUEY campervan", item_count=5).result \
+        is amazon_service.search_products("US", "bluey campervans", item_count=5).result
+    indexed_client.search_items.assert_not_called()
+
+
+def test_search_products_low_recall_goes_upstream(indexed_client):
+    """Test queries the index can't answer well are searched upstream."""
+    amazon_service.search_products("US", "bluey plush", item_count=10)
+    amazon_service.search_products("GB", "bluey campervan", item_count=5)
+
+    assert [c.kwargs["keywords"] for c in indexed_client.search_items.call_args_list] == [
+        "bluey plush", "bluey campervan"]
+
+
+def test_search_products_prefers_cached_upstream_results(indexed_client, mocker):
+    """Test a search already run upstream keeps its exact PA API results."""
+    lookup = mocker.spy(amazon_service, 'lookup_bluey_products')
+
+    amazon_service.search_products("US", "Bluey Toys", item_count=5)
+
+    lookup.assert_called_once_with(region="US", keywords="Bluey Toys", item_count=5, offset=0)
+    indexed_client.search_items.assert_not_called()  # Served from the page cache
+
+
+def test_search_products_probe_is_not_counted(indexed_client):
+    """Test checking for cached upstream results doesn't count as a cache hit or miss."""
+    before = amazon_service.CACHE.stats()
+
+    amazon_service.search_products("US", "Bluey Toys", item_count=5)  # Page 1 cached
+    amazon_service.search_products("US", "bluey campervans", item_count=5)  # From the index
+
+    after = amazon_service.CACHE.stats()
+    assert (after["hits"] - before["hits"], after["misses"] - before["misses"]) == (1, 0)
+
+
+@patch.dict(os.environ, {amazon_service.ENV_LOCAL_SEARCH: "0"})
+def test_search_products_local_search_disabled(indexed_client):
+    amazon_service.search_products("US", "bluey campervan", item_count=5)
+
+    indexed_client.search_items.assert_called_once()
+
+
+def test_patch_cached_offers_updates_index(indexed_client):
+    amazon_service.patch_cached_offers("US", {"B000": ("$3.00", "In Stock")})
+
+    assert amazon_service.SEARCH_INDEX.get("US", "B000").price == "$3.00"
+
+# --- Tests for category facets ---
+
+
+def _browse_nodes(node_id, name):
+    toys = SimpleNamespace(id="1", display_name="Toys & Games", ancestor=None)
+    return SimpleNamespace(browse_nodes=[
+        SimpleNamespace(id=node_id, display_name=name, ancestor=toys)])
+
+
+@pytest.fixture
+def categorised_client(mocker, fast_upstream):
+    """A client whose 'Bluey Toys' search returns products in two categories."""
+    result = _titled_result(["Bluey Plush", "Bingo Plush", "Bluey Campervan"])
+    result.items[0].browse_node_info = _browse_nodes("10", "Plush")
+    result.items[1].browse_node_info = _browse_nodes("10", "Plush")
+    result.items[2].browse_node_info = _browse_nodes("11", "Vehicles")
+    mock_api_client = mocker.Mock(spec=AmazonApi)
+    mock_api_client.search_items.return_value = result
+    mocker.patch('backend.amazon_service.get_amazon_client', return_value=mock_api_client)
+    amazon_service.lookup_bluey_products("US")
+    mock_api_client.search_items.reset_mock()
+    return mock_api_client
+
+
+def test_fetched_categories_are_listed(categorised_client):
+    assert [(c["name"], c["count"]) for c in amazon_service.get_categories("US")] == [
+        ("Toys & Games", 3), ("Plush", 2), ("Vehicles", 1)]
+
+
+def test_search_products_filters_by_category_locally(categorised_client):
+    """Test category filters never call the PA API, even with few matches."""
+    plush = amazon_service.search_products("US", "bluey", category="10")
+    listed = amazon_service.search_products("US", "", category="10")
+    unknown = amazon_service.search_products("US", "bluey", category="999")
+
+    categorised_client.search_items.assert_not_called()
+    assert [p.title for p in plush.result.products] == ["Bluey Plush"]
+    assert [p.title for p in listed.result.products] == ["Bingo Plush", "Bluey Plush"]
+    assert unknown.result.products == ()
+
+# --- Tests for query canonicalisation ---
+
+
+def test_equivalent_queries_share_one_upstream_search(mocker, fast_upstream):
+    """Test case, spacing and punctuation variants are served from one cached search."""
+    stubs = _stub_clients(mocker, total=20)
+
+    for keywords in ("Bluey Toys", "bluey toys ", "Bluey  toys!", "BLUEY TOYS"):
+        outcome = amazon_service.lookup_bluey_products("US", keywords, item_count=9)
+        assert len(outcome.result.products) == 9
+
+    assert stubs["US"].calls == [("bluey toys", 1)]
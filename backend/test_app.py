@@ -1,9 +1,12 @@
+import gzip
+import json
 import pytest
 from unittest.mock import patch
 # Import the Flask app instance (changed to relative import)
 from .app import app
 # To mock its functions (changed to relative import)
 from . import amazon_service
+from .products import ProductRecord, project_search_result, encode_cursor
 from types import SimpleNamespace
 import os
 
@@ -15,6 +18,13 @@ def client():
     with app.test_client() as client:
         yield client
 
+
+@pytest.fixture(autouse=True)
+def empty_search_index():
+    """Searches fall through to the (mocked) upstream lookup unless a test indexes products."""
+    amazon_service.SEARCH_INDEX.clear()
+    amazon_service.FACETS.clear()
+
 # --- Tests for /api/products endpoint ---
 
 
@@ -38,7 +48,8 @@ def test_get_products_success(client, mocker):
     )
     mock_result = SimpleNamespace(items=[mock_item], errors=None)
     mock_search = mocker.patch(
-        'backend.app.amazon_service.search_bluey_products', return_value=mock_result)
+        'backend.app.amazon_service.lookup_bluey_products',
+        return_value=amazon_service.SearchOutcome(project_search_result(mock_result), 0.0, False))
 
     response = client.get(
         '/api/products?region=US&keywords=Bluey&item_count=1')
@@ -55,9 +66,12 @@ def test_get_products_success(client, mocker):
     assert product['price'] == '$19.99'
     assert product['image'] == 'http://example.com/image.jpg'
     assert product['url'] == 'http://example.com/bluey'
+    assert json_data['stale'] is False
+    assert 'fetched_at' in json_data
+    assert response.headers['Age'] == '0'
     # Verify the service was called correctly
     mock_search.assert_called_once_with(
-        region='US', keywords='Bluey', item_count=1
+        region='US', keywords='Bluey', item_count=1, offset=0
     )
 
 
@@ -87,7 +101,7 @@ def test_get_products_invalid_item_count(client):
 def test_get_products_service_failure(client, mocker):
     """Test error response when amazon_service returns None."""
     mock_search = mocker.patch(
-        'backend.app.amazon_service.search_bluey_products', return_value=None)
+        'backend.app.amazon_service.lookup_bluey_products', return_value=None)
 
     response = client.get('/api/products?region=CA')
 
@@ -96,7 +110,7 @@ def test_get_products_service_failure(client, mocker):
     assert 'error' in json_data
     assert 'Failed to fetch products from Amazon' in json_data['error']
     mock_search.assert_called_once_with(
-        region='CA', keywords='Bluey Toys', item_count=10  # Check defaults
+        region='CA', keywords='Bluey Toys', item_count=10, offset=0  # Check defaults
     )
 
 
@@ -110,7 +124,8 @@ def test_get_products_api_errors(client, mocker):
     mock_result = SimpleNamespace(
         items=[], errors=['Some API Error', 'Another Error'])
     mock_search = mocker.patch(
-        'backend.app.amazon_service.search_bluey_products', return_value=mock_result)
+        'backend.app.amazon_service.lookup_bluey_products',
+        return_value=amazon_service.SearchOutcome(project_search_result(mock_result), 0.0, False))
 
     response = client.get('/api/products?region=GB')
 
@@ -121,8 +136,11 @@ def test_get_products_api_errors(client, mocker):
     assert 'Some API Error' in json_data['api_errors']
     assert 'Another Error' in json_data['api_errors']
     mock_search.assert_called_once_with(
-        region='GB', keywords='Bluey Toys', item_count=10
+        region='GB', keywords='Bluey Toys', item_count=10, offset=0
     )
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert 'ETag' not in response.headers
+    assert 'Last-Modified' not in response.headers
 
 
 @patch.dict(os.environ, {
@@ -143,7 +161,8 @@ def test_get_products_partial_data(client, mocker):
     )
     mock_result = SimpleNamespace(items=[mock_item], errors=None)
     mock_search = mocker.patch(
-        'backend.app.amazon_service.search_bluey_products', return_value=mock_result)
+        'backend.app.amazon_service.lookup_bluey_products',
+        return_value=amazon_service.SearchOutcome(project_search_result(mock_result), 0.0, False))
 
     response = client.get('/api/products?region=AU')
 
@@ -157,5 +176,487 @@ def test_get_products_partial_data(client, mocker):
     assert product['image'] is None  # Check None for missing image
     assert product['url'] == 'http://example.com/bluey2'
     mock_search.assert_called_once_with(
-        region='AU', keywords='Bluey Toys', item_count=10
+        region='AU', keywords='Bluey Toys', item_count=10, offset=0
     )
+
+
+def test_get_cache_stats(client, mocker):
+    """Test that cache counters are exposed through the API."""
+    mocker.patch('backend.app.amazon_service.get_cache_stats', return_value={
+        "hits": 3, "misses": 1, "evictions": 0, "entries": 1})
+
+    response = client.get('/api/cache/stats')
+
+    assert response.status_code == 200
+    json_data = response.get_json()
+    assert json_data["hits"] == 3
+    assert json_data["misses"] == 1
+
+
+def test_get_products_reports_stale_age(client, mocker):
+    """Test that stale results are flagged and their age sent in the Age header."""
+    page = project_search_result(SimpleNamespace(items=[], errors=None))
+    mocker.patch(
+        'backend.app.amazon_service.lookup_bluey_products',
+        return_value=amazon_service.SearchOutcome(page, 4242.42, True))
+
+    response = client.get('/api/products?region=US')
+
+    assert response.status_code == 200
+    json_data = response.get_json()
+    assert json_data['stale'] is True
+    assert json_data['fetched_at'] == page.fetched_at
+    assert response.headers['Age'] == '4242'
+
+
+def test_get_products_serves_precomputed_gzip(client, mocker):
+    """Test that gzip clients get the page's cached compressed body."""
+    mock_item = SimpleNamespace(asin='B01N7P1G3A', detail_page_url='http://example.com/bluey')
+    page = project_search_result(SimpleNamespace(items=[mock_item], errors=None)).encode()
+    mocker.patch(
+        'backend.app.amazon_service.lookup_bluey_products',
+        return_value=amazon_service.SearchOutcome(page, 0.0, False))
+
+    response = client.get('/api/products?region=US',
+                          headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.data == page.body(encoding='gzip')
+    assert json.loads(gzip.decompress(response.data))['products'][0]['asin'] == 'B01N7P1G3A'
+
+# --- Tests for HTTP caching headers ---
+
+
+def _mock_page_lookup(mocker, stale=False, age=0.0):
+    """Patch the service to return a one-product page; returns the page."""
+    mock_item = SimpleNamespace(asin='B01N7P1G3A', detail_page_url='http://example.com/bluey')
+    page = project_search_result(SimpleNamespace(items=[mock_item], errors=None))
+    page.fetched_at = 1700000000.0
+    mocker.patch(
+        'backend.app.amazon_service.lookup_bluey_products',
+        return_value=amazon_service.SearchOutcome(page, age, stale))
+    return page
+
+
+
+def test_get_products_cursor_pagination(client, mocker):
+    """Test the cursor selects the offset and the next cursor is returned in the body."""
+    page = _mock_page_lookup(mocker)
+    page.next_cursor = encode_cursor(30)
+    mock_search = amazon_service.lookup_bluey_products
+
+    response = client.get(f'/api/products?region=US&item_count=10&cursor={encode_cursor(20)}')
+
+    assert response.status_code == 200
+    assert response.get_json()["next_cursor"] == encode_cursor(30)
+    mock_search.assert_called_once_with(
+        region='US', keywords='Bluey Toys', item_count=10, offset=20)
+
+
+@pytest.mark.parametrize("query", [
+    "item_count=0",
+    "cursor=not-a-cursor",
+    f"cursor={encode_cursor(100)}",
+])
+def test_get_products_invalid_pagination(client, mocker, query):
+    """Test non-positive item counts and bad or out of range cursors are rejected."""
+    mock_search = mocker.patch('backend.app.amazon_service.lookup_bluey_products')
+
+    response = client.get(f'/api/products?region=US&{query}')
+
+    assert response.status_code == 400
+    mock_search.assert_not_called()
+
+def test_get_products_sets_validators_and_cache_control(client, mocker):
+    """Test ETag, Last-Modified and Cache-Control aligned with the backend TTLs."""
+    page = _mock_page_lookup(mocker)
+
+    response = client.get('/api/products?region=us')
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{page.etag()}"'
+    assert response.headers['Last-Modified'] == 'Tue, 14 Nov 2023 22:13:20 GMT'
+    soft_ttl = amazon_service.get_cache_ttl("US")
+    swr = amazon_service.get_hard_cache_ttl("US") - soft_ttl
+    cache_control = response.headers['Cache-Control']
+    assert 'public' in cache_control
+    assert f'max-age={soft_ttl}' in cache_control
+    assert f'stale-while-revalidate={swr}' in cache_control
+    assert 'stale-if-error=' in cache_control
+
+
+def test_get_products_if_none_match_returns_304(client, mocker):
+    """Test that a matching ETag short-circuits with 304 Not Modified."""
+    page = _mock_page_lookup(mocker)
+
+    response = client.get('/api/products?region=US',
+                          headers={'If-None-Match': f'"{page.etag()}"'})
+
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == f'"{page.etag()}"'
+
+
+def test_get_products_if_none_match_mismatch_returns_body(client, mocker):
+    """Test that a stale validator gets the full response."""
+    _mock_page_lookup(mocker)
+
+    response = client.get('/api/products?region=US',
+                          headers={'If-None-Match': '"outdated"'})
+
+    assert response.status_code == 200
+    assert response.get_json()['products'][0]['asin'] == 'B01N7P1G3A'
+
+
+def test_get_products_if_modified_since_returns_304(client, mocker):
+    """Test Last-Modified based revalidation."""
+    _mock_page_lookup(mocker)
+
+    response = client.get('/api/products?region=US',
+                          headers={'If-Modified-Since': 'Tue, 14 Nov 2023 22:13:20 GMT'})
+
+    assert response.status_code == 304
+
+
+def test_get_products_etag_differs_per_encoding_and_staleness(client, mocker):
+    """Test that each representation has its own strong ETag."""
+    page = _mock_page_lookup(mocker, stale=True, age=5000.0)
+
+    plain = client.get('/api/products?region=US')
+    gzipped = client.get('/api/products?region=US',
+                         headers={'Accept-Encoding': 'gzip'})
+
+    assert plain.headers['ETag'] == f'"{page.etag(True)}"'
+    assert page.etag(True) != page.etag(False)
+    assert gzipped.headers['ETag'] == f'"{page.etag(True)}-gzip"'
+
+
+def test_get_products_serves_precomputed_brotli(client, mocker):
+    """Test that brotli-capable clients get the page's cached br body."""
+    brotli = pytest.importorskip("brotli")
+    page = _mock_page_lookup(mocker)
+    page.encode()
+
+    response = client.get('/api/products?region=US',
+                          headers={'Accept-Encoding': 'gzip, deflate, br'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.data == page.body(encoding='br')
+    assert json.loads(brotli.decompress(response.data))['products'][0]['asin'] == 'B01N7P1G3A'
+
+
+def test_get_products_respects_q_values(client, mocker):
+    """Test that a client preferring gzip over br gets gzip."""
+    _mock_page_lookup(mocker)
+
+    response = client.get('/api/products?region=US',
+                          headers={'Accept-Encoding': 'br;q=0.1, gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_get_warmup_status(client, mocker):
+    """Test that recent warmup runs are reported."""
+    runs = [{"started_at": 1.0, "duration_seconds": 2.5, "succeeded": 3,
+             "failed": 1, "failures": [{"region": "CA", "keywords": "Bluey Toys",
+                                        "reason": "TooManyRequests"}]}]
+    mocker.patch('backend.app.warmup.WARMER.history', return_value=runs)
+
+    response = client.get('/api/warmup/status')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"runs": runs}
+
+
+def test_get_rate_limit_stats(client, mocker):
+    """Test the rate limiter metrics are exposed."""
+    stats = {"US/abcd1234": {"queue_depth": 2, "max_queue_depth": 3}}
+    mocker.patch('backend.app.amazon_service.get_rate_limit_stats', return_value=stats)
+
+    response = client.get('/api/ratelimit/stats')
+
+    assert response.status_code == 200
+    assert response.get_json() == stats
+
+
+def test_metrics_endpoint(client, mocker):
+    """Test /metrics serves request latency and cache metrics in the Prometheus text format."""
+    client.get('/api/products')  # 400: missing region
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type == "text/plain; version=0.0.4; charset=utf-8"
+    text = response.get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_request_duration_seconds_count{endpoint="get_products",status="400"}' in text
+    assert 'product_cache_hits_total ' in text
+    assert 'http_requests_in_flight 1\n' in text  # The scrape itself
+
+
+def test_upstream_status(client, mocker):
+    """Test the admin endpoint reports circuit breakers and keys backing off."""
+    mocker.patch.object(amazon_service.BREAKER, '_circuits', {})
+    mocker.patch.object(amazon_service.FAILURES, '_failures', {})
+    amazon_service.FAILURES.record_failure("search:v2:US:bluey:1", None, "Boom")
+    for _ in range(amazon_service.BREAKER.failure_threshold):
+        amazon_service.BREAKER.record_failure("US", "TooManyRequests: Slow down")
+
+    response = client.get('/api/upstream/status')
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["circuits"]["US"]["state"] == "open"
+    assert data["backoff"]["keys"] == 1
+    assert data["backoff"]["entries"]["search:v2:US:bluey:1"]["error"] == "Boom"
+
+# --- Tests for /api/products/multi endpoint ---
+
+
+def _multi_result(region, keywords="Bluey Toys", error=None):
+    if error is not None:
+        return amazon_service.MultiSearchResult(region, keywords, None, error)
+    page = project_search_result(SimpleNamespace(
+        items=[SimpleNamespace(asin=f"{region}-1")], errors=None))
+    page.fetched_at = 1700000000.0
+    return amazon_service.MultiSearchResult(
+        region, keywords, amazon_service.SearchOutcome(page, 30.0, False), None)
+
+
+def test_get_products_multi_success(client, mocker):
+    """Test results for every region are returned, partial failures included."""
+    mock_search = mocker.patch('backend.app.amazon_service.search_many', return_value=[
+        _multi_result("US"), _multi_result("GB", error="timeout")])
+
+    response = client.get('/api/products/multi?regions=us,gb&item_count=5')
+
+    assert response.status_code == 200
+    mock_search.assert_called_once_with([("US", "Bluey Toys"), ("GB", "Bluey Toys")], 5)
+    data = response.get_json()
+    assert data["partial"] is True
+    us, gb = data["results"]
+    assert us["status"] == "ok"
+    assert us["products"][0]["asin"] == "US-1"
+    assert us["age_seconds"] == 30
+    assert us["fetched_at"] == 1700000000.0
+    assert gb == {"region": "GB", "keywords": "Bluey Toys",
+                  "status": "timeout", "error": "timeout"}
+
+
+def test_get_products_multi_defaults_to_all_regions(client, mocker):
+    """Test every configured region is searched when none are given."""
+    regions = list(amazon_service.REGION_CONFIG)
+    mock_search = mocker.patch('backend.app.amazon_service.search_many',
+                               return_value=[_multi_result(r) for r in regions])
+
+    response = client.get('/api/products/multi?keywords=Bluey%20Plush')
+
+    assert response.status_code == 200
+    assert response.get_json()["partial"] is False
+    queries, _ = mock_search.call_args.args
+    assert queries == [(r, "Bluey Plush") for r in regions]
+
+
+def test_get_products_multi_all_failed(client, mocker):
+    """Test a 500 when no query succeeded."""
+    mocker.patch('backend.app.amazon_service.search_many',
+                 return_value=[_multi_result("US", error="failed")])
+
+    response = client.get('/api/products/multi?regions=US')
+
+    assert response.status_code == 500
+    assert response.get_json()["results"][0]["status"] == "error"
+
+
+@pytest.mark.parametrize("query", [
+    "regions=US,XX",
+    "item_count=abc",
+    "regions=" + ",".join(["US"] * 21),
+])
+def test_get_products_multi_invalid_params(client, mocker, query):
+    """Test unknown regions, bad item counts and oversized fan-outs are rejected."""
+    mock_search = mocker.patch('backend.app.amazon_service.search_many')
+
+    response = client.get(f'/api/products/multi?{query}')
+
+    assert response.status_code == 400
+    mock_search.assert_not_called()
+
+# --- Tests for catalogue mode ---
+
+
+@pytest.fixture
+def catalogue_mode(mocker, tmp_path):
+    """Serve /api/products from a temporary catalogue."""
+    from .catalogue import Catalogue
+    store = Catalogue(str(tmp_path / "catalogue.sqlite3"))
+    mocker.patch.dict(os.environ, {"PRODUCT_SOURCE": "catalogue"})
+    mocker.patch('backend.app.catalogue.get_catalogue', return_value=store)
+    yield store
+    store.close()
+
+
+def test_get_products_from_catalogue(client, mocker, catalogue_mode):
+    """Test catalogue mode answers from local storage without touching the PA API."""
+    from .products import ProductRecord
+    catalogue_mode.apply_snapshot(
+        "US", "Bluey Toys",
+        [ProductRecord(f"A{i}", None, None, None, None) for i in range(15)],
+        1700000000.0)
+    mock_search = mocker.patch('backend.app.amazon_service.lookup_bluey_products')
+
+    response = client.get('/api/products?region=us')
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [p["asin"] for p in data["products"]] == [f"A{i}" for i in range(10)]
+    assert data["fetched_at"] == 1700000000.0
+    mock_search.assert_not_called()
+
+    response = client.get(f'/api/products?region=US&cursor={data["next_cursor"]}')
+    assert [p["asin"] for p in response.get_json()["products"]] == [f"A{i}" for i in range(10, 15)]
+
+
+def test_get_products_from_catalogue_missing_search(client, mocker, catalogue_mode):
+    """Test a search that was never refreshed is a 404, not an upstream call."""
+    mock_search = mocker.patch('backend.app.amazon_service.lookup_bluey_products')
+
+    response = client.get('/api/products?region=US&keywords=Bluey%20Campervan')
+
+    assert response.status_code == 404
+    mock_search.assert_not_called()
+
+
+# --- Tests for bundles mode ---
+
+
+@pytest.fixture
+def bundles_mode(mocker, tmp_path):
+    """Serve /api/products from a temporary bundle build."""
+    from .bundles import BundleStore, build_bundles
+    from .products import ProductPage, ProductRecord
+    records = tuple(ProductRecord(f"A{i}", None, None, None, None) for i in range(15))
+    mocker.patch('backend.bundles.amazon_service.refresh_pages', return_value=[
+        ProductPage(records[:10], (), fetched_at=1700000000.0),
+        ProductPage(records[10:], (), fetched_at=1700000000.0)])
+    build_bundles(str(tmp_path), regions=["US"], keywords=["Bluey Toys"])
+    mocker.patch.dict(os.environ, {"PRODUCT_SOURCE": "bundles"})
+    mocker.patch('backend.app.bundles.get_bundles', return_value=BundleStore(str(tmp_path)))
+
+
+def test_get_products_from_bundles(client, mocker, bundles_mode):
+    """Test bundles mode answers from the prebuilt files without touching the PA API."""
+    mock_search = mocker.patch('backend.app.amazon_service.lookup_bluey_products')
+    record_views = mocker.patch('backend.app.prices.PRICES.record_views')
+
+    response = client.get('/api/products?region=us', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    data = json.loads(gzip.decompress(response.get_data()))
+    assert [p["asin"] for p in data["products"]] == [f"A{i}" for i in range(10)]
+    assert data["fetched_at"] == 1700000000.0
+    mock_search.assert_not_called()
+    record_views.assert_not_called()
+
+    conditional = client.get('/api/products?region=us', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+    assert conditional.status_code == 304
+
+    response = client.get(f'/api/products?region=US&cursor={data["next_cursor"]}')
+    assert [p["asin"] for p in response.get_json()["products"]] == [f"A{i}" for i in range(10, 15)]
+
+
+@pytest.mark.parametrize("query, status", [
+    ("region=US&keywords=Bluey%20Campervan", 404),
+    ("region=US&category=toys", 400),
+])
+def test_get_products_from_bundles_unavailable(client, mocker, bundles_mode, query, status):
+    mock_search = mocker.patch('backend.app.amazon_service.search_products')
+
+    assert client.get(f'/api/products?{query}').status_code == status
+    mock_search.assert_not_called()
+
+
+def test_get_products_records_views(client, mocker):
+    """Test served products are counted for price refresh scheduling."""
+    page = _mock_page_lookup(mocker)
+    record_views = mocker.patch('backend.app.prices.PRICES.record_views')
+
+    client.get('/api/products?region=gb')
+
+    record_views.assert_called_once_with("GB", page.products)
+
+
+def test_get_prices_status(client, mocker):
+    runs = [{"batches": 3, "asins": 25, "failed_batches": 0}]
+    mocker.patch('backend.app.prices.PRICES.history', return_value=runs)
+
+    response = client.get('/api/prices/status')
+
+    assert response.get_json() == {"runs": runs}
+
+
+def _index_products(region="US"):
+    amazon_service.SEARCH_INDEX.add(region, [
+        ProductRecord("A", "Bluey Plush", None, None, "$10.00"),
+        ProductRecord("B", "Bluey Campervan", None, None, "$30.00"),
+    ])
+    amazon_service.FACETS.add(region, {
+        "A": (("10", "Plush", "1"), ("1", "Toys & Games", None)),
+        "B": (("11", "Vehicles", "1"), ("1", "Toys & Games", None)),
+    })
+
+
+def test_get_categories(client):
+    _index_products()
+
+    response = client.get('/api/categories?region=us')
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["region"] == "US"
+    assert data["categories"][0] == {"id": "1", "name": "Toys & Games",
+                                     "parent_id": None, "count": 2}
+    assert {c["id"] for c in data["categories"]} == {"1", "10", "11"}
+    assert client.get('/api/categories').status_code == 400
+
+
+def test_get_products_by_category(client, mocker):
+    """Test category filtering is answered in memory without an upstream lookup."""
+    _index_products()
+    mock_search = mocker.patch('backend.app.amazon_service.lookup_bluey_products')
+
+    response = client.get('/api/products?region=US&category=11')
+    filtered = client.get('/api/products?region=US&category=1&keywords=plush')
+
+    assert [p["asin"] for p in response.get_json()["products"]] == ["B"]
+    assert [p["asin"] for p in filtered.get_json()["products"]] == ["A"]
+    mock_search.assert_not_called()
+
+
+def test_get_products_unknown_category(client):
+    _index_products()
+
+    response = client.get('/api/products?region=GB&category=11')
+
+    assert response.status_code == 404
+
+
+def test_init_app_configures_in_order(mocker):
+    """Test init_app loads .env before configuring logging and the service."""
+    calls = []
+    mocker.patch('dotenv.load_dotenv', side_effect=lambda path: calls.append(("env", path)))
+    mocker.patch('backend.app.configure_logging', side_effect=lambda: calls.append("logging"))
+    mocker.patch('backend.app.amazon_service.configure',
+                 side_effect=lambda path: calls.append(("service", path)))
+    start = mocker.patch('backend.app.start_services')
+    from .app import init_app
+
+    assert init_app("custom.env", start_background=False) is app
+
+    assert calls == [("env", "custom.env"), "logging", ("service", "custom.env")]
+    start.assert_not_called()
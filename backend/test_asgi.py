@@ -0,0 +1,251 @@
+import time
+import asyncio
+import threading
+import pytest
+from urllib.parse import urlsplit
+# Import the module we are testing
+from . import asgi
+from . import amazon_service
+from .app import app, init_app
+from .cache_backends import SQLiteBackend
+from .products import ProductPage, ProductRecord
+
+
+def _page(*asins):
+    return ProductPage(tuple(ProductRecord(a, f"Bluey {a}", None, None, "$9.99") for a in asins), ())
+
+
+@pytest.fixture(autouse=True)
+def clear_state():
+    amazon_service.CACHE.clear()
+    amazon_service.VIEWS.clear()
+    amazon_service.RESULT_ENDS.clear()
+    amazon_service.SEARCH_INDEX.clear()
+    amazon_service.FACETS.clear()
+    amazon_service.FAILURES.clear()
+    amazon_service.BREAKER.reset()
+
+
+async def _request(application, url, headers=()):
+    """Sends one GET through an ASGI app. Returns (status, headers dict, body)."""
+    parts = urlsplit(url)
+    scope = {"type": "http", "method": "GET", "path": parts.path, "root_path": "",
+             "query_string": parts.query.encode(), "http_version": "1.1", "scheme": "http",
+             "server": ("testserver", 80), "client": ("127.0.0.1", 50000),
+             "headers": [(k.lower().encode(), v.encode()) for k, v in headers]}
+    received = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        received.append(message)
+
+    await application(scope, receive, send)
+    start, body = received
+    return (start["status"], {k.decode(): v.decode() for k, v in start["headers"]},
+            body["body"])
+
+
+def _get(url, headers=()):
+    return asyncio.run(_request(asgi.application, url, headers))
+
+
+def _cache_pages(region, keywords, *pages, age=0.0):
+    stored_at = time.time() - age
+    for number, page in enumerate(pages, 1):
+        key = amazon_service._page_cache_key(region, keywords, number)
+        amazon_service.CACHE.set(key, page)
+        amazon_service.CACHE.get_entry(key).stored_at = stored_at
+
+
+def test_products_response_matches_wsgi(mocker):
+    """Test that the ASGI route keeps the Flask route's status, headers and body."""
+    mocker.patch('backend.amazon_service.lookup_bluey_products',
+                 return_value=amazon_service.SearchOutcome(_page("B1", "B2"), 12.0, False))
+    url = '/api/products?region=us&keywords=Bluey&item_count=2'
+    headers = [('Accept-Encoding', 'gzip'), ('Origin', 'http://localhost:3000')]
+
+    status, asgi_headers, body = _get(url, headers)
+    wsgi = app.test_client().get(url, headers=dict(headers))
+
+    assert status == wsgi.status_code == 200
+    assert body == wsgi.get_data()
+    for name in ('Content-Type', 'Content-Encoding', 'Vary', 'Age', 'ETag', 'Last-Modified',
+                 'Cache-Control', 'Access-Control-Allow-Origin'):
+        assert asgi_headers[name.lower()] == wsgi.headers[name], name
+
+
+@pytest.mark.parametrize("query, message", [
+    ("keywords=Bluey", "Missing required query parameter: region"),
+    ("region=US&item_count=x", "Invalid item_count parameter. Must be an integer."),
+    ("region=US&cursor=bad", "Invalid cursor parameter."),
+])
+def test_products_validation_errors(query, message):
+    status, _, body = _get(f'/api/products?{query}')
+    assert status == 400
+    assert message.encode() in body
+
+
+def test_products_conditional_request():
+    page = _page("B1")
+    _cache_pages("US", "bluey", page)
+    etag = _get('/api/products?region=US&keywords=Bluey')[1]["etag"]
+
+    status, _, body = _get('/api/products?region=US&keywords=Bluey',
+                           [('If-None-Match', etag)])
+
+    assert status == 304
+    assert body == b""
+
+
+def test_cached_products_served_on_event_loop(mocker):
+    """Test that cache hits (fresh or stale) already encoded don't hand the request to a thread."""
+    _cache_pages("US", "bluey", _page(*[f"A{n}" for n in range(10)]), _page("B1"),
+                 age=amazon_service.CACHE_DURATION_SECONDS + 1)
+    mocker.patch.object(amazon_service, '_schedule_refresh')
+    _get('/api/products?region=US&keywords=Bluey&item_count=20')  # Encodes the new view
+    executor = mocker.patch.object(amazon_service, '_SEARCH_EXECUTOR')
+    lookup = mocker.patch('backend.amazon_service.lookup_bluey_products')
+
+    status, headers, body = _get('/api/products?region=US&keywords=Bluey&item_count=20')
+
+    assert status == 200
+    assert b'"stale":true' in body and b'"B1"' in body
+    executor.submit.assert_not_called()
+    lookup.assert_not_called()
+
+
+@pytest.mark.parametrize("url", [
+    '/api/products?region=US&keywords=Bluey&item_count=20',  # A new view of cached pages
+    '/api/products?region=US&keywords=Bluey%20Plush',  # Answered by the local index
+])
+def test_slow_in_memory_work_runs_on_worker_thread(mocker, url):
+    """Test first-time compression and searches of large local indexes don't run on the event loop."""
+    _cache_pages("US", "bluey", _page(*[f"A{n}" for n in range(10)]), _page("B1"))
+    amazon_service.SEARCH_INDEX.add(
+        "US", [ProductRecord(f"P{n}", f"Bluey Plush {n}", None, None, None) for n in range(10)])
+    mocker.patch.object(amazon_service, 'ASYNC_INLINE_INDEX_MAX_PRODUCTS', 5)
+    threads = []
+    real_prepare = ProductPage.prepare
+    mocker.patch.object(ProductPage, 'prepare', autospec=True,
+                        side_effect=lambda page, stale, encoding: threads.append(
+                            threading.current_thread()) or real_prepare(page, stale, encoding))
+    real_search = amazon_service._search_locally
+    mocker.patch('backend.amazon_service._search_locally',
+                 side_effect=lambda *args: threads.append(
+                     threading.current_thread()) or real_search(*args))
+    lookup = mocker.patch('backend.amazon_service.lookup_bluey_products')
+
+    status, _, _ = _get(url, [('Accept-Encoding', 'gzip')])
+
+    assert status == 200
+    assert threads and threading.main_thread() not in threads
+    lookup.assert_not_called()
+
+
+def test_shared_cache_backend_is_only_used_off_the_loop(mocker, tmp_path):
+    """Test a shared backend's I/O (even probing for a page) runs on a worker thread."""
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    mocker.patch.object(amazon_service, 'CACHE', backend)
+    _cache_pages("US", "bluey", _page("B1"))
+    amazon_service.SEARCH_INDEX.add(
+        "US", [ProductRecord(f"P{n}", f"Bluey Plush {n}", None, None, None) for n in range(10)])
+    threads = []
+    for name in ('get_entry', 'peek', '__contains__'):
+        real = getattr(SQLiteBackend, name)
+        mocker.patch.object(SQLiteBackend, name, autospec=True,
+                            side_effect=lambda self, *args, real=real, **kwargs: threads.append(
+                                threading.current_thread()) or real(self, *args, **kwargs))
+
+    for keywords in ("Bluey", "Bluey Plush"):
+        status, _, _ = _get(f'/api/products?region=US&keywords={keywords}')
+        assert status == 200
+
+    assert threads and threading.main_thread() not in threads
+    backend.close()
+
+
+def test_page_evicted_after_check_is_not_fetched_on_the_loop(mocker):
+    """Test the in-memory path never waits on upstream, even if a page goes meanwhile."""
+    mocker.patch('backend.amazon_service._cached_until_hard_ttl', return_value=True)
+    threads = []
+    mocker.patch('backend.amazon_service.lookup_bluey_products',
+                 side_effect=lambda *args: threads.append(threading.current_thread()) or
+                 amazon_service.SearchOutcome(_page("B1"), 0.0, False))
+
+    status, _, body = _get('/api/products?region=US&keywords=Bluey')
+
+    assert status == 200
+    assert b'"B1"' in body
+    assert threads and threading.main_thread() not in threads
+
+
+def test_concurrent_misses_share_one_search(mocker):
+    """Test that identical requests waiting on upstream await one search on one thread."""
+    calls, threads = [], set()
+
+    def slow_lookup(region, keywords, item_count, offset):
+        calls.append((region, keywords, item_count, offset))
+        threads.add(threading.current_thread())
+        time.sleep(0.1)
+        return amazon_service.SearchOutcome(_page("B1"), 0.0, False)
+
+    mocker.patch('backend.amazon_service.lookup_bluey_products', side_effect=slow_lookup)
+    mocker.patch.dict('os.environ', {amazon_service.ENV_LOCAL_SEARCH: "0"})
+
+    async def main():
+        return await asyncio.gather(*(
+            _request(asgi.application, f'/api/products?region=US&keywords={kw}')
+            for kw in ["Bluey Toys", "bluey  toys", "BLUEY TOYS"] * 10))
+
+    responses = asyncio.run(main())
+
+    assert [status for status, _, _ in responses] == [200] * 30
+    assert calls == [("US", "bluey toys", 10, 0)]
+    assert len(threads) == 1
+    assert len(amazon_service.ASYNC_IN_FLIGHT) == 0
+
+
+def test_failed_search_returns_json_error(mocker):
+    mocker.patch('backend.amazon_service.lookup_bluey_products', return_value=None)
+    status, headers, body = _get('/api/products?region=US&keywords=Bluey')
+    assert status == 500
+    assert body == b'{"error":"Failed to fetch products from Amazon."}\n'
+
+
+def test_other_routes_run_on_worker_thread(mocker):
+    threads = []
+    real_stats = amazon_service.get_cache_stats
+    mocker.patch('backend.app.amazon_service.get_cache_stats',
+                 side_effect=lambda: threads.append(threading.current_thread()) or real_stats())
+
+    status, headers, body = _get('/api/cache/stats')
+
+    assert status == 200
+    assert headers["content-type"] == "application/json"
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_lifespan_runs_startup_and_shutdown():
+    events = []
+    application = asgi.AsgiApp(on_startup=lambda: events.append("start"),
+                               on_shutdown=lambda: events.append("stop"))
+    messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+    sent = []
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    asyncio.run(application({"type": "lifespan"}, receive, send))
+
+    assert events == ["start", "stop"]
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+
+
+def test_module_application_initialises_worker():
+    """Test serving backend.asgi:application directly still applies settings at startup."""
+    assert asgi.application.on_startup is init_app
@@ -0,0 +1,184 @@
+import random
+import pytest
+# Import the module we are testing
+from . import breaker
+from .breaker import NegativeCache, CircuitBreaker, backoff_delay
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class MaxJitter:
+    """Jitter source that always picks the full backoff."""
+
+    def uniform(self, a, b):
+        return b
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+# --- Tests for backoff_delay ---
+
+
+def test_backoff_delay_doubles_up_to_cap():
+    assert [backoff_delay(n, 10, 50, MaxJitter()) for n in range(1, 6)] == [10, 20, 40, 50, 50]
+
+
+def test_backoff_delay_jitter_keeps_at_least_half():
+    rng = random.Random(3)
+    delays = [backoff_delay(3, 10, 1000, rng) for _ in range(200)]
+    assert all(20 <= delay <= 40 for delay in delays)
+    assert len(set(delays)) > 1
+
+# --- Tests for NegativeCache ---
+
+
+def test_negative_cache_replays_failure_until_retry(clock):
+    cache = NegativeCache(base=10, clock=clock, rng=MaxJitter())
+    assert cache.get("k") is None
+
+    assert cache.record_failure("k", "error page", "Boom") == 10
+    assert cache.get("k") == ("error page",)
+    clock.now += 9.9
+    assert cache.get("k") == ("error page",)
+    clock.now += 0.1
+    assert cache.get("k") is None
+
+
+def test_negative_cache_replays_none_results(clock):
+    """Test a failure without a result (an exception) is still remembered."""
+    cache = NegativeCache(base=10, clock=clock)
+    cache.record_failure("k")
+    assert cache.get("k") == (None,)
+
+
+def test_negative_cache_backs_off_exponentially(clock):
+    cache = NegativeCache(base=10, cap=25, clock=clock, rng=MaxJitter())
+    assert [cache.record_failure("k") for _ in range(3)] == [10, 20, 25]
+    assert cache.stats()["entries"]["k"]["failures"] == 3
+
+
+def test_negative_cache_success_forgets_key(clock):
+    cache = NegativeCache(base=10, clock=clock, rng=MaxJitter())
+    cache.record_failure("k")
+    cache.record_failure("k")
+    cache.record_success("k")
+
+    assert cache.get("k") is None
+    assert cache.record_failure("k") == 10  # Backoff starts over
+
+
+def test_negative_cache_bounds_entries(clock):
+    cache = NegativeCache(max_entries=2, clock=clock)
+    for key in ("a", "b", "a", "c"):
+        cache.record_failure(key)
+
+    assert set(cache.stats()["entries"]) == {"a", "c"}  # "b" failed longest ago
+
+
+def test_negative_cache_stats(clock):
+    cache = NegativeCache(base=10, clock=clock, rng=MaxJitter())
+    cache.record_failure("k", error="Boom")
+    clock.now += 5
+    cache.record_failure("j")
+
+    assert cache.stats() == {
+        "keys": 2, "backing_off": 2,
+        "entries": {"k": {"failures": 1, "retry_in_seconds": 5.0, "error": "Boom"},
+                    "j": {"failures": 1, "retry_in_seconds": 10.0, "error": None}},
+    }
+    clock.now += 5
+    assert cache.stats()["backing_off"] == 1
+
+# --- Tests for CircuitBreaker ---
+
+
+@pytest.fixture
+def circuit(clock):
+    return CircuitBreaker(failure_threshold=3, cooldown=10, max_cooldown=30,
+                          clock=clock, rng=MaxJitter())
+
+
+def test_circuit_opens_after_consecutive_failures(circuit):
+    for _ in range(2):
+        circuit.record_failure("US")
+    assert circuit.allow("US")
+    assert circuit.state("US") == breaker.CLOSED
+
+    circuit.record_failure("US", "TooManyRequests: Slow down")
+    assert circuit.state("US") == breaker.OPEN
+    assert not circuit.allow("US")
+    assert circuit.allow("GB")  # Other regions are unaffected
+
+
+def test_circuit_success_resets_failure_count(circuit):
+    circuit.record_failure("US")
+    circuit.record_failure("US")
+    circuit.record_success("US")
+    circuit.record_failure("US")
+    circuit.record_failure("US")
+
+    assert circuit.state("US") == breaker.CLOSED
+
+
+def test_circuit_lets_one_probe_through_after_cooldown(circuit, clock):
+    for _ in range(3):
+        circuit.record_failure("US")
+    clock.now += 10
+
+    assert circuit.allow("US")
+    assert circuit.state("US") == breaker.HALF_OPEN
+    assert not circuit.allow("US")  # The probe is still out
+
+    circuit.record_success("US")
+    assert circuit.state("US") == breaker.CLOSED
+    assert circuit.allow("US")
+
+
+def test_circuit_failed_probe_reopens_with_longer_cooldown(circuit, clock):
+    for _ in range(3):
+        circuit.record_failure("US")
+    clock.now += 10
+    assert circuit.allow("US")
+
+    circuit.record_failure("US")
+    assert circuit.state("US") == breaker.OPEN
+    clock.now += 19
+    assert not circuit.allow("US")
+    clock.now += 1
+    assert circuit.allow("US")
+
+
+def test_circuit_released_probe_can_be_retried(circuit, clock):
+    for _ in range(3):
+        circuit.record_failure("US")
+    clock.now += 10
+    assert circuit.allow("US")
+
+    circuit.release("US")
+    assert circuit.allow("US")
+
+
+def test_circuit_stats(circuit, clock):
+    for _ in range(3):
+        circuit.record_failure("US", "Boom")
+    circuit.record_failure("GB")
+    clock.now += 4
+
+    stats = circuit.stats()
+    assert stats["US"]["state"] == breaker.OPEN
+    assert stats["US"]["consecutive_failures"] == 3
+    assert stats["US"]["retry_in_seconds"] == 6.0
+    assert stats["US"]["last_error"] == "Boom"
+    assert stats["US"]["opened_at"] is not None
+    assert stats["GB"] == {"state": breaker.CLOSED, "consecutive_failures": 1,
+                           "opened_at": None, "retry_in_seconds": 0.0, "last_error": None}
@@ -0,0 +1,240 @@
+import os
+import gzip
+import json
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch
+from amazon_paapi.errors import ItemsNotFound
+# Import the module we are testing
+from . import bundles
+from . import amazon_service
+from .bundles import BundleStore
+from .products import ProductPage, ProductRecord, encode_cursor
+from .ratelimit import UpstreamLimiter
+
+FETCHED_AT = 1700000000.0
+
+
+def _record(asin, price="$10.00"):
+    return ProductRecord(asin, f"Title {asin}", f"http://example.com/{asin}", None, price)
+
+
+def _page(*asins):
+    return ProductPage(tuple(_record(a) for a in asins), (), fetched_at=FETCHED_AT)
+
+
+def _pages(prefix, count):
+    """refresh_pages output for ``count`` results."""
+    asins = [f"{prefix}{i}" for i in range(count)]
+    return [_page(*asins[i:i + 10]) for i in range(0, count, 10)] or [_page()]
+
+
+class Clock:
+    def __init__(self, now=FETCHED_AT + 60):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def refresh(mocker):
+    """refresh_pages returning 15 results per search, prefixed by region."""
+    return mocker.patch('backend.bundles.amazon_service.refresh_pages',
+                        side_effect=lambda region, keywords, item_count: _pages(region, 15))
+
+
+def _build(directory, **kwargs):
+    kwargs.setdefault("regions", ["US", "GB"])
+    kwargs.setdefault("keywords", ["Bluey Toys"])
+    return bundles.build_bundles(str(directory), **kwargs)
+
+
+def _bundle_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".bundle"))
+
+# --- Tests for building ---
+
+
+def test_build_writes_hashed_bundles_and_manifest(tmp_path, refresh):
+    manifest = _build(tmp_path)
+
+    assert sorted(manifest["bundles"]) == ["GB", "US"]
+    assert manifest["failed"] == []
+    for bundle in manifest["bundles"].values():
+        assert bundle["file"].endswith(f"-{bundle['sha256'][:16]}.bundle")
+        assert os.path.getsize(tmp_path / bundle["file"]) == bundle["size"]
+    with open(tmp_path / bundles.MANIFEST_NAME) as f:
+        assert json.load(f) == manifest
+    assert not [n for n in os.listdir(tmp_path) if ".tmp-" in n]
+
+
+def test_rebuild_with_same_data_reuses_files(tmp_path, refresh):
+    first = _build(tmp_path)
+    second = _build(tmp_path)
+
+    assert first["bundles"] == second["bundles"]
+    assert len(_bundle_files(tmp_path)) == 2
+
+
+def test_rebuild_prunes_builds_older_than_previous(tmp_path, mocker):
+    """Test the previous build's files are kept (servers may have them mapped), older ones go."""
+    for n in range(3):
+        mocker.patch('backend.bundles.amazon_service.refresh_pages',
+                     return_value=_pages(f"X{n}-", 3))
+        _build(tmp_path, regions=["US"])
+        files = _bundle_files(tmp_path)
+        if n == 0:
+            oldest = files
+
+    assert len(files) == 2
+    assert not set(oldest) & set(files)
+
+
+@pytest.mark.parametrize("pages", [[], [_page("A"), None], [ProductPage((), ("TooManyRequests",))]])
+def test_failed_search_keeps_previous_results(tmp_path, refresh, pages):
+    _build(tmp_path)
+    refresh.side_effect = lambda region, keywords, item_count: pages if region == "US" \
+        else _pages(region, 15)
+
+    manifest = _build(tmp_path)
+
+    assert manifest["failed"] == []
+    page = BundleStore(str(tmp_path), clock=Clock()).lookup("US", "Bluey Toys").result
+    assert [p.asin for p in page.products] == [f"US{i}" for i in range(10)]
+
+
+def test_failed_search_without_previous_results_is_reported(tmp_path, refresh):
+    refresh.side_effect = lambda region, keywords, item_count: [None] if region == "GB" \
+        else _pages(region, 15)
+
+    manifest = _build(tmp_path)
+
+    assert manifest["failed"] == [["GB", "bluey toys"]]
+    assert sorted(manifest["bundles"]) == ["US"]
+
+
+def test_search_filling_its_last_page_is_bundled(tmp_path, mocker):
+    """Test 20 results (the page after them not found) are bundled, not reported as failed."""
+    def search_items(keywords, item_count, item_page):
+        if item_page > 2:
+            raise ItemsNotFound("No items have been found")
+        return SimpleNamespace(errors=None, items=[
+            SimpleNamespace(asin=f"A{(item_page - 1) * 10 + i}") for i in range(10)])
+
+    for state in (amazon_service.CACHE, amazon_service.RESULT_ENDS, amazon_service.FAILURES):
+        state.clear()
+    mocker.patch.object(amazon_service, 'UPSTREAM', UpstreamLimiter(rate=100.0, capacity=10))
+    mocker.patch('backend.amazon_service.get_client',
+                 return_value=SimpleNamespace(search_items=search_items))
+
+    manifest = _build(tmp_path, regions=["US"], keywords=["Bluey Exact"], item_count=30)
+
+    assert manifest["failed"] == []
+    outcome = BundleStore(str(tmp_path), clock=Clock()).lookup("US", "Bluey Exact", 30)
+    assert len(outcome.result.products) == 20
+    assert outcome.result.next_cursor is None
+
+# --- Tests for serving ---
+
+
+@pytest.fixture
+def store(tmp_path, refresh):
+    _build(tmp_path)
+    return BundleStore(str(tmp_path), clock=Clock())
+
+
+@pytest.mark.parametrize("stale", [False, True])
+def test_prebuilt_pages_match_product_pages(store, stale):
+    """Test bundled bodies and etags are what the live endpoint would serve."""
+    records = tuple(_record(f"US{i}") for i in range(15))
+    for offset in (0, 10):
+        expected = bundles._page_of(records, FETCHED_AT, offset, 10)
+        page = store.lookup("US", "Bluey Toys", 10, offset).result
+
+        assert isinstance(page, bundles.BundlePage)
+        assert page.body(stale) == expected.body(stale)
+        assert gzip.decompress(page.body(stale, "gzip")) == expected.body(stale)
+        assert page.etag(stale) == expected.etag(stale)
+        assert page.next_cursor == expected.next_cursor
+        assert page.products == expected.products
+
+
+def test_lookup_uses_canonical_keywords(store):
+    assert store.lookup("US", "  BLUEY toys ").result.body() == \
+        store.lookup("US", "Bluey Toys").result.body()
+
+
+def test_other_page_shapes_are_cut_from_results(store):
+    outcome = store.lookup("US", "Bluey Toys", item_count=4, offset=3)
+
+    assert [p.asin for p in outcome.result.products] == ["US3", "US4", "US5", "US6"]
+    assert outcome.result.next_cursor == encode_cursor(7)
+    assert store.lookup("US", "Bluey Toys", item_count=4, offset=3).result is outcome.result
+
+
+def test_lookup_unknown_search(store):
+    assert store.lookup("US", "Bluey Campervan") is None
+    assert store.lookup("AU", "Bluey Toys") is None
+
+
+def test_lookup_flags_old_builds_stale(store):
+    store._clock.now = FETCHED_AT + 3 * 24 * 3600
+
+    outcome = store.lookup("US", "Bluey Toys")
+
+    assert outcome.age_seconds == 3 * 24 * 3600
+    assert outcome.stale is True
+
+
+def test_missing_encoding_compresses_on_the_fly(store):
+    page = store.lookup("US", "Bluey Toys").result
+    del page._bodies["fresh"]["gzip"]
+
+    assert gzip.decompress(page.body(encoding="gzip")) == page.body()
+
+
+def test_store_picks_up_rebuilds(tmp_path, refresh):
+    _build(tmp_path)
+    clock = Clock()
+    store = BundleStore(str(tmp_path), clock=clock)
+    refresh.side_effect = lambda region, keywords, item_count: _pages("new", 3)
+    _build(tmp_path)
+
+    assert store.lookup("US", "Bluey Toys").result.products[0].asin == "US0"
+    clock.now += bundles.RELOAD_CHECK_SECONDS
+    assert store.lookup("US", "Bluey Toys").result.products[0].asin == "new0"
+
+
+def test_store_without_build(tmp_path):
+    assert BundleStore(str(tmp_path)).lookup("US", "Bluey Toys") is None
+
+
+def test_store_keeps_serving_when_new_manifest_is_bad(tmp_path, refresh):
+    _build(tmp_path)
+    clock = Clock()
+    store = BundleStore(str(tmp_path), clock=clock)
+    os.remove(tmp_path / store.files().pop())
+    with open(tmp_path / bundles.MANIFEST_NAME, "r+") as f:
+        manifest = json.load(f)
+        manifest["built_at"] += 1
+        f.seek(0)
+        json.dump(manifest, f)
+    os.utime(tmp_path / bundles.MANIFEST_NAME, ns=(0, 0))
+
+    clock.now += bundles.RELOAD_CHECK_SECONDS
+    assert store.lookup("US", "Bluey Toys") is not None
+
+
+@patch('backend.bundles.amazon_service.configure')
+def test_main_builds_and_reports_failures(mock_configure, tmp_path, mocker):
+    mocker.patch('backend.bundles.amazon_service.refresh_pages',
+                 side_effect=lambda region, keywords, item_count:
+                 _pages(region, 3) if region == "US" else [None])
+
+    assert bundles.main(['--out', str(tmp_path), '--regions', 'US,GB',
+                         '--keywords', 'Bluey Toys']) == 1
+
+    mock_configure.assert_called_once_with()
+    assert [p.asin for p in BundleStore(str(tmp_path)).lookup("US", "Bluey Toys").result.products] \
+        == ["US0", "US1", "US2"]
@@ -0,0 +1,232 @@
+import pytest
+from unittest.mock import patch
+from types import SimpleNamespace
+# Import the module we are testing
+from .cache import TTLCache, estimate_size
+
+START_TIME = 1700000000.0
+
+
+@pytest.fixture
+def mock_time():
+    """Patch time.time as seen by the cache module."""
+    with patch('backend.cache.time.time', return_value=START_TIME) as mocked:
+        yield mocked
+
+# --- Tests for TTLCache ---
+
+
+def test_get_and_set(mock_time):
+    """Test values round-trip and hits/misses are counted."""
+    cache = TTLCache()
+    assert cache.get("missing") is None
+    cache.set("key", "value")
+
+    assert cache.get("key") == "value"
+    assert "key" in cache
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+def test_peek_is_not_counted(mock_time):
+    """Test peek returns unexpired entries without touching stats or LRU order."""
+    cache = TTLCache(max_entries=2, default_ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    assert cache.peek("a").value == 1
+    assert cache.peek("missing") is None
+    cache.set("c", 3)  # Evicts "a": peeking didn't make it recently used
+
+    assert "a" not in cache
+    mock_time.return_value = START_TIME + 10
+    assert cache.peek("b") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 0)
+
+
+def test_entries_older_than_max_age_count_as_misses(mock_time):
+    """Test an entry past the caller's max_age is returned but not counted as a hit."""
+    cache = TTLCache(default_ttl=100)
+    cache.set("key", "value")
+    mock_time.return_value = START_TIME + 10
+
+    assert cache.get_entry("key", max_age=20).value == "value"
+    assert cache.get_entry("key", max_age=10).value == "value"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_entry_expires_after_ttl(mock_time):
+    """Test that an entry is dropped once its TTL has elapsed."""
+    cache = TTLCache(default_ttl=10)
+    cache.set("key", "value")
+
+    mock_time.return_value = START_TIME + 9
+    assert cache.get("key") == "value"
+
+    mock_time.return_value = START_TIME + 10
+    assert cache.get("key") is None
+    assert len(cache) == 0
+    assert cache.stats()["expirations"] == 1
+
+
+def test_per_entry_ttl_overrides_default(mock_time):
+    """Test that an explicit ttl on set takes precedence over the default."""
+    cache = TTLCache(default_ttl=10)
+    cache.set("short", "value", ttl=1)
+    cache.set("long", "value")
+
+    mock_time.return_value = START_TIME + 5
+    assert cache.get("short") is None
+    assert cache.get("long") == "value"
+
+
+def test_lru_eviction_by_entry_count(mock_time):
+    """Test that the least recently used entry is evicted at max_entries."""
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # 'a' is now most recently used
+    cache.set("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_eviction_by_byte_budget(mock_time):
+    """Test that entries are evicted when the byte budget is exceeded."""
+    cache = TTLCache(max_bytes=250, size_of=lambda value: len(value))
+    cache.set("a", b"x" * 100)
+    cache.set("b", b"x" * 100)
+    cache.set("c", b"x" * 100)
+
+    assert "a" not in cache
+    assert cache.stats()["bytes"] == 200
+    assert cache.stats()["evictions"] == 1
+
+
+def test_value_larger_than_budget_not_cached(mock_time, caplog):
+    """Test that a single oversized value is rejected rather than flushing the cache."""
+    cache = TTLCache(max_bytes=50, size_of=lambda value: len(value))
+    cache.set("small", b"x" * 10)
+    cache.set("huge", b"x" * 100)
+
+    assert "huge" not in cache
+    assert "small" in cache
+    assert "exceeds cache budget" in caplog.text
+
+
+def test_overwrite_replaces_size_accounting(mock_time):
+    """Test that overwriting a key does not double count its size."""
+    cache = TTLCache(size_of=lambda value: len(value))
+    cache.set("key", b"x" * 10)
+    cache.set("key", b"x" * 30)
+
+    assert len(cache) == 1
+    assert cache.stats()["bytes"] == 30
+
+
+def test_replace_keeps_times_and_updates_size(mock_time):
+    """Test replacing a value doesn't refresh its age and keeps the byte count right."""
+    cache = TTLCache(size_of=lambda value: len(value), default_ttl=60)
+    cache.set("key", b"x" * 10)
+
+    mock_time.return_value = START_TIME + 30
+    assert cache.replace("key", b"y" * 25) is True
+    assert cache.replace("missing", b"z") is False
+
+    entry = cache.get_entry("key")
+    assert entry.value == b"y" * 25
+    assert entry.stored_at == START_TIME
+    assert entry.expires_at == START_TIME + 60
+    assert cache.stats()["bytes"] == 25
+    assert "missing" not in cache
+
+    mock_time.return_value = START_TIME + 60
+    assert cache.replace("key", b"late") is False
+
+
+def test_replace_only_the_value_read(mock_time):
+    """Test a patch of an older read doesn't overwrite a value stored since."""
+    cache = TTLCache(default_ttl=60)
+    cache.set("key", "old")
+    mock_time.return_value = START_TIME + 10
+    cache.set("key", "new")
+
+    assert cache.replace("key", "patched old", stored_at=START_TIME) is False
+    assert cache.replace("key", "patched new", stored_at=START_TIME + 10) is True
+    assert cache.get("key") == "patched new"
+
+
+def test_lazy_sweep_on_write(mock_time):
+    """Test that writes periodically sweep expired entries of other keys."""
+    cache = TTLCache(default_ttl=10, sweep_interval=60)
+    cache.set("old", "value")
+
+    mock_time.return_value = START_TIME + 61
+    cache.set("new", "value")
+
+    assert len(cache) == 1
+    assert cache.stats()["expirations"] == 1
+
+
+def test_explicit_sweep(mock_time):
+    """Test that sweep removes only expired entries."""
+    cache = TTLCache()
+    cache.set("short", "value", ttl=5)
+    cache.set("long", "value", ttl=500)
+
+    mock_time.return_value = START_TIME + 10
+    assert cache.sweep() == 1
+    assert "long" in cache
+
+
+def test_background_sweeper_starts_and_stops():
+    """Test the background sweeper removes expired entries without access."""
+    cache = TTLCache(default_ttl=0)
+    cache.set("key", "value")
+    cache.start_sweeper(interval=0.01)
+    try:
+        for _ in range(100):
+            if len(cache) == 0:
+                break
+            cache._sweeper_stop.wait(0.01)
+        assert len(cache) == 0
+    finally:
+        cache.stop_sweeper()
+    assert cache._sweeper_thread is None
+
+
+def test_delete_and_clear(mock_time):
+    """Test removing entries and resetting the counters."""
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.delete("a") is True
+    assert cache.delete("a") is False
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()["bytes"] == 0
+    assert cache.stats()["hits"] == 0
+
+# --- Tests for estimate_size ---
+
+
+def test_estimate_size_includes_nested_objects():
+    """Test that nested attributes contribute to the estimated size."""
+    shallow = SimpleNamespace(items=[])
+    deep = SimpleNamespace(items=["x" * 1000])
+    assert estimate_size(deep) > estimate_size(shallow) + 1000
+
+
+def test_estimate_size_handles_cycles():
+    """Test that self-referencing structures do not recurse forever."""
+    node = SimpleNamespace()
+    node.self = node
+    assert estimate_size(node) > 0
@@ -0,0 +1,277 @@
+import time
+import fnmatch
+import pytest
+from unittest.mock import patch
+# Import the module we are testing
+from .cache import TTLCache
+from .products import ProductPage, ProductRecord
+from .cache_backends import (
+    SQLiteBackend, RedisBackend, create_cache_backend, serialize, deserialize,
+    COMPRESS_THRESHOLD_BYTES)
+
+START_TIME = 1700000000.0
+PRODUCTS = {"products": [{"asin": "B01", "title": "Bluey Plush",
+                          "price": "$19.99"}], "api_errors": []}
+
+
+@pytest.fixture
+def mock_time():
+    """Patch time.time as seen by the backends."""
+    with patch('backend.cache_backends.time.time', return_value=START_TIME) as mocked:
+        yield mocked
+
+
+class FakeRedis:
+    """Minimal in-process stand-in for the redis-py client API we use."""
+
+    def __init__(self):
+        self.store = {}  # { key: (value, expires_at) }
+
+    def _now(self):
+        return time.time()
+
+    def get(self, name):
+        value = self.store.get(name)
+        if value is None or self._now() >= value[1]:
+            self.store.pop(name, None)
+            return None
+        return value[0]
+
+    def set(self, name, value, px=None, xx=False):
+        if xx and self.get(name) is None:
+            return None
+        self.store[name] = (value, self._now() + px / 1000.0)
+        return True
+
+    def delete(self, *names):
+        return sum(1 for name in names if self.store.pop(name, None) is not None)
+
+    def scan_iter(self, match='*'):
+        return [key for key in list(self.store) if fnmatch.fnmatch(key, match)]
+
+# --- Tests for serialization ---
+
+
+def test_serialize_round_trip():
+    """Test that projected product data survives serialization."""
+    assert deserialize(serialize(PRODUCTS)) == PRODUCTS
+
+
+def test_serialize_compresses_large_payloads():
+    """Test that large payloads are stored compressed."""
+    large = {"products": [PRODUCTS["products"][0]] * 50, "api_errors": []}
+    data = serialize(large)
+
+    assert data[:1] == b'z'
+    assert len(data) < COMPRESS_THRESHOLD_BYTES * 2
+    assert deserialize(data) == large
+
+
+def test_serialize_product_page_stores_response_json():
+    """Test that pages are stored as their JSON body and restored intact."""
+    page = ProductPage((ProductRecord("B01", "Bluey Plush", None, None, "$19.99"),), ())
+
+    data = serialize(page)
+    restored = deserialize(data)
+
+    assert data[1:] == page.to_json()
+    assert isinstance(restored, ProductPage)
+    assert restored == page
+    assert restored.fetched_at == page.fetched_at
+
+
+def test_serialize_rejects_sdk_objects():
+    """Test that arbitrary objects are not silently pickled."""
+    with pytest.raises(TypeError):
+        serialize(object())
+
+# --- Tests for SQLiteBackend ---
+
+
+def test_sqlite_backend_shares_entries_between_instances(tmp_path, mock_time):
+    """Test that two workers using the same file see each other's entries."""
+    path = str(tmp_path / "cache.sqlite3")
+    worker_a = SQLiteBackend(path)
+    worker_b = SQLiteBackend(path)
+
+    worker_a.set("US_Bluey Toys_10", PRODUCTS, ttl=60)
+    entry = worker_b.get_entry("US_Bluey Toys_10")
+
+    assert entry.value == PRODUCTS
+    assert entry.stored_at == START_TIME
+    assert entry.expires_at == START_TIME + 60
+    assert worker_b.stats()["hits"] == 1
+    assert worker_a.stats()["hits"] == 0  # Counters are per process
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "redis"])
+def test_peek_is_not_counted(tmp_path, mock_time, kind):
+    cache = SQLiteBackend(str(tmp_path / "cache.sqlite3")) if kind == "sqlite" \
+        else RedisBackend(FakeRedis())
+    cache.set("key", PRODUCTS, ttl=10)
+
+    assert cache.peek("key").value == PRODUCTS
+    assert cache.peek("key").stored_at == START_TIME
+    assert cache.peek("missing") is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (0, 0)
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "redis"])
+def test_entries_older_than_max_age_count_as_misses(tmp_path, mock_time, kind):
+    cache = SQLiteBackend(str(tmp_path / "cache.sqlite3")) if kind == "sqlite" \
+        else RedisBackend(FakeRedis())
+    cache.set("key", PRODUCTS, ttl=100)
+    mock_time.return_value = START_TIME + 10
+
+    assert cache.get_entry("key", max_age=20).value == PRODUCTS
+    assert cache.get_entry("key", max_age=10).value == PRODUCTS
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "redis"])
+def test_replace_only_the_value_read(tmp_path, mock_time, kind):
+    cache = SQLiteBackend(str(tmp_path / "cache.sqlite3")) if kind == "sqlite" \
+        else RedisBackend(FakeRedis())
+    cache.set("key", PRODUCTS, ttl=60)
+    mock_time.return_value = START_TIME + 10
+    cache.set("key", {"new": True}, ttl=60)
+
+    assert cache.replace("key", {"patched": "old"}, stored_at=START_TIME) is False
+    assert cache.replace("key", {"patched": "new"}, stored_at=START_TIME + 10) is True
+    assert cache.get("key") == {"patched": "new"}
+
+
+def test_sqlite_backend_expires_entries(tmp_path, mock_time):
+    """Test that entries past their TTL are not returned."""
+    cache = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    cache.set("key", PRODUCTS, ttl=10)
+
+    mock_time.return_value = START_TIME + 10
+    assert "key" not in cache
+    assert cache.get("key") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_sqlite_backend_evicts_oldest_over_max_entries(tmp_path, mock_time):
+    """Test that the oldest entries are evicted when max_entries is exceeded."""
+    cache = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    for i, key in enumerate(["a", "b", "c"]):
+        mock_time.return_value = START_TIME + i
+        cache.set(key, PRODUCTS)
+
+    assert "a" not in cache
+    assert "b" in cache and "c" in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_sqlite_backend_delete_and_clear(tmp_path, mock_time):
+    """Test removing entries from the shared store."""
+    cache = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    cache.set("a", PRODUCTS)
+    cache.set("b", PRODUCTS)
+
+    assert cache.delete("a") is True
+    assert cache.delete("a") is False
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+
+
+def test_sqlite_backend_replace_keeps_times(tmp_path, mock_time):
+    """Test patching a value leaves its stored and expiry times alone."""
+    cache = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    cache.set("key", PRODUCTS, ttl=60)
+
+    mock_time.return_value = START_TIME + 30
+    assert cache.replace("key", {"patched": True}) is True
+    assert cache.replace("missing", PRODUCTS) is False
+
+    entry = cache.get_entry("key")
+    assert entry.value == {"patched": True}
+    assert entry.stored_at == START_TIME
+    assert entry.expires_at == START_TIME + 60
+    assert "missing" not in cache
+
+
+def test_sqlite_backend_uses_wal(tmp_path):
+    """Test that the database is opened in WAL mode for concurrent readers."""
+    cache = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    mode = cache._conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+# --- Tests for RedisBackend ---
+
+
+def test_redis_backend_round_trip(mock_time):
+    """Test storing and reading entries through a redis-compatible client."""
+    page = ProductPage((ProductRecord("B01", "Bluey Plush", None, None, None),), ())
+    cache = RedisBackend(FakeRedis())
+    cache.set("US_Bluey Toys_10", page, ttl=60)
+
+    entry = cache.get_entry("US_Bluey Toys_10")
+    assert entry.value == page
+    assert entry.stored_at == START_TIME
+    assert entry.expires_at == START_TIME + 60
+    assert "US_Bluey Toys_10" in cache
+
+
+def test_redis_backend_delegates_expiry(mock_time):
+    """Test that the TTL is passed to the server."""
+    client = FakeRedis()
+    cache = RedisBackend(client)
+    cache.set("key", PRODUCTS, ttl=10)
+
+    mock_time.return_value = START_TIME + 10
+    assert cache.get("key") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_redis_backend_replace_keeps_times(mock_time):
+    """Test patching a value keeps its header and remaining TTL."""
+    client = FakeRedis()
+    cache = RedisBackend(client)
+    cache.set("key", PRODUCTS, ttl=60)
+
+    mock_time.return_value = START_TIME + 20
+    assert cache.replace("key", {"patched": True}) is True
+    assert cache.replace("missing", PRODUCTS) is False
+
+    entry = cache.get_entry("key")
+    assert entry.value == {"patched": True}
+    assert entry.stored_at == START_TIME
+    mock_time.return_value = START_TIME + 60
+    assert cache.get("key") is None
+
+
+def test_redis_backend_clear_only_touches_prefix(mock_time):
+    """Test that clearing leaves keys outside the cache namespace alone."""
+    client = FakeRedis()
+    client.set("other:key", b"value", px=60000)
+    cache = RedisBackend(client, prefix="bluey:")
+    cache.set("a", PRODUCTS)
+
+    cache.clear()
+
+    assert cache.stats()["entries"] == 0
+    assert client.get("other:key") == b"value"
+
+# --- Tests for create_cache_backend ---
+
+
+def test_create_cache_backend_memory():
+    """Test that the memory backend is the LRU TTLCache."""
+    cache = create_cache_backend("memory", max_entries=5)
+    assert isinstance(cache, TTLCache)
+    assert cache.max_entries == 5
+
+
+def test_create_cache_backend_sqlite(tmp_path):
+    """Test that the sqlite backend ignores memory-only options."""
+    cache = create_cache_backend("sqlite", path=str(tmp_path / "c.sqlite3"),
+                                 max_entries=5, max_bytes=100)
+    assert isinstance(cache, SQLiteBackend)
+
+
+def test_create_cache_backend_unknown():
+    """Test that an unknown backend name is rejected."""
+    with pytest.raises(ValueError):
+        create_cache_backend("memcached")
@@ -0,0 +1,276 @@
+import time
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch
+from amazon_paapi.errors import ItemsNotFound
+# Import the module we are testing
+from . import catalogue
+from . import amazon_service
+from .catalogue import Catalogue
+from .products import ProductPage, ProductRecord, encode_cursor
+from .ratelimit import UpstreamLimiter
+
+FETCHED_AT = 1700000000.0
+
+
+def _record(asin, price="$10.00"):
+    return ProductRecord(asin, f"Title {asin}", f"http://example.com/{asin}", None, price)
+
+
+def _fetched_at(store, asin, region="US"):
+    return store._conn.execute(
+        "SELECT fetched_at FROM products WHERE region = ? AND asin = ?",
+        (region, asin)).fetchone()[0]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Catalogue(str(tmp_path / "catalogue.sqlite3"))
+    yield store
+    store.close()
+
+# --- Tests for snapshots ---
+
+
+def test_apply_snapshot_inserts_products(store):
+    """Test a first snapshot stores every product and the result order."""
+    diff = store.apply_snapshot("US", "Bluey Toys", [_record("A"), _record("B")], FETCHED_AT)
+
+    assert diff == (2, 0, 0, 0)
+    page = store.page("US", "Bluey Toys")
+    assert [p.asin for p in page.products] == ["A", "B"]
+    assert page.products[0] == _record("A")
+    assert page.fetched_at == FETCHED_AT
+    assert page.next_cursor is None
+
+
+def test_apply_snapshot_only_writes_changes(store):
+    """Test unchanged rows keep their timestamps and only changed rows are rewritten."""
+    store.apply_snapshot("US", "Bluey Toys", [_record("A"), _record("B")], FETCHED_AT)
+
+    diff = store.apply_snapshot("US", "Bluey Toys",
+                                [_record("A"), _record("B", price="$8.00")], FETCHED_AT + 86400)
+
+    assert diff == (0, 1, 1, 0)
+    assert diff.changed
+    assert _fetched_at(store, "A") == FETCHED_AT
+    assert _fetched_at(store, "B") == FETCHED_AT + 86400
+    assert store.page("US", "Bluey Toys").products[1].price == "$8.00"
+
+
+def test_apply_snapshot_identical_is_noop(store):
+    """Test re-applying the same results changes nothing but the snapshot time."""
+    records = [_record("A"), _record("B")]
+    store.apply_snapshot("US", "Bluey Toys", records, FETCHED_AT)
+    before = store._conn.total_changes
+
+    diff = store.apply_snapshot("US", "Bluey Toys", records, FETCHED_AT + 60)
+
+    assert diff == (0, 0, 2, 0)
+    assert not diff.changed
+    assert store._conn.total_changes - before == 1  # The snapshot row only
+    assert store.page("US", "Bluey Toys").fetched_at == FETCHED_AT + 60
+
+
+def test_apply_snapshot_removes_and_reorders(store):
+    """Test products dropped from a search stop being listed and order follows upstream."""
+    store.apply_snapshot("US", "Bluey Toys", [_record("A"), _record("B"), _record("C")], FETCHED_AT)
+
+    diff = store.apply_snapshot("US", "Bluey Toys", [_record("C"), _record("A")], FETCHED_AT)
+
+    assert diff == (0, 0, 2, 1)
+    assert [p.asin for p in store.page("US", "Bluey Toys").products] == ["C", "A"]
+
+
+def test_apply_snapshot_skips_unkeyed_and_duplicate_records(store):
+    diff = store.apply_snapshot("US", "Bluey Toys",
+                                [_record(None), _record("A"), _record("A")], FETCHED_AT)
+
+    assert diff.inserted == 1
+    assert [p.asin for p in store.page("US", "Bluey Toys").products] == ["A"]
+
+
+def test_regions_and_searches_are_separate(store):
+    """Test the same ASIN is stored per region and listings per keywords."""
+    store.apply_snapshot("US", "Bluey Toys", [_record("A", "$10.00")], FETCHED_AT)
+    store.apply_snapshot("GB", "Bluey Toys", [_record("A", "£9.00")], FETCHED_AT)
+    store.apply_snapshot("US", "Bluey Plush", [_record("B")], FETCHED_AT)
+
+    assert store.page("GB", "Bluey Toys").products[0].price == "£9.00"
+    assert store.page("US", "Bluey Toys").products[0].price == "$10.00"
+    assert [p.asin for p in store.page("US", "Bluey Plush").products] == ["B"]
+    assert store.page("AU", "Bluey Toys") is None
+    assert [s[:2] for s in store.searches()] == [
+        ("GB", "bluey toys"), ("US", "bluey plush"), ("US", "bluey toys")]
+
+
+def test_equivalent_keywords_share_a_search(store):
+    """Test searches are stored and looked up by canonical keywords."""
+    store.apply_snapshot("US", "Bluey Toys", [_record("A")], FETCHED_AT)
+    store.apply_snapshot("US", " bluey  TOYS!", [_record("B")], FETCHED_AT + 1)
+
+    assert [p.asin for p in store.page("US", "bluey toys").products] == ["B"]
+    assert len(store.searches()) == 1
+
+
+def test_searches_stored_before_canonical_keywords_are_renamed(tmp_path):
+    """Test an existing catalogue keeps serving its searches after upgrading."""
+    path = str(tmp_path / "old.sqlite3")
+    old = Catalogue(path)
+    old.apply_snapshot("US", "Bluey Toys", [_record("A")], FETCHED_AT)
+    old.apply_snapshot("US", "Bluey Plush", [_record("B")], FETCHED_AT)
+    old.apply_snapshot("US", "Bluey Figures", [_record("D")], FETCHED_AT + 1)
+    with old._lock:
+        # As written by earlier versions
+        old._conn.execute("UPDATE snapshots SET keywords = 'Bluey Toys' WHERE keywords = 'bluey toys'")
+        old._conn.execute("UPDATE listings SET keywords = 'Bluey Toys' WHERE keywords = 'bluey toys'")
+        old._conn.execute("UPDATE snapshots SET keywords = 'Bluey Figures' WHERE keywords = 'bluey figures'")
+        old._conn.execute("UPDATE listings SET keywords = 'Bluey Figures' WHERE keywords = 'bluey figures'")
+        # An older snapshot of the same search, superseded by the canonical one
+        old._conn.execute("INSERT INTO snapshots VALUES ('US', 'BLUEY PLUSH', ?)", (FETCHED_AT - 1,))
+    old.close()
+
+    store = Catalogue(path)
+
+    assert [p.asin for p in store.page("US", "Bluey Toys").products] == ["A"]
+    assert [p.asin for p in store.page("US", "Bluey Plush").products] == ["B"]
+    assert [s[1] for s in store.searches()] == ["bluey figures", "bluey plush", "bluey toys"]
+    store.close()
+
+# --- Tests for reads ---
+
+
+def test_page_paginates_with_cursor(store):
+    store.apply_snapshot("US", "Bluey Toys", [_record(f"A{i}") for i in range(25)], FETCHED_AT)
+
+    first = store.page("US", "Bluey Toys", 0, 10)
+    last = store.page("US", "Bluey Toys", 20, 10)
+
+    assert [p.asin for p in first.products] == [f"A{i}" for i in range(10)]
+    assert first.next_cursor == encode_cursor(10)
+    assert [p.asin for p in last.products] == [f"A{i}" for i in range(20, 25)]
+    assert last.next_cursor is None
+
+
+def test_page_is_memoized_until_next_snapshot(store):
+    """Test repeated reads reuse the page (and its encoded bodies)."""
+    store.apply_snapshot("US", "Bluey Toys", [_record("A")], FETCHED_AT)
+    page = store.page("US", "Bluey Toys")
+    assert store.page("US", "Bluey Toys") is page
+
+    store.apply_snapshot("US", "Bluey Toys", [_record("B")], FETCHED_AT + 1)
+
+    assert store.page("US", "Bluey Toys").products[0].asin == "B"
+
+
+@patch('backend.catalogue.time.time', return_value=FETCHED_AT + 3 * 24 * 3600)
+def test_lookup_flags_old_snapshots_stale(mock_time, store):
+    store.apply_snapshot("US", "Bluey Toys", [_record("A")], FETCHED_AT)
+
+    outcome = store.lookup("US", "Bluey Toys")
+
+    assert outcome.age_seconds == 3 * 24 * 3600
+    assert outcome.stale is True
+    assert store.lookup("US", "Bluey Plush") is None
+
+# --- Tests for the refresh job ---
+
+
+def _page(*asins):
+    return ProductPage(tuple(_record(a) for a in asins), (), fetched_at=FETCHED_AT)
+
+
+@patch('backend.catalogue.amazon_service.refresh_pages')
+def test_refresh_search_applies_all_pages(mock_refresh, store):
+    mock_refresh.return_value = [_page(*[f"A{i}" for i in range(10)]), _page("B0", "B1")]
+
+    diff = catalogue.refresh_search(store, "US", "Bluey Toys", item_count=11)
+
+    mock_refresh.assert_called_once_with("US", "Bluey Toys", 11)
+    assert diff.inserted == 11
+    assert len(store.page("US", "Bluey Toys", limit=20).products) == 11
+
+
+@pytest.mark.parametrize("pages", [
+    [],
+    [_page("A"), None],
+    [ProductPage((), ("TooManyRequests",))],
+])
+@patch('backend.catalogue.amazon_service.refresh_pages')
+def test_refresh_search_keeps_snapshot_on_failure(mock_refresh, store, pages):
+    """Test a failed fetch never truncates what is stored."""
+    store.apply_snapshot("US", "Bluey Toys", [_record("A"), _record("B")], FETCHED_AT)
+    mock_refresh.return_value = pages
+
+    assert catalogue.refresh_search(store, "US", "Bluey Toys") is None
+    assert len(store.page("US", "Bluey Toys").products) == 2
+
+
+def test_refresh_search_stores_full_last_page(store, mocker):
+    """Test 20 results (the page after them not found) are stored, not reported as failed."""
+    def search_items(keywords, item_count, item_page):
+        if item_page > 2:
+            raise ItemsNotFound("No items have been found")
+        return SimpleNamespace(errors=None, items=[
+            SimpleNamespace(asin=f"A{(item_page - 1) * 10 + i}") for i in range(10)])
+
+    for state in (amazon_service.CACHE, amazon_service.RESULT_ENDS, amazon_service.FAILURES):
+        state.clear()
+    mocker.patch.object(amazon_service, 'UPSTREAM', UpstreamLimiter(rate=100.0, capacity=10))
+    mocker.patch('backend.amazon_service.get_client',
+                 return_value=SimpleNamespace(search_items=search_items))
+
+    diff = catalogue.refresh_search(store, "US", "Bluey Exact", item_count=30)
+
+    assert diff is not None and diff.inserted == 20
+    assert len(store.page("US", "Bluey Exact", limit=30).products) == 20
+
+
+@patch('backend.catalogue.amazon_service.refresh_pages')
+def test_main_refreshes_every_search(mock_refresh, tmp_path):
+    """Test the CLI refreshes region x keyword pairs and reports failures."""
+    mock_refresh.side_effect = lambda region, keywords, item_count: \
+        [_page(f"{region}-1")] if region == "US" else [None]
+    path = str(tmp_path / "cli.sqlite3")
+
+    assert catalogue.main(['--path', path, '--regions', 'US,GB',
+                           '--keywords', 'Bluey Toys']) == 1
+
+    store = Catalogue(path)
+    assert [p.asin for p in store.page("US", "Bluey Toys").products] == ["US-1"]
+    assert store.page("GB", "Bluey Toys") is None
+    store.close()
+
+# --- Tests for offer patches ---
+
+
+def test_patch_offers_updates_only_changed_rows(store):
+    """Test a price refresh rewrites just the products whose offer changed."""
+    store.apply_snapshot("US", "Bluey Toys", [_record("A"), _record("B")], FETCHED_AT)
+    page = store.page("US", "Bluey Toys")
+
+    changed = store.patch_offers("US", {"A": ("$7.00", "In Stock"),
+                                        "B": ("$10.00", None),
+                                        "Z": ("$1.00", None)}, FETCHED_AT + 60)
+
+    assert changed == 1
+    assert _fetched_at(store, "A") == FETCHED_AT + 60
+    assert _fetched_at(store, "B") == FETCHED_AT
+    patched = store.page("US", "Bluey Toys")
+    assert patched is not page
+    assert patched.products[0].price == "$7.00"
+    assert patched.products[0].availability == "In Stock"
+
+
+def test_page_memo_sees_other_connections_writes(tmp_path):
+    """Test a worker's memoized pages are dropped when the refresh job commits."""
+    path = str(tmp_path / "shared.sqlite3")
+    worker, job = Catalogue(path), Catalogue(path)
+    job.apply_snapshot("US", "Bluey Toys", [_record("A")], FETCHED_AT)
+    assert worker.page("US", "Bluey Toys").products[0].price == "$10.00"
+
+    job.patch_offers("US", {"A": ("$5.00", None)})
+
+    assert worker.page("US", "Bluey Toys").products[0].price == "$5.00"
+    worker.close()
+    job.close()
@@ -0,0 +1,67 @@
+import gzip
+import pytest
+from werkzeug.http import parse_accept_header
+# Import the module we are testing
+from . import compression
+
+BODY = b'{"products":[{"asin":"B01","title":"Bluey Plush"}],"api_errors":[]}' * 10
+
+
+@pytest.fixture
+def no_brotli(monkeypatch):
+    """Simulate an environment without the optional brotli package."""
+    monkeypatch.setattr(compression, 'brotli', None)
+
+# --- Tests for negotiate ---
+
+
+@pytest.mark.parametrize("header, expected", [
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip, deflate, br', 'br'),
+    ('gzip;q=1.0, br;q=0.5', 'gzip'),
+    ('br;q=0, gzip;q=0', None),
+    ('deflate', None),
+    ('*', 'br'),
+])
+def test_negotiate(header, expected):
+    """Test Accept-Encoding negotiation honours q-values and server preference."""
+    pytest.importorskip("brotli")
+    assert compression.negotiate(parse_accept_header(header)) == expected
+
+
+def test_negotiate_without_brotli(no_brotli):
+    """Test that br is never chosen when brotli isn't installed."""
+    assert compression.available_encodings() == ('gzip',)
+    assert compression.negotiate(parse_accept_header('br, gzip;q=0.5')) == 'gzip'
+    assert compression.negotiate(parse_accept_header('br')) is None
+
+# --- Tests for compress ---
+
+
+def test_compress_gzip_is_deterministic():
+    """Test gzip output is stable so ETags and caches stay consistent."""
+    data = compression.compress(BODY, 'gzip')
+    assert data == compression.compress(BODY, 'gzip')
+    assert gzip.decompress(data) == BODY
+    assert len(data) < len(BODY)
+
+
+def test_compress_brotli_round_trip():
+    """Test brotli compression when the optional package is available."""
+    brotli = pytest.importorskip("brotli")
+    data = compression.compress(BODY, 'br')
+    assert brotli.decompress(data) == BODY
+
+
+def test_compress_unknown_encoding():
+    """Test that unsupported encodings raise."""
+    with pytest.raises(ValueError):
+        compression.compress(BODY, 'compress')
+
+
+def test_compress_brotli_unavailable(no_brotli):
+    """Test that br raises cleanly without the optional package."""
+    with pytest.raises(ValueError):
+        compression.compress(BODY, 'br')
@@ -0,0 +1,79 @@
+import pytest
+# Import the module we are testing
+from . import facets
+from .facets import FacetIndex
+
+TOYS = ("165793011", "Toys & Games", None)
+PLUSH = ("166461011", "Stuffed Animals & Plush Toys", "165793011")
+VEHICLES = ("166092011", "Toy Vehicles", "165793011")
+
+
+class FakeClock:
+    """Manually advanced wall clock."""
+
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def index(clock):
+    index = FacetIndex(max_age=3600, clock=clock)
+    index.add("US", {"A": (PLUSH, TOYS), "B": (PLUSH, TOYS), "C": (VEHICLES, TOYS)})
+    return index
+
+
+def test_categories_with_counts(index):
+    """Test categories are listed most populated first with their parents."""
+    assert index.categories("US") == [
+        {"id": TOYS[0], "name": "Toys & Games", "parent_id": None, "count": 3},
+        {"id": PLUSH[0], "name": "Stuffed Animals & Plush Toys", "parent_id": TOYS[0], "count": 2},
+        {"id": VEHICLES[0], "name": "Toy Vehicles", "parent_id": TOYS[0], "count": 1},
+    ]
+    assert index.categories("GB") == []
+
+
+def test_members(index):
+    assert index.members("US", PLUSH[0]) == {"A", "B"}
+    assert index.members("US", "missing") is None
+    assert index.members("GB", PLUSH[0]) is None
+
+
+def test_refetch_updates_incrementally(index):
+    """Test a re-fetched product moves between categories and empty ones disappear."""
+    plush = index.members("US", PLUSH[0])
+    toys = index.members("US", TOYS[0])
+    generation = index.generation("US")
+
+    index.add("US", {"C": (PLUSH, TOYS)})
+
+    assert index.members("US", PLUSH[0]) == {"A", "B", "C"}
+    assert index.members("US", VEHICLES[0]) is None
+    assert index.members("US", TOYS[0]) is toys  # Untouched categories keep their snapshot
+    assert plush == {"A", "B"}  # Earlier snapshots are immutable
+    assert index.generation("US") > generation
+
+    generation = index.generation("US")
+    index.add("US", {"A": (PLUSH, TOYS)})  # Unchanged
+    assert index.generation("US") == generation
+
+
+def test_products_expire_after_max_age(index, clock):
+    clock.now += 3000
+    index.add("US", {"A": (PLUSH, TOYS)})
+    clock.now += facets.PRUNE_INTERVAL_SECONDS + 700
+
+    index.add("US", {})
+
+    # Ties are listed by name
+    assert index.categories("US") == [
+        {"id": PLUSH[0], "name": "Stuffed Animals & Plush Toys", "parent_id": TOYS[0], "count": 1},
+        {"id": TOYS[0], "name": "Toys & Games", "parent_id": None, "count": 1},
+    ]
@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import logging
+import threading
+import subprocess
+import pytest
+# Import the module we are testing
+from . import log_config
+from .log_config import SampleFilter, configure_logging, shutdown_logging
+
+
+@pytest.fixture
+def restore_root_logger():
+    """configure_logging replaces the root handlers (including pytest's); put them back."""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    shutdown_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def _read(path) -> list:
+    return path.read_text(encoding="utf-8").splitlines()
+
+
+def test_records_are_written_by_listener_thread(tmp_path, restore_root_logger, mocker):
+    log_file = tmp_path / "service.log"
+    configure_logging(log_file=str(log_file), level="INFO", json_output=False)
+    writers = []
+    real_emit = logging.FileHandler.emit
+    mocker.patch.object(logging.FileHandler, 'emit', autospec=True,
+                        side_effect=lambda self, record: (writers.append(threading.current_thread()),
+                                                          real_emit(self, record)))
+
+    logging.info("Product query: region=%s keywords=%r", "US", "Bluey Toys")
+    logging.debug("Not at this level")
+    shutdown_logging()  # Drains the queue
+
+    lines = _read(log_file)
+    assert len(lines) == 1
+    assert lines[0].endswith(" - INFO - Product query: region=US keywords='Bluey Toys'")
+    assert writers and threading.current_thread() not in writers
+
+
+def test_formatting_is_deferred_to_listener(tmp_path, restore_root_logger, mocker):
+    """Test the request thread only enqueues; the message is built when written."""
+    configure_logging(log_file=str(tmp_path / "service.log"), level="INFO")
+    formatted_on = []
+
+    class Arg:
+        def __str__(self):
+            formatted_on.append(threading.current_thread())
+            return "arg"
+
+    logging.info("value=%s", Arg())
+    shutdown_logging()
+
+    assert len(formatted_on) >= 1
+    assert threading.current_thread() not in formatted_on
+
+
+def test_json_output(tmp_path, restore_root_logger):
+    log_file = tmp_path / "service.log"
+    configure_logging(log_file=str(log_file), level="INFO", json_output=True)
+
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("backend.test").error("Failed for %s", "US", exc_info=True)
+    shutdown_logging()
+
+    record = json.loads(_read(log_file)[0])
+    assert record["level"] == "ERROR"
+    assert record["logger"] == "backend.test"
+    assert record["message"] == "Failed for US"
+    assert "ValueError: boom" in record["exc_info"]
+    assert record["time"].endswith("+00:00")
+
+
+def test_cache_hits_are_sampled(tmp_path, restore_root_logger):
+    log_file = tmp_path / "service.log"
+    configure_logging(log_file=str(log_file), level="INFO", cache_hit_sample_rate=0.25)
+
+    hits = logging.getLogger(log_config.CACHE_HIT_LOGGER)
+    for n in range(8):
+        hits.info("Returning cached result %s", n)
+    logging.info("Not sampled")
+    shutdown_logging()
+
+    lines = _read(log_file)
+    assert [line.rsplit(" ", 1)[1] for line in lines if "cached result" in line] == ["0", "4"]
+    assert any(line.endswith("Not sampled") for line in lines)
+
+
+@pytest.mark.parametrize("rate, kept", [(None, 0), (1.0, 2)])
+def test_queries_are_opt_in(tmp_path, restore_root_logger, rate, kept):
+    log_file = tmp_path / "service.log"
+    configure_logging(log_file=str(log_file), level="INFO", query_sample_rate=rate)
+
+    for keywords in ("Bluey Toys", "Bingo"):
+        logging.getLogger(log_config.QUERY_LOGGER).info("Product query: keywords=%r", keywords)
+    shutdown_logging()
+
+    assert sum("Product query" in line for line in _read(log_file)) == kept
+
+
+def test_reconfiguring_replaces_previous_setup(tmp_path, restore_root_logger):
+    configure_logging(log_file=str(tmp_path / "a.log"), level="INFO")
+    configure_logging(log_file="", level="WARNING")
+
+    root = logging.getLogger()
+    assert len(root.handlers) == 1
+    assert root.level == logging.WARNING
+    assert len(logging.getLogger(log_config.CACHE_HIT_LOGGER).filters) == 1
+    assert len(logging.getLogger(log_config.QUERY_LOGGER).filters) == 1
+
+
+def test_configuration_from_environment(tmp_path, restore_root_logger, monkeypatch):
+    log_file = tmp_path / "env.log"
+    monkeypatch.setenv(log_config.ENV_LOG_FILE, str(log_file))
+    monkeypatch.setenv(log_config.ENV_LOG_LEVEL, "warning")
+    monkeypatch.setenv(log_config.ENV_LOG_JSON, "1")
+
+    configure_logging()
+    logging.info("dropped")
+    logging.warning("kept")
+    shutdown_logging()
+
+    assert [json.loads(line)["message"] for line in _read(log_file)] == ["kept"]
+
+
+@pytest.mark.parametrize("rate, kept", [(1.0, 6), (0.5, 3), (0.0, 0)])
+def test_sample_filter(rate, kept):
+    sample = SampleFilter(rate)
+    record = logging.makeLogRecord({})
+    assert sum(sample.filter(record) for _ in range(6)) == kept
+
+
+def test_importing_service_configures_nothing():
+    """Importing the service must not add handlers or open log files."""
+    code = ("import logging, backend.amazon_service; "
+            "assert logging.getLogger().handlers == [], logging.getLogger().handlers")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,132 @@
+import gc
+import threading
+import pytest
+# Import the module we are testing
+from . import metrics
+from .metrics import Counter, Gauge, Histogram, Registry, Family
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def _run_in_threads(fn, n_threads=8):
+    threads = [threading.Thread(target=fn) for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+# --- Tests for recording ---
+
+
+def test_counter_sums_across_threads(registry):
+    counter = Counter("calls", "Calls.", registry=registry)
+
+    _run_in_threads(lambda: [counter.inc() for _ in range(1000)])
+    counter.inc(5)
+
+    assert counter.labels().value() == 8005
+
+
+def test_counts_survive_thread_exit(registry):
+    """Test a finished thread's cells are folded into the total, not lost or kept per thread."""
+    counter = Counter("calls", "Calls.", registry=registry)
+    for _ in range(50):
+        _run_in_threads(counter.inc, n_threads=2)
+    gc.collect()
+
+    child = counter.labels()
+    assert child.value() == 100
+    assert len(child._cells._live) <= 1  # Only threads still alive keep cells
+
+
+def test_gauge_inc_and_dec_on_different_threads(registry):
+    gauge = Gauge("in_flight", "In flight.", registry=registry)
+    gauge.inc(3)
+    _run_in_threads(gauge.dec, n_threads=2)
+
+    assert gauge.labels().value() == 1
+
+
+def test_histogram_buckets_are_upper_inclusive(registry):
+    histogram = Histogram("latency", "Latency.", buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.1, 0.5, 1.0, 3.0):
+        histogram.observe(value)
+
+    samples = {(suffix, labels.get("le")): value
+               for suffix, labels, value in histogram.collect().samples}
+    assert samples[("_bucket", "0.1")] == 2
+    assert samples[("_bucket", "1")] == 4
+    assert samples[("_bucket", "+Inf")] == 5
+    assert samples[("_count", None)] == 5
+    assert samples[("_sum", None)] == pytest.approx(4.65)
+
+
+def test_histogram_time(registry, mocker):
+    histogram = Histogram("latency", "Latency.", ["region"], registry=registry)
+    mocker.patch('backend.metrics.time.perf_counter', side_effect=[10.0, 10.25])
+
+    with histogram.labels("US").time():
+        pass
+
+    assert ("_sum", {"region": "US"}, 0.25) in histogram.collect().samples
+
+
+def test_labels_are_validated(registry):
+    histogram = Histogram("latency", "Latency.", ["region"], registry=registry)
+    with pytest.raises(ValueError):
+        histogram.labels("US", "extra")
+    with pytest.raises(ValueError):
+        histogram.observe(1.0)  # Labelled metrics need labels()
+
+
+def test_label_values_are_strings(registry):
+    counter = Counter("responses", "Responses.", ["status"], registry=registry)
+    counter.labels(200).inc()
+    counter.labels("200").inc()
+
+    assert counter.collect().samples == [("_total", {"status": "200"}, 2)]
+
+
+def test_duplicate_names_rejected(registry):
+    Counter("calls", "Calls.", registry=registry)
+    with pytest.raises(ValueError):
+        Gauge("calls", "Calls again.", registry=registry)
+
+# --- Tests for the exposition format ---
+
+
+def test_exposition(registry):
+    counter = Counter("calls", "Calls made.", ["region"], registry=registry)
+    counter.labels("US").inc(2)
+    Gauge("idle", "Nothing recorded.", registry=registry)
+    registry.add_collector(lambda: [
+        Family("cache_entries", "gauge", "Entries\nin cache.", [("", {}, 7)])])
+
+    assert registry.exposition() == (
+        '# HELP calls Calls made.\n'
+        '# TYPE calls counter\n'
+        'calls_total{region="US"} 2\n'
+        '# HELP idle Nothing recorded.\n'
+        '# TYPE idle gauge\n'
+        'idle 0\n'  # Unlabelled metrics are exported from the start
+        '# HELP cache_entries Entries\\nin cache.\n'
+        '# TYPE cache_entries gauge\n'
+        'cache_entries 7\n'
+    )
+
+
+def test_exposition_escapes_label_values(registry):
+    counter = Counter("searches", "Searches.", ["keywords"], registry=registry)
+    counter.labels('say "hi"\\').inc()
+
+    assert 'searches_total{keywords="say \\"hi\\"\\\\"} 1' in registry.exposition()
+
+
+def test_default_registry_holds_app_metrics():
+    from . import app  # noqa: F401  (registers the request metrics)
+    for name in ("http_request_duration_seconds", "paapi_request_duration_seconds",
+                 "response_serialization_seconds", "http_requests_in_flight"):
+        assert metrics.REGISTRY.get(name) is not None
@@ -0,0 +1,156 @@
+import pytest
+from unittest.mock import patch
+# Import the module we are testing
+from . import prices
+from .prices import PriceRefresher
+from .products import ProductRecord
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _records(*asins):
+    return [ProductRecord(asin, None, None, None, None) for asin in asins]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def refresher(clock):
+    return PriceRefresher(hot_count=1, hot_interval=10, cold_interval=100, clock=clock)
+
+
+@pytest.fixture(autouse=True)
+def tracked(mocker):
+    """Every ASIN is on a page this process fetched, unless a test says otherwise."""
+    return mocker.patch('backend.prices.amazon_service.tracked_asins',
+                        side_effect=lambda region, asins: list(asins))
+
+# --- Tests for scheduling ---
+
+
+def test_nothing_due_right_after_being_shown(refresher):
+    """Test products shown with a fresh page wait an interval before refreshing."""
+    refresher.record_views("US", _records("A", "B"))
+    assert refresher.due() == {}
+
+
+def test_hot_asins_refresh_more_often(refresher, clock):
+    """Test the most viewed ASIN is due on the hot schedule and others on the cold one."""
+    for _ in range(3):
+        refresher.record_views("US", _records("A"))
+    refresher.record_views("US", _records("B", None))
+    refresher.record_views("GB", _records("A"))
+
+    clock.now += 10
+    assert refresher.due() == {"US": ["A"], "GB": ["A"]}  # Each region has its own hot set
+
+    clock.now += 90
+    assert refresher.due()["US"] == ["A", "B"]  # Hottest first
+
+
+def test_views_decay_and_unseen_asins_are_forgotten(refresher, clock):
+    """Test hotness follows recent traffic and long-unseen ASINs stop being refreshed."""
+    refresher.record_views("US", _records("A"))
+    for _ in range(4):
+        refresher.record_views("US", _records("B"))
+
+    for _ in range(4):
+        clock.now += prices.VIEW_DECAY_SECONDS
+        refresher._decay_views()
+
+    assert ("US", "A") not in refresher._refreshed
+    assert refresher.due() == {"US": ["B"]}
+
+
+def test_views_decay_by_time_elapsed(refresher, clock):
+    """Test a run after a long gap decays views by the whole gap, not one half-life."""
+    for _ in range(8):
+        refresher.record_views("US", _records("A"))
+
+    clock.now += 3 * prices.VIEW_DECAY_SECONDS
+    refresher._decay_views()
+
+    assert refresher._views[("US", "A")] == pytest.approx(1.0)
+
+# --- Tests for run_once ---
+
+
+@patch('backend.prices.amazon_service.patch_cached_offers', return_value=1)
+@patch('backend.prices.amazon_service.get_item_offers')
+def test_run_once_batches_get_items_calls(mock_offers, mock_patch, refresher, clock):
+    """Test due ASINs are fetched 10 at a time and patched into the cache."""
+    asins = [f"A{i:02}" for i in range(25)]
+    refresher.record_views("US", _records(*asins))
+    clock.now += 100
+    mock_offers.side_effect = lambda region, batch: {a: ("$1.00", "In Stock") for a in batch}
+
+    summary = refresher.run_once()
+
+    assert [len(c.args[1]) for c in mock_offers.call_args_list] == [10, 10, 5]
+    assert sorted(a for c in mock_offers.call_args_list for a in c.args[1]) == asins
+    assert mock_patch.call_count == 3
+    assert summary["batches"] == 3
+    assert summary["asins"] == 25
+    assert summary["patched_pages"] == 3
+    assert refresher.due() == {}  # Nothing due until the next interval
+    assert refresher.history() == [summary]
+
+
+@patch('backend.prices.amazon_service.patch_cached_offers')
+@patch('backend.prices.amazon_service.get_item_offers', return_value=None)
+def test_run_once_failed_batch_waits_an_interval(mock_offers, mock_patch, refresher, clock):
+    """Test a failing region isn't retried on every tick."""
+    refresher.record_views("US", _records("A"))
+    clock.now += 100
+
+    summary = refresher.run_once()
+
+    assert summary["failed_batches"] == 1
+    mock_patch.assert_not_called()
+    assert refresher.due() == {}
+
+
+@patch('backend.prices.amazon_service.patch_cached_offers', return_value=1)
+@patch('backend.prices.amazon_service.get_item_offers')
+def test_run_once_skips_untracked_asins(mock_offers, mock_patch, refresher, clock, tracked):
+    """Test ASINs whose pages this process doesn't have (e.g. a shared cache) cost no GetItems call."""
+    refresher.record_views("US", _records("A", "B", "C"))
+    refresher.record_views("GB", _records("D"))
+    clock.now += 100
+    tracked.side_effect = lambda region, asins: [a for a in asins if a == "B"]
+    mock_offers.side_effect = lambda region, batch: {a: ("$1.00", "In Stock") for a in batch}
+
+    summary = refresher.run_once()
+
+    mock_offers.assert_called_once_with("US", ["B"])
+    assert summary["skipped_asins"] == 3
+    assert refresher.due() == {}  # Skipped ones are checked again an interval later
+
+
+@patch('backend.prices.catalogue.serve_from_catalogue', return_value=True)
+@patch('backend.prices.catalogue.get_catalogue')
+@patch('backend.prices.amazon_service.patch_cached_offers', return_value=0)
+@patch('backend.prices.amazon_service.get_item_offers')
+def test_run_once_patches_catalogue_when_serving_from_it(
+        mock_offers, mock_patch, mock_get_catalogue, mock_mode, refresher, clock):
+    offers = {"A": ("$2.00", "In Stock")}
+    mock_offers.return_value = offers
+    mock_get_catalogue.return_value.patch_offers.return_value = 1
+    refresher.record_views("US", _records("A"))
+    clock.now += 10
+
+    summary = refresher.run_once()
+
+    mock_get_catalogue.return_value.patch_offers.assert_called_once_with("US", offers)
+    assert summary["patched_rows"] == 1
@@ -0,0 +1,179 @@
+import gzip
+import json
+import pytest
+from types import SimpleNamespace
+# Import the module we are testing
+from .products import ProductPage, ProductRecord, project_search_result, project_offer, project_features, project_categories, encode_cursor, decode_cursor
+
+
+def _make_item(asin='B01N7P1G3A', title='Bluey Plush', price='$19.99',
+               image='http://example.com/image.jpg'):
+    """Build a PA API-like item with the nested attributes we read."""
+    return SimpleNamespace(
+        asin=asin,
+        item_info=SimpleNamespace(title=SimpleNamespace(display_value=title)),
+        detail_page_url='http://example.com/bluey',
+        images=SimpleNamespace(primary=SimpleNamespace(
+            large=SimpleNamespace(url=image))),
+        offers=SimpleNamespace(listings=[SimpleNamespace(
+            price=SimpleNamespace(display_amount=price))])
+    )
+
+# --- Tests for project_search_result ---
+
+
+def test_project_search_result_extracts_fields():
+    """Test that the displayed fields are extracted from each item."""
+    result = SimpleNamespace(items=[_make_item()], errors=None)
+
+    projected = project_search_result(result)
+
+    assert projected.products == (ProductRecord(
+        asin='B01N7P1G3A',
+        title='Bluey Plush',
+        url='http://example.com/bluey',
+        image='http://example.com/image.jpg',
+        price='$19.99',
+    ),)
+    assert projected.api_errors == ()
+
+
+def test_project_search_result_partial_data():
+    """Test that missing images/offers project to None."""
+    item = SimpleNamespace(
+        asin='B01N7P1G3B',
+        item_info=SimpleNamespace(
+            title=SimpleNamespace(display_value='Bluey Figure')),
+        detail_page_url='http://example.com/bluey2',
+        images=None,
+        offers=None
+    )
+
+    product = project_search_result(
+        SimpleNamespace(items=[item], errors=None)).products[0]
+
+    assert product.title == 'Bluey Figure'
+    assert product.image is None
+    assert product.price is None
+
+
+def test_project_search_result_errors_are_stringified():
+    """Test that API errors are converted to strings."""
+    result = SimpleNamespace(items=None, errors=[ValueError("Throttled")])
+
+    projected = project_search_result(result)
+
+    assert projected.products == ()
+    assert projected.api_errors == ("Throttled",)
+
+
+def test_product_record_uses_slots():
+    """Test that records carry no per-instance __dict__."""
+    record = ProductRecord('B01', None, None, None, None)
+    assert not hasattr(record, '__dict__')
+
+# --- Tests for ProductPage ---
+
+
+def _make_page():
+    return project_search_result(SimpleNamespace(items=[_make_item()], errors=None))
+
+
+def test_page_body_is_response_json():
+    """Test that the fresh body carries products, errors and freshness."""
+    page = _make_page()
+
+    body = json.loads(page.body())
+
+    assert body["products"][0]["asin"] == 'B01N7P1G3A'
+    assert body["api_errors"] == []
+    assert body["fetched_at"] == page.fetched_at
+    assert body["stale"] is False
+    assert json.loads(page.body(stale=True))["stale"] is True
+
+
+def test_page_body_is_memoized():
+    """Test that each body variant is encoded only once."""
+    page = _make_page().encode()
+
+    assert page.body() is page.body()
+    assert page.body(encoding='gzip') is page.body(encoding='gzip')
+    assert gzip.decompress(page.body(encoding='gzip')) == page.body()
+
+
+def test_page_body_rejects_unknown_encoding():
+    """Test that unsupported encodings raise rather than serving garbage."""
+    with pytest.raises(ValueError):
+        _make_page().body(encoding='compress')
+
+
+def test_page_json_round_trip():
+    """Test that a page rebuilt from its JSON equals the original."""
+    page = _make_page()
+
+    restored = ProductPage.from_json(page.to_json())
+
+    assert restored == page
+    assert restored.fetched_at == page.fetched_at
+    assert restored.body() == page.body()
+
+
+def test_page_json_round_trip_keeps_cursor():
+    """Test that the pagination cursor is part of the body and survives storage."""
+    page = _make_page()
+    page.next_cursor = encode_cursor(10)
+
+    restored = ProductPage.from_json(page.to_json())
+
+    assert json.loads(page.body())["next_cursor"] == page.next_cursor
+    assert restored.next_cursor == page.next_cursor
+
+
+def test_cursor_round_trip():
+    for offset in (0, 10, 95):
+        assert decode_cursor(encode_cursor(offset)) == offset
+
+
+@pytest.mark.parametrize("cursor", ["", "!!", "eDox", "bzotMQ"])
+def test_decode_cursor_rejects_garbage(cursor):
+    """Test that malformed cursors raise ValueError."""
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_project_offer_reads_price_and_availability():
+    """Test the volatile offer fields are extracted for price refreshes."""
+    item = SimpleNamespace(offers=SimpleNamespace(listings=[SimpleNamespace(
+        price=SimpleNamespace(display_amount='$19.99'),
+        availability=SimpleNamespace(message='In Stock'))]))
+
+    assert project_offer(item) == ('$19.99', 'In Stock')
+    assert project_offer(SimpleNamespace(asin='B01', offers=None)) == (None, None)
+    record = project_search_result(SimpleNamespace(items=[item], errors=None)).products[0]
+    assert record.to_dict()['availability'] == 'In Stock'
+
+
+def test_project_features():
+    item = SimpleNamespace(item_info=SimpleNamespace(
+        features=SimpleNamespace(display_values=['Soft', 'Washable'])))
+
+    assert project_features(item) == ('Soft', 'Washable')
+    assert project_features(SimpleNamespace(item_info=SimpleNamespace(features=None))) == ()
+
+
+def test_project_categories_includes_ancestors():
+    """Test each browse node is followed by its ancestor chain, without duplicates."""
+    toys = SimpleNamespace(id='165793011', display_name='Toys & Games', ancestor=None)
+    item = SimpleNamespace(browse_node_info=SimpleNamespace(browse_nodes=[
+        SimpleNamespace(id='166461011', display_name='Plush Toys', ancestor=toys),
+        SimpleNamespace(id='166092011', display_name=None, context_free_name='Toy Vehicles',
+                        ancestor=SimpleNamespace(id='165793011', display_name='Toys & Games',
+                                                 ancestor=None)),
+    ]))
+
+    assert project_categories(item) == (
+        ('166461011', 'Plush Toys', '165793011'),
+        ('165793011', 'Toys & Games', None),
+        ('166092011', 'Toy Vehicles', '165793011'),
+    )
+    assert project_categories(SimpleNamespace(asin='B01')) == ()
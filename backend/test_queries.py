@@ -0,0 +1,44 @@
+import pytest
+from unittest.mock import patch
+# Import the module we are testing
+from .queries import canonical_keywords, search_key, fold_plural, ENV_QUERY_STEMMING
+
+
+@pytest.mark.parametrize("keywords", [
+    "Bluey Toys", "bluey toys ", "Bluey  toys", " BLUEY\ttoys!", "bluey, toys",
+    "Ｂｌｕｅｙ Toys",  # Full-width characters
+])
+def test_equivalent_keywords_share_a_canonical_form(keywords):
+    assert canonical_keywords(keywords) == "bluey toys"
+
+
+def test_canonical_keywords_keeps_in_word_punctuation():
+    assert canonical_keywords("Bluey’s T-Shirt -- size 4") == "bluey's t-shirt size 4"
+    assert canonical_keywords("bluey_toys") == "bluey toys"
+    assert canonical_keywords("") == ""
+
+
+def test_canonical_keywords_is_idempotent():
+    once = canonical_keywords("  Bluey’s  Campervan & Bingo's T-Shirt!! ")
+    assert canonical_keywords(once) == once
+
+
+def test_fold_plural():
+    assert [fold_plural(t) for t in ("toys", "glass", "bus", "figures")] == [
+        "toy", "glass", "bus", "figure"]
+
+
+def test_search_key_is_collision_safe():
+    """Test no keywords can produce another search's (or page's) key."""
+    assert search_key("US", "Bluey Toys", 1) == search_key("US", "bluey  toys", 1)
+    assert search_key("US", "a:1", 2) == search_key("US", "a 1", 2)  # Equivalent queries
+    keys = {search_key("US", "a", 1), search_key("US", "a 1", 2), search_key("U", "S:a", 1),
+            search_key("US", "a%3A1", 2), search_key("US:a", "1", 2), search_key("US", "a:", 1)}
+    assert len(keys) == 5  # "a" and "a:" are equivalent; every other pair differs
+    assert search_key("US", "bluey toys", 2) == "search:v2:US:bluey%20toys:2"
+
+
+def test_search_key_stemming_is_optional():
+    assert search_key("US", "bluey toys", 1) != search_key("US", "bluey toy", 1)
+    with patch.dict('os.environ', {ENV_QUERY_STEMMING: "1"}):
+        assert search_key("US", "Bluey Toys", 1) == search_key("US", "bluey toy", 1)
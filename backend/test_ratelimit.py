@@ -0,0 +1,155 @@
+import threading
+import pytest
+# Import the module we are testing
+from .ratelimit import TokenBucket, UpstreamLimiter, INTERACTIVE, BACKGROUND
+
+KEY = ("US", "abcd1234")
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _wait_for_depth(limiter, key, depth, timeout=5.0):
+    """Poll until ``depth`` callers are queued for ``key``."""
+    pause = threading.Event()
+    for _ in range(int(timeout / 0.005)):
+        if limiter.queue_depth(key) >= depth:
+            return
+        pause.wait(0.005)
+    raise AssertionError(f"Timed out waiting for queue depth {depth}")
+
+# --- Tests for TokenBucket ---
+
+
+def test_token_bucket_refills_at_rate():
+    """Test tokens are consumed and refilled up to capacity."""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=clock)
+
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.time_until_available() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    clock.now += 10
+    assert bucket.tokens == 2  # Capped at capacity
+
+
+def test_token_bucket_drain():
+    """Test draining forces callers to wait for a full refill interval."""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=3, clock=clock)
+    bucket.drain()
+    assert not bucket.try_acquire()
+    assert bucket.time_until_available() == pytest.approx(1.0)
+
+
+def test_token_bucket_rejects_invalid_settings():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, capacity=1)
+
+# --- Tests for UpstreamLimiter ---
+
+
+def test_acquire_within_burst_is_immediate():
+    """Test the burst is granted without waiting and counted per priority."""
+    limiter = UpstreamLimiter(rate=0.01, capacity=2)
+    assert limiter.acquire(KEY, timeout=0)
+    assert limiter.acquire(KEY, BACKGROUND, timeout=0)
+
+    stats = limiter.stats()["US/abcd1234"]
+    assert stats["priorities"]["interactive"]["granted"] == 1
+    assert stats["priorities"]["background"]["granted"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_acquire_times_out_when_exhausted():
+    """Test a bounded wait gives up and is recorded as rejected."""
+    limiter = UpstreamLimiter(rate=0.01, capacity=1)
+    assert limiter.acquire(KEY)
+    assert not limiter.acquire(KEY, timeout=0.05)
+
+    stats = limiter.stats()["US/abcd1234"]
+    assert stats["priorities"]["interactive"]["rejected"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["max_queue_depth"] == 1
+
+
+def test_keys_have_independent_buckets():
+    """Test one region exhausting its quota doesn't block another."""
+    limiter = UpstreamLimiter(rate=0.01, capacity=1, overrides={"GB": (0.01, 2)})
+    assert limiter.acquire(KEY, timeout=0)
+    assert limiter.acquire(("GB", "abcd1234"), timeout=0)
+    assert limiter.acquire(("GB", "abcd1234"), timeout=0)  # Override burst of 2
+    assert not limiter.acquire(KEY, timeout=0)
+
+
+def test_interactive_preempts_queued_background():
+    """Test an interactive caller is served before earlier background callers."""
+    limiter = UpstreamLimiter(rate=5.0, capacity=1)
+    assert limiter.acquire(KEY)
+    order = []
+
+    def caller(name, priority):
+        if limiter.acquire(KEY, priority, timeout=5):
+            order.append(name)
+
+    background = threading.Thread(target=caller, args=("background", BACKGROUND))
+    background.start()
+    _wait_for_depth(limiter, KEY, 1)
+    interactive = threading.Thread(target=caller, args=("interactive", INTERACTIVE))
+    interactive.start()
+    background.join()
+    interactive.join()
+
+    assert order == ["interactive", "background"]
+    stats = limiter.stats()["US/abcd1234"]["priorities"]
+    assert stats["background"]["max_wait_seconds"] > stats["interactive"]["max_wait_seconds"]
+
+
+def test_promote_moves_tagged_ticket_ahead():
+    """Test promoting a background ticket lets it go before other background work."""
+    limiter = UpstreamLimiter(rate=5.0, capacity=1)
+    assert limiter.acquire(KEY)
+    order = []
+
+    def caller(name):
+        if limiter.acquire(KEY, BACKGROUND, timeout=5, tag=name):
+            order.append(name)
+
+    first = threading.Thread(target=caller, args=("first",))
+    first.start()
+    _wait_for_depth(limiter, KEY, 1)
+    second = threading.Thread(target=caller, args=("second",))
+    second.start()
+    _wait_for_depth(limiter, KEY, 2)
+
+    assert limiter.promote("second") == 1
+    first.join()
+    second.join()
+
+    assert order == ["second", "first"]
+
+
+def test_penalize_empties_bucket():
+    """Test a throttling signal from upstream makes the next caller wait."""
+    limiter = UpstreamLimiter(rate=0.01, capacity=3)
+    limiter.penalize(KEY)
+    assert not limiter.acquire(KEY, timeout=0)
+
+
+def test_reset_forgets_buckets():
+    limiter = UpstreamLimiter(rate=0.01, capacity=1)
+    assert limiter.acquire(KEY)
+    limiter.reset()
+    assert limiter.stats() == {}
+    assert limiter.acquire(KEY, timeout=0)
@@ -0,0 +1,142 @@
+import pytest
+# Import the module we are testing
+from . import search_index
+from .search_index import SearchIndex, tokenize
+from .products import ProductRecord
+
+
+class FakeClock:
+    """Manually advanced wall clock."""
+
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _record(asin, title, price=None):
+    return ProductRecord(asin, title, None, None, price)
+
+
+def _asins(hits):
+    return [record.asin for record in hits.records]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def index(clock):
+    index = SearchIndex(max_age=3600, clock=clock)
+    index.add("US", [
+        _record("CAMPER", "Bluey Campervan Playset"),
+        _record("PLUSH", "Bluey Plush Toy"),
+        _record("BINGO", "Bingo Plush Toy"),
+        _record("HOUSE", "Bluey Family Home Playset with Bluey and Bingo figures"),
+    ])
+    return index
+
+# --- Tests for tokenize ---
+
+
+def test_tokenize_normalises_terms():
+    """Test case, punctuation, stopwords and plurals are folded away."""
+    assert tokenize("Bluey's Toys & Games for the Family!") == ["bluey", "s", "toy", "game", "family"]
+    assert tokenize("Glass") == ["glass"]
+    assert tokenize(None) == []
+
+# --- Tests for search ---
+
+
+def test_search_requires_every_term(index):
+    """Test multi-term queries only match products containing all terms."""
+    hits = index.search("US", "bluey playset")
+
+    assert hits.total == 2
+    assert set(_asins(hits)) == {"CAMPER", "HOUSE"}
+    assert index.search("US", "bluey dinosaur").total == 0
+    assert index.search("GB", "bluey").total == 0  # Regions are separate
+
+
+def test_search_ranks_with_bm25(index):
+    """Test rarer terms and shorter, denser titles rank first."""
+    # "campervan" is rarer than "playset"; the short title mentions it
+    assert _asins(index.search("US", "campervan")) == ["CAMPER"]
+    # Both plush toys match; the Bluey one also matches the second term
+    assert _asins(index.search("US", "bluey plush toys"))[0] == "PLUSH"
+    # Mentioning a term twice counts, with diminishing returns
+    hits = index.search("US", "bluey")
+    assert hits.total == 3
+    assert _asins(hits)[0] == "HOUSE"
+
+
+def test_search_matches_prefixes_and_typos(index):
+    """Test as-you-type prefixes and single typos still find products."""
+    assert _asins(index.search("US", "camper")) == ["CAMPER"]
+    assert _asins(index.search("US", "campervna")) == []  # Transposition is two edits
+    assert _asins(index.search("US", "campervon")) == ["CAMPER"]
+    assert _asins(index.search("US", "blue plush")) == ["PLUSH"]  # Prefix of "bluey"
+    assert _asins(index.search("US", "plsh bingo")) == ["BINGO"]
+
+
+def test_exact_matches_outrank_prefix_matches(clock):
+    index = SearchIndex(clock=clock)
+    index.add("US", [_record("A", "Bluey Car"), _record("B", "Bluey Carnival")])
+
+    assert _asins(index.search("US", "car")) == ["A", "B"]
+
+
+def test_search_limit_and_total(index):
+    hits = index.search("US", "bluey", limit=1)
+
+    assert hits.total == 3
+    assert len(hits.records) == 1
+
+
+def test_features_are_searchable(clock):
+    """Test feature bullet points are indexed alongside titles."""
+    index = SearchIndex(clock=clock)
+    index.add("US", [_record("A", "Bluey Figure"), _record("B", "Bluey Figure")],
+              features={"A": ["Includes a tiny campervan"]})
+
+    assert _asins(index.search("US", "bluey campervan")) == ["A"]
+
+
+def test_reindexing_replaces_terms(index):
+    """Test a changed title no longer matches its old terms."""
+    index.add("US", [_record("CAMPER", "Bluey Caravan Adventure")])
+
+    assert index.search("US", "campervan").total == 0
+    assert _asins(index.search("US", "caravan")) == ["CAMPER"]
+    assert index.size("US") == 4
+
+
+def test_update_records_keeps_postings(index):
+    """Test refreshed offers are served without re-indexing the title."""
+    generation = index.generation("US")
+
+    assert index.update_records("US", {"PLUSH": _record("PLUSH", "Bluey Plush Toy", "$5.00")}) == 1
+    assert index.update_records("GB", {"PLUSH": _record("PLUSH", "x")}) == 0
+
+    assert index.search("US", "plush bluey").records[0].price == "$5.00"
+    assert index.get("US", "PLUSH").price == "$5.00"
+    assert index.generation("US") > generation
+
+
+def test_products_expire_after_max_age(index, clock):
+    """Test products no longer returned by upstream searches age out."""
+    clock.now += 1800
+    index.add("US", [_record("PLUSH", "Bluey Plush Toy")])  # Seen again
+    clock.now += 1801
+
+    assert _asins(index.search("US", "bluey")) == ["PLUSH"]
+    assert index.search("US", "bluey").indexed_at == (clock.now - 1801, clock.now - 1801)
+
+    clock.now += search_index.PRUNE_INTERVAL_SECONDS
+    index.add("US", [])  # Adding triggers the periodic prune
+    assert index.size("US") == 1
+    assert index.stats() == {"US": {"products": 1, "terms": 3}}
+    assert index.search("US", "campervan").total == 0
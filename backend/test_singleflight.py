@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import pytest
+# Import the module we are testing
+from .singleflight import SingleFlight, AsyncSingleFlight
+
+N_CALLERS = 8
+
+
+def _wait_for_waiters(flight, key, count, timeout=5.0):
+    """Poll until ``count`` callers are blocked on the in-flight call for ``key``."""
+    deadline = threading.Event()
+    for _ in range(int(timeout / 0.005)):
+        if flight.waiters(key) >= count:
+            return
+        deadline.wait(0.005)
+    raise AssertionError(f"Timed out waiting for {count} waiters on {key}")
+
+
+def _wait_for_in_flight(flight, key, timeout=5.0):
+    """Poll until a call for ``key`` is executing."""
+    deadline = threading.Event()
+    for _ in range(int(timeout / 0.005)):
+        if flight.in_flight(key):
+            return
+        deadline.wait(0.005)
+    raise AssertionError(f"Timed out waiting for a call on {key}")
+
+
+def _run_concurrently(flight, key, fn):
+    """Start N_CALLERS threads calling flight.do(key, fn); return threads and outcomes."""
+    outcomes = []
+    lock = threading.Lock()
+
+    def caller():
+        try:
+            result = flight.do(key, fn)
+        except Exception as e:
+            result = e
+        with lock:
+            outcomes.append(result)
+
+    threads = [threading.Thread(target=caller) for _ in range(N_CALLERS)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+# --- Tests for SingleFlight ---
+
+
+def test_do_runs_function_and_returns_result():
+    """Test a single caller simply runs the function."""
+    flight = SingleFlight()
+    assert flight.do("key", lambda x: x * 2, 21) == 42
+    assert not flight.in_flight("key")
+
+
+def test_concurrent_callers_share_one_execution():
+    """Test that concurrent callers for one key share a single call."""
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        release.wait(5)
+        return "shared"
+
+    threads, outcomes = _run_concurrently(flight, "key", slow_fetch)
+    _wait_for_waiters(flight, "key", N_CALLERS - 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert outcomes == ["shared"] * N_CALLERS
+    assert not flight.in_flight("key")
+
+
+def test_concurrent_callers_share_exception():
+    """Test that an exception from the shared call reaches every caller."""
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def failing_fetch():
+        calls.append(1)
+        release.wait(5)
+        raise ValueError("upstream down")
+
+    threads, outcomes = _run_concurrently(flight, "key", failing_fetch)
+    _wait_for_waiters(flight, "key", N_CALLERS - 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(outcomes) == N_CALLERS
+    assert all(isinstance(o, ValueError) for o in outcomes)
+
+
+def test_completed_key_runs_again():
+    """Test that results are not memoized once the call has finished."""
+    flight = SingleFlight()
+    calls = []
+    flight.do("key", calls.append, 1)
+    flight.do("key", calls.append, 2)
+    assert calls == [1, 2]
+
+
+def test_exception_clears_key():
+    """Test that a failed call doesn't leave the key stuck in flight."""
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flight.do("key", fail)
+    assert not flight.in_flight("key")
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_do_within_bounds_joining_callers():
+    """Test a joining caller gives up after the timeout while the call carries on."""
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=("key", release.wait))
+    leader.start()
+    _wait_for_in_flight(flight, "key")
+
+    with pytest.raises(TimeoutError):
+        flight.do_within(0.01, "key", lambda: "joined")
+    assert flight.in_flight("key")
+    assert flight.waiters("key") == 0
+    release.set()
+    leader.join()
+    assert flight.do_within(0.01, "key", lambda: "ran") == "ran"
+
+# --- Tests for AsyncSingleFlight ---
+
+
+def test_async_concurrent_awaits_share_one_call():
+    """Test that coroutines awaiting the same key run the function once."""
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def main():
+        results = await asyncio.gather(*(flight.do("key", fetch, 21) for _ in range(N_CALLERS)))
+        return results, len(flight)
+
+    results, in_flight_after = asyncio.run(main())
+    assert calls == [21]
+    assert results == [42] * N_CALLERS
+    assert in_flight_after == 0
+
+
+def test_async_exception_shared_and_cleared():
+    """Test that every waiter sees the exception and the key can run again."""
+    flight = AsyncSingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def ok():
+        return "ok"
+
+    async def main():
+        outcomes = await asyncio.gather(flight.do("key", fail), flight.do("key", fail),
+                                        return_exceptions=True)
+        return outcomes, await flight.do("key", ok)
+
+    outcomes, retried = asyncio.run(main())
+    assert all(isinstance(o, ValueError) for o in outcomes)
+    assert retried == "ok"
+
+
+def test_async_cancelled_caller_does_not_cancel_call():
+    flight = AsyncSingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("key", slow))
+        second = asyncio.ensure_future(flight.do("key", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "done"
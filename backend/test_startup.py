@@ -0,0 +1,44 @@
+import os
+import sys
+import subprocess
+import pytest
+
+# Cold-start budget: what importing the service costs before it can serve a
+# request (the PRD targets serverless, where every cold start pays this).
+# Measured at about 40ms for backend.amazon_service, most of it the standard
+# library (165ms when it imported the PA API SDK, asyncio and python-dotenv
+# eagerly); the budget leaves room for slower machines and is checked
+# against the fastest of a few runs.
+IMPORT_BUDGET_MS = {"backend.amazon_service": 80}
+RUNS = 3
+# Imported on first use only: the SDK when a client is built, asyncio by the
+# ASGI server and multi-region search, dotenv by app.init_app
+DEFERRED_MODULES = ("amazon_paapi", "asyncio", "dotenv")
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_times(statement: str) -> dict:
+    """Runs ``statement`` under -X importtime. Returns {module: cumulative microseconds}."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, cwd=_ROOT, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", ["backend.amazon_service", "backend.app"])
+def test_heavy_modules_are_not_imported(module):
+    interpreter = set(_import_times("pass"))  # e.g. imported by site-packages .pth files
+    imported = set(_import_times(f"import {module}")) - interpreter
+    assert not [m for m in imported if m.split(".")[0] in DEFERRED_MODULES]
+
+
+@pytest.mark.parametrize("module, budget_ms", sorted(IMPORT_BUDGET_MS.items()))
+def test_import_within_budget(module, budget_ms):
+    best_ms = min(_import_times(f"import {module}")[module] for _ in range(RUNS)) / 1000
+    assert best_ms < budget_ms, f"importing {module} took {best_ms:.1f}ms"
@@ -0,0 +1,135 @@
+import os
+from unittest.mock import patch
+# Import the module we are testing
+from . import warmup
+from .products import ProductPage
+
+
+def _ok_page():
+    return ProductPage(products=(), api_errors=())
+
+# --- Tests for configuration helpers ---
+
+
+def test_hot_keywords_default():
+    """Test that the defaults are used when WARMUP_KEYWORDS is unset."""
+    with patch.dict(os.environ, {}, clear=True):
+        assert warmup.hot_keywords() == warmup.DEFAULT_KEYWORDS
+
+
+@patch.dict(os.environ, {warmup.ENV_WARMUP_KEYWORDS: "Bluey Toys, Bluey Plush ,,"})
+def test_hot_keywords_from_env():
+    """Test that configured keywords are split and trimmed."""
+    assert warmup.hot_keywords() == ("Bluey Toys", "Bluey Plush")
+
+
+def test_warmup_plan_interleaves_regions():
+    """Test that consecutive calls go to different regions."""
+    plan = warmup.warmup_plan(["US", "GB"], ["a", "b"])
+    assert plan == [("US", "a"), ("GB", "a"), ("US", "b"), ("GB", "b")]
+
+# --- Tests for Warmer ---
+
+
+@patch('backend.warmup.amazon_service.refresh_bluey_products')
+def test_run_once_refreshes_every_region_and_keyword(mock_refresh):
+    """Test that a run covers the full matrix and records successes."""
+    mock_refresh.return_value = _ok_page()
+    warmer = warmup.Warmer(keywords=["Bluey Toys", "Bluey Plush"],
+                           min_call_spacing=0)
+
+    run = warmer.run_once()
+
+    regions = list(warmup.amazon_service.REGION_CONFIG)
+    assert mock_refresh.call_count == 2 * len(regions)
+    mock_refresh.assert_any_call("US", "Bluey Plush", 10)
+    assert run.succeeded == 2 * len(regions)
+    assert run.failures == []
+
+
+@patch('backend.warmup.amazon_service.refresh_bluey_products')
+def test_run_once_records_failures(mock_refresh):
+    """Test that None results, API errors and exceptions are recorded per pair."""
+    outcomes = {
+        "US": _ok_page(),
+        "GB": None,
+        "AU": ProductPage(products=(), api_errors=("TooManyRequests",)),
+    }
+
+    def refresh(region, keywords, item_count):
+        if region == "CA":
+            raise RuntimeError("boom")
+        return outcomes[region]
+
+    mock_refresh.side_effect = refresh
+    warmer = warmup.Warmer(min_call_spacing=0)
+
+    run = warmer.run_once()
+
+    assert run.succeeded == 1
+    reasons = {region: reason for region, _, reason in run.failures}
+    assert "no result" in reasons["GB"]
+    assert reasons["AU"] == "TooManyRequests"
+    assert "boom" in reasons["CA"]
+    history = warmer.history()
+    assert history[-1]["failed"] == 3
+    assert history[-1]["duration_seconds"] >= 0
+
+
+@patch('backend.warmup.amazon_service.refresh_bluey_products')
+def test_run_once_spaces_upstream_calls(mock_refresh):
+    """Test that the warmer waits between calls to respect PA API TPS."""
+    mock_refresh.return_value = _ok_page()
+    warmer = warmup.Warmer(regions=["US", "GB", "AU"], keywords=["Bluey Toys"],
+                           min_call_spacing=5)
+
+    with patch.object(warmer, '_wait', return_value=False) as mock_wait:
+        warmer.run_once()
+
+    assert mock_wait.call_count == 2  # No wait before the first call
+    for args, _ in mock_wait.call_args_list:
+        assert 4 < args[0] <= 5
+
+
+@patch('backend.warmup.amazon_service.refresh_bluey_products')
+def test_run_once_stops_when_requested(mock_refresh):
+    """Test that a stop request interrupts the run between calls."""
+    mock_refresh.return_value = _ok_page()
+    warmer = warmup.Warmer(regions=["US", "GB", "AU"], keywords=["Bluey Toys"],
+                           min_call_spacing=5)
+
+    with patch.object(warmer, '_wait', return_value=True):
+        run = warmer.run_once()
+
+    assert mock_refresh.call_count == 1
+    assert run.succeeded == 1
+
+
+@patch('backend.warmup.amazon_service.refresh_bluey_products')
+def test_start_runs_immediately_and_stops(mock_refresh):
+    """Test the background scheduler runs on startup and shuts down cleanly."""
+    mock_refresh.return_value = _ok_page()
+    warmer = warmup.Warmer(regions=["US"], min_call_spacing=0)
+
+    warmer.start(interval=3600)
+    for _ in range(200):
+        if warmer.history():
+            break
+        warmer._stop.wait(0.01)
+    warmer.stop()
+
+    assert len(warmer.history()) == 1
+    mock_refresh.assert_called_once_with("US", "Bluey Toys", 10)
+
+# --- Tests for the CLI ---
+
+
+@patch('backend.warmup.amazon_service.refresh_bluey_products')
+def test_main_once_exit_code(mock_refresh):
+    """Test the standalone CLI reports failures through its exit code."""
+    mock_refresh.return_value = _ok_page()
+    assert warmup.main(['--once', '--regions', 'US,GB', '--spacing', '0']) == 0
+    assert mock_refresh.call_count == 2
+
+    mock_refresh.return_value = None
+    assert warmup.main(['--once', '--regions', 'US', '--spacing', '0']) == 1
@@ -0,0 +1,215 @@
+"""
+Scheduled prefetch of the hot region x keyword matrix.
+
+Keeps popular searches fresh in the product cache so the first visitor after
+a cold start or TTL expiry doesn't pay the PA API round trip. Runs inside the
+backend (``WARMER.start()``) or standalone:
+
+    python -m backend.warmup --once
+    python -m backend.warmup --interval 2700 --keywords "Bluey Toys,Bluey Plush"
+"""
+import os
+import time
+import logging
+import argparse
+import threading
+from collections import deque
+from . import amazon_service
+
+# --- Configuration ---
+ENV_WARMUP_KEYWORDS = "WARMUP_KEYWORDS"  # Comma separated list
+ENV_WARMUP_INTERVAL = "WARMUP_INTERVAL_SECONDS"
+DEFAULT_KEYWORDS = ("Bluey Toys",)
+# Refresh a little before the soft TTL so hot keys are never served stale
+DEFAULT_INTERVAL_SECONDS = int(amazon_service.CACHE_DURATION_SECONDS * 0.75)
+# Spacing between upstream calls; PA API allows ~1 request/second by default
+DEFAULT_MIN_CALL_SPACING_SECONDS = 1.1
+HISTORY_SIZE = 20  # Number of past runs kept for status reporting
+
+
+def hot_keywords() -> tuple:
+    """Returns the keywords to warm, from WARMUP_KEYWORDS or the defaults."""
+    configured = os.getenv(ENV_WARMUP_KEYWORDS)
+    if not configured:
+        return DEFAULT_KEYWORDS
+    return tuple(k.strip() for k in configured.split(',') if k.strip())
+
+
+def warmup_plan(regions, keywords) -> list:
+    """
+    Orders the region x keyword matrix so consecutive calls hit different regions.
+
+    Interleaving spreads each region's calls out in time (keyword-major order),
+    which staggers load on any one marketplace.
+    """
+    return [(region, keyword) for keyword in keywords for region in regions]
+
+
+class WarmupRun:
+    """Outcome of one pass over the warmup matrix."""
+
+    __slots__ = ('started_at', 'duration_seconds', 'succeeded', 'failures')
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.duration_seconds = 0.0
+        self.succeeded = 0
+        self.failures = []  # [(region, keywords, reason)]
+
+    def to_dict(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "duration_seconds": round(self.duration_seconds, 3),
+            "succeeded": self.succeeded,
+            "failed": len(self.failures),
+            "failures": [{"region": r, "keywords": k, "reason": reason}
+                         for r, k, reason in self.failures],
+        }
+
+
+class Warmer:
+    """Periodically refreshes a fixed set of searches, one call at a time."""
+
+    def __init__(self, regions=None, keywords=None, item_count: int = 10,
+                 min_call_spacing: float = DEFAULT_MIN_CALL_SPACING_SECONDS):
+        """
+        Args:
+            regions: Region codes to warm (defaults to every REGION_CONFIG region).
+            keywords: Keywords to warm (defaults to ``hot_keywords()``).
+            item_count: Item count used for each search.
+            min_call_spacing: Minimum seconds between consecutive upstream calls.
+        """
+        self.regions = tuple(regions or amazon_service.REGION_CONFIG)
+        self.keywords = tuple(keywords or hot_keywords())
+        self.item_count = item_count
+        self.min_call_spacing = min_call_spacing
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+
+    def run_once(self) -> WarmupRun:
+        """Refreshes every region x keyword pair once and records the outcome."""
+        with self._run_lock:
+            run = WarmupRun(time.time())
+            start = time.monotonic()
+            last_call = None
+
+            for region, keywords in warmup_plan(self.regions, self.keywords):
+                if self._stop.is_set():
+                    break
+                # Rate limit: keep consecutive upstream calls spaced out
+                if last_call is not None:
+                    delay = self.min_call_spacing - (time.monotonic() - last_call)
+                    if delay > 0 and self._wait(delay):
+                        break
+                last_call = time.monotonic()
+
+                reason = self._refresh(region, keywords)
+                if reason is None:
+                    run.succeeded += 1
+                else:
+                    run.failures.append((region, keywords, reason))
+
+            run.duration_seconds = time.monotonic() - start
+            self._history.append(run)
+
+        logging.info(
+            "Warmup run finished in %.1fs: %s succeeded, %s failed.", run.duration_seconds, run.succeeded, len(run.failures))
+        for region, keywords, reason in run.failures:
+            logging.warning(
+                "Warmup failed for '%s' in region %s: %s", keywords, region, reason)
+        return run
+
+    def start(self, interval: float | None = None, run_immediately: bool = True) -> None:
+        """Runs warmups on a daemon thread every ``interval`` seconds until stopped."""
+        if interval is None:
+            interval = float(os.getenv(ENV_WARMUP_INTERVAL, DEFAULT_INTERVAL_SECONDS))
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, args=(interval, run_immediately),
+            name="cache-warmup", daemon=True)
+        self._thread.start()
+        logging.info(
+            "Started cache warmup every %.0fs for %s regions x %s keywords.", interval, len(self.regions), len(self.keywords))
+
+    def stop(self) -> None:
+        """Stops the scheduler thread, interrupting any spacing wait."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def history(self) -> list:
+        """Returns recent runs, newest last, as dicts."""
+        return [run.to_dict() for run in list(self._history)]
+
+    def _loop(self, interval: float, run_immediately: bool) -> None:
+        if not run_immediately and self._wait(interval):
+            return
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error("Warmup run crashed: %s", e, exc_info=True)
+            if self._wait(interval):
+                return
+
+    def _wait(self, seconds: float) -> bool:
+        """Sleeps up to ``seconds``; returns True if a stop was requested."""
+        return self._stop.wait(seconds)
+
+    def _refresh(self, region: str, keywords: str) -> str | None:
+        """Refreshes one search. Returns None on success or a failure reason."""
+        try:
+            page = amazon_service.refresh_bluey_products(
+                region, keywords, self.item_count)
+        except Exception as e:
+            return f"exception: {e}"
+        if page is None:
+            return "no result (client or API failure)"
+        if page.api_errors:
+            return "; ".join(page.api_errors)
+        return None
+
+
+# Scheduler used by the Flask app
+WARMER = Warmer()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Warm the product cache for every region and hot keyword.")
+    parser.add_argument('--once', action='store_true',
+                        help="Run a single pass and exit (non-zero if anything failed).")
+    parser.add_argument('--interval', type=float,
+                        help="Seconds between runs (default: WARMUP_INTERVAL_SECONDS or 75%% of the cache TTL).")
+    parser.add_argument('--keywords', help="Comma separated keywords to warm.")
+    parser.add_argument('--regions', help="Comma separated region codes to warm.")
+    parser.add_argument('--spacing', type=float, default=DEFAULT_MIN_CALL_SPACING_SECONDS,
+                        help="Minimum seconds between upstream calls.")
+    args = parser.parse_args(argv)
+    amazon_service.configure()
+
+    warmer = Warmer(
+        regions=args.regions.split(',') if args.regions else None,
+        keywords=[k.strip() for k in args.keywords.split(',')] if args.keywords else None,
+        min_call_spacing=args.spacing)
+
+    if args.once:
+        run = warmer.run_once()
+        return 1 if run.failures else 0
+
+    warmer.start(interval=args.interval)
+    try:
+        while warmer._thread.is_alive():
+            warmer._thread.join(1.0)
+    except KeyboardInterrupt:
+        warmer.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())